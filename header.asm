@@ -1,4 +1,6 @@
 include "hram.asm"
+include "accounting.asm"
+include "vram.asm"
 
 ; Warning: each of these sections can only be 8b long!
 section "Restart handler 0", ROM0 [$00]
@@ -27,9 +29,14 @@ Restart7::
 	jp HaltForever
 
 ; Warning: each of these sections can only be 8b long!
+; The @budgets are checked by tools/cycle_analyzer.py. VBlank must finish within the vblank period,
+; and Timer within one tick (1024 cycles) so it's never still running when the next one arrives.
+; In debug builds, VBlank may also take as long as its start and end AccountingMarks. The start one
+; comes before the VRAM writes, and GraphicsVBlank.ret's @budget checks they still fit in the vblank period.
+; Neither wakes tasks itself, they leave that to the scheduler (see IntSafeWaiterWake).
 section "VBlank Interrupt handler", ROM0 [$40]
 ; triggered upon VBLANK period starting
-IntVBlank::
+IntVBlank:: ; @budget VBLANK_CYCLES + 2 * ACCOUNTING_MARK_CYCLES
 	jp GraphicsVBlank
 section "LCDC Interrupt handler", ROM0 [$48]
 ; Also known as STAT handler
@@ -38,16 +45,16 @@ IntLCDC::
 	reti
 section "Timer Interrupt handler", ROM0 [$50]
 ; A configurable amount of time has passed
-IntTimer::
+IntTimer:: ; @budget 1024
 	; This is a jr instruction for speed, but the assembler isn't smart enough to allow it.
 	; So, given the hard-coded assuption that TimerHandler is at $68, we hand-code a instruction.
 	; $68 - $50 = $18, so we encode "jr $18".
 	; Opcode is $18 nn where nn is signed byte (jump distance - 2), so we encode $18 $16.
-	db $18, $16 ; jr $18 = jr TimerHandler
+	db $18, $16 ; jr $18 = jr TimerHandler. @as jr TimerHandler
 section "Serial Interrupt handler", ROM0 [$58]
 ; Serial transfer is complete
 IntSerial::
-	reti
+	jp SerialInt
 section "Joypad Interrupt handler", ROM0 [$60]
 ; Change in joystick state
 IntJoypad::
@@ -60,11 +67,14 @@ section "Extended handler code", ROM0 [$68]
 TimerHandler::
 	; our purpose here is to make it as fast as possible for the far-most-common case
 	; where we only increment the least signifigant byte
-	; current cycle count, assuming no switch or joy, not counting anything /256 or smaller:
-	; (before nocarry: 17 + 11/16) + (after nocarry: 15) = ~32.7 on average
-	; Since it runs ~ every 1000 cycles, this means a min overhead of ~32.7/1000 = ~3.27%
+	; current cycle count, assuming no switch or joy or CPU accounting, not counting anything /256 or smaller:
+	; (before nocarry: 17 + 25/16) + (after nocarry: 15) = ~33.6 on average
+	; Since it runs ~ every 1000 cycles, this means a min overhead of ~33.6/1000 = ~3.36%
 	; Theoretical limit for jr (from interrupt handle addr) + push one + pop one + reti = 14
 	; To do better than this (1.4%) we'd need to lower Uptime's granularity.
+	; While nothing is runnable, the scheduler slows the timer down so this only runs when it must:
+	; when a sleeping task may be due, every 16 ticks while there's joypad or serial work to do below,
+	; and otherwise every 63 ticks. See SchedIdle.
 	push AF
 	; Increment 4-byte number
 	ld A, [Uptime]
@@ -72,26 +82,32 @@ TimerHandler::
 	ld [Uptime], A
 	and $0f
 	jr nz, .nocarry ; if lower byte != 0, we're done with incrementing.
-	; otherwise maybe do joypad scan, then check upper byte
-	ld A, [JoyState]
-	and A
-	jr z, .nojoy
-	call JoyReadState
-.nojoy
+	; Only this slow path is recorded for CPU accounting. The fast path is too short and frequent
+	; to be worth logging, so tools/cpu_accounting.py estimates it instead.
+	AccountingMark ACCOUNTING_TIMER
+	; otherwise maybe do joypad scan, poll the serial link, then check upper byte
+	ld A, [TimerPeriodic]
+	bit TIMER_PERIODIC_JOY, A
+	call nz, JoyReadState
+	ld A, [TimerPeriodic] ; JoyReadState clobbers A
+	bit TIMER_PERIODIC_SERIAL, A
+	call nz, SerialPoll
 	ld A, [Uptime]
 	and A
-	jr nz, .nocarry ; if the original byte we were talking about is 0, continue. else don't.
+	jr nz, .slow_done ; if the original byte we were talking about is 0, continue. else don't.
 	ld A, [Uptime+1]
 	inc A
 	ld [Uptime+1], A
-	jr nz, .nocarry
+	jr nz, .slow_done
 	ld A, [Uptime+2]
 	inc A
 	ld [Uptime+2], A
-	jr nz, .nocarry
+	jr nz, .slow_done
 	ld A, [Uptime+3]
 	inc A
 	ld [Uptime+3], A
+.slow_done
+	AccountingMark ACCOUNTING_END
 .nocarry
 	ld A, [SwitchTimer]
 	dec A ; set z if we're ready to switch
@@ -114,7 +130,7 @@ TimerHandler::
 	ei ; It's now safe - we can't switch out but we're done with int-critical operations
 	pop AF
 	; note we've been careful to reinstate all clobbered regs before calling TaskYield
-	jp TaskYield ; does not return
+	jp TaskYield ; does not return. @exit since interrupts are enabled again
 
 
 section "Core Utility", ROM0
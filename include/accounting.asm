@@ -0,0 +1,108 @@
+IF !DEF(_G_ACCOUNTING)
+_G_ACCOUNTING EQU "true"
+
+include "hram.asm"
+include "ioregs.asm"
+
+; CPU accounting records when the CPU switches between tasks and OS activities,
+; so we can work out how much CPU time each one is using. See ideas/cpu-accounting.txt
+; for the design, and tools/cpu_accounting.py to decode the results.
+
+; The log is a 256-byte aligned ring of 4-byte entries, which wraps around forever while accounting is on.
+; AccountingIndex (in HRAM) is the offset of the next entry to write plus 1, or 0 if accounting is off.
+; The +1 means it can never be 0 while on, even when it wraps around.
+
+; --- Log entry struct ---
+RSRESET
+; Timestamp in units of 2^-18 seconds (4 cycles), formed from the bottom byte of Uptime and TimerCounter.
+; It wraps every 2^-2 seconds, so we rely on entries being written more often than that.
+; While the scheduler has slowed the timer down (see SchedIdle), it's only accurate to 2^-12 seconds.
+acct_time_hi rb 1
+acct_time_lo rb 1
+acct_type rb 1 ; one of the ACCOUNTING_* event types below
+acct_task rb 1 ; value of CurrentTask at time of writing
+ACCOUNTING_ENTRY_SIZE rb 0
+
+; --- Event types ---
+; A task was loaded and is now running. From here, time is accounted to acct_task.
+ACCOUNTING_SWITCH EQU 0
+; Nothing is runnable. From here, time is accounted as idle.
+ACCOUNTING_IDLE EQU 1
+; These mark the start of an OS activity which steals time from whatever was running.
+; They may be nested, eg. a joypad scan inside the timer handler.
+ACCOUNTING_VBLANK EQU 2
+ACCOUNTING_TIMER EQU 3
+ACCOUNTING_JOYPAD EQU 4
+; Marks the end of the most recently started OS activity.
+ACCOUNTING_END EQU 5
+; Unused entries in the log
+ACCOUNTING_EMPTY EQU $ff
+
+; The most an AccountingMark can add to an interrupt handler, for their @budgets (see header.asm)
+IF DEBUG > 0
+ACCOUNTING_MARK_CYCLES EQU 84
+ELSE
+ACCOUNTING_MARK_CYCLES EQU 0
+ENDC
+
+; Add an entry of event type \1 to the log, if accounting is on.
+; Interrupts must be disabled, or else an interrupt handler could write the same entry.
+; Takes 7 cycles if accounting is off, 51 if on, or 84 while the scheduler has slowed the timer down.
+; Only debug builds start accounting (see main.asm), so in release builds this is left out entirely,
+; and costs the interrupt handlers nothing (see the @budgets in header.asm).
+; Clobbers A.
+AccountingMark: MACRO
+IF DEBUG > 0
+	ld A, [AccountingIndex] ; 3 cycles
+	and A ; 1 cycle. set z if accounting is off
+	jr z, .skip\@ ; 3 cycles if taken
+	_AccountingWrite \1
+.skip\@
+ENDC
+ENDM
+
+; As AccountingMark, but for use with interrupts enabled. They're only disabled while the entry
+; is written, so this costs the same as AccountingMark when accounting is off.
+; Takes 7 cycles if accounting is off, 55 if on, or 88 while the scheduler has slowed the timer down.
+; As with AccountingMark, this is left out of release builds.
+; Clobbers A.
+AccountingMarkIntsOn: MACRO
+IF DEBUG > 0
+	ld A, [AccountingIndex]
+	and A
+	jr z, .skip\@
+	di
+	ld A, [AccountingIndex] ; an interrupt may have written an entry since we last looked
+	_AccountingWrite \1
+	ei
+.skip\@
+ENDC
+ENDM
+
+; Write an entry of event type \1 to the log, given A = AccountingIndex, which must be non-zero.
+_AccountingWrite: MACRO
+	push HL
+	ld L, A
+	dec L ; L = offset of entry to write
+	add ACCOUNTING_ENTRY_SIZE ; note this wraps from the last entry to the first
+	ld [AccountingIndex], A
+	ld H, AccountingLog >> 8 ; HL = entry to write. Entries never cross a page, so we can inc HL freely.
+	ld A, [IdleTickStart]
+	and A ; set nz if the scheduler has slowed the timer down
+	jr nz, .slow\@
+	ld A, [Uptime]
+	ld [HL+], A
+	ld A, [TimerCounter]
+	ld [HL+], A
+	jr .timed\@
+.slow\@
+	call _AccountingSlowTime
+.timed\@
+	ld [HL], \1
+	inc L
+	ld A, [CurrentTask]
+	ld [HL], A
+	pop HL
+ENDM
+
+ENDC
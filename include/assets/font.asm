@@ -0,0 +1,8 @@
+; Generated from assets/font.json
+
+FONT_TILE_COUNT EQU 95
+FONT_TILE_DATA_SIZE EQU 1520
+FONT_COMPRESSED EQUS "rle"
+FONT_COMPRESSED_SIZE EQU 1082
+
+INCBIN "include/assets/font.rle"
@@ -0,0 +1,142 @@
+; Generated by tools/clock_tables.py
+; Include this at the start of a page-aligned section, see tasks/clock.asm.
+
+ClockBCD:
+	db $00, $01, $02, $03, $04, $05, $06, $07, $08, $09, $10, $11, $12, $13, $14, $15
+	db $16, $17, $18, $19, $20, $21, $22, $23, $24, $25, $26, $27, $28, $29, $30, $31
+	db $32, $33, $34, $35, $36, $37, $38, $39, $40, $41, $42, $43, $44, $45, $46, $47
+	db $48, $49, $50, $51, $52, $53, $54, $55, $56, $57, $58, $59, $60, $61, $62, $63
+	db $64, $65, $66, $67, $68, $69, $70, $71, $72, $73, $74, $75, $76, $77, $78, $79
+	db $80, $81, $82, $83, $84, $85, $86, $87, $88, $89, $90, $91, $92, $93, $94, $95
+	db $96, $97, $98, $99, $00, $01, $02, $03, $04, $05, $06, $07, $08, $09, $10, $11
+	db $12, $13, $14, $15, $16, $17, $18, $19, $20, $21, $22, $23, $24, $25, $26, $27
+	db $28, $29, $30, $31, $32, $33, $34, $35, $36, $37, $38, $39, $40, $41, $42, $43
+	db $44, $45, $46, $47, $48, $49, $50, $51, $52, $53, $54, $55, $56, $57, $58, $59
+	db $60, $61, $62, $63, $64, $65, $66, $67, $68, $69, $70, $71, $72, $73, $74, $75
+	db $76, $77, $78, $79, $80, $81, $82, $83, $84, $85, $86, $87, $88, $89, $90, $91
+	db $92, $93, $94, $95, $96, $97, $98, $99, $00, $01, $02, $03, $04, $05, $06, $07
+	db $08, $09, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20, $21, $22, $23
+	db $24, $25, $26, $27, $28, $29, $30, $31, $32, $33, $34, $35, $36, $37, $38, $39
+	db $40, $41, $42, $43, $44, $45, $46, $47, $48, $49, $50, $51, $52, $53, $54, $55
+
+ClockDiv60:
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $01, $01, $01, $01
+	db $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01
+	db $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01
+	db $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01, $01
+	db $01, $01, $01, $01, $01, $01, $01, $01, $02, $02, $02, $02, $02, $02, $02, $02
+	db $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02
+	db $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02
+	db $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02
+	db $02, $02, $02, $02, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03
+	db $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03
+	db $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03
+	db $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03, $03
+	db $04, $04, $04, $04, $04, $04, $04, $04, $04, $04, $04, $04, $04, $04, $04, $04
+
+ClockMod60:
+	db $00, $01, $02, $03, $04, $05, $06, $07, $08, $09, $0a, $0b, $0c, $0d, $0e, $0f
+	db $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $1a, $1b, $1c, $1d, $1e, $1f
+	db $20, $21, $22, $23, $24, $25, $26, $27, $28, $29, $2a, $2b, $2c, $2d, $2e, $2f
+	db $30, $31, $32, $33, $34, $35, $36, $37, $38, $39, $3a, $3b, $00, $01, $02, $03
+	db $04, $05, $06, $07, $08, $09, $0a, $0b, $0c, $0d, $0e, $0f, $10, $11, $12, $13
+	db $14, $15, $16, $17, $18, $19, $1a, $1b, $1c, $1d, $1e, $1f, $20, $21, $22, $23
+	db $24, $25, $26, $27, $28, $29, $2a, $2b, $2c, $2d, $2e, $2f, $30, $31, $32, $33
+	db $34, $35, $36, $37, $38, $39, $3a, $3b, $00, $01, $02, $03, $04, $05, $06, $07
+	db $08, $09, $0a, $0b, $0c, $0d, $0e, $0f, $10, $11, $12, $13, $14, $15, $16, $17
+	db $18, $19, $1a, $1b, $1c, $1d, $1e, $1f, $20, $21, $22, $23, $24, $25, $26, $27
+	db $28, $29, $2a, $2b, $2c, $2d, $2e, $2f, $30, $31, $32, $33, $34, $35, $36, $37
+	db $38, $39, $3a, $3b, $00, $01, $02, $03, $04, $05, $06, $07, $08, $09, $0a, $0b
+	db $0c, $0d, $0e, $0f, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $1a, $1b
+	db $1c, $1d, $1e, $1f, $20, $21, $22, $23, $24, $25, $26, $27, $28, $29, $2a, $2b
+	db $2c, $2d, $2e, $2f, $30, $31, $32, $33, $34, $35, $36, $37, $38, $39, $3a, $3b
+	db $00, $01, $02, $03, $04, $05, $06, $07, $08, $09, $0a, $0b, $0c, $0d, $0e, $0f
+
+ClockDiv60Carry:
+	db $00, $04, $08, $0c, $11, $15, $19, $1d, $22, $26, $2a, $2e, $33, $37, $3b, $40
+	db $44, $48, $4c, $51, $55, $59, $5d, $62, $66, $6a, $6e, $73, $77, $7b, $80, $84
+	db $88, $8c, $91, $95, $99, $9d, $a2, $a6, $aa, $ae, $b3, $b7, $bb, $c0, $c4, $c8
+	db $cc, $d1, $d5, $d9, $dd, $e2, $e6, $ea, $ee, $f3, $f7, $fb, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+
+ClockMod60Carry:
+	db $00, $10, $20, $30, $04, $14, $24, $34, $08, $18, $28, $38, $0c, $1c, $2c, $00
+	db $10, $20, $30, $04, $14, $24, $34, $08, $18, $28, $38, $0c, $1c, $2c, $00, $10
+	db $20, $30, $04, $14, $24, $34, $08, $18, $28, $38, $0c, $1c, $2c, $00, $10, $20
+	db $30, $04, $14, $24, $34, $08, $18, $28, $38, $0c, $1c, $2c, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00
+
+ClockCentis:
+	db $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $00, $01, $01, $01, $01, $01
+	db $01, $01, $01, $01, $01, $02, $02, $02, $02, $02, $02, $02, $02, $02, $02, $03
+	db $03, $03, $03, $03, $03, $03, $03, $03, $03, $04, $04, $04, $04, $04, $04, $04
+	db $04, $04, $04, $04, $05, $05, $05, $05, $05, $05, $05, $05, $05, $05, $06, $06
+	db $06, $06, $06, $06, $06, $06, $06, $06, $07, $07, $07, $07, $07, $07, $07, $07
+	db $07, $07, $08, $08, $08, $08, $08, $08, $08, $08, $08, $08, $08, $09, $09, $09
+	db $09, $09, $09, $09, $09, $09, $09, $10, $10, $10, $10, $10, $10, $10, $10, $10
+	db $10, $11, $11, $11, $11, $11, $11, $11, $11, $11, $11, $12, $12, $12, $12, $12
+	db $12, $12, $12, $12, $12, $12, $13, $13, $13, $13, $13, $13, $13, $13, $13, $13
+	db $14, $14, $14, $14, $14, $14, $14, $14, $14, $14, $15, $15, $15, $15, $15, $15
+	db $15, $15, $15, $15, $16, $16, $16, $16, $16, $16, $16, $16, $16, $16, $16, $17
+	db $17, $17, $17, $17, $17, $17, $17, $17, $17, $18, $18, $18, $18, $18, $18, $18
+	db $18, $18, $18, $19, $19, $19, $19, $19, $19, $19, $19, $19, $19, $20, $20, $20
+	db $20, $20, $20, $20, $20, $20, $20, $20, $21, $21, $21, $21, $21, $21, $21, $21
+	db $21, $21, $22, $22, $22, $22, $22, $22, $22, $22, $22, $22, $23, $23, $23, $23
+	db $23, $23, $23, $23, $23, $23, $24, $24, $24, $24, $24, $24, $24, $24, $24, $24
+	db $25, $25, $25, $25, $25, $25, $25, $25, $25, $25, $25, $26, $26, $26, $26, $26
+	db $26, $26, $26, $26, $26, $27, $27, $27, $27, $27, $27, $27, $27, $27, $27, $28
+	db $28, $28, $28, $28, $28, $28, $28, $28, $28, $29, $29, $29, $29, $29, $29, $29
+	db $29, $29, $29, $29, $30, $30, $30, $30, $30, $30, $30, $30, $30, $30, $31, $31
+	db $31, $31, $31, $31, $31, $31, $31, $31, $32, $32, $32, $32, $32, $32, $32, $32
+	db $32, $32, $33, $33, $33, $33, $33, $33, $33, $33, $33, $33, $33, $34, $34, $34
+	db $34, $34, $34, $34, $34, $34, $34, $35, $35, $35, $35, $35, $35, $35, $35, $35
+	db $35, $36, $36, $36, $36, $36, $36, $36, $36, $36, $36, $37, $37, $37, $37, $37
+	db $37, $37, $37, $37, $37, $37, $38, $38, $38, $38, $38, $38, $38, $38, $38, $38
+	db $39, $39, $39, $39, $39, $39, $39, $39, $39, $39, $40, $40, $40, $40, $40, $40
+	db $40, $40, $40, $40, $41, $41, $41, $41, $41, $41, $41, $41, $41, $41, $41, $42
+	db $42, $42, $42, $42, $42, $42, $42, $42, $42, $43, $43, $43, $43, $43, $43, $43
+	db $43, $43, $43, $44, $44, $44, $44, $44, $44, $44, $44, $44, $44, $45, $45, $45
+	db $45, $45, $45, $45, $45, $45, $45, $45, $46, $46, $46, $46, $46, $46, $46, $46
+	db $46, $46, $47, $47, $47, $47, $47, $47, $47, $47, $47, $47, $48, $48, $48, $48
+	db $48, $48, $48, $48, $48, $48, $49, $49, $49, $49, $49, $49, $49, $49, $49, $49
+	db $50, $50, $50, $50, $50, $50, $50, $50, $50, $50, $50, $51, $51, $51, $51, $51
+	db $51, $51, $51, $51, $51, $52, $52, $52, $52, $52, $52, $52, $52, $52, $52, $53
+	db $53, $53, $53, $53, $53, $53, $53, $53, $53, $54, $54, $54, $54, $54, $54, $54
+	db $54, $54, $54, $54, $55, $55, $55, $55, $55, $55, $55, $55, $55, $55, $56, $56
+	db $56, $56, $56, $56, $56, $56, $56, $56, $57, $57, $57, $57, $57, $57, $57, $57
+	db $57, $57, $58, $58, $58, $58, $58, $58, $58, $58, $58, $58, $58, $59, $59, $59
+	db $59, $59, $59, $59, $59, $59, $59, $60, $60, $60, $60, $60, $60, $60, $60, $60
+	db $60, $61, $61, $61, $61, $61, $61, $61, $61, $61, $61, $62, $62, $62, $62, $62
+	db $62, $62, $62, $62, $62, $62, $63, $63, $63, $63, $63, $63, $63, $63, $63, $63
+	db $64, $64, $64, $64, $64, $64, $64, $64, $64, $64, $65, $65, $65, $65, $65, $65
+	db $65, $65, $65, $65, $66, $66, $66, $66, $66, $66, $66, $66, $66, $66, $66, $67
+	db $67, $67, $67, $67, $67, $67, $67, $67, $67, $68, $68, $68, $68, $68, $68, $68
+	db $68, $68, $68, $69, $69, $69, $69, $69, $69, $69, $69, $69, $69, $70, $70, $70
+	db $70, $70, $70, $70, $70, $70, $70, $70, $71, $71, $71, $71, $71, $71, $71, $71
+	db $71, $71, $72, $72, $72, $72, $72, $72, $72, $72, $72, $72, $73, $73, $73, $73
+	db $73, $73, $73, $73, $73, $73, $74, $74, $74, $74, $74, $74, $74, $74, $74, $74
+	db $75, $75, $75, $75, $75, $75, $75, $75, $75, $75, $75, $76, $76, $76, $76, $76
+	db $76, $76, $76, $76, $76, $77, $77, $77, $77, $77, $77, $77, $77, $77, $77, $78
+	db $78, $78, $78, $78, $78, $78, $78, $78, $78, $79, $79, $79, $79, $79, $79, $79
+	db $79, $79, $79, $79, $80, $80, $80, $80, $80, $80, $80, $80, $80, $80, $81, $81
+	db $81, $81, $81, $81, $81, $81, $81, $81, $82, $82, $82, $82, $82, $82, $82, $82
+	db $82, $82, $83, $83, $83, $83, $83, $83, $83, $83, $83, $83, $83, $84, $84, $84
+	db $84, $84, $84, $84, $84, $84, $84, $85, $85, $85, $85, $85, $85, $85, $85, $85
+	db $85, $86, $86, $86, $86, $86, $86, $86, $86, $86, $86, $87, $87, $87, $87, $87
+	db $87, $87, $87, $87, $87, $87, $88, $88, $88, $88, $88, $88, $88, $88, $88, $88
+	db $89, $89, $89, $89, $89, $89, $89, $89, $89, $89, $90, $90, $90, $90, $90, $90
+	db $90, $90, $90, $90, $91, $91, $91, $91, $91, $91, $91, $91, $91, $91, $91, $92
+	db $92, $92, $92, $92, $92, $92, $92, $92, $92, $93, $93, $93, $93, $93, $93, $93
+	db $93, $93, $93, $94, $94, $94, $94, $94, $94, $94, $94, $94, $94, $95, $95, $95
+	db $95, $95, $95, $95, $95, $95, $95, $95, $96, $96, $96, $96, $96, $96, $96, $96
+	db $96, $96, $97, $97, $97, $97, $97, $97, $97, $97, $97, $97, $98, $98, $98, $98
+	db $98, $98, $98, $98, $98, $98, $99, $99, $99, $99, $99, $99, $99, $99, $99, $99
@@ -31,6 +31,13 @@ Switchable rb 1
 ; Down Up Left Right Start Select B A
 JoyState rb 1
 
+; Which of TimerHandler's periodic jobs, that it does every 16 ticks, currently need doing.
+; Each bit is set and cleared by the job's owner. While this is 0, the scheduler can slow
+; the timer down further while nothing is runnable (see SchedIdle).
+TimerPeriodic rb 1
+TIMER_PERIODIC_JOY EQU 0 ; a button is held, so joypad.asm polls it
+TIMER_PERIODIC_SERIAL EQU 1 ; we're the active side of the link, so serial.asm polls the other side
+
 
 ; Whether working sprite ram should be copied into real sprite ram next VBlank:
 ; 0 - Not dirty (don't copy)
@@ -53,6 +60,10 @@ HardwareVariant rb 1
 DMA_WAIT_SIZE EQU 10
 DMAWait rb DMA_WAIT_SIZE
 
+; Offset + 1 of the next CPU accounting log entry to write, or 0 if accounting is off.
+; See include/accounting.asm.
+AccountingIndex rb 1
+
 
 ; --- HRAM-related macros ---
 
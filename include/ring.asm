@@ -115,4 +115,124 @@ RingPop: MACRO
 .end\@
 	ENDM
 
+; Helpers for the bulk macros below. Copy C bytes (not 0) from DE to HL, or HL to DE,
+; advancing both. Clobbers A. Sets C to 0.
+_RingCopyIn: MACRO
+.loop\@
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+	dec C
+	jr nz, .loop\@
+	ENDM
+
+_RingCopyOut: MACRO
+.loop\@
+	ld A, [HL+]
+	ld [DE], A
+	inc DE
+	dec C
+	jr nz, .loop\@
+	ENDM
+
+; Helper for bulk macros. Args are (ring address, ring capacity, index field to start from).
+; Given B bytes (not 0) to copy, sets C to how many of them come before the end of the buffer,
+; and HL to the address of the first one. Clobbers A.
+_RingFirstRun: MACRO
+	ld A, \2
+	ld HL, (\1) + (\3)
+	sub [HL]
+	inc A ; A = bytes before the end of the buffer, or 0 if that's all 256 of them
+	jr z, .all\@
+	cp B
+	jr c, .got\@
+.all\@
+	ld A, B
+.got\@
+	ld C, A
+	ld A, [HL]
+	LongAddToA (\1) + ring_data, HL
+	ENDM
+
+; Push up to C bytes from DE to ring at immediate \1 of capacity \2, or as many as there's room for.
+; Sets B to how many were pushed, and advances DE past them.
+; This is much faster than pushing one at a time for more than a couple of bytes, since the bytes are
+; copied in at most two runs, either side of the end of the buffer, and head is only updated once.
+; Clobbers A, C, H, L.
+RingPushN: MACRO
+	ld HL, (\1) + ring_tail
+	ld A, [HL-] ; A = tail, HL points at head
+	scf
+	sbc [HL]
+	and \2 ; A = (tail - head - 1) % (capacity+1), ie. how much room there is
+	cp C
+	jr c, .got_count\@
+	ld A, C
+.got_count\@
+	ld B, A ; B = how many we'll push
+	and A
+	jr z, .end\@
+	_RingFirstRun \1, \2, ring_head
+	_RingCopyIn
+	; If we went past the end of the buffer, the rest goes at the start. Since head + B wrapped around,
+	; what it wrapped around to is how much is left.
+	ld A, [(\1) + ring_head]
+	ld C, A
+	add B
+	and \2 ; A = new head
+	cp C
+	jr nc, .updateHead\@ ; we didn't wrap around
+	and A
+	jr z, .updateHead\@ ; we stopped exactly at the end
+	ld C, A
+	ld HL, (\1) + ring_data
+	_RingCopyIn
+.updateHead\@
+	; Only now the data is in place can we let the reader see it
+	ld A, [(\1) + ring_head]
+	add B
+	and \2
+	ld [(\1) + ring_head], A
+.end\@
+	ENDM
+
+; Pop up to C bytes from ring at immediate \1 of capacity \2 to DE, or as many as there are.
+; Sets B to how many were popped, and advances DE past them.
+; As per RingPushN, this is much faster than popping one at a time.
+; Clobbers A, C, H, L.
+RingPopN: MACRO
+	ld HL, (\1) + ring_head
+	ld A, [HL+] ; A = head, HL points at tail
+	sub [HL]
+	and \2 ; A = how many items there are
+	cp C
+	jr c, .got_count\@
+	ld A, C
+.got_count\@
+	ld B, A ; B = how many we'll pop
+	and A
+	jr z, .end\@
+	_RingFirstRun \1, \2, ring_tail
+	_RingCopyOut
+	; If we went past the end of the buffer, the rest comes from the start, as per RingPushN
+	ld A, [(\1) + ring_tail]
+	ld C, A
+	add B
+	and \2 ; A = new tail
+	cp C
+	jr nc, .updateTail\@
+	and A
+	jr z, .updateTail\@
+	ld C, A
+	ld HL, (\1) + ring_data
+	_RingCopyOut
+.updateTail\@
+	; Only now we're done with the data can we let the writer re-use it
+	ld A, [(\1) + ring_tail]
+	add B
+	and \2
+	ld [(\1) + ring_tail], A
+.end\@
+	ENDM
+
 ENDC
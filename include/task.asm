@@ -10,6 +10,9 @@ task_rambank rb 1 ; loaded ram bank, or 0
 task_waiter rw 1 ; address of waiter being waited on by task, or ffff.
                  ; Note that uniquely identifying waiter may rely on addr + current ram bank info,
                  ; either SRAM (top 3 bits = 101), or WRAM (top 3 bits = 110).
+task_wait_next rb 1 ; next task id in the list of tasks waiting on the same waiter, or ff.
+                    ; Only meaningful while task_waiter is set.
+task_priority rb 1 ; one of the PRIORITY_* values below
 
 TASK_SIZE rb 0
 
@@ -19,6 +22,17 @@ TASK_SIZE rb 0
 
 MAX_TASKS EQU 31
 
+; Task priorities. Lower numbers are more urgent.
+; A runnable task always runs before any runnable task of a less urgent priority,
+; and tasks of the same priority take turns. This means a task that never sleeps or waits
+; will starve all less urgent tasks, so tasks above PRIORITY_NORMAL should only run briefly
+; before waiting again, eg. tasks that respond to input.
+PRIORITY_REALTIME EQU 0
+PRIORITY_HIGH EQU 1
+PRIORITY_NORMAL EQU 2
+PRIORITY_LOW EQU 3 ; for background work that should only run when nothing else wants to
+PRIORITY_COUNT EQU 4
+
 IF MAX_TASKS * TASK_SIZE >= 256
 FAIL "Since CurrentTask is only 1 byte, TaskList must fit within 256 bytes"
 ENDC
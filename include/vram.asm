@@ -45,4 +45,7 @@ AltTileGrid EQU $9c00
 ; This priority ordering also applies to the 10 sprites/row limit.
 SpriteTable EQU $fe00
 
+; VRAM is only free for us to access during VBlank, which lasts for 10 lines of 114 cycles.
+VBLANK_CYCLES EQU 10 * 114
+
 ENDC
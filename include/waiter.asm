@@ -11,9 +11,10 @@ include "longcalc.asm"
 ; --- Waiter struct ---
 RSRESET
 waiter_count rb 1 ; How many tasks are currently waiting on this waiter.
-                  ; This is used to avoid unneeded work, mostly for when count is 0 or 1.
-waiter_min_task rb 1 ; Minimum task id that may be waiting on this waiter.
-                     ; Again, this saves time by letting us jump straight to the task in question.
+                  ; This is used to avoid unneeded work, mostly for when count is 0.
+waiter_head rb 1 ; Task id of the most recent task to wait on this waiter, or ff.
+                 ; The other waiting tasks follow in a list threaded through their task_wait_next fields,
+                 ; so waking only touches the tasks being woken.
 WAITER_SIZE rb 0
 
 ; --- IntSafeWaiter struct ---
@@ -25,6 +26,10 @@ RSRESET
 ;     This indicates to the task that it must roll back its wait and call Wake.
 isw_flag rb 1
 isw_waiter rb WAITER_SIZE ; Wrapped waiter
+; While the scheduler has been asked to wake this waiter, the next waiter it's been asked to wake,
+; or ffff if this is the last (see SchedDeferWake). Otherwise 0. Little-endian.
+; So that this can't be confused with ffff, IntSafeWaiters can't be in HRAM.
+isw_deferred_next rw 1
 ISW_SIZE rb 0
 
 ; Declare memory for a waiter
@@ -41,7 +46,7 @@ WaiterInit: MACRO
 	xor A
 	ld [\1 + waiter_count], A
 	dec A ; A = ff
-	ld [\1 + waiter_min_task], A
+	ld [\1 + waiter_head], A
 ENDM
 
 ; Be careful to ensure int-safe waiters are not used by interrupts before they're fully
@@ -49,6 +54,8 @@ ENDM
 IntSafeWaiterInit: MACRO
 	xor A
 	ld [\1 + isw_flag], A
+	ld [\1 + isw_deferred_next], A
+	ld [\1 + isw_deferred_next + 1], A
 	WaiterInit (\1 + isw_waiter)
 ENDM
 
@@ -109,6 +116,7 @@ ENDM
 ; In either case, nothing will be clobbered between returning from \2 and returning from this function.
 ; This function is needed as otherwise the condition could change and the waiter woken
 ; in between checking your condition and calling IntSafeWaiterWait, leaving you waiting forever.
+; If we waited, we return with carry unset once woken, so you can loop until \2 sets carry.
 IntSafeWaiterCheckOrWait: MACRO
 	push AF
 	call T_DisableSwitch ; prevent switching in order to safely touch the isw flag
@@ -124,7 +132,11 @@ IntSafeWaiterCheckOrWait: MACRO
 	pop HL
 ENDM
 
-; Safely wakes waiters of IntSafeWaiter \1.
+; Safely wakes waiters of IntSafeWaiter \1. For use in interrupt handlers, with interrupts disabled.
+; The wake is always left to the scheduler to do when it next picks a task to run. If the interrupted
+; code has switching disabled, it may be part way through changing the scheduler's state, and even if
+; it isn't, waking every waiting task takes longer than an interrupt handler can afford
+; (see the @budgets in header.asm).
 ; Clobbers A.
 IntSafeWaiterWake: MACRO
 	ld A, [(\1) + isw_flag]
@@ -135,7 +147,16 @@ IntSafeWaiterWake: MACRO
 	ld [(\1) + isw_flag], A
 	jr .end\@
 .wake\@
-	WaiterWake ((\1) + isw_waiter)
+	ld A, [(\1) + isw_waiter + waiter_count]
+	and A ; set z if nothing is waiting
+	jr z, .end\@
+	ld A, [(\1) + isw_deferred_next + 1]
+	and A ; set z if the scheduler hasn't already been asked to wake it
+	jr nz, .end\@
+	push HL
+	ld HL, (\1)
+	call SchedDeferWake
+	pop HL
 .end\@
 ENDM
 
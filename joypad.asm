@@ -2,6 +2,8 @@ include "hram.asm"
 include "ioregs.asm"
 include "ring.asm"
 include "debug.asm"
+include "accounting.asm"
+include "waiter.asm"
 
 ; Joypad input is not sampled under normal circumstances to save CPU time.
 ; We set up a JoyInt to fire if any button is pressed.
@@ -33,15 +35,22 @@ SECTION "Joypad RAM", WRAM0
 JoyQueue::
 	RingDeclare JOY_QUEUE_SIZE
 
+; Woken whenever we push to JoyQueue, so tasks can wait for events instead of polling.
+JoyWaiter::
+	DeclareIntSafeWaiter
+
 
 SECTION "Joypad management methods", ROM0
 
 
 JoyInit::
 	RingInit JoyQueue
+	IntSafeWaiterInit JoyWaiter
 	xor A
 	ld [JoyIO], A ; Select both input lines
 	ld [JoyState], A ; Start with nothing pressed
+	ld HL, TimerPeriodic
+	res TIMER_PERIODIC_JOY, [HL] ; so we don't need polling
 	ld HL, InterruptsEnabled
 	set 4, [HL] ; Enable joypad interrupt
 	Debug "Joy Int enabled"
@@ -60,6 +69,7 @@ JoyInt::
 ; and manage interrupt state.
 ; Clobbers AF. Assumes interrupts are disabled.
 JoyReadState::
+	AccountingMark ACCOUNTING_JOYPAD
 	ld A, JoySelectDPad
 	ld [JoyIO], A
 	_UnitTestUpdateJoyIO
@@ -94,6 +104,8 @@ JoyReadState::
 	; prev state was 0, so interrupt is enabled, we need to disable it since we'll be polling now
 	ld HL, InterruptsEnabled
 	res 4, [HL] ; disable joypad interrupt
+	ld HL, TimerPeriodic
+	set TIMER_PERIODIC_JOY, [HL] ; start polling
 	Debug "Joy Int disabled"
 	jr .not_now_zero
 .not_prev_zero
@@ -111,6 +123,8 @@ JoyReadState::
 	res 4, [HL] ; clear any pending joypad interrupt
 	ld HL, InterruptsEnabled
 	set 4, [HL] ; enable joypad interrupts
+	ld HL, TimerPeriodic
+	res TIMER_PERIODIC_JOY, [HL] ; stop polling
 	Debug "Joy Int enabled"
 .not_now_zero
 
@@ -119,12 +133,15 @@ JoyReadState::
 
 	RingPush JoyQueue, JOY_QUEUE_SIZE, B, C ; push B to JoyQueue, clobbers C
 	; Note above may fail, but we don't care either way - we'll just drop inputs if queue is full.
+	; Either way, there's an event for any waiting tasks to get.
+	IntSafeWaiterWake JoyWaiter
 
 	pop HL
 .ret
 	xor A
 	ld [JoyIO], A ; select both lines, so subsequent interrupts will fire for either dpad or buttons
 	pop BC
+	AccountingMark ACCOUNTING_END
 	ret
 
 
@@ -147,12 +164,21 @@ T_JoyTryGetEvent::
 
 
 ; As T_JoyTryGetEvent, but blocks until an event is available.
+; While there are no events, the task sleeps on JoyWaiter rather than using CPU time.
+; Puts event in B. Clobbers A, H, L.
 ; Note: Since this may block, there is no non-T_ version
 T_JoyGetEvent::
-	; TODO for now, busy loop. Use something smarter later.
-.loop
-	call T_JoyTryGetEvent
-	jr z, .loop ; try again if not success
+	IntSafeWaiterCheckOrWait JoyWaiter, _JoyCheckEvent
+	jr nc, T_JoyGetEvent ; we waited, so there should be an event now. Check again.
+	ret
+
+
+; Helper for T_JoyGetEvent. As JoyTryGetEvent, but sets c if there was an event instead of unsetting z.
+_JoyCheckEvent:
+	call JoyTryGetEvent
+	scf
+	ret nz ; return with c set if we got an event
+	ccf ; otherwise unset c
 	ret
 
 
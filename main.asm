@@ -4,13 +4,7 @@ include "hram.asm"
 include "ioregs.asm"
 include "debug.asm"
 include "macros.asm"
-
-
-Section "Core Stack", WRAM0
-
-CoreStackBase:
-	ds CORE_STACK_SIZE
-CoreStack::
+include "task.asm"
 
 
 Section "Core Functions", ROM0
@@ -71,12 +65,19 @@ Start::
 	ld [Uptime+1], A
 	ld [Uptime+2], A
 	ld [Uptime+3], A
+	ld [TimerPeriodic], A
 
 	; Init things
 	call TaskInit
 	call SchedInit
 	call GraphicsInit
 	call JoyInit
+	call SerialInit
+	call AccountingInit
+IF DEBUG > 0
+	; Debug builds always collect CPU accounting, so it can be examined with tools/cpu_accounting.py
+	call AccountingStart
+ENDC
 
 	ld HL, GeneralDynMem
 	ld B, GENERAL_DYN_MEM_SIZE
@@ -93,20 +94,34 @@ Start::
 	ld [SpritePalette0], A
 	ld [SpritePalette1], A
 
+	call SchedStartTimer ; Uptime timer starts from here
 	xor A
-	ld [TimerCounter], A ; Uptime timer starts from here
 	ld [InterruptFlags], A ; Reset pending interrupts now that we're properly set up
 
 	ld A, IntEnableTimer | IntEnableVBlank | IntEnableJoypad
+IF DEBUG > 0
+	; Only the serial echo task uses the link cable, so release builds leave it alone.
+	; Any task that wants to use it needs this, as it replaces what SerialInit set.
+	or IntEnableSerial
+ENDC
 	ld [InterruptsEnabled], A
 	ei ; note we've still got switching disabled until we switch into our first task
 
 	ld C, 0
 	SetTaskNewEntryPoint TaskPaintMain
+	ld B, PRIORITY_HIGH ; it responds to input, and spends most of its time waiting for it
 	call TaskNewDynStack
 
 	SetTaskNewEntryPoint TaskClockMain
+	ld B, PRIORITY_NORMAL
+	call TaskNewDynStack
+
+IF DEBUG > 0
+	; Only for testing the link with tools/serial_link.py, which runs the debug rom
+	SetTaskNewEntryPoint TaskSerialEchoMain
+	ld B, PRIORITY_NORMAL
 	call TaskNewDynStack
+ENDC
 
 	jp SchedLoadNext ; does not return
 
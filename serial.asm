@@ -0,0 +1,438 @@
+include "hram.asm"
+include "ioregs.asm"
+include "ring.asm"
+include "longcalc.asm"
+include "waiter.asm"
+
+; Serial link driver. See ideas/serial.txt for how the hardware works.
+;
+; Tasks send and receive bytes via two rings, SerialTxQueue and SerialRxQueue.
+; One side of the link is the active side, which starts every transfer, and the other is passive.
+; Every transfer swaps one byte each way. Both sides start passive, and one must be made active
+; with T_SerialSetActive.
+;
+; The passive side can't control when transfers happen, so it only says it's ready for one
+; (by setting bit 7 of SerialControl) once it's taken the last byte received and loaded the next byte
+; to send. If it isn't ready, or there's no cable, the active side reads $ff. So $ff is never sent
+; as data, and the active side knows to send the same byte again. It retries straight away,
+; since a transfer takes long enough for the passive side to finish what it was doing,
+; but after SERIAL_MAX_RETRIES in a row it gives up and waits for the next poll (see SerialPoll).
+;
+; When there's nothing to send, we send SERIAL_IDLE. Data bytes that look like our special values
+; are sent as SERIAL_ESCAPE followed by the value with all bits flipped. This is done by T_SerialSend
+; and T_SerialRecv, so the rings contain bytes as sent over the wire, except received
+; SERIAL_IDLE and SERIAL_NONE bytes, which are dropped.
+;
+; Neither side starts (or readies itself for) a transfer unless there's room in its rx ring for
+; the byte it will receive, so bytes are never dropped. If the ring is full, we stall until
+; T_SerialRecv makes room.
+;
+; While bytes are moving either way, the active side starts each transfer as soon as the last one ends.
+; Otherwise it only checks whether the passive side has something to send every 16 ticks.
+;
+; Partial transfers (eg. a cable pulled out mid-byte) are not handled, and may leave the passive side
+; out of step with the active side until reset. Nor is the passive side losing a serial interrupt
+; (see SerialPoll), which leaves it never ready again.
+
+SERIAL_QUEUE_SIZE EQU 63
+
+; Special values on the wire
+SERIAL_NONE EQU $ff ; what the active side reads if the passive side wasn't ready, or there's no cable
+SERIAL_IDLE EQU $fe ; sent when we have nothing to send
+SERIAL_ESCAPE EQU $fd ; the next byte is a data byte >= SERIAL_ESCAPE with its bits flipped
+
+; How many transfers in a row the passive side can miss before we stop trying until the next poll.
+SERIAL_MAX_RETRIES EQU 8
+
+; Values to write to SerialControl
+SERIAL_START EQU $81 ; start a transfer with our clock
+SERIAL_READY EQU $80 ; wait for a transfer with the other side's clock
+
+
+SECTION "Serial RAM", WRAM0
+
+SerialTxQueue::
+	RingDeclare SERIAL_QUEUE_SIZE
+SerialRxQueue::
+	RingDeclare SERIAL_QUEUE_SIZE
+
+; Woken when bytes are taken from SerialTxQueue
+SerialTxWaiter::
+	DeclareIntSafeWaiter
+; Woken when bytes are added to SerialRxQueue
+SerialRxWaiter::
+	DeclareIntSafeWaiter
+
+; 1 if we're the active side, 0 if passive
+SerialActive::
+	db
+; Active side only: 1 if a transfer is in progress
+SerialBusy::
+	db
+; 1 if we've stopped transferring until there's room in SerialRxQueue
+SerialStalled::
+	db
+; Active side only: Byte being sent, kept until the passive side gets it, or SERIAL_IDLE if none.
+SerialOutgoing::
+	db
+; Active side only: How many transfers in a row the passive side wasn't ready for
+SerialRetries::
+	db
+
+
+SECTION "Serial methods", ROM0
+
+
+; Set up serial as the passive side. Clobbers A.
+SerialInit::
+	RingInit SerialTxQueue
+	RingInit SerialRxQueue
+	IntSafeWaiterInit SerialTxWaiter
+	IntSafeWaiterInit SerialRxWaiter
+	xor A
+	ld [SerialActive], A
+	ld [SerialBusy], A
+	ld [SerialStalled], A
+	ld [SerialRetries], A
+	ld A, SERIAL_IDLE
+	ld [SerialOutgoing], A
+	ld [SerialData], A
+	ld A, SERIAL_READY
+	ld [SerialControl], A
+	ld HL, TimerPeriodic
+	res TIMER_PERIODIC_SERIAL, [HL] ; only the active side polls
+	ld HL, InterruptsEnabled
+	set 3, [HL] ; Enable serial interrupt
+	ret
+
+
+; Make this the active side of the link. Exactly one side must be active.
+; This should be done before the other side has started any transfers.
+; Interrupts must be disabled. Clobbers A, B, C, H, L.
+SerialSetActive::
+	ld A, [SerialActive]
+	and A
+	ret nz
+	inc A
+	ld [SerialActive], A
+	ld HL, TimerPeriodic
+	set TIMER_PERIODIC_SERIAL, [HL] ; start polling the other side (see SerialPoll)
+	xor A
+	ld [SerialControl], A ; stop waiting for the other side to start a transfer
+	; As the passive side, we may have already taken a byte from the queue to send next. Send it first.
+	ld A, [SerialData]
+	ld [SerialOutgoing], A
+	ld A, [SerialStalled]
+	and A
+	ret nz ; we'll start once there's room to receive
+	jp _SerialStartTransfer ; tail call
+
+
+; As SerialSetActive, but callable from tasks.
+T_SerialSetActive::
+	di
+	call SerialSetActive
+	reti ; enable interrupts and return
+
+
+; Called from the timer interrupt every 16 ticks while we're the active side.
+; If we aren't transferring, start a transfer to check if the other side has anything for us.
+; If we are, but its interrupt was lost, raise it again.
+; Clobbers A.
+SerialPoll::
+	ld A, [SerialBusy]
+	and A
+	jr nz, .busy
+	ld A, [SerialStalled]
+	and A
+	ret nz
+	push BC
+	push HL
+	call _SerialStartTransfer
+	pop HL
+	pop BC
+	ret
+.busy
+	; A write to InterruptFlags elsewhere can lose our interrupt if the transfer ends between
+	; its read and write, and then we'd wait for it forever. So if the transfer's done
+	; and its interrupt isn't pending, make it pending again. SerialInt runs once the timer
+	; interrupt returns. Setting it is a write to InterruptFlags too, but we only get here
+	; in the rare case that one already lost our interrupt.
+	ld A, [SerialControl]
+	rla ; set c if it's still in progress
+	ret c
+	ld A, [InterruptFlags]
+	and IntEnableSerial
+	ret nz
+	push HL
+	ld HL, InterruptFlags
+	set 3, [HL]
+	pop HL
+	ret
+
+
+SerialInt::
+	push AF
+	push BC
+	push HL
+	ld A, [SerialData]
+	ld B, A ; B = received byte
+	call _SerialPushRx ; A = non-zero if we received data
+	ld C, A
+	ld A, [SerialActive]
+	and A
+	jr nz, .active
+
+	; Passive side. We were ready, so the byte we loaded has been sent.
+	call _SerialRxFull
+	jr z, .stall
+	call _SerialNextTx
+	ld [SerialData], A
+	ld A, SERIAL_READY
+	ld [SerialControl], A
+	jr .ret
+.stall
+	; We'll get ready again once there's room. Until then there's no byte to send.
+	ld A, SERIAL_IDLE
+	ld [SerialData], A
+	ld A, 1
+	ld [SerialStalled], A
+	jr .ret
+
+.active
+	ld A, B
+	cp SERIAL_NONE
+	jr z, .not_ready
+	xor A
+	ld [SerialRetries], A
+	ld A, [SerialOutgoing]
+	cp SERIAL_IDLE
+	jr nz, .moved
+	ld A, C
+	and A
+	jr nz, .moved
+	; Neither side had anything to send, so wait for the next poll
+	xor A
+	ld [SerialBusy], A
+	jr .ret
+.moved
+	ld A, SERIAL_IDLE
+	ld [SerialOutgoing], A ; the passive side got it
+	call _SerialStartTransfer
+	jr .ret
+
+.not_ready
+	ld A, [SerialRetries]
+	inc A
+	ld [SerialRetries], A
+	cp SERIAL_MAX_RETRIES
+	jr nc, .give_up
+	; Send the same byte again
+	ld A, [SerialOutgoing]
+	ld [SerialData], A
+	ld A, SERIAL_START
+	ld [SerialControl], A
+	jr .ret
+.give_up
+	; Either there's nothing on the other end, or it's very busy. Wait for the next poll.
+	xor A
+	ld [SerialRetries], A
+	ld [SerialBusy], A
+
+.ret
+	pop HL
+	pop BC
+	pop AF
+	reti
+
+
+; Set z if there's no room in SerialRxQueue. Clobbers A, C.
+_SerialRxFull:
+	ld A, [SerialRxQueue + ring_tail]
+	ld C, A
+	ld A, [SerialRxQueue + ring_head]
+	inc A
+	and SERIAL_QUEUE_SIZE
+	cp C
+	ret
+
+
+; Push received byte B to SerialRxQueue unless it's SERIAL_IDLE or SERIAL_NONE.
+; There must be room. Interrupts must be disabled.
+; Sets A to non-zero if we pushed it, otherwise 0. Clobbers C, H, L.
+_SerialPushRx:
+	ld A, B
+	cp SERIAL_IDLE
+	jr nc, .nothing ; SERIAL_IDLE or SERIAL_NONE
+	RingPushNoCheck SerialRxQueue, SERIAL_QUEUE_SIZE, B
+	IntSafeWaiterWake SerialRxWaiter
+	ld A, 1
+	ret
+.nothing
+	xor A
+	ret
+
+
+; Take the next byte to send from SerialTxQueue into A, or SERIAL_IDLE if there isn't one.
+; Interrupts must be disabled. Clobbers B, H, L.
+_SerialNextTx:
+	RingPop SerialTxQueue, SERIAL_QUEUE_SIZE, B
+	ld A, SERIAL_IDLE
+	ret z
+	IntSafeWaiterWake SerialTxWaiter
+	ld A, B
+	ret
+
+
+; Active side only: Start a transfer, sending SerialOutgoing, or the next byte to send if there isn't one.
+; If there's no room to receive a byte, stall instead.
+; Interrupts must be disabled. Clobbers A, B, C, H, L.
+_SerialStartTransfer:
+	call _SerialRxFull
+	jr nz, .room
+	ld A, 1
+	ld [SerialStalled], A
+	xor A
+	ld [SerialBusy], A
+	ret
+.room
+	ld A, [SerialOutgoing]
+	cp SERIAL_IDLE
+	jr nz, .got_byte ; retrying a byte the passive side didn't get
+	call _SerialNextTx
+	ld [SerialOutgoing], A
+.got_byte
+	ld [SerialData], A
+	ld A, 1
+	ld [SerialBusy], A
+	ld A, SERIAL_START
+	ld [SerialControl], A
+	ret
+
+
+; Start transferring again after a stall, now there's room in SerialRxQueue.
+; Interrupts must be disabled. Clobbers A, B, C, H, L.
+_SerialResume:
+	xor A
+	ld [SerialStalled], A
+	ld A, [SerialActive]
+	and A
+	jp nz, _SerialStartTransfer ; tail call
+	call _SerialNextTx
+	ld [SerialData], A
+	ld A, SERIAL_READY
+	ld [SerialControl], A
+	ret
+
+
+; Send the byte in B over the link cable, blocking while the send queue is full.
+; Note: Since this may block, there is no non-T_ version
+; Clobbers A, C, H, L.
+T_SerialSend::
+	IntSafeWaiterCheckOrWait SerialTxWaiter, _SerialTrySend
+	jr nc, T_SerialSend ; we waited, so there should be room now. Check again.
+	ret
+
+
+; Helper for T_SerialSend. Queue byte B if there's room, and set c if we did.
+; Clobbers A, C, H, L.
+_SerialTrySend:
+	ld A, [SerialTxQueue + ring_tail]
+	ld C, A
+	ld A, [SerialTxQueue + ring_head]
+	sub C
+	and SERIAL_QUEUE_SIZE ; A = number of bytes queued
+	ld C, A
+	ld A, B
+	cp SERIAL_ESCAPE ; set nc if B needs escaping
+	ld A, C
+	jr c, .no_escape
+	inc A ; we need room for the escape byte too
+.no_escape
+	cp SERIAL_QUEUE_SIZE ; set c if there's room
+	ret nc
+
+	ld A, B
+	cp SERIAL_ESCAPE
+	jr c, .push
+	ld C, SERIAL_ESCAPE
+	RingPushNoCheck SerialTxQueue, SERIAL_QUEUE_SIZE, C
+	ld A, B
+	cpl
+	ld C, A
+	RingPushNoCheck SerialTxQueue, SERIAL_QUEUE_SIZE, C
+	jr .pushed
+.push
+	RingPushNoCheck SerialTxQueue, SERIAL_QUEUE_SIZE, B
+.pushed
+
+	; If we're the active side and have stopped, start again
+	di
+	ld A, [SerialActive]
+	and A
+	jr z, .done
+	ld A, [SerialBusy]
+	ld C, A
+	ld A, [SerialStalled]
+	or C
+	jr nz, .done
+	push BC
+	call _SerialStartTransfer
+	pop BC
+.done
+	ei
+	scf
+	ret
+
+
+; Receive a byte from the link cable into B, blocking until one is available.
+; Note: Since this may block, there is no non-T_ version
+; Clobbers A, C, H, L.
+T_SerialRecv::
+	IntSafeWaiterCheckOrWait SerialRxWaiter, _SerialTryRecv
+	jr nc, T_SerialRecv ; we waited, so there should be a byte now. Check again.
+	ret
+
+
+; Helper for T_SerialRecv. Take a byte into B if there is one, and set c if we did.
+; Clobbers A, C, H, L.
+_SerialTryRecv:
+	ld A, [SerialRxQueue + ring_tail]
+	ld C, A
+	ld A, [SerialRxQueue + ring_head]
+	sub C
+	and SERIAL_QUEUE_SIZE ; A = number of bytes queued. This also unsets c.
+	ret z
+	ld B, A
+	ld A, C
+	LongAddToA SerialRxQueue + ring_data, HL ; HL = first byte
+	ld A, [HL]
+	cp SERIAL_ESCAPE
+	jr nz, .pop
+	; We need the byte after the escape too
+	ld A, B
+	cp 2 ; set c if we only have the escape
+	ccf
+	ret nc
+	RingPopNoCheck SerialRxQueue, SERIAL_QUEUE_SIZE, B ; discard the escape
+	RingPopNoCheck SerialRxQueue, SERIAL_QUEUE_SIZE, B
+	ld A, B
+	cpl
+	ld B, A
+	jr .popped
+.pop
+	RingPopNoCheck SerialRxQueue, SERIAL_QUEUE_SIZE, B
+.popped
+
+	; If we stopped because the queue was full, there's room now
+	ld A, [SerialStalled]
+	and A
+	jr z, .done
+	di
+	push BC
+	call _SerialResume
+	pop BC
+	ei
+.done
+	scf
+	ret
@@ -3,6 +3,14 @@ include "task.asm"
 include "macros.asm"
 include "longcalc.asm"
 include "constants.asm"
+include "accounting.asm"
+
+
+SECTION "Core Stack", WRAM0
+
+CoreStackBase:
+	ds CORE_STACK_SIZE
+CoreStack::
 
 
 SECTION "Task List", WRAM0
@@ -57,20 +65,27 @@ TaskFindNextFree:
 	ret
 
 
-; Create a new task with entry point in DE, initial stack pointer in HL and inital ROM bank in C.
+; Create a new task with entry point in DE, initial stack pointer in HL, inital ROM bank in C
+; and priority (one of the PRIORITY_* values) in B.
 ; Returns the new task id in B, or 255 if no task could be allocated.
 TaskNewWithStack::
 	; Pick a task id
+	push BC
 	push HL
 	call TaskFindNextFree
 	pop HL
 	ld A, B
+	pop BC ; B = priority, C = ROM bank
 	cp $ff
-	ret z ; if B == 255, exit early with failure
-	; fall through to TaskNewWithID
+	jr nz, TaskNewWithID
+	ld B, A ; if A == 255, exit early with failure
+	ret
 ; Create a new task with entry point in DE, initial stack pointer in HL,
-; initial ROM bank in C and new task id in B.
+; initial ROM bank in C, priority in B and new task id in A.
+; Returns the new task id in B.
 TaskNewWithID:
+	push BC ; we need B for the task id, so save the priority for later
+	ld B, A
 	; prepare the initial stack, which can be mostly garbage.
 	dec HL
 	ld A, D
@@ -94,37 +109,43 @@ TaskNewWithID:
 	RepointStruct HL, task_rambank+1, task_waiter
 	dec A ; A = ff
 	ld [HL], A ; [HL] = ff, this says the task is initially not waiting for any waiter
+	RepointStruct HL, task_waiter, task_priority
+	pop DE ; D = priority. We're done with DE.
+	ld [HL], D ; this sets the initial priority
 	jp SchedAddTask ; schedule new task to run and return
 
 
-; Create a new task with entry point in DE, ROM bank C (or 0) and a stack allocated from dynamic memory.
+; Create a new task with entry point in DE, ROM bank C (or 0), priority B
+; and a stack allocated from dynamic memory.
 ; Returns the new task id in B, or 255 if no task could be allocated.
 TaskNewDynStack::
+	push BC
 	call TaskFindNextFree ; B = new task id or 255
 	ld A, B
 	cp $ff
-	ret z ; if B = 255, exit early with failure
+	jr z, .fail ; if B = 255, exit early with failure
 	push DE
 	ld D, B ; this sets task ownership of allocated mem
-	ld E, C ; storing B and C in D and E is faster than push and pop
 	ld B, DYN_MEM_STACK_SIZE
 	ld HL, GeneralDynMem
 	call DynMemAlloc ; allocate stack in the name of task D, put in HL
-	ld B, D
-	ld C, E ; restore B and C
-	pop DE
 	ld A, H
 	or L ; H or L -> set Z if HL == $0000
-	jr nz, .nofail
-	; return failure since we couldn't allocate a stack
-	ld B, $ff
-	ret
-.nofail
+	ld A, D ; A = task id
+	pop DE
+	jr z, .fail ; return failure since we couldn't allocate a stack
+	pop BC ; B = priority, C = ROM bank
 	; HL points to the base of the new stack, but stacks grow down,
 	; we want to give the top of the stack
+	push AF
 	ld A, DYN_MEM_STACK_SIZE
 	LongAddToA HL, HL ; HL += stack size
+	pop AF
 	jr TaskNewWithID ; tail call
+.fail
+	pop BC
+	ld B, $ff
+	ret
 
 
 ; Task-callable versions of TaskNew family
@@ -139,6 +160,17 @@ T_TaskNewDynStack::
 	jp T_EnableSwitch
 
 
+; Set the priority of task B to C, which must be one of the PRIORITY_* values.
+; If the task is already waiting to run, it keeps its place until it next runs.
+; This is a single write, so it's also safe to call from core code.
+; Clobbers A, HL.
+T_TaskSetPriority::
+	ld A, B
+	LongAddToA TaskList+task_priority, HL ; HL = TaskList + B + task_priority = &(TaskList[B].task_priority)
+	ld [HL], C
+	ret
+
+
 ; Save task state from current cpu state and transitions into the (blank) core stack.
 ; Expects the top of stack to look like: (top), Return address, PC of task, user stack
 ; (it is done this way so that 'call TaskSave' will save your caller and return to you,
@@ -199,6 +231,8 @@ TaskLoad::
 	ld [CurrentRAMBank], A
 	SetRAMBank
 .noRAM
+	; Record the switch for CPU accounting
+	AccountingMarkIntsOn ACCOUNTING_SWITCH
 	; set stack pointer
 	ld H, B
 	ld L, C
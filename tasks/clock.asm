@@ -1,5 +1,3 @@
-include "longcalc.asm"
-
 ; A basic clock task that puts OS uptime in a specific position on screen using sprites.
 
 ; Location on screen to display
@@ -14,7 +12,10 @@ _CLOCK_POS_X EQU CLOCK_POS_X + 8
 _CLOCK_POS_Y EQU CLOCK_POS_Y + 16
 
 
-SECTION "Task clock code", ROMX
+; The tables go at the start, so they're page-aligned and in the same bank as the code that reads them.
+SECTION "Task clock code", ROMX, ALIGN[8]
+
+include "clock_tables.asm"
 
 TaskClockMain::
 .mainloop
@@ -53,19 +54,24 @@ TaskClockMain::
 
 
 ; Get current uptime and store in BCDE as 2-digit BCD values hours, minutes, seconds, centiseconds
-; Note it will be incorrect in the hours column after 100 hours!
+; Hours wrap around after 100 hours, and are incorrect after 256 hours!
+; The division and BCD conversion are done with lookup tables, see tools/clock_tables.py.
 TaskClockGetHMS:
 	call T_GetUptime ; BCDE = uptime in ticks
 
 	; Our general approach: First, turn 32-bit ticks into 8-bit hours, mins, secs, centis.
-	; Then worry about the BCD conversion.
+	; Then look up the BCD form of each.
 
 	; Centis/seconds is the easy part, since we know that split is 10 bits in,
-	; since ticks are in units of 2^-10 seconds.
+	; since ticks are in units of 2^-10 seconds. There's a 4-page table that gives us
+	; the centiseconds in BCD for any fraction of a second.
 	ld A, D
 	and %00000011
+	add HIGH(ClockCentis)
 	ld H, A
-	ld L, E ; HL = bottom 10 bits of BCDE = fraction of a second in ticks
+	ld L, E ; HL = ClockCentis + bottom 10 bits of BCDE
+	ld A, [HL]
+	push AF ; centiseconds in BCD
 	; Now we need to shift 24-bit reg B,C,D down by 2 to get seconds
 	srl B
 	rr C
@@ -74,124 +80,65 @@ TaskClockGetHMS:
 	rr C
 	rr D ; shifted twice
 
-	; We calculate 100 * HL / 1024 to get 100ths of a second.
-	; 100 * HL / 1024 === 25 * HL / 256 -> multiply by 25 then take top byte (H)
-	push DE
-	ld DE, 0
-	MultiplyConst16 HL, 25, DE ; DE = HL * 25
-	ld H, D
-	pop DE
-	; Now H = 100ths of a second
-
-	ld E, 60
-	call TaskClockDivMod ; BCD, A = BCD / 60, BCD % 60
-	ld L, A ; Now L = seconds
-	call TaskClockDivMod ; BCD, A = BCD / 60, BCD % 60
-	; CD = hours, A = minutes
-	; We're punting on dealing with >= 100 hours sanely, so we just discard C
-	; and assume D < 100.
-
-	call TaskClockBCDConvert
-	ld C, A ; C = minutes in BCD
-	ld A, D
-	ld D, C ; because BC will get clobbered
-	call TaskClockBCDConvert
-	ld B, A ; B = hours in BCD
-	ld C, D
-	push BC
-	ld A, L
-	call TaskClockBCDConvert
+	call TaskClockDivMod60 ; BCD, A = BCD / 60, BCD % 60
+	ld H, HIGH(ClockBCD)
+	ld L, A
+	ld A, [HL]
+	push AF ; seconds in BCD
+	call TaskClockDivMod60 ; BCD, A = BCD / 60, BCD % 60
+	; BCD = hours, A = minutes
+	; We're punting on dealing with >= 256 hours sanely, so we just discard B and C.
+	ld H, HIGH(ClockBCD)
+	ld L, A
+	ld C, [HL] ; C = minutes in BCD
+	ld L, D
+	ld B, [HL] ; B = hours in BCD
+	pop AF
 	ld D, A ; D = seconds in BCD
-	ld A, H
-	call TaskClockBCDConvert
+	pop AF
 	ld E, A ; E = centiseconds in BCD
-	pop BC
-
-	ret
-
-
-; Convert A = 0 to 99 into BCD form and output in A.
-; Clobbers BCE.
-TaskClockBCDConvert:
-	; I don't actually understand this algorithm - I found it online and it seems to work:
-    ; digits all start at 0 and are 4-bit binary numbers
-    ; repeat N times (where N is number of input binary number bits):
-    ;   for each digit:
-    ;     if digit >= 5, digit += 3
-    ;   shift left, in order, with carry between them:
-    ;     binary number, ones digit, tens digit, etc
-	;     (eg. shift MSB of binary number into LSB of ones digit)
-    ; each 4-bit digit is now a BCD digit
-	; TODO I actually understand this now. Consider the 5 and 3 values AFTER they've been shifted:
-	; 5 becomes 10, 3 becomes 6. So if the digit is >= 10, add 6. It's performing the same calculation
-	; as the DAA instruction, and could be greatly sped up by using that instead.
-	ld C, A
-	ld B, 0
-
-; arg \1 is either 0 or 4 (0 to check lower half, 4 to check upper)
-; clobbers E
-_Check5: MACRO
-    ld A, B
-    and $0f << \1
-    cp 5 << \1
-    jr c, .lessThan5\@
-    add 3 << \1
-    ld E, A
-    ld A, B
-    and $0f << (4 - \1) ; get opposite half
-    or E ; combine with new value for this half
-    ld B, A
-.lessThan5\@
-    ENDM
-
-	REPT 8
-	_Check5 0
-	_Check5 4
-	sla C
-	rl B
-	ENDR
-
-	ld A, B
 	ret
 
 
-; Calculate divisor and modulus by E of 24-bit unsigned int in regs BCD
+; Calculate divisor and modulus by 60 of 24-bit unsigned int in regs BCD
 ; Outputs divisor in BCD and modulus in A.
-TaskClockDivMod:
-	; This algorithm is ultimately a kind of long division in base 2.
-	; We're short on registers, so we carefully manage B, C and D to set the quotient
-	; even as we shift the input out.
-	; The bit that is at the bottom just after we shift out bit n will become bit n after the full
-	; 8 shifts is completed. Visual explanation:
-	;  n1 n2 n3 n4 n5 n6 n7 n8
-	;  n2 n3 n4 n5 n6 n7 n8 q1
-	;  n3 n4 n5 n6 n7 n8 q1 q2
-	;  n4 n5 n6 n7 n8 q1 q2 q3
-	;  n5 n6 n7 n8 q1 q2 q3 q4
-	;  n6 n7 n8 q1 q2 q3 q4 q5
-	;  n7 n8 q1 q2 q3 q4 q5 q6
-	;  n8 q1 q2 q3 q4 q5 q6 q7
-	;  q1 q2 q3 q4 q5 q6 q7 q8
-
-	xor A ; initialize remainder
-
-; Helper macro to unroll. Takes current register to consider \1 = B, C or D.
-_DivModPart: MACRO
-	REPT 8
-	sla \1 ; shift \1, putting the top bit into carry flag and setting bottom bit to 0
-	rla ; rotate A left, doubling it and setting bottom bit depending on carry flag
-	cp E ; set c if A < divisor
-	jr c, .lessThanDivisor\@
-	; A > divisor, set next quotient bit (bottom bit of \1) and sub divisor from A
-	sub E
-	inc \1 ; sets bottom bit, since we know we set it to 0 just above
-.lessThanDivisor\@
-	ENDR
+; Clobbers E, H, L.
+TaskClockDivMod60:
+	; This is long division in base 256, looking up each step in tables.
+	; For the most significant byte, there's no remainder from before, so the quotient byte
+	; and remainder are just B / 60 and B % 60.
+	ld H, HIGH(ClockDiv60)
+	ld L, B
+	ld B, [HL]
+	inc H ; ClockMod60
+	ld E, [HL] ; E = remainder so far
+
+; Helper macro to unroll. Takes current register to consider \1 = C or D.
+; With remainder so far r in E, we want (256 * r + \1) / 60 and % 60. That's the sum
+; of each part divided separately, with a carry if the remainders add up to 60 or more.
+_DivMod60Part: MACRO
+	ld H, HIGH(ClockDiv60Carry)
+	ld L, E
+	ld A, [HL] ; A = 256 * r / 60
+	set 7, L ; ClockMod60Carry is half way through the same page
+	ld E, [HL] ; E = 256 * r % 60
+	ld H, HIGH(ClockDiv60)
+	ld L, \1
+	add [HL]
+	ld \1, A ; \1 = 256 * r / 60 + \1 / 60
+	inc H ; ClockMod60
+	ld A, [HL]
+	add E ; A = 256 * r % 60 + \1 % 60, which is < 120
+	cp 60
+	jr c, .noCarry\@
+	sub 60
+	inc \1
+.noCarry\@
+	ld E, A
 	ENDM
 
-	_DivModPart B
-	_DivModPart C
-	_DivModPart D
+	_DivMod60Part C
+	_DivMod60Part D
 	; BCD now contains the quotient, and A the final remainder.
 	ret
 
@@ -0,0 +1,17 @@
+
+; A task that sends back everything it receives over the link cable.
+; This is for testing links, see tools/serial_link.py. It's only in debug builds.
+
+IF DEBUG > 0
+
+
+SECTION "Task serial echo code", ROMX
+
+
+TaskSerialEchoMain::
+.mainloop
+	call T_SerialRecv ; B = received byte
+	call T_SerialSend
+	jr .mainloop
+
+ENDC
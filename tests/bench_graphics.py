@@ -0,0 +1,80 @@
+"""Cycle budgets for GraphicsTryWriteTile across tile queue depths.
+
+Each budget is how long the current implementation was measured to take (the cycles the test runner
+logs, including the call itself), with headroom added by budget().
+If you make a routine slower on purpose, measure it again and update its count here.
+"""
+
+file = 'graphics'
+target = 'GraphicsTryWriteTile'
+
+# Enqueueing shouldn't depend on how full the queue is
+def write_test(depth):
+	return Test(
+		in_DE = 0x0120, # queue 1
+		in_C = 0x41,
+		in_TileQueueInfo = Memory(0, 0, depth, (2 * depth) % 256),
+		out_A = 0,
+		out_TileQueueInfo = Memory(0, 0, depth + 1, (2 * depth + 2) % 256),
+		max_cycles = budget(78),
+	)
+
+write_empty = write_test(0)
+write_half_full = write_test(64)
+write_nearly_full = write_test(127)
+
+# Failing is fast
+write_full = Test(
+	in_DE = 0x0120,
+	in_C = 0x41,
+	in_TileQueueInfo = Memory(0, 0, 128, 0),
+	out_A = 128,
+	out_TileQueueInfo = Memory(0, 0, 128, 0),
+	max_cycles = budget(25),
+)
+
+# Throughput of a frame's worth of copying, tile queues vs. a single block.
+# With every tile queue full, a frame gets through VBLANK_INITIAL_CREDITS (60) tiles, ie. 60 bytes.
+# A block gets through 8 bytes for every 5 credits (after a 5 credit setup), ie. 88 bytes in about the same time.
+VBLANK_INITIAL_CREDITS = 60
+BLOCK_BYTES_PER_FRAME = 88
+
+vblank_tiles_full = Test('GraphicsVBlank',
+	in_DirtySprites = Memory(0),
+	in_TileQueueInfo = Memory([128, 0]*4),
+	in_BlockQueueLength = Memory(0),
+	in_AccountingIndex = Memory(0),
+	in_InterruptsEnabled = Memory(1),
+	out_TileQueueInfo = Memory(128 - VBLANK_INITIAL_CREDITS, 0, [128, 0]*3),
+	max_cycles = budget(858),
+)
+
+vblank_block_full = Test('GraphicsVBlank',
+	in_DirtySprites = Memory(0),
+	in_TileQueueInfo = Memory([0] * 8),
+	in_BlockQueueLength = Memory(1),
+	in_BlockQueueTail = Memory(0),
+	in_BlockQueue = Memory(255, 0x00, 0xd8, 0x00, 0x98), # 255 bytes from $d800 to the tilemap
+	in_AccountingIndex = Memory(0),
+	in_InterruptsEnabled = Memory(1),
+	out_BlockQueueLength = Memory(1),
+	out_BlockQueue = Memory(255 - BLOCK_BYTES_PER_FRAME, BLOCK_BYTES_PER_FRAME, 0xd8, BLOCK_BYTES_PER_FRAME, 0x98),
+	out_InterruptsEnabled = Memory(1), # vblank remains enabled
+	max_cycles = budget(912),
+)
+
+# Writing text. A full 20x18 screen redraw is 18 rows of 20 characters.
+# One T_GraphicsWriteTile per character costs about 195 cycles, plus about 18 for the caller's loop
+# to get the next character ready: 360 * 213 = 76680 cycles, or 4.4 frames of CPU time.
+# T_GraphicsWriteString costs 111 cycles per row on top of the test below: 18 * 615 = 11070 cycles, or 0.6 frames.
+# Either way, the screen takes 6 frames to update, since a frame only gets through 60 tiles.
+write_string_row = Test('_GraphicsTryWriteString',
+	in_TileQueueInfo = Memory([0] * 8),
+	in_HL = 0xd800,
+	in_DE = 0x0040,
+	in_C = 20,
+	out_cflag = 1,
+	out_C = 0,
+	out_TileQueueInfo = Memory(20, 40, [0] * 6),
+	max_cycles = budget(504),
+)
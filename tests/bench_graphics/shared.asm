@@ -0,0 +1,755 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+
+
+; --- original target file ---
+include "macros.asm"
+include "longcalc.asm"
+include "vram.asm"
+include "ioregs.asm"
+include "hram.asm"
+include "accounting.asm"
+include "waiter.asm"
+
+
+; Timing info for keeping the vblank handler from running too long.
+; tools/cycle_analyzer.py checks we're done with VRAM within VBLANK_CYCLES (see include/vram.asm).
+; One credit is roughly 11 cycles and VBlank has 1140 cycles, but there's
+; also a fixed cost overhead to worry about. This value was determined experimentally.
+VBLANK_INITIAL_CREDITS EQU 60
+; One credit is very roughly 11 cycles. DMA + setup takes a bit over 160 cycles.
+; 160/11 ~= 14.5, we add a little leeway
+VBLANK_SPRITE_DMA_COST EQU 16
+; A tile queue item takes 13 cycles and costs 1 credit. At the same rate, copying a group of
+; 8 bytes from a block takes 66 cycles and costs 5, and the fixed cost of a block (looking it up,
+; then removing it from the queue once it's done) is about 70 cycles.
+VBLANK_BLOCK_GROUP_COST EQU 5
+VBLANK_BLOCK_SETUP_COST EQU 5
+
+; Block queue entries are commands to copy a block of up to 255 bytes into VRAM.
+RSRESET
+block_len rb 1 ; bytes left to copy
+block_src rw 1 ; little-endian address of the next byte to copy
+block_dest rw 1 ; little-endian address to copy the next byte to
+block_end rb 0
+BLOCK_ENTRY_SIZE EQU 8 ; padded to make indexing cheap
+BLOCK_QUEUE_SIZE EQU 8
+IF block_end > BLOCK_ENTRY_SIZE
+FAIL "Block queue entries are too big for BLOCK_ENTRY_SIZE"
+ENDC
+
+
+SECTION "Core assets", ROM0
+
+FontTileData:
+include "assets/font.asm" ; defines FONT_TILE_DATA_SIZE
+
+
+SECTION "Graphics system RAM", WRAM0
+
+; For now, we make no attempt to mediate access. But if more than one task is writing
+; they're gonna be uncoordinated and have a bad time.
+
+TileQueueInfo:
+; Array of 4 x (length, head) info for the respective tile queues in TileQueues.
+; - length: length of tile queue, in items, 0 to 128.
+; - head: head of tile queue as index into queue.
+;   Valid items in queues are from head - 2 * length to head - 1.
+	ds 2 * 4
+
+; Number of entries in BlockQueue, 0 to BLOCK_QUEUE_SIZE
+BlockQueueLength:
+	db
+; Offset into BlockQueue of the oldest entry, ie. the one currently being copied.
+; Valid entries are from here to here + BLOCK_ENTRY_SIZE * length - 1, wrapping around.
+BlockQueueTail:
+	db
+
+; Woken every vblank, so tasks waiting for room in the tile or block queues can try again.
+GraphicsQueueWaiter::
+	DeclareIntSafeWaiter
+
+
+SECTION "Graphics block queue", WRAM0, ALIGN[8]
+
+; Queue of block_* structs, for copies too big to be worth doing with the tile queues.
+; Aligned so that an entry is addressed by its offset in the low byte.
+BlockQueue:
+	ds BLOCK_ENTRY_SIZE * BLOCK_QUEUE_SIZE
+
+
+SECTION "Graphics system aligned RAM", WRAM0, ALIGN[8]
+
+; An array of 4 tile queues, each 256 bytes long.
+; Each queue is 128 entries of 2 bytes (addr, value), where addr is the lower byte of
+; the tilemap address to write into.
+; Aligned so we can select the queue with the high byte and address into it with the low.
+TileQueues:
+	ds 256 * 4
+
+; An aside on the tradeoffs of the same approach as above for OAM (sprite) RAM.
+; If we were to use this method, it would cost us 256b of RAM, and 45+11/item cycles.
+; In comparison, using the hardware DMA method costs us 160b of RAM and 160 cycles.
+; It only takes 11 items before the queue method is slower.
+; We still use a dirty flag to know when to do the DMA,
+; though we store that dirty flag in HRAM so we can clear it during otherwise useless DMA time.
+
+; This is the shadow sprite table that can be updated whenever and gets copied during VBlank.
+; Aligned so we can do DMA.
+WorkingSprites::
+	ds 40 * 4
+
+
+SECTION "Graphics system functions", ROM0
+
+
+; Init graphics system. Display must be disabled.
+GraphicsInit::
+	; Load core tile data
+	ld HL, FontTileData
+	ld DE, OverlapTileMap + $20 * $10 ; first char in font is ' ' = $20, each char is 16 bytes
+IF DEF(FONT_COMPRESSED)
+	call Decompress ; Decompress from HL to DE
+ELSE
+	ld BC, FONT_TILE_DATA_SIZE
+	LongCopy ; Copy BC bytes from HL to DE
+ENDC
+
+	; Init queues by zeroing heads and lengths
+	xor A
+	ld HL, TileQueueInfo
+REPT 8
+	ld [HL+], A
+ENDR
+	ld [BlockQueueLength], A
+	ld [BlockQueueTail], A
+	IntSafeWaiterInit GraphicsQueueWaiter
+
+	; Init sprite ram (and working sprites) to disable all sprites by setting Y = 0
+	ld HL, WorkingSprites
+	ld B, 40
+	call ClearSprites
+	ld HL, SpriteTable
+	ld B, 40
+	call ClearSprites
+
+	; Init DirtySprites to not dirty
+	xor A
+	ld [DirtySprites], A
+
+	; Copy DMAWait into place
+	ld HL, _DMAWaitROM
+	ld DE, DMAWait
+	ld B, DMA_WAIT_SIZE
+	Copy ; Copy B bytes from HL to DE
+
+	ret
+
+
+; Helper function that disables B sprites starting from address HL.
+; We disable sprites by setting Y = 0.
+; Clobbers A, B, HL.
+ClearSprites::
+	xor A
+.loop
+	ld [HL+], A
+	inc L
+	inc L
+	inc L ; note we know L won't wrap because sprite ram is always aligned
+	dec B
+	jr nz, .loop
+	ret
+
+
+; Function that executes in HRAM during an ongoing DMA.
+; Do not call this function - it gets copied to DMAWait in HRAM. Call that instead.
+; It also clears DirtySprites.
+; Expects A = high byte of WorkingSprites to save space.
+; Clobbers A.
+_DMAWaitROM:
+	ldh [DMATransfer], A ; initiate DMA transfer. start 160 cycle timer. 2 bytes.
+	ld A, 39 ; 2 cycles. 2 bytes.
+.loop ; Loop runs for 38*4 + 1*3 = 155 cycles
+	dec A ; 1 cycle. 1 byte.
+	jr nz, .loop ; 3 cycles if taken, 2 if not. 2 bytes. @loop 39
+	ldh [DirtySprites], A ; DirtySprites = 0. 3 cycles. 2 bytes.
+	; we should be done with the DMA by now, since ret accesses [SP].
+	; cycles passed: 2 + 155 + 3 = 160.
+	ret ; 1 byte
+DMA_WAIT_SIZE_ACTUAL EQU @ - _DMAWaitROM
+IF DMA_WAIT_SIZE_ACTUAL != DMA_WAIT_SIZE
+FAIL "DMAWait routine size mismatch: Expected {DMA_WAIT_SIZE}, got {DMA_WAIT_SIZE_ACTUAL}"
+ENDC
+
+
+; VBlank handler that actually does the writes.
+; It does as much as it can before vblank time runs out, then returns.
+GraphicsVBlank:: ; @pool credits VBLANK_INITIAL_CREDITS
+	push AF
+	push BC
+	push DE
+	push HL
+
+	AccountingMark ACCOUNTING_VBLANK
+
+	ld HL, TileQueueInfo
+
+	; We use a primitive scheme of timekeeping here, where we have a number of 'credits'.
+	; Doing a queue item write costs 1 credit.
+	; We check if we can afford actions before doing them and track how many we have left.
+	; This prevents us running too long and not being in vblank anymore.
+	ld B, VBLANK_INITIAL_CREDITS
+
+	; A possible improvement - read io regs to determine where in vblank we are,
+	; preventing a delayed interrupt from causing havoc.
+
+	; Sprites get priority update over background
+	ld A, [DirtySprites]
+	and A ; set z if A = 0
+	jr z, .no_sprites
+	ld A, B ; TODO we can do this bit during the DMA to shave cycles
+	sub VBLANK_SPRITE_DMA_COST ; note we assume we can always afford since we're first priority. @spend credits VBLANK_SPRITE_DMA_COST
+	ld B, A
+	ld A, WorkingSprites >> 8
+	call DMAWait ; calls into HRAM routine to do the transfer and unset DirtySprites. @as call _DMAWaitROM
+.no_sprites
+
+; Helper macro for unrolling loop. Takes loop iteration 0-3 as \1.
+; Cycle cost (worst case): 45 + 11/item
+_GraphicsVBlankLoop: MACRO
+	ld A, [HL+] ; A = queue length, HL now points at queue head
+	and A ; set z if A == 0
+	jr z, .inc_hl_and_next\@
+	ld C, A
+	ld D, A ; C = D = length for safekeeping
+	ld A, [HL-] ; A = queue head, HL points at queue length
+	sub C
+	sub C
+	ld E, A ; E = queue head - 2 * queue length = queue tail
+	        ; we want this in L eventually but need HL for now
+	ld A, B ; A = time credits remaining
+	and A ; set z if we have no time credits left
+	jp z, .ret ; return if we're out of time
+	sub C ; A = time credits - items, set c if too many items
+	jr nc, .can_afford\@
+	ld C, B ; C = all remaining time credits
+	xor A ; A = 0 in prep for next line, faster than having two paths
+.can_afford\@
+	ld B, A ; set remaining credits to A (either subtract result or 0)
+	ld A, D ; A = original length
+	sub C ; A -= actual length we're consuming. A = remaining length.
+	ld [HL+], A ; update queue's length, point HL at queue head
+	push HL
+	ld L, E ; L = queue tail
+	ld H, (TileQueues >> 8) + \1 ; HL = addr of queue tail slot
+	ld D, (TileGrid >> 8) + \1 ; by setting E, we can now manipulate DE = addr into TileGrid
+	; We're finally ready. C is the loop counter.
+.queue_loop\@
+	ld A, [HL+] ; L will only ever wrap around on every second increment, so this is safe
+	            ; since we DON'T want H to change. A = target addr low byte.
+	ld E, A ; DE = target addr
+	ld A, [HL] ; NOT safe to HL+ here because we don't want H to increment if L wraps
+	ld [DE], A ; set value in array
+	inc L
+	dec C ; @spend credits 1
+	jr nz, .queue_loop\@ ; consider unrolling? lose granularity in time credits
+	pop HL ; HL = next queue length
+
+.inc_hl_and_next\@
+	inc HL
+ENDM
+
+	_GraphicsVBlankLoop 0
+	_GraphicsVBlankLoop 1
+	_GraphicsVBlankLoop 2
+	_GraphicsVBlankLoop 3
+
+	; If we've reached here, we either never ran out of credits, or we ran out in the last loop
+	; We check if there are any left (it's ok for us to consider 'exactly enough' as 'not enough' here)
+	ld A, B
+	and A ; set z if A == 0
+	jp z, .ret ; if we ran out, return now
+
+	; All tile queues are now empty. Spend what's left on the block queue.
+.block_loop
+	ld A, [BlockQueueLength]
+	and A ; set z if no blocks
+	jp z, .all_done
+	ld A, B
+	cp VBLANK_BLOCK_SETUP_COST + VBLANK_BLOCK_GROUP_COST ; set c if we can't afford to copy anything
+	jp c, .ret
+	sub VBLANK_BLOCK_SETUP_COST ; @spend credits VBLANK_BLOCK_SETUP_COST
+	ld B, A
+	ld A, [BlockQueueTail]
+	ld L, A
+	ld H, HIGH(BlockQueue) ; HL = oldest entry
+	push HL
+	ld A, [HL+]
+	ld C, A ; C = bytes left to copy
+	ld A, [HL+]
+	ld E, A
+	ld A, [HL+]
+	ld D, A ; DE = source
+	ld A, [HL+]
+	ld H, [HL]
+	ld L, A ; HL = dest
+	; Copy in groups of 8 bytes, while we can afford to
+.block_group
+	ld A, B
+	sub VBLANK_BLOCK_GROUP_COST
+	jr c, .block_out_of_credits
+	ld B, A ; @spend credits VBLANK_BLOCK_GROUP_COST
+	ld A, C
+	cp 8 ; set c if there's less than a full group left
+	jr c, .block_remainder
+REPT 8
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+ENDR
+	ld A, C
+	sub 8
+	ld C, A ; set z if there's nothing left
+	jr nz, .block_group
+	jr .block_done
+.block_remainder
+	; Copy the last 1-7 bytes, in the same time as a group or less
+	bit 2, C
+	jr z, .block_remainder_no4
+REPT 4
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+ENDR
+.block_remainder_no4
+	bit 1, C
+	jr z, .block_remainder_no2
+REPT 2
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+ENDR
+.block_remainder_no2
+	bit 0, C
+	jr z, .block_done
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.block_done
+	add SP, 2 ; discard entry pointer
+	; Remove the entry from the queue. We're in an interrupt, so tasks can't see this half-done.
+	ld A, [BlockQueueTail]
+	add BLOCK_ENTRY_SIZE
+	and BLOCK_ENTRY_SIZE * BLOCK_QUEUE_SIZE - 1
+	ld [BlockQueueTail], A
+	ld HL, BlockQueueLength
+	dec [HL]
+	jp .block_loop
+
+.block_out_of_credits
+	; Save our progress so we can continue next time. We're out of credits, so we can use B.
+	ld B, H
+	ld A, L
+	pop HL ; HL = entry
+	ld [HL], C
+	inc L
+	ld [HL], E
+	inc L
+	ld [HL], D
+	inc L
+	ld [HL+], A
+	ld [HL], B ; entry = remaining length, source, dest
+	jr .ret
+
+.all_done
+	; If we never ran out of credits, all queues are now empty.
+	; We disable any future vblank interrupts from happening at all, until a new value is written
+	ld HL, InterruptsEnabled
+	res 0, [HL] ; reset bit 0 of Interrupt Enable register
+
+.ret ; We must be done with VRAM by here. The interrupt and the jp at IntVBlank take 9 cycles. @budget VBLANK_CYCLES - 9
+	; Any tasks waiting for room in the queues can try again
+	IntSafeWaiterWake GraphicsQueueWaiter
+	AccountingMark ACCOUNTING_END
+	pop HL
+	pop DE
+	pop BC
+	pop AF
+	reti
+
+
+; VBlank interrupt handler turns itself off if it completes all work,
+; this function turns it back on and should be called after giving it more work.
+; Clobbers HL.
+GraphicsEnableVBlank::
+	; If it's still on, it'll get to our new work, and we can leave InterruptFlags alone.
+	; Writing to it can lose another interrupt that arrives between the read and the write,
+	; eg. the end of a serial transfer, so we only do so when we have to.
+	ld HL, InterruptsEnabled
+	bit 0, [HL]
+	ret nz
+	; Make sure to clear any pending VBlank first, or else it'll fire immediately!
+	ld HL, InterruptFlags
+	bit 0, [HL]
+	jr z, .enable
+	res 0, [HL] ; clear vblank flag in InterruptFlags register
+.enable
+	ld HL, InterruptsEnabled
+	set 0, [HL] ; set vblank flag in InterruptsEnabled register
+	ret
+
+
+; Set tile at tilemap index DE to value C
+; Sets A to 0 on success, otherwise on failure.
+; Clobbers HL.
+GraphicsTryWriteTile::
+	; We assume we're the only writer, but we need to be constantly aware that vblank could
+	; run at any time.
+
+	ld A, D
+	add D
+	LongAddToA TileQueueInfo, HL ; HL = TileQueueInfo + 2 * D
+	; HL = length of D'th queue
+
+	ld A, [HL+] ; A = length of queue, HL = addr of head
+	cp 128 ; set carry if length < 128, ie. if there's room for another item
+	ret nc ; if no carry, fail. A = length != 0 so we're indicating failure.
+
+	push HL ; we'll need TileQueueInfo again later
+	ld L, [HL] ; L = current queue head position
+	ld A, TileQueues >> 8
+	add D
+	ld H, A ; H = TileQueues high byte + D
+	; now HL = addr of queue head position
+	ld [HL], E
+	inc L
+	ld [HL], C
+	inc L ; add (index, value) to queue and set L to new queue head position
+	ld A, L
+	pop HL ; HL = addr of queue head in TileQueueInfo
+
+	; This section needs to be done atomically, otherwise if vblank runs in between
+	; it would do the wrong items.
+	di
+	ld [HL-], A ; set head to new value, set HL to length addr
+	inc [HL] ; increment length
+	ei
+
+	call GraphicsEnableVBlank
+
+	xor A ; A = 0 to indicate success
+	ret
+
+
+; As GraphicsTryWriteTile, but callable from tasks
+T_GraphicsTryWriteTile::
+	call T_DisableSwitch
+	call GraphicsTryWriteTile
+	ld H, A ; safekeeping, since T_EnableSwitch clobbers A
+	call T_EnableSwitch
+	ld A, H
+	ret
+
+
+; As T_GraphicsTryWriteTile, but blocks until the write succeeds.
+; Clobbers A, HL.
+; Note: Since this may block, there is no non-T_ version
+T_GraphicsWriteTile::
+	IntSafeWaiterCheckOrWait GraphicsQueueWaiter, _GraphicsTryWriteTile
+	jr nc, T_GraphicsWriteTile ; we waited, so there should be room now
+	ret
+
+
+; Helper for T_GraphicsWriteTile. As GraphicsTryWriteTile, but sets c on success.
+; Clobbers A, HL.
+_GraphicsTryWriteTile:
+	call GraphicsTryWriteTile
+	cp 1 ; set c if A == 0
+	ret
+
+
+; Copy C bytes from HL to VRAM address DE at the next vblank, or over several if there's too much
+; to do in one. Source data must stay valid until then, and must be in ROM0, WRAM0 or HRAM,
+; since we don't know what banks will be loaded when the copy happens.
+; Copying 0 bytes always succeeds.
+; Unlike GraphicsTryWriteTile, there is no particular size of region the copy must lie in,
+; and it may happen before or after writes queued with GraphicsTryWriteTile.
+; Sets A to 0 on success, otherwise on failure.
+GraphicsTryWriteBlock::
+	ld A, C
+	and A ; set z if there's nothing to copy
+	ret z
+	push BC
+	push HL
+	; We need a consistent view of the queue, since vblank may remove an entry at any time.
+	di
+	ld A, [BlockQueueTail]
+	ld B, A
+	ld A, [BlockQueueLength]
+	ei
+	cp BLOCK_QUEUE_SIZE ; set c if there's room for another entry
+	jr nc, .ret ; on failure, A = length != 0
+	add A
+	add A
+	add A ; A = length * BLOCK_ENTRY_SIZE
+	add B
+	and BLOCK_ENTRY_SIZE * BLOCK_QUEUE_SIZE - 1
+	ld L, A
+	ld H, HIGH(BlockQueue) ; HL = first unused entry
+	ld [HL], C
+	inc L
+	pop BC ; BC = source
+	push BC
+	ld [HL], C
+	inc L
+	ld [HL], B
+	inc L
+	ld [HL], E
+	inc L
+	ld [HL], D ; entry = length, source, dest
+	; Only now the entry is complete can we let vblank see it. This is a single instruction,
+	; so it's safe from interrupts.
+	ld HL, BlockQueueLength
+	inc [HL]
+	call GraphicsEnableVBlank
+	xor A ; A = 0 to indicate success
+.ret
+	pop HL
+	pop BC
+	ret
+
+
+; As GraphicsTryWriteBlock, but callable from tasks
+T_GraphicsTryWriteBlock::
+	call T_DisableSwitch
+	call GraphicsTryWriteBlock
+	push AF
+	call T_EnableSwitch
+	pop AF
+	ret
+
+
+; As T_GraphicsTryWriteBlock, but blocks until the write succeeds.
+; Clobbers A.
+; Note: Since this may block, there is no non-T_ version
+T_GraphicsWriteBlock::
+	IntSafeWaiterCheckOrWait GraphicsQueueWaiter, _GraphicsTryWriteBlock
+	jr nc, T_GraphicsWriteBlock ; we waited, so there should be room now
+	ret
+
+
+; Helper for T_GraphicsWriteBlock. As GraphicsTryWriteBlock, but sets c on success.
+; Clobbers A.
+_GraphicsTryWriteBlock:
+	call GraphicsTryWriteBlock
+	cp 1 ; set c if A == 0
+	ret
+
+
+; The bulk version of T_GraphicsWriteTile. Writes C tile values from HL to consecutive tilemap indexes
+; starting at DE. The same restrictions on the source data apply as for GraphicsTryWriteBlock.
+; Blocks until the write has been queued.
+; Clobbers A.
+T_GraphicsWriteTiles::
+	push DE
+	ld A, D
+	add HIGH(TileGrid)
+	ld D, A ; DE = TileGrid + DE. TileGrid is aligned, so we only need the high byte.
+	call T_GraphicsWriteBlock
+	pop DE
+	ret
+
+
+; Writes a string of C characters from HL to consecutive tilemap indexes starting at DE,
+; using the font tiles (see GraphicsInit). Blocks until all of it has been queued.
+; Anything past the end of the tilemap (index $3ff) is dropped.
+; This is much faster than a T_GraphicsWriteTile call for each character, and unlike
+; T_GraphicsWriteTiles, the string doesn't need to stay valid after it returns.
+; Returns with HL and DE pointing after the end of the string, and C = 0.
+; Clobbers A, B.
+; Note: Since this may block, there is no non-T_ version
+T_GraphicsWriteString::
+	IntSafeWaiterCheckOrWait GraphicsQueueWaiter, _GraphicsTryWriteString
+	jr nc, T_GraphicsWriteString ; we waited, so there should be room now. Continue from where we got up to.
+	ret
+
+
+; Helper for T_GraphicsWriteString. Queue as much of the string as there's room for,
+; updating HL, DE and C to what's left. Sets c if we queued all of it.
+; Clobbers A, B.
+_GraphicsTryWriteString:
+	ld A, C
+	and A
+	scf
+	ret z ; nothing left to write
+	call _GraphicsWriteStringPart
+	jr c, _GraphicsTryWriteString
+	ret
+
+
+; Queue as much of the string as fits in the tile queue for the part of the tilemap that DE is in.
+; Updates HL, DE and C as per _GraphicsTryWriteString. C must not be 0.
+; Sets c on success, or unsets it if the queue was full.
+; Clobbers A, B.
+_GraphicsWriteStringPart:
+	; We write whichever is smallest of: what's left of the string, the indexes left before
+	; the part of the tilemap covered by the next queue, and the room left in the queue.
+	ld A, E
+	cpl
+	inc A ; A = indexes left in this part of the tilemap, or 0 for all 256
+	jr z, .no_boundary
+	cp C
+	jr c, .got_boundary
+.no_boundary
+	ld A, C
+.got_boundary
+	ld B, A
+	push HL
+	ld A, D
+	add D
+	LongAddToA TileQueueInfo, HL ; HL = length of D'th queue
+	ld A, 128
+	sub [HL] ; A = room in the queue. This can't carry, since length <= 128.
+	jr z, .full
+	cp B
+	jr nc, .got_count
+	ld B, A
+.got_count
+	; B = how many we'll write
+	ld A, C
+	sub B
+	ld C, A ; C = what will be left after this
+	inc HL
+	ld A, [HL] ; A = queue head
+	pop HL
+	push BC ; for later
+	ld C, E ; C = tilemap index
+	ld E, A
+	ld A, D
+	add HIGH(TileQueues)
+	ld D, H
+	ld H, A
+	ld A, L
+	ld L, E ; HL = queue head
+	ld E, A ; DE = string
+
+	; For each character, add (index, tile) to the queue
+.loop
+	ld A, [DE]
+	inc DE
+	add 128 ; the font is at 128 + ascii value
+	ld [HL], C
+	inc L
+	ld [HL], A
+	inc L ; add (index, value) to queue. L wraps around, and H stays the same.
+	inc C
+	dec B
+	jr nz, .loop
+
+	ld A, C
+	pop BC ; B = how many we wrote, C = what's left
+	push DE ; string
+	ld E, A
+	ld A, H
+	sub HIGH(TileQueues)
+	ld D, A ; DE = next tilemap index, unless we reached the next queue's part (see below)
+	ld A, L
+	push AF ; A = new queue head
+	ld A, D
+	add D
+	LongAddToA TileQueueInfo, HL ; HL = length of D'th queue
+	pop AF
+	; This needs to be done atomically, as per GraphicsTryWriteTile. Note vblank may have
+	; shortened the queue since we looked, so we add to the length rather than setting it.
+	di
+	inc HL
+	ld [HL-], A ; set new head, point HL at length
+	ld A, [HL]
+	add B
+	ld [HL], A
+	ei
+
+	call GraphicsEnableVBlank
+	pop HL ; HL = rest of string
+	; If the tilemap index wrapped around to 0, we're now at the start of the next queue's part
+	ld A, E
+	and A
+	jr nz, .done
+	inc D
+	ld A, D
+	cp 4 ; set c if there is a next part
+	jr c, .done
+	; We've reached the end of the tilemap, and there's no queue for what's after it.
+	; Drop the rest of the string, as if we'd written it.
+	ld A, C
+	LongAddToAParts H,L, H,L ; HL = end of string
+	ld C, 0
+.done
+	scf
+	ret
+
+.full
+	pop HL ; c is unset from the sub
+	ret
+
+
+; Writes a sprite to the sprite table and sets the flag for it to be drawn next frame.
+; A = sprite index, B = X coord, C = Y coord, D = Tile number, E = flags.
+; Clobbers A, HL.
+GraphicsWriteSprite::
+	rla
+	rla ; Shift A left twice, ie. A = 4 * A. Note the rotate is equiv to shift because A < 64.
+	LongAddToA WorkingSprites, HL ; HL = WorkingSprites + A
+	; In order to avoid a half-written sprite from being drawn, we ensure no draw will occur
+	; until we are done. We do this by clearing the dirty flag regardless of whether it was set.
+	; We know this won't be overwritten because we've disabled switching when calling this function.
+	xor A
+	ld [DirtySprites], A
+	ld A, C
+	ld [HL+], A ; Y coord = C, HL points to X coord
+	ld A, B
+	ld [HL+], A ; X coord = B, HL points to tile number
+	ld A, D
+	ld [HL+], A ; Tile number = D, HL points to flags
+	ld [HL], E ; Flags = E
+	; Now we set the dirty flag so the sprite will be drawn next frame.
+	jp GraphicsSetDirtySprites
+
+
+; Set dirty sprites flag so that sprites will be drawn to screen next frame.
+; Clobbers A, HL
+GraphicsSetDirtySprites::
+	ld A, 1
+	ld [DirtySprites], A
+	jp GraphicsEnableVBlank
+
+
+T_GraphicsWriteSprite::
+	ld H, A ; DisableSwitch clobbers A
+	call T_DisableSwitch
+	ld A, H
+	call GraphicsWriteSprite
+	jp T_EnableSwitch
+
+
+T_GraphicsSetDirtySprites::
+	call T_DisableSwitch
+	call GraphicsSetDirtySprites
+	jp T_EnableSwitch
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT BlockQueue
+EXPORT BlockQueueLength
+EXPORT BlockQueueTail
+EXPORT TileQueueInfo
+EXPORT TileQueues
+EXPORT _GraphicsTryWriteString
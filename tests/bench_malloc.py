@@ -0,0 +1,126 @@
+"""Cycle budgets for DynMemAlloc and DynMemFree over long randomized traces of allocations and frees.
+
+Each trace is run by a small driver, and the model in tools/dynmem.py works out the expected result.
+The budget for a trace is the sum of the budgets for each of its operations: the slowest each routine
+was measured to take over these traces (including the call itself), plus the driver's overhead.
+Allocations that had to search their size class get an extra budget for each chunk looked at.
+Then budget() adds headroom. If you make a routine slower on purpose, measure it again and update its count here.
+
+For comparison, when DynMemAlloc was a first-fit scan over every chunk, it took 70 cycles plus 44
+for every chunk it stepped over, and there was no way to free memory.
+"""
+
+import dynmem
+
+file = 'malloc'
+target = 'BenchRunTrace'
+
+BASE = 0xd000
+PAGES = 4
+SLOTS = 16
+
+ALLOC_CYCLES = 414
+SCAN_CYCLES = 28
+FREE_CYCLES = 433
+# Driver overhead per operation, the slower of the alloc and free paths
+DRIVER_CYCLES = 53
+# Calling the driver, and reading the end of the trace
+TRACE_CYCLES = 15
+
+OP_FREE = 0xfe
+OP_END = 0xff
+
+asm = """
+include "longcalc.asm"
+
+SECTION "bench malloc range", WRAMX[${base:04x}]
+TestDynMem:
+	ds {size}
+
+SECTION "bench malloc slots", WRAM0
+BenchSlots:
+	ds {slots} * 2
+
+SECTION "bench malloc driver", ROM0
+
+; Run the trace at HL against TestDynMem. Each op is two bytes: the size to allocate (or OP_FREE)
+; then the offset of the slot in BenchSlots to store the allocation in (or free it from).
+; The trace ends with OP_END. Frees of failed allocations are skipped.
+BenchRunTrace:
+	ld A, [HL+]
+	cp {end}
+	ret z
+	ld B, A
+	ld A, [HL+]
+	push HL
+	ld HL, BenchSlots
+	LongAddToA HL, HL ; HL = slot
+	ld A, B
+	cp {free}
+	jr z, .free
+	push HL
+	ld HL, TestDynMem
+	ld D, 1
+	call DynMemAlloc
+	ld D, H
+	ld E, L
+	pop HL
+	ld [HL], E
+	inc HL
+	ld [HL], D
+	pop HL
+	jr BenchRunTrace
+.free
+	ld A, [HL+]
+	ld H, [HL]
+	ld L, A ; HL = allocation
+	or H ; set z if the allocation failed
+	jr z, .next
+	ld DE, TestDynMem
+	call DynMemFree
+.next
+	pop HL
+	jr BenchRunTrace
+""".format(base=BASE, size=PAGES * 256, slots=SLOTS, end=OP_END, free=OP_FREE)
+
+
+def trace_test(name, length, max_size):
+	"""Run a random trace with allocations of up to max_size bytes.
+	Adds the trace to the rom under the given label, and returns the Test."""
+	global asm
+	trace = dynmem.random_trace(random, length, max_size, SLOTS)
+	model = dynmem.DynMem(BASE, PAGES)
+	slots = [0] * SLOTS
+	cycles = TRACE_CYCLES
+	data = []
+	for op in trace:
+		cycles += DRIVER_CYCLES
+		if op[0] == 'alloc':
+			_, size, slot = op
+			scanned = model.scanned
+			slots[slot] = model.alloc(size, 1)
+			cycles += ALLOC_CYCLES + SCAN_CYCLES * (model.scanned - scanned)
+			data += [size, slot * 2]
+		else:
+			_, slot = op
+			if slots[slot]:
+				model.free(slots[slot])
+				cycles += FREE_CYCLES
+			data += [OP_FREE, slot * 2]
+	data.append(OP_END)
+	asm += "\n{}:\n".format(name)
+	for i in range(0, len(data), 16):
+		asm += "\tdb {}\n".format(', '.join(map(str, data[i:i+16])))
+	return Test(
+		in_HL = name,
+		in_BenchSlots = Memory([0] * SLOTS * 2),
+		out_BenchSlots = Memory(*[[addr & 0xff, addr >> 8] for addr in slots]),
+		out_TestDynMem = Memory(model.mem[:dynmem.HEADER_SIZE]), # free list heads
+		pre_asm = ['\tld HL, TestDynMem', '\tld B, {}'.format(PAGES), '\tcall DynMemInit'],
+		max_cycles = budget(cycles),
+	)
+
+small_allocs = trace_test('BenchTraceSmall', 200, 16)
+mixed_allocs = trace_test('BenchTraceMixed', 200, 64)
+# Big allocations fill up memory, so some fail and some have to search
+large_allocs = trace_test('BenchTraceLarge', 200, 200)
@@ -0,0 +1,203 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+include "longcalc.asm"
+include "longcalc.asm"
+include "hram.asm"
+include "constants.asm"
+RSRESET
+chunk_len rb 1
+chunk_prev_len rb 1
+chunk_owner rb 1
+chunk_data rb 0
+chunk_free_next rw 1 ; next chunk in the same free list, or $0000
+chunk_free_prev rw 1 ; address of the link that points to this chunk, ie. the list head
+DYN_MEM_MIN_CHUNK rb 0
+DYN_MEM_CLASSES EQU 5
+DYN_MEM_HEADER_SIZE EQU DYN_MEM_CLASSES * 2
+DYN_MEM_SENTINEL_SIZE EQU chunk_data
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+	ld HL, TestDynMem
+	ld B, 4
+	call DynMemInit
+	ld HL, BenchSlots
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld H, (BenchTraceMixed) >> 8
+	ld L, (BenchTraceMixed) & $ff
+	; run test
+	_TestLog "%ZEROCLKS%"
+	call BenchRunTrace
+	_TestLog "=== Cycles: %LASTCLKS% clocks, max 119048 cycles ==="
+	; check results
+	ld HL, BenchSlots
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr BenchSlots+%DE% expected %B% but got %A%"
+	ld HL, TestDynMem
+	ld DE, .outMem1
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr TestDynMem+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 0, 32
+	db 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
+	db 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
+	db 0, 0
+.outMem0
+	db 0, 32
+	db 216, 211, 82, 211, 200, 211, 157, 211, 63, 211, 70, 210, 207, 211, 200, 211
+	db 77, 210, 193, 211, 246, 211, 33, 210, 207, 211, 77, 210, 13, 210, 86, 210
+	db 0, 0
+.outMem1
+	db 0, 10
+	db 246, 211, 10, 210, 0, 0, 79, 211, 96, 210
+	db 0, 0
@@ -0,0 +1,92 @@
+"""Cycle budgets for SchedEnqueueSleepTask across increasing numbers of sleeping tasks,
+with the timing wheel's cursor both up to date and behind.
+
+Each budget is how long the current implementation was measured to take (the cycles the test runner
+logs, including the call itself and its Debug message), with headroom added by budget().
+If you make a routine slower on purpose, measure it again and update its count here.
+"""
+
+import struct
+
+file = 'scheduler'
+target = 'SchedEnqueueSleepTask'
+
+TASK_SIZE = 8
+MAX_TASKS = 31
+SLEEP_WHEEL_SIZE = 64
+
+# When the wheel's cursor is up to date, the worst case is when other tasks are sleeping
+# but none of them need waking. It costs the same no matter how many there are.
+# For comparison, when sleeping tasks were kept in a sorted list the worst case was going at the front,
+# so every other sleeping task was shuffled down. That took 203 + 23 * (sleepers - 2) cycles,
+# or 106 for a single sleeper.
+ENQUEUE_CYCLES = 139
+# With nothing else sleeping, the cursor is stale, so it's reset rather than caught up.
+ENQUEUE_ALONE_CYCLES = 125
+
+# But first, CheckNextWake catches the cursor up to Uptime one tick at a time. Each tick costs
+# CATCH_UP_CYCLES, plus PASSED_SLEEPER_CYCLES for each task in that tick's slot which is due on a later lap.
+# The cursor is caught up on every task switch, which happens at least every SWITCH_TIME_INTERVAL ticks
+# while switching is enabled, so that's how far behind it can usually be.
+CATCH_UP_CYCLES = 65
+PASSED_SLEEPER_CYCLES = 36
+# So with the cursor that far behind and another task sleeping, it costs 659 cycles rather than 139.
+SWITCH_TIME_INTERVAL = 8
+
+def uptime(value):
+	return Memory(struct.pack('<I', value))
+
+def cursor(value):
+	return Memory(struct.pack('<H', value))
+
+# The task we're putting to sleep, and how long for.
+B = 6 * TASK_SIZE
+DE = 0x10
+NOW = 0x100
+
+def sleep_test(sleepers, behind=0):
+	"""Put a task to sleep so that there are the given number of tasks sleeping, including it.
+	The others are due at or after our wake time, spread over the wheel.
+	The cursor starts the given number of ticks behind Uptime, so it has to catch up first."""
+	others = [i * TASK_SIZE for i in range(MAX_TASKS) if i * TASK_SIZE != B][:sleepers - 1]
+	wheel = [255] * SLEEP_WHEEL_SIZE
+	entries = [None] * (MAX_TASKS * TASK_SIZE)
+	# Slots the cursor passes over while catching up. Any others in them are due on a later lap.
+	caught_up = [time % SLEEP_WHEEL_SIZE for time in range(NOW + 1 - behind, NOW + 1)]
+	passed = 0
+	for n, task in enumerate(others):
+		time = NOW + DE + n * SLEEP_WHEEL_SIZE / 8
+		slot = time % SLEEP_WHEEL_SIZE
+		entries[task:task+3] = [wheel[slot]] + list(bytearray(struct.pack('<H', time)))
+		wheel[slot] = task
+		if slot in caught_up:
+			passed += 1
+	slot = (NOW + DE) % SLEEP_WHEEL_SIZE
+	return Test(
+		in_B = B,
+		in_DE = DE,
+		in_Uptime = uptime(NOW),
+		in_SleepCount = Memory(len(others)),
+		in_SleepCursor = cursor(NOW + 1 - behind),
+		in_SleepWheel = Memory(wheel),
+		in_SleepEntries = Memory(entries),
+		in_RunList = Memory(0, 0),
+		out_SleepCount = Memory(sleepers),
+		out_SleepCursor = cursor(NOW + 1),
+		out_SleepWheel = Memory([None] * slot + [B]),
+		out_RunList = Memory(0, 0),
+		max_cycles = budget(
+			ENQUEUE_ALONE_CYCLES if not others
+			else ENQUEUE_CYCLES + behind * CATCH_UP_CYCLES + passed * PASSED_SLEEPER_CYCLES
+		),
+	)
+
+# With the sorted list, these took 106, 341 and 870 cycles.
+sleep_1 = sleep_test(1)
+sleep_8 = sleep_test(8)
+sleep_31 = sleep_test(MAX_TASKS)
+
+# The cursor as far behind as it usually gets. With 8 or more sleeping, some are in the slots passed.
+behind_1 = sleep_test(1, SWITCH_TIME_INTERVAL)
+behind_8 = sleep_test(8, SWITCH_TIME_INTERVAL)
+behind_31 = sleep_test(MAX_TASKS, SWITCH_TIME_INTERVAL)
@@ -0,0 +1,41 @@
+"""Cycle budgets for a task switch, ie. TaskSave then TaskLoad.
+
+Each budget is how long the current implementation was measured to take (the cycles the test runner
+logs, including the call itself), with headroom added by budget().
+If you make a routine slower on purpose, measure it again and update its count here.
+"""
+
+file = 'tasks'
+target = 'BenchTaskSwitch'
+
+asm = """
+include "hram.asm"
+
+SECTION "Bench task switch", ROM0
+
+; Save the current task, then immediately load it again. TaskLoad returns to our caller.
+BenchTaskSwitch:
+	call TaskSave
+	ld A, [CurrentTask]
+	jp TaskLoad
+"""
+
+TASK_SIZE = 8
+
+def switch_test(task_id, rombank, rambank, cycles):
+	return Test(
+		in_CurrentTask = Memory(task_id),
+		in_TaskList = Memory([None] * task_id + [0, 0, rombank, rambank, 0xff, 0xff, 0xff, 0]),
+		in_A = 0x12,
+		in_BC = 0x3456,
+		in_DE = 0x789a,
+		# all regs should survive the round trip
+		out_A = 0x12,
+		out_BC = 0x3456,
+		out_DE = 0x789a,
+		out_CurrentTask = Memory(task_id),
+		max_cycles = budget(cycles),
+	)
+
+switch_no_banks = switch_test(0, 0, 0, 138)
+switch_with_banks = switch_test(5 * TASK_SIZE, 1, 1, 151)
@@ -0,0 +1,206 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+include "hram.asm"
+include "hram.asm"
+include "task.asm"
+include "macros.asm"
+include "longcalc.asm"
+include "constants.asm"
+include "accounting.asm"
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+	ld HL, TaskList
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld HL, CurrentTask
+	ld DE, .inMem1
+	call _TestLoadMem
+	ld A, 18
+	ld C, (13398) & $ff
+	ld B, (13398) >> 8
+	ld E, (30874) & $ff
+	ld D, (30874) >> 8
+	; run test
+	_TestLog "%ZEROCLKS%"
+	call BenchTaskSwitch
+	_TestLog "=== Cycles: %LASTCLKS% clocks, max 188 cycles ==="
+	; check results
+	cp 18
+	_TestFailIfNot z, "Reg A expected 18 but got %A%"
+	ld A, C
+	cp (13398) & $ff
+	_TestFailIfNot z, "Reg C expected (13398) & $ff but got %A%"
+	ld A, B
+	cp (13398) >> 8
+	_TestFailIfNot z, "Reg B expected (13398) >> 8 but got %A%"
+	ld A, E
+	cp (30874) & $ff
+	_TestFailIfNot z, "Reg E expected (30874) & $ff but got %A%"
+	ld A, D
+	cp (30874) >> 8
+	_TestFailIfNot z, "Reg D expected (30874) >> 8 but got %A%"
+	ld HL, CurrentTask
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr CurrentTask+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 40, 8
+	db 0, 0, 1, 1, 255, 255, 255, 0
+	db 0, 0
+.inMem1
+	db 0, 1
+	db 40
+	db 0, 0
+.outMem0
+	db 0, 1
+	db 40
+	db 0, 0
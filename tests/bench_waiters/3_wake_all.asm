@@ -0,0 +1,260 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+include "longcalc.asm"
+include "hram.asm"
+include "waiter.asm"
+include "waiter.asm"
+include "task.asm"
+include "hram.asm"
+include "longcalc.asm"
+_WaiterCheckTask: MACRO
+	; Check ram bank, if needed.
+	; This seems kinda wasteful to determine every time but we're out of regs.
+	; We determine this from top 4 bits:
+	;  101x - SRAM bank (currently ignored since we assume no sram switching right now)
+	;  1100 - WRAM0 (no bank to check)
+	;  1101 - WRAMX (check ram bank)
+	;  1111 - HRAM (no bank to check)
+	ld A, D
+	rla
+	rla ; this puts 2nd from top bit into carry. 0 -> SRAM, 1 -> WRAM or HRAM
+	; TODO SRAM checking goes here once we track that, for now assume good
+	jr nc, .bank_is_good\@
+	and %11000000 ; select top 2 bits. 00 -> WRAM0, 01 -> WRAMX, 11 -> HRAM
+	cp %01000000 ; set z if WRAMX
+	jr nz, .bank_is_good\@
+	ld A, [CurrentRAMBank]
+	cp [HL] ; compare to task_rambank, set z if match
+	jr z, .bank_is_good\@
+	RepointStruct HL, task_rambank, task_waiter + 2
+	jr \1
+.bank_is_good\@
+	; Advance to task_waiter
+	RepointStruct HL, task_rambank, task_waiter
+	; Check it against address
+	ld A, [HL+]
+	cp D ; set z if upper half of address matches
+	ld A, [HL+]
+	jr nz, \1 ; skip forward if D didn't match
+	cp E ; set z if lower half matches
+	jr nz, \1 ; skip forward if E didn't match
+ENDM
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+	ld HL, TaskList
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld HL, BenchWaiter
+	ld DE, .inMem1
+	call _TestLoadMem
+	ld HL, RunList
+	ld DE, .inMem2
+	call _TestLoadMem
+	ld HL, CurrentRAMBank
+	ld DE, .inMem3
+	call _TestLoadMem
+	ld H, (BenchWaiter) >> 8
+	ld L, (BenchWaiter) & $ff
+	; run test
+	_TestLog "%ZEROCLKS%"
+	call _WaiterWake
+	_TestLog "=== Cycles: %LASTCLKS% clocks, max 5882 cycles ==="
+	; check results
+	ld HL, BenchWaiter
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr BenchWaiter+%DE% expected %B% but got %A%"
+	ld HL, RunList
+	ld DE, .outMem1
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr RunList+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 0, 248
+	db 208, 0, 0, 1, 208, 0, 8, 0, 208, 0, 0, 1, 208, 0, 16, 0
+	db 208, 0, 0, 1, 208, 0, 24, 0, 208, 0, 0, 1, 208, 0, 32, 0
+	db 208, 0, 0, 1, 208, 0, 40, 0, 208, 0, 0, 1, 208, 0, 48, 0
+	db 208, 0, 0, 1, 208, 0, 56, 0, 208, 0, 0, 1, 208, 0, 64, 0
+	db 208, 0, 0, 1, 208, 0, 72, 0, 208, 0, 0, 1, 208, 0, 80, 0
+	db 208, 0, 0, 1, 208, 0, 88, 0, 208, 0, 0, 1, 208, 0, 96, 0
+	db 208, 0, 0, 1, 208, 0, 104, 0, 208, 0, 0, 1, 208, 0, 112, 0
+	db 208, 0, 0, 1, 208, 0, 120, 0, 208, 0, 0, 1, 208, 0, 128, 0
+	db 208, 0, 0, 1, 208, 0, 136, 0, 208, 0, 0, 1, 208, 0, 144, 0
+	db 208, 0, 0, 1, 208, 0, 152, 0, 208, 0, 0, 1, 208, 0, 160, 0
+	db 208, 0, 0, 1, 208, 0, 168, 0, 208, 0, 0, 1, 208, 0, 176, 0
+	db 208, 0, 0, 1, 208, 0, 184, 0, 208, 0, 0, 1, 208, 0, 192, 0
+	db 208, 0, 0, 1, 208, 0, 200, 0, 208, 0, 0, 1, 208, 0, 208, 0
+	db 208, 0, 0, 1, 208, 0, 216, 0, 208, 0, 0, 1, 208, 0, 224, 0
+	db 208, 0, 0, 1, 208, 0, 232, 0, 208, 0, 0, 1, 208, 0, 240, 0
+	db 208, 0, 0, 1, 208, 0, 255, 0
+	db 0, 0
+.inMem1
+	db 0, 2
+	db 31, 0
+	db 0, 0
+.inMem2
+	db 0, 2
+	db 0, 0
+	db 0, 0
+.inMem3
+	db 0, 1
+	db 1
+	db 0, 0
+.outMem0
+	db 0, 2
+	db 0, 255
+	db 0, 0
+.outMem1
+	db 0, 33
+	db 31, 0, 0, 8, 16, 24, 32, 40, 48, 56, 64, 72, 80, 88, 96, 104
+	db 112, 120, 128, 136, 144, 152, 160, 168, 176, 184, 192, 200, 208, 216, 224, 232
+	db 240
+	db 0, 0
@@ -0,0 +1,49 @@
+"""Tests for the clock task's conversion of uptime to hours, minutes, seconds and centiseconds.
+
+Each call has a cycle budget: the slowest the current implementation was measured to take
+over the times below (including the call itself and T_GetUptime), with headroom added by budget().
+Before it used lookup tables, this took 1171 to 1667 cycles, depending on the time.
+"""
+
+import struct
+
+file = 'tasks/clock'
+target = 'TaskClockGetHMS'
+
+# For Uptime, which the clock task only uses via T_GetUptime
+asm = """
+include "hram.asm"
+"""
+
+GET_HMS_CYCLES = 226
+
+TICKS_PER_SECOND = 1024
+
+
+def uptime(value):
+	return Memory(struct.pack('<I', value))
+
+def bcd(n):
+	return ((n / 10) << 4) | (n % 10)
+
+def hms_test(ticks):
+	seconds, fraction = divmod(ticks, TICKS_PER_SECOND)
+	minutes, seconds = divmod(seconds, 60)
+	hours, minutes = divmod(minutes, 60)
+	return Test(
+		in_Uptime = uptime(ticks),
+		out_B = bcd(hours % 256 % 100),
+		out_C = bcd(minutes),
+		out_D = bcd(seconds),
+		out_E = bcd(fraction * 100 / TICKS_PER_SECOND),
+		max_cycles = budget(GET_HMS_CYCLES),
+	)
+
+
+zero = hms_test(0)
+almost_a_second = hms_test(TICKS_PER_SECOND - 1)
+almost_an_hour = hms_test(3600 * TICKS_PER_SECOND - 1)
+some_time = hms_test((((12 * 60) + 34) * 60 + 56) * TICKS_PER_SECOND + 789)
+large = hms_test(0x01234567)
+# hours wrap around after 100
+wraps = hms_test(101 * 3600 * TICKS_PER_SECOND + 5)
@@ -0,0 +1,200 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+include "hram.asm"
+
+
+
+; --- original target file ---
+; A basic clock task that puts OS uptime in a specific position on screen using sprites.
+
+; Location on screen to display
+CLOCK_POS_X EQU 4
+CLOCK_POS_Y EQU 4
+
+; Sprite indexes to use (hardcoded for now). Set start of range, we use 11 sprites.
+CLOCK_SPRITE_INDEX_START EQU 0
+
+; Actual X and Y values to use
+_CLOCK_POS_X EQU CLOCK_POS_X + 8
+_CLOCK_POS_Y EQU CLOCK_POS_Y + 16
+
+
+; The tables go at the start, so they're page-aligned and in the same bank as the code that reads them.
+SECTION "Task clock code", ROMX, ALIGN[8]
+
+include "clock_tables.asm"
+
+TaskClockMain::
+.mainloop
+	call TaskClockGetHMS ; BCDE = HH MM SS cc in BCD
+	ld HL, CLOCK_SPRITE_INDEX_START << 8 + _CLOCK_POS_X
+
+	ld A, B
+	push DE
+	push BC
+	; We only display one digit of hours (let it wrap after 10 hours)
+	; because we can only display 10 sprites on one line.
+	and $0f
+	add 128 + "0"
+	call TaskClockDrawChar
+	ld A, 128 + ":"
+	call TaskClockDrawChar
+	pop BC
+	ld A, C
+	call TaskClockDrawDigitPair
+	ld A, 128 + ":"
+	call TaskClockDrawChar
+	pop DE
+	push DE
+	ld A, D
+	call TaskClockDrawDigitPair
+	ld A, 128 + "."
+	call TaskClockDrawChar
+	pop DE
+	ld A, E
+	call TaskClockDrawDigitPair
+
+	ld DE, 16 ; 16ms ~= 1 frame
+	call T_SchedSleepTask
+
+	jr .mainloop
+
+
+; Get current uptime and store in BCDE as 2-digit BCD values hours, minutes, seconds, centiseconds
+; Hours wrap around after 100 hours, and are incorrect after 256 hours!
+; The division and BCD conversion are done with lookup tables, see tools/clock_tables.py.
+TaskClockGetHMS:
+	call T_GetUptime ; BCDE = uptime in ticks
+
+	; Our general approach: First, turn 32-bit ticks into 8-bit hours, mins, secs, centis.
+	; Then look up the BCD form of each.
+
+	; Centis/seconds is the easy part, since we know that split is 10 bits in,
+	; since ticks are in units of 2^-10 seconds. There's a 4-page table that gives us
+	; the centiseconds in BCD for any fraction of a second.
+	ld A, D
+	and %00000011
+	add HIGH(ClockCentis)
+	ld H, A
+	ld L, E ; HL = ClockCentis + bottom 10 bits of BCDE
+	ld A, [HL]
+	push AF ; centiseconds in BCD
+	; Now we need to shift 24-bit reg B,C,D down by 2 to get seconds
+	srl B
+	rr C
+	rr D ; shifted once
+	srl B
+	rr C
+	rr D ; shifted twice
+
+	call TaskClockDivMod60 ; BCD, A = BCD / 60, BCD % 60
+	ld H, HIGH(ClockBCD)
+	ld L, A
+	ld A, [HL]
+	push AF ; seconds in BCD
+	call TaskClockDivMod60 ; BCD, A = BCD / 60, BCD % 60
+	; BCD = hours, A = minutes
+	; We're punting on dealing with >= 256 hours sanely, so we just discard B and C.
+	ld H, HIGH(ClockBCD)
+	ld L, A
+	ld C, [HL] ; C = minutes in BCD
+	ld L, D
+	ld B, [HL] ; B = hours in BCD
+	pop AF
+	ld D, A ; D = seconds in BCD
+	pop AF
+	ld E, A ; E = centiseconds in BCD
+	ret
+
+
+; Calculate divisor and modulus by 60 of 24-bit unsigned int in regs BCD
+; Outputs divisor in BCD and modulus in A.
+; Clobbers E, H, L.
+TaskClockDivMod60:
+	; This is long division in base 256, looking up each step in tables.
+	; For the most significant byte, there's no remainder from before, so the quotient byte
+	; and remainder are just B / 60 and B % 60.
+	ld H, HIGH(ClockDiv60)
+	ld L, B
+	ld B, [HL]
+	inc H ; ClockMod60
+	ld E, [HL] ; E = remainder so far
+
+; Helper macro to unroll. Takes current register to consider \1 = C or D.
+; With remainder so far r in E, we want (256 * r + \1) / 60 and % 60. That's the sum
+; of each part divided separately, with a carry if the remainders add up to 60 or more.
+_DivMod60Part: MACRO
+	ld H, HIGH(ClockDiv60Carry)
+	ld L, E
+	ld A, [HL] ; A = 256 * r / 60
+	set 7, L ; ClockMod60Carry is half way through the same page
+	ld E, [HL] ; E = 256 * r % 60
+	ld H, HIGH(ClockDiv60)
+	ld L, \1
+	add [HL]
+	ld \1, A ; \1 = 256 * r / 60 + \1 / 60
+	inc H ; ClockMod60
+	ld A, [HL]
+	add E ; A = 256 * r % 60 + \1 % 60, which is < 120
+	cp 60
+	jr c, .noCarry\@
+	sub 60
+	inc \1
+.noCarry\@
+	ld E, A
+	ENDM
+
+	_DivMod60Part C
+	_DivMod60Part D
+	; BCD now contains the quotient, and A the final remainder.
+	ret
+
+
+; Draw sprites for each digit of the pair of BCD digits in A
+; with X position taken from L and sprite index taken from H.
+; Updates H and L to next available index and X position.
+; Clobbers ABCDE.
+TaskClockDrawDigitPair:
+	ld B, A
+	and $f0
+	swap A ; A = first digit value
+	add 128 + "0" ; A = first digit character
+	push BC
+	call TaskClockDrawChar
+	pop BC
+	ld A, B
+	and $0f ; A = second digit value
+	add 128 + "0" ; A = second digit character
+	jp TaskClockDrawChar
+
+
+; Draw sprite with tile A at X position L, sprite index H, updating H and L to next position.
+; Clobbers ABCDE.
+TaskClockDrawChar:
+	ld B, L
+	ld C, _CLOCK_POS_Y
+	ld D, A
+	ld E, 0
+	ld A, H
+	push HL
+	call T_GraphicsWriteSprite
+	pop HL
+	inc H
+	ld A, L
+	add 8
+	ld L, A
+	ret
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT ClockDiv60
+EXPORT ClockDiv60Carry
+EXPORT TaskClockGetHMS
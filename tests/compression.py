@@ -0,0 +1,37 @@
+import rle
+
+file = 'compression'
+target = 'Decompress'
+
+asm = """
+SECTION "compression test mem", WRAM0
+
+TestInput:
+	ds 512
+TestOutput:
+	ds 1024
+"""
+
+def decompress_test(data, compressed=None):
+	"""Test that decompressing compressed (default: data compressed by rle.py) gives data"""
+	if compressed is None:
+		compressed = rle.compress(data)
+	return Test(
+		in_HL = 'TestInput',
+		in_DE = 'TestOutput',
+		in_TestInput = Memory(compressed),
+		in_TestOutput = Memory([42] * (len(data) + 1)),
+		out_HL = 'TestInput + {}'.format(len(compressed)),
+		out_DE = 'TestOutput + {}'.format(len(data)),
+		out_TestOutput = Memory(data, 42), # writes exactly len(data) bytes
+	)
+
+empty = decompress_test([], [0])
+literal = decompress_test([1, 2, 3], [3, 1, 2, 3, 0])
+repeat = decompress_test([7] * 5, [5 + 126, 7, 0])
+mixed = decompress_test([1, 2, 0, 0, 0, 0, 3], [2, 1, 2, 4 + 126, 0, 1, 3, 0])
+longest_runs = decompress_test([5] * 129 + range(127), [255, 5, 127] + range(127) + [0])
+zeroes = decompress_test([0] * 300)
+
+data = [random.choice([0, 0, 0, 0xff, random.randrange(256)]) for _ in range(400)]
+rand = decompress_test(data)
@@ -0,0 +1,270 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+
+
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+	ld HL, TestOutput
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld HL, TestInput
+	ld DE, .inMem1
+	call _TestLoadMem
+	ld H, (TestInput) >> 8
+	ld E, (TestOutput) & $ff
+	ld D, (TestOutput) >> 8
+	ld L, (TestInput) & $ff
+	; run test
+	call Decompress
+	; check results
+	ld A, H
+	cp (TestInput + 344) >> 8
+	_TestFailIfNot z, "Reg H expected (TestInput + 344) >> 8 but got %A%"
+	ld A, E
+	cp (TestOutput + 400) & $ff
+	_TestFailIfNot z, "Reg E expected (TestOutput + 400) & $ff but got %A%"
+	ld A, L
+	cp (TestInput + 344) & $ff
+	_TestFailIfNot z, "Reg L expected (TestInput + 344) & $ff but got %A%"
+	ld A, D
+	cp (TestOutput + 400) >> 8
+	_TestFailIfNot z, "Reg D expected (TestOutput + 400) >> 8 but got %A%"
+	ld HL, TestOutput
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr TestOutput+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 0, 255
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 0, 146
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42, 42
+	db 42, 42
+	db 0, 0
+.inMem1
+	db 0, 255
+	db 3, 125, 0, 255, 131, 0, 129, 255, 16, 0, 135, 106, 178, 70, 0, 197
+	db 0, 255, 0, 0, 255, 0, 0, 157, 64, 130, 0, 11, 255, 255, 0, 0
+	db 93, 255, 0, 0, 255, 116, 255, 129, 0, 10, 16, 255, 0, 0, 255, 0
+	db 185, 255, 0, 0, 129, 255, 2, 0, 181, 130, 0, 5, 33, 57, 255, 0
+	db 148, 130, 0, 3, 40, 0, 255, 129, 0, 3, 120, 84, 255, 129, 0, 11
+	db 190, 0, 113, 255, 119, 68, 98, 255, 80, 0, 137, 129, 255, 18, 0, 0
+	db 222, 0, 255, 0, 151, 0, 0, 112, 89, 37, 0, 0, 4, 0, 0, 255
+	db 131, 0, 1, 255, 129, 0, 1, 191, 131, 0, 16, 104, 0, 54, 255, 0
+	db 0, 243, 215, 0, 0, 255, 0, 255, 255, 50, 255, 131, 0, 1, 34, 131
+	db 0, 5, 227, 255, 0, 0, 255, 145, 0, 6, 255, 172, 0, 0, 156, 255
+	db 138, 0, 1, 132, 129, 0, 11, 153, 0, 0, 195, 70, 0, 0, 1, 255
+	db 39, 31, 131, 0, 2, 151, 255, 129, 0, 1, 255, 129, 0, 7, 255, 0
+	db 178, 175, 255, 0, 2, 129, 0, 21, 255, 255, 0, 255, 0, 0, 52, 209
+	db 255, 0, 249, 0, 255, 29, 255, 88, 0, 0, 220, 0, 255, 129, 0, 1
+	db 255, 129, 0, 11, 176, 177, 0, 23, 255, 0, 39, 0, 162, 255, 9, 130
+	db 0, 6, 53, 254, 255, 0, 0, 255, 131, 0, 7, 255, 145, 184, 0
+	db 0, 89
+	db 60, 255, 255, 131, 0, 129, 255, 129, 0, 1, 62, 130, 0, 2, 255, 27
+	db 129, 0, 19, 255, 189, 0, 206, 255, 255, 0, 21, 255, 0, 255, 0, 196
+	db 0, 0, 255, 0, 0, 250, 129, 0, 9, 204, 0, 255, 255, 0, 177, 51
+	db 0, 27, 129, 0, 7, 185, 0, 255, 255, 0, 255, 255, 130, 0, 1, 255
+	db 134, 0, 1, 147, 131, 0, 4, 255, 0, 0, 203, 130, 0, 10, 244, 255
+	db 255, 185, 0, 26, 255, 255, 0, 0, 0
+	db 0, 0
+.outMem0
+	db 0, 255
+	db 125, 0, 255, 0, 0, 0, 0, 0, 255, 255, 255, 0, 135, 106, 178, 70
+	db 0, 197, 0, 255, 0, 0, 255, 0, 0, 157, 64, 0, 0, 0, 0, 255
+	db 255, 0, 0, 93, 255, 0, 0, 255, 116, 255, 0, 0, 0, 16, 255, 0
+	db 0, 255, 0, 185, 255, 0, 0, 255, 255, 255, 0, 181, 0, 0, 0, 0
+	db 33, 57, 255, 0, 148, 0, 0, 0, 0, 40, 0, 255, 0, 0, 0, 120
+	db 84, 255, 0, 0, 0, 190, 0, 113, 255, 119, 68, 98, 255, 80, 0, 137
+	db 255, 255, 255, 0, 0, 222, 0, 255, 0, 151, 0, 0, 112, 89, 37, 0
+	db 0, 4, 0, 0, 255, 0, 0, 0, 0, 0, 255, 0, 0, 0, 191, 0
+	db 0, 0, 0, 0, 104, 0, 54, 255, 0, 0, 243, 215, 0, 0, 255, 0
+	db 255, 255, 50, 255, 0, 0, 0, 0, 0, 34, 0, 0, 0, 0, 0, 227
+	db 255, 0, 0, 255, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
+	db 0, 0, 0, 0, 0, 0, 0, 255, 172, 0, 0, 156, 255, 0, 0, 0
+	db 0, 0, 0, 0, 0, 0, 0, 0, 0, 132, 0, 0, 0, 153, 0, 0
+	db 195, 70, 0, 0, 1, 255, 39, 31, 0, 0, 0, 0, 0, 151, 255, 0
+	db 0, 0, 255, 0, 0, 0, 255, 0, 178, 175, 255, 0, 2, 0, 0, 0
+	db 255, 255, 0, 255, 0, 0, 52, 209, 255, 0, 249, 0, 255, 29, 255
+	db 0, 146
+	db 88, 0, 0, 220, 0, 255, 0, 0, 0, 255, 0, 0, 0, 176, 177, 0
+	db 23, 255, 0, 39, 0, 162, 255, 9, 0, 0, 0, 0, 53, 254, 255, 0
+	db 0, 255, 0, 0, 0, 0, 0, 255, 145, 184, 0, 60, 255, 255, 0, 0
+	db 0, 0, 0, 255, 255, 255, 0, 0, 0, 62, 0, 0, 0, 0, 255, 27
+	db 0, 0, 0, 255, 189, 0, 206, 255, 255, 0, 21, 255, 0, 255, 0, 196
+	db 0, 0, 255, 0, 0, 250, 0, 0, 0, 204, 0, 255, 255, 0, 177, 51
+	db 0, 27, 0, 0, 0, 185, 0, 255, 255, 0, 255, 255, 0, 0, 0, 0
+	db 255, 0, 0, 0, 0, 0, 0, 0, 0, 147, 0, 0, 0, 0, 0, 255
+	db 0, 0, 203, 0, 0, 0, 0, 244, 255, 255, 185, 0, 26, 255, 255, 0
+	db 0, 42
+	db 0, 0
@@ -0,0 +1,65 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+SECTION "compression test mem", WRAM0
+
+TestInput:
+	ds 512
+TestOutput:
+	ds 1024
+
+
+
+; --- original target file ---
+; Decompression routines for data compressed by tools/rle.py
+
+
+SECTION "Decompression routines", ROM0
+
+
+; Decompress run-length encoded data from HL into DE.
+; Compressed data is a series of runs, each starting with a control byte C:
+;   C = 0: End of data
+;   0 < C < 128: The next C bytes are copied as-is
+;   C >= 128: The next byte is repeated C - 126 times (ie. 2 to 129 times)
+; Literal runs cost 12 + 10/byte cycles and repeat runs 17 + 8/byte, plus 8 to finish.
+; For comparison, LongCopy costs 10/byte, so decompression is never much slower than
+; copying the uncompressed data, and is faster when there are many repeats.
+; Returns HL pointing after the end of the compressed data, and DE after the end of the output.
+; Clobbers A, B.
+Decompress::
+	ld A, [HL+] ; 2
+	and A ; 1
+	ret z ; 2 (5 if returning)
+	bit 7, A ; 2
+	jr nz, .repeat ; 2 (3 if taken)
+	ld B, A ; 1
+.literal
+	ld A, [HL+] ; 2
+	ld [DE], A ; 2
+	inc DE ; 2
+	dec B ; 1
+	jr nz, .literal ; 3 (2 on last byte)
+	jr Decompress ; 3
+.repeat
+	sub 126 ; 2
+	ld B, A ; 1
+	ld A, [HL+] ; 2
+.repeatLoop
+	ld [DE], A ; 2
+	inc DE ; 2
+	dec B ; 1
+	jr nz, .repeatLoop ; 3 (2 on last byte)
+	jr Decompress ; 3
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT TestInput
+EXPORT TestOutput
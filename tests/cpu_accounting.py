@@ -0,0 +1,82 @@
+file = 'cpu_accounting'
+
+# Materialize the mark macro
+asm = """
+include "accounting.asm"
+
+SECTION "Test accounting mark", ROM0
+
+TestMark:
+	ld HL, $1234 ; to check the mark preserves it
+	AccountingMark ACCOUNTING_VBLANK
+	ret
+"""
+
+ENTRIES = 64
+VBLANK = 2
+
+init = Test('AccountingInit',
+	in_AccountingIndex = Memory(42),
+	out_AccountingIndex = Memory(0),
+	out_AccountingStoppedIndex = Memory(0),
+)
+
+start = Test('AccountingStart',
+	in_AccountingLog = Memory([0] * 256),
+	out_AccountingIndex = Memory(1),
+	out_AccountingLog = Memory([0, 0, 255, 0] * ENTRIES),
+)
+
+stop = Test('AccountingStop',
+	in_AccountingIndex = Memory(9),
+	out_AccountingIndex = Memory(0),
+	out_AccountingStoppedIndex = Memory(9),
+)
+
+stop_when_stopped = Test('AccountingStop',
+	in_AccountingIndex = Memory(0),
+	in_AccountingStoppedIndex = Memory(9),
+	out_AccountingIndex = Memory(0),
+	out_AccountingStoppedIndex = Memory(9),
+)
+
+Uptime = Memory(0x12)
+TimerCounter = Memory(0x34)
+CurrentTask = Memory(6)
+
+# The budgets here are exact: call, ld HL, the mark and ret come to 13 cycles + 7 when off,
+# 51 when on or 84 while the scheduler has slowed the timer down.
+mark_off = Test('TestMark',
+	in_AccountingIndex = Memory(0),
+	in_AccountingLog = Memory([0] * 4),
+	out_AccountingIndex = Memory(0),
+	out_AccountingLog = Memory([0] * 4),
+	out_HL = 0x1234,
+	max_cycles = 13 + 7,
+)
+
+mark_first = Test('TestMark',
+	in_AccountingIndex = Memory(1),
+	out_AccountingIndex = Memory(5),
+	out_AccountingLog = Memory(0x12, 0x34, VBLANK, 6),
+	out_HL = 0x1234,
+	max_cycles = 13 + 51,
+)
+
+mark_wraps = Test('TestMark',
+	in_AccountingIndex = Memory(253),
+	out_AccountingIndex = Memory(1),
+	out_AccountingLog = Memory([None] * 252, 0x12, 0x34, VBLANK, 6),
+	out_HL = 0x1234,
+)
+
+# Uptime is 2 ticks behind, and we're 3 slow counts into the third
+mark_slow = Test('TestMark',
+	in_AccountingIndex = Memory(1),
+	in_IdleTickStart = Memory(0xc8),
+	in_TimerCounter = Memory(0xd3),
+	out_AccountingIndex = Memory(5),
+	out_AccountingLog = Memory(0x14, 0xc0, VBLANK, 6),
+	out_HL = 0x1234,
+	max_cycles = 13 + 84,
+)
@@ -0,0 +1,115 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+include "accounting.asm"
+
+SECTION "Test accounting mark", ROM0
+
+TestMark:
+	ld HL, $1234 ; to check the mark preserves it
+	AccountingMark ACCOUNTING_VBLANK
+	ret
+
+
+
+; --- original target file ---
+include "accounting.asm"
+include "hram.asm"
+include "longcalc.asm"
+
+
+SECTION "CPU accounting log", WRAM0, ALIGN[8]
+
+; Ring of log entries, see include/accounting.asm
+AccountingLog::
+	ds 256
+
+
+SECTION "CPU accounting RAM", WRAM0
+
+; Value of AccountingIndex when accounting was last stopped, ie. offset + 1 of the oldest entry in the log.
+AccountingStoppedIndex::
+	db
+
+
+SECTION "CPU accounting methods", ROM0
+
+
+; Init accounting to off. Must be called before interrupts are enabled.
+; Clobbers A.
+AccountingInit::
+	xor A
+	ld [AccountingIndex], A
+	ld [AccountingStoppedIndex], A
+	ret
+
+
+; Clear the log and start accounting.
+; Clobbers A, B, HL.
+AccountingStart::
+	ld HL, AccountingLog
+	ld B, 256 / ACCOUNTING_ENTRY_SIZE
+	ld A, ACCOUNTING_EMPTY
+.loop
+	; We only need to clear each entry's type
+	RepointStruct HL, 0, acct_type
+	ld [HL], A
+	RepointStruct HL, acct_type, ACCOUNTING_ENTRY_SIZE
+	dec B
+	jr nz, .loop
+	ld A, 1 ; start writing at offset 0
+	ld [AccountingIndex], A
+	ret
+
+
+; For AccountingMark. Write a timestamp to HL while the scheduler has slowed the timer down (see SchedIdle).
+; TimerCounter counts 4 times a tick, from IdleTickStart at the start of the tick Uptime is on,
+; and Uptime may be some ticks behind, since the scheduler only catches it up when it wakes.
+; Leaves HL pointing after the timestamp. Clobbers A.
+_AccountingSlowTime::
+	push BC
+	ld A, [IdleTickStart]
+	ld B, A
+	ld A, [TimerCounter]
+	sub B
+	ld B, A ; B = slow counts since the tick Uptime is on started
+	rrca
+	rrca
+	and $3f
+	ld C, A ; C = whole ticks since then
+	ld A, [Uptime]
+	add C
+	ld [HL+], A
+	ld A, B
+	rrca
+	rrca
+	and $c0 ; A = fast count, to the nearest slow count
+	ld [HL+], A
+	pop BC
+	ret
+
+
+; Stop accounting, so the log can be read without it changing underneath us.
+; Decode the results with tools/cpu_accounting.py.
+; Clobbers A. Interrupts are enabled on return.
+AccountingStop::
+	di ; an interrupt could write a new entry between reading and clearing the index
+	ld A, [AccountingIndex]
+	and A
+	jr z, .already_stopped ; don't overwrite the index we saved last time
+	ld [AccountingStoppedIndex], A
+	xor A
+	ld [AccountingIndex], A
+.already_stopped
+	reti ; re-enable interrupts and return
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT TestMark
@@ -5,10 +5,31 @@ asm = """
 ; Functions being tested may enable VBlank interrupt, ensure it safely does nothing
 SECTION "graphics test vblank", ROM0[$40]
 	reti
+
+SECTION "graphics test data", WRAMX[$d800]
+TestBlockData:
+	ds 256
 """
 
+TestBlockData = 0xd800
+TileGrid = 0x9800
+BLOCK_ENTRY_SIZE = 8
+BLOCK_QUEUE_SIZE = 8
+
+# Unless a test says otherwise, there are no blocks to copy
+BlockQueueLength = Memory(0)
+
+def block(length, src, dest):
+	"""A block queue entry"""
+	return [length, src & 0xff, src >> 8, dest & 0xff, dest >> 8, None, None, None]
+
 init = Test('GraphicsInit',
+	in_BlockQueueLength = Memory(3),
+	in_BlockQueueTail = Memory(16),
 	out_TileQueueInfo = Memory([0] * 8),
+	out_BlockQueueLength = Memory(0),
+	out_BlockQueueTail = Memory(0),
+	out_GraphicsQueueWaiter = Memory(0, 0, 255, 0, 0),
 	out_WorkingSprites = Memory([0, None, None, None] * 40),
 	out_DirtySprites = Memory(0),
 )
@@ -41,6 +62,133 @@ write_tile_full = Test('GraphicsTryWriteTile',
 	out_InterruptsEnabled = Memory(0), # vblank remains disabled
 )
 
+write_block_from_empty = Test('GraphicsTryWriteBlock',
+	in_BlockQueueLength = Memory(0),
+	in_BlockQueueTail = Memory(0),
+	in_HL = 'TestBlockData',
+	in_DE = TileGrid + 0x45,
+	in_C = 20,
+	out_A = 0, # success
+	out_HL = 'TestBlockData', # inputs are preserved, so a failed write can be retried
+	out_DE = TileGrid + 0x45,
+	out_C = 20,
+	out_BlockQueueLength = Memory(1),
+	out_BlockQueueTail = Memory(0),
+	out_BlockQueue = Memory(block(20, TestBlockData, TileGrid + 0x45)),
+	out_InterruptsEnabled = Memory(1), # vblank int enabled
+)
+
+write_block_wraps = Test('GraphicsTryWriteBlock',
+	in_BlockQueueLength = Memory(3),
+	in_BlockQueueTail = Memory(6 * BLOCK_ENTRY_SIZE), # entries 6, 7 and 0 are in use
+	in_HL = 'TestBlockData',
+	in_DE = 0x8800,
+	in_C = 255,
+	out_A = 0,
+	out_BlockQueueLength = Memory(4),
+	out_BlockQueueTail = Memory(6 * BLOCK_ENTRY_SIZE),
+	out_BlockQueue = Memory([None] * BLOCK_ENTRY_SIZE, block(255, TestBlockData, 0x8800)), # entry 1
+)
+
+write_block_full = Test('GraphicsTryWriteBlock',
+	in_BlockQueueLength = Memory(BLOCK_QUEUE_SIZE),
+	in_BlockQueueTail = Memory(0),
+	in_HL = 'TestBlockData',
+	in_DE = TileGrid,
+	in_C = 1,
+	out_A = BLOCK_QUEUE_SIZE, # failure value = length
+	out_BlockQueueLength = Memory(BLOCK_QUEUE_SIZE),
+	out_InterruptsEnabled = Memory(0), # vblank remains disabled
+)
+
+write_block_nothing = Test('GraphicsTryWriteBlock',
+	in_BlockQueueLength = Memory(BLOCK_QUEUE_SIZE), # even if full
+	in_HL = 'TestBlockData',
+	in_DE = TileGrid,
+	in_C = 0,
+	out_A = 0,
+	out_BlockQueueLength = Memory(BLOCK_QUEUE_SIZE),
+	out_InterruptsEnabled = Memory(0),
+)
+
+write_tiles = Test('T_GraphicsWriteTiles',
+	in_BlockQueueLength = Memory(0),
+	in_BlockQueueTail = Memory(0),
+	in_HL = 'TestBlockData',
+	in_DE = 0x0123,
+	in_C = 10,
+	out_DE = 0x0123,
+	out_BlockQueueLength = Memory(1),
+	out_BlockQueue = Memory(block(10, TestBlockData, TileGrid + 0x0123)),
+)
+
+def text(string):
+	"""Tile values for the characters in string"""
+	return [128 + ord(c) for c in string]
+
+write_string = Test('_GraphicsTryWriteString',
+	in_TileQueueInfo = Memory([0] * 8),
+	in_TestBlockData = Memory("Hi!"),
+	in_HL = 'TestBlockData',
+	in_DE = 0x0021,
+	in_C = 3,
+	out_cflag = 1,
+	out_HL = 'TestBlockData + 3',
+	out_DE = 0x0024,
+	out_C = 0,
+	out_TileQueueInfo = Memory(3, 6, [0] * 6),
+	out_TileQueues = Memory(*zip(range(0x21, 0x24), text("Hi!"))),
+	out_InterruptsEnabled = Memory(1), # vblank int enabled
+)
+
+# The string goes past the part of the tilemap the 1st queue covers, so the rest goes in the 2nd
+write_string_next_queue = Test('_GraphicsTryWriteString',
+	in_TileQueueInfo = Memory(0, 0, 5, 10, [0] * 4),
+	in_TestBlockData = Memory("abcd"),
+	in_HL = 'TestBlockData',
+	in_DE = 0x00fe,
+	in_C = 4,
+	out_cflag = 1,
+	out_HL = 'TestBlockData + 4',
+	out_DE = 0x0102,
+	out_C = 0,
+	out_TileQueueInfo = Memory(2, 4, 7, 14, [0] * 4),
+	out_TileQueues = Memory(0xfe, text("a"), 0xff, text("b"), [None] * 252, [None] * 10, 0, text("c"), 1, text("d")),
+)
+
+# The string runs off the end of the tilemap, so the rest is dropped.
+# The block queue comes after the last tile queue's info, and must be left alone.
+write_string_tilemap_end = Test('_GraphicsTryWriteString',
+	in_TileQueueInfo = Memory([0] * 8),
+	in_BlockQueueLength = Memory(0),
+	in_TestBlockData = Memory("abcd"),
+	in_HL = 'TestBlockData',
+	in_DE = 0x03fe,
+	in_C = 4,
+	out_cflag = 1,
+	out_HL = 'TestBlockData + 4',
+	out_DE = 0x0400,
+	out_C = 0,
+	out_TileQueueInfo = Memory([0] * 6, 2, 4),
+	out_BlockQueueLength = Memory(0),
+	out_TileQueues = Memory([None] * 768, 0xfe, text("a"), 0xff, text("b")),
+)
+
+# There's only room for one more, so we stop there and say how much is left
+write_string_full = Test('_GraphicsTryWriteString',
+	in_TileQueueInfo = Memory(127, 254, [0] * 6),
+	in_TestBlockData = Memory("abc"),
+	in_HL = 'TestBlockData',
+	in_DE = 0x0040,
+	in_C = 3,
+	out_cflag = 0,
+	out_HL = 'TestBlockData + 1',
+	out_DE = 0x0041,
+	out_C = 2,
+	out_TileQueueInfo = Memory(128, 0, [0] * 6),
+	out_TileQueues = Memory([None] * 254, 0x40, text("a")),
+)
+
 write_sprite = Test('GraphicsWriteSprite',
 	in_WorkingSprites = Memory([0] * 160),
 	in_A = 6, # Write a vertically-flipped G at position 32x40 to sprite index 6
@@ -69,6 +217,41 @@ vblank_small = Test('GraphicsVBlank',
 	out_InterruptsEnabled = Memory(0), # vblank was disabled
 )
 
+block_data = [random.randrange(256) for i in range(40)]
+vblank_blocks = Test('GraphicsVBlank',
+	in_DirtySprites = Memory(0),
+	in_TileQueueInfo = Memory([0] * 8),
+	in_BlockQueueLength = Memory(2),
+	in_BlockQueueTail = Memory(7 * BLOCK_ENTRY_SIZE), # second entry wraps around to the start
+	in_BlockQueue = Memory(
+		block(3, TestBlockData + 37, TileGrid + 0x100),
+		[None] * BLOCK_ENTRY_SIZE * 6,
+		block(37, TestBlockData, TileGrid + 0x20),
+	),
+	in_TestBlockData = Memory(block_data),
+	in_InterruptsEnabled = Memory(1),
+	out_BlockQueueLength = Memory(0),
+	out_BlockQueueTail = Memory(1 * BLOCK_ENTRY_SIZE),
+	out_TileGrid = Memory([None] * 0x20, block_data[:37], [None] * (0x100 - 0x20 - 37), block_data[37:]),
+	out_InterruptsEnabled = Memory(0), # vblank was disabled
+)
+
+# Tile queues are done first, then blocks with the remaining time
+vblank_tiles_and_block = Test('GraphicsVBlank',
+	in_DirtySprites = Memory(0),
+	in_TileQueueInfo = Memory(0, 0, 20, 40, [0]*4),
+	in_TileQueues = Memory([None]*256, writes),
+	in_BlockQueueLength = Memory(1),
+	in_BlockQueueTail = Memory(0),
+	in_BlockQueue = Memory(block(16, TestBlockData, TileGrid + 0x200)),
+	in_TestBlockData = Memory(block_data),
+	in_InterruptsEnabled = Memory(1),
+	out_TileQueueInfo = Memory(0, 0, 0, 40, [0]*4),
+	out_TileGrid = Memory([None]*256, [None]*60, range(70, 90), [None] * (0x200 - 256 - 80), block_data[:16]),
+	out_BlockQueueLength = Memory(0),
+	out_InterruptsEnabled = Memory(0),
+)
+
 vblank_large = Test('GraphicsVBlank',
 	in_DirtySprites = Memory(0),
 	in_TileQueueInfo = Memory([128, 0]*4), # completely full
@@ -0,0 +1,288 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+
+include "macros.asm"
+include "longcalc.asm"
+include "vram.asm"
+include "ioregs.asm"
+include "hram.asm"
+include "accounting.asm"
+include "waiter.asm"
+VBLANK_INITIAL_CREDITS EQU 60
+VBLANK_SPRITE_DMA_COST EQU 16
+VBLANK_BLOCK_GROUP_COST EQU 5
+VBLANK_BLOCK_SETUP_COST EQU 5
+RSRESET
+block_len rb 1 ; bytes left to copy
+block_src rw 1 ; little-endian address of the next byte to copy
+block_dest rw 1 ; little-endian address to copy the next byte to
+block_end rb 0
+BLOCK_ENTRY_SIZE EQU 8 ; padded to make indexing cheap
+BLOCK_QUEUE_SIZE EQU 8
+_GraphicsVBlankLoop: MACRO
+	ld A, [HL+] ; A = queue length, HL now points at queue head
+	and A ; set z if A == 0
+	jr z, .inc_hl_and_next\@
+	ld C, A
+	ld D, A ; C = D = length for safekeeping
+	ld A, [HL-] ; A = queue head, HL points at queue length
+	sub C
+	sub C
+	ld E, A ; E = queue head - 2 * queue length = queue tail
+	        ; we want this in L eventually but need HL for now
+	ld A, B ; A = time credits remaining
+	and A ; set z if we have no time credits left
+	jp z, .ret ; return if we're out of time
+	sub C ; A = time credits - items, set c if too many items
+	jr nc, .can_afford\@
+	ld C, B ; C = all remaining time credits
+	xor A ; A = 0 in prep for next line, faster than having two paths
+.can_afford\@
+	ld B, A ; set remaining credits to A (either subtract result or 0)
+	ld A, D ; A = original length
+	sub C ; A -= actual length we're consuming. A = remaining length.
+	ld [HL+], A ; update queue's length, point HL at queue head
+	push HL
+	ld L, E ; L = queue tail
+	ld H, (TileQueues >> 8) + \1 ; HL = addr of queue tail slot
+	ld D, (TileGrid >> 8) + \1 ; by setting E, we can now manipulate DE = addr into TileGrid
+	; We're finally ready. C is the loop counter.
+.queue_loop\@
+	ld A, [HL+] ; L will only ever wrap around on every second increment, so this is safe
+	            ; since we DON'T want H to change. A = target addr low byte.
+	ld E, A ; DE = target addr
+	ld A, [HL] ; NOT safe to HL+ here because we don't want H to increment if L wraps
+	ld [DE], A ; set value in array
+	inc L
+	dec C ; @spend credits 1
+	jr nz, .queue_loop\@ ; consider unrolling? lose granularity in time credits
+	pop HL ; HL = next queue length
+
+.inc_hl_and_next\@
+	inc HL
+ENDM
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+call GraphicsInit
+	ld HL, BlockQueueLength
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld HL, InterruptsEnabled
+	ld DE, .inMem1
+	call _TestLoadMem
+	ld HL, DirtySprites
+	ld DE, .inMem2
+	call _TestLoadMem
+	ld HL, WorkingSprites
+	ld DE, .inMem3
+	call _TestLoadMem
+	; run test
+	call GraphicsVBlank
+	; check results
+	ld HL, InterruptsEnabled
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr InterruptsEnabled+%DE% expected %B% but got %A%"
+	ld HL, SpriteTable
+	ld DE, .outMem1
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr SpriteTable+%DE% expected %B% but got %A%"
+	ld HL, DirtySprites
+	ld DE, .outMem2
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr DirtySprites+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 0, 1
+	db 0
+	db 0, 0
+.inMem1
+	db 0, 1
+	db 1
+	db 0, 0
+.inMem2
+	db 0, 1
+	db 1
+	db 0, 0
+.inMem3
+	db 0, 160
+	db 16, 24, 176, 0, 19, 27, 177, 64, 22, 30, 178, 32, 25, 33, 179, 64
+	db 28, 36, 180, 32, 31, 39, 181, 64, 34, 42, 182, 0, 37, 45, 183, 32
+	db 40, 48, 184, 32, 43, 51, 185, 64, 46, 54, 186, 32, 49, 57, 187, 64
+	db 52, 60, 188, 32, 55, 63, 189, 0, 58, 66, 190, 0, 61, 69, 191, 0
+	db 64, 72, 192, 0, 67, 75, 193, 0, 70, 78, 194, 0, 73, 81, 195, 64
+	db 76, 84, 196, 64, 79, 87, 197, 0, 82, 90, 198, 0, 85, 93, 199, 64
+	db 88, 96, 200, 64, 91, 99, 201, 32, 94, 102, 202, 64, 97, 105, 203, 0
+	db 100, 108, 204, 32, 103, 111, 205, 32, 106, 114, 206, 0, 109, 117, 207, 64
+	db 112, 120, 208, 0, 115, 123, 209, 0, 118, 126, 210, 64, 121, 129, 211, 32
+	db 124, 132, 212, 0, 127, 135, 213, 0, 130, 138, 214, 0, 133, 141, 215, 0
+	db 0, 0
+.outMem0
+	db 0, 1
+	db 0
+	db 0, 0
+.outMem1
+	db 0, 160
+	db 16, 24, 176, 0, 19, 27, 177, 64, 22, 30, 178, 32, 25, 33, 179, 64
+	db 28, 36, 180, 32, 31, 39, 181, 64, 34, 42, 182, 0, 37, 45, 183, 32
+	db 40, 48, 184, 32, 43, 51, 185, 64, 46, 54, 186, 32, 49, 57, 187, 64
+	db 52, 60, 188, 32, 55, 63, 189, 0, 58, 66, 190, 0, 61, 69, 191, 0
+	db 64, 72, 192, 0, 67, 75, 193, 0, 70, 78, 194, 0, 73, 81, 195, 64
+	db 76, 84, 196, 64, 79, 87, 197, 0, 82, 90, 198, 0, 85, 93, 199, 64
+	db 88, 96, 200, 64, 91, 99, 201, 32, 94, 102, 202, 64, 97, 105, 203, 0
+	db 100, 108, 204, 32, 103, 111, 205, 32, 106, 114, 206, 0, 109, 117, 207, 64
+	db 112, 120, 208, 0, 115, 123, 209, 0, 118, 126, 210, 64, 121, 129, 211, 32
+	db 124, 132, 212, 0, 127, 135, 213, 0, 130, 138, 214, 0, 133, 141, 215, 0
+	db 0, 0
+.outMem2
+	db 0, 1
+	db 0
+	db 0, 0
@@ -38,34 +38,45 @@ _JoyTestState:
 target = 'JoyReadState'
 
 JoyQueue = Memory(0, 0, 42) # empty queue, 42 used for uninitialized mem
+JoyWaiter = Memory(0, 0, 255, 0, 0) # nothing waiting
 
 JOY_QUEUE_SIZE = 63
 
+# TimerPeriodic bits. The serial one is set in these tests, to check we leave it alone.
+TIMER_PERIODIC_JOY = 1
+TIMER_PERIODIC_SERIAL = 2
+
 
 read_zero_to_non_zero = Test(
 	in_InterruptsEnabled = Memory(1 << 4), # Joypad interrupt enabled
 	in_JoyState = Memory(0), # prev state = nothing pressed
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_SERIAL),
 	in__JoyTestState = Memory(1), # 'A' button pressed
 	out_InterruptsEnabled = Memory(0), # Joypad interrupt disabled
 	out_JoyState = Memory(1), # correctly read 'A' press and stored it
+	out_TimerPeriodic = Memory(TIMER_PERIODIC_SERIAL | TIMER_PERIODIC_JOY), # and we now poll for changes
 	out_JoyQueue = Memory(1, 0, 1), # written 1 to queue
 )
 
 read_non_zero_to_zero = Test(
 	in_InterruptsEnabled = Memory(0), # Joypad interrupt disabled
 	in_JoyState = Memory(0x10), # prev state = 'Right' pressed
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_SERIAL | TIMER_PERIODIC_JOY),
 	in__JoyTestState = Memory(0), # nothing pressed
 	out_InterruptsEnabled = Memory(1 << 4), # Joypad interrupt enabled
 	out_JoyState = Memory(0), # correctly read nothing pressed
+	out_TimerPeriodic = Memory(TIMER_PERIODIC_SERIAL), # and we stop polling
 	out_JoyQueue = Memory(1, 0, 0), # written 0 to queue
 )
 
 read_non_zero_to_non_zero = Test(
 	in_InterruptsEnabled = Memory(0), # Joypad interrupt disabled
 	in_JoyState = Memory(0x80), # prev state = 'Down' pressed
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_SERIAL | TIMER_PERIODIC_JOY),
 	in_JoyQueue = Memory(5, 4, [42]*4, 100, 42), # a queue with 1 item already present
 	in__JoyTestState = Memory(0x81), # 'Down'+'A' pressed
 	out_InterruptsEnabled = Memory(0), # Joypad interrupt still disabled
+	out_TimerPeriodic = Memory(TIMER_PERIODIC_SERIAL | TIMER_PERIODIC_JOY), # still polling
 	out_JoyState = Memory(0x81), # correctly changed to new state
 	out_JoyQueue = Memory(6, 4, [42]*4, 100, 0x81), # written new state to queue
 )
@@ -88,6 +99,46 @@ read_with_queue_full = Test(
 	out_JoyQueue = Memory(JOY_QUEUE_SIZE, 0, queue_contents), # but JoyQueue didn't
 )
 
+# A task is part way through waiting for an event, so it's left to the task to wake the waiter
+read_wakes_during_wait = Test(
+	in_JoyState = Memory(0),
+	in__JoyTestState = Memory(1),
+	in_JoyWaiter = Memory(1, 0, 255),
+	out_JoyQueue = Memory(1, 0, 1),
+	out_JoyWaiter = Memory(2, 0, 255),
+)
+
+# A task is waiting, so we ask the scheduler to wake it
+read_wakes_deferred = Test(
+	in_JoyState = Memory(0),
+	in__JoyTestState = Memory(1),
+	in_JoyWaiter = Memory(0, 1, 0, 0, 0),
+	in_Switchable = Memory(1),
+	in_DeferredWakes = Memory(0xff, 0xff),
+	out_JoyQueue = Memory(1, 0, 1),
+	out_JoyWaiter = Memory(0, 1, 0, 0xff, 0xff), # it's the only one on the scheduler's list
+)
+
+# No change, so there's nothing to wake anyone for
+read_no_wake = Test(
+	in_JoyState = Memory(1),
+	in__JoyTestState = Memory(1),
+	in_JoyWaiter = Memory(0, 1, 0, 0, 0),
+	in_Switchable = Memory(1),
+	in_DeferredWakes = Memory(0xff, 0xff),
+	out_JoyWaiter = Memory(0, 1, 0, 0, 0),
+	out_DeferredWakes = Memory(0xff, 0xff),
+)
+
+joy_get_event = Test('T_JoyGetEvent',
+	in_JoyQueue = Memory(2, 0, 0x81, 0x01),
+	in_Switchable = Memory(0),
+	out_B = 0x81,
+	out_JoyQueue = Memory(2, 1),
+	out_JoyWaiter = Memory(0, 0, 255), # we didn't wait
+	out_Switchable = Memory(0),
+)
+
 joy_presses_basic = Test('T_JoyGetPress',
 	in_JoyQueue = Memory(1, 0, 3), # A+B pressed
 	in_C = 1, # initial state = A pressed
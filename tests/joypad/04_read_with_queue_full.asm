@@ -0,0 +1,247 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+_UnitTestUpdateJoyIO: MACRO
+	push AF
+	push BC
+	ld A, [JoyIO]
+	ld B, A
+	xor A
+	bit 4, B
+	jr nz, ._no_dpad\@
+	ld A, [_JoyTestState]
+	swap A
+	and $0f
+._no_dpad\@
+	ld C, A
+	xor A
+	bit 5, B
+	jr nz, ._no_buttons\@
+	ld A, [_JoyTestState]
+	and $0f
+._no_buttons\@
+	or C
+	cpl
+	ld [JoyIO], A
+	pop BC
+	pop AF
+ENDM
+include "hram.asm"
+include "ioregs.asm"
+include "ring.asm"
+include "debug.asm"
+include "accounting.asm"
+include "waiter.asm"
+IF DEF(_IS_UNIT_TEST)
+PURGE JoyIO
+JoyIO EQU $fffe
+ELSE
+_UnitTestUpdateJoyIO: MACRO
+ENDM
+ENDC
+JOY_QUEUE_SIZE EQU 63
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+	ld HL, JoyWaiter
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld HL, JoyQueue
+	ld DE, .inMem1
+	call _TestLoadMem
+	ld HL, _JoyTestState
+	ld DE, .inMem2
+	call _TestLoadMem
+	ld HL, JoyState
+	ld DE, .inMem3
+	call _TestLoadMem
+	; run test
+	call JoyReadState
+	; check results
+	ld HL, JoyState
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr JoyState+%DE% expected %B% but got %A%"
+	ld HL, JoyQueue
+	ld DE, .outMem1
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr JoyQueue+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 0, 5
+	db 0, 0, 255, 0, 0
+	db 0, 0
+.inMem1
+	db 0, 65
+	db 63, 0, 4, 33, 73, 64, 251, 136, 109, 233, 62, 58, 62, 236, 150, 46
+	db 122, 48, 111, 17, 209, 171, 106, 150, 230, 135, 147, 13, 94, 70, 174, 6
+	db 157, 161, 134, 5, 187, 71, 175, 233, 181, 36, 250, 69, 225, 41, 120, 96
+	db 244, 39, 167, 64, 142, 70, 146, 198, 118, 187, 166, 87, 91, 117, 181, 19
+	db 181
+	db 0, 0
+.inMem2
+	db 0, 1
+	db 3
+	db 0, 0
+.inMem3
+	db 0, 1
+	db 1
+	db 0, 0
+.outMem0
+	db 0, 1
+	db 3
+	db 0, 0
+.outMem1
+	db 0, 65
+	db 63, 0, 4, 33, 73, 64, 251, 136, 109, 233, 62, 58, 62, 236, 150, 46
+	db 122, 48, 111, 17, 209, 171, 106, 150, 230, 135, 147, 13, 94, 70, 174, 6
+	db 157, 161, 134, 5, 187, 71, 175, 233, 181, 36, 250, 69, 225, 41, 120, 96
+	db 244, 39, 167, 64, 142, 70, 146, 198, 118, 187, 166, 87, 91, 117, 181, 19
+	db 181
+	db 0, 0
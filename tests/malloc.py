@@ -1,63 +1,196 @@
 
+import dynmem
+
 file = 'malloc'
 target = 'DynMemAlloc'
 
-GENERAL_DYN_MEM_SIZE = 4
+# We use our own range at a fixed address, so we can work out the free list pointers
+BASE = 0xd000
+PAGES = 4
+
+asm = """
+SECTION "malloc test range", WRAMX[${:04x}]
+TestDynMem:
+	ds {}
+""".format(BASE, PAGES * 256)
+
+
+def setup(allocs=(), frees=(), pages=PAGES):
+	"""Returns a model of the range after allocating each of allocs (a list of sizes),
+	then freeing the allocations with the given indexes in order, and the list of allocated addresses."""
+	model = dynmem.DynMem(BASE, pages)
+	addrs = [model.alloc(size, 1) for size in allocs]
+	for index in frees:
+		model.free(addrs[index])
+	return model, addrs
+
+
+def alloc_test(size, allocs=(), frees=(), pages=PAGES, owner=16):
+	model, addrs = setup(allocs, frees, pages)
+	before = list(model.mem)
+	addr = model.alloc(size, owner)
+	return Test(
+		in_HL = 'TestDynMem',
+		in_B = size,
+		in_D = owner,
+		in_TestDynMem = Memory(before),
+		out_HL = addr,
+		out_D = owner,
+		out_TestDynMem = Memory(model.mem),
+	)
+
+
+def free_test(index, allocs, frees=()):
+	"""Free the allocation with the given index, after doing setup(allocs, frees)"""
+	model, addrs = setup(allocs, frees)
+	before = list(model.mem)
+	model.free(addrs[index])
+	return Test('DynMemFree',
+		in_HL = addrs[index],
+		in_DE = 'TestDynMem',
+		in_TestDynMem = Memory(before),
+		out_DE = 'TestDynMem',
+		out_TestDynMem = Memory(model.mem),
+	)
 
-# this is the initial state assuming all uninitialized mem is set to 42
-GeneralDynMem = Memory(
-	([0, 255] + [42]*254) * (GENERAL_DYN_MEM_SIZE-1),
-	255, 255, [42]*253, [1],
-)
 
 init = Test('DynMemInit',
-	in_HL = 'GeneralDynMem',
-	in_B = 4,
-	in_GeneralDynMem = Memory([42] * 1024),
-	out_GeneralDynMem = GeneralDynMem,
+	in_HL = 'TestDynMem',
+	in_B = PAGES,
+	in_TestDynMem = Memory([42] * PAGES * 256),
+	out_TestDynMem = Memory(setup()[0].mem),
 )
 
-basic = Test(
-	in_HL = 'GeneralDynMem',
-	in_B = 64,
-	in_D = 16,
-	out_HL = 'GeneralDynMem + 2',
-	out_GeneralDynMem = Memory(66, 16, [42]*64, 256-66, 255),
+# The same thing for a single page, written out by hand
+_one_page = Memory(
+	[0] * 8, 0x0a, 0xd0, # only the largest class has a free chunk
+	243, 1, 255, 0, 0, 0x08, 0xd0, [42] * 236, # free chunk, with links back to the class head
+	1, 243, 0, # end sentinel
 )
-
-no_split = Test(
-	in_HL = 'GeneralDynMem',
-	in_B = 252,
-	in_D = 0,
-	out_HL = 'GeneralDynMem + 2',
-	out_GeneralDynMem = Memory(0, 0, [42]*254, 0, 255),
+init_one_page = Test('DynMemInit',
+	in_HL = 'TestDynMem',
+	in_B = 1,
+	in_TestDynMem = Memory([42] * 256),
+	out_TestDynMem = _one_page,
 )
 
-first_no_fit = Test(
-	in_HL = 'GeneralDynMem',
+
+# The rest of these are on a single page and written out by hand too,
+# so they don't depend on the model in tools/dynmem.py being right.
+
+split = Test(
+	in_HL = 'TestDynMem',
 	in_B = 16,
 	in_D = 40,
-	in_GeneralDynMem = Memory(16, 255, [42]*14, 18, 255, [42]*16, 256-16-18, 255),
-	out_HL = 'GeneralDynMem + 16 + 2',
-	out_GeneralDynMem = Memory(16, 255, [42]*14, 18, 40),
+	in_TestDynMem = _one_page,
+	out_HL = 0xd00d,
+	out_TestDynMem = Memory(
+		[0] * 8, 0x1d, 0xd0,
+		19, 1, 40, [None] * 16, # our chunk, with the old links left in its data
+		224, 19, 255, 0, 0, 0x08, 0xd0, [42] * 217, # the rest, still in the largest class
+		1, 224, 0,
+	),
 )
 
-first_taken = Test(
-	in_HL = 'GeneralDynMem',
-	in_B = 1,
+# A free 16-byte chunk (the smallest in class 1) before an allocated one and the rest of the page
+_classes = Memory(
+	0, 0, 0x0a, 0xd0, 0, 0, 0, 0, 0x2a, 0xd0,
+	16, 1, 255, 0, 0, 0x02, 0xd0, [42] * 9,
+	16, 16, 1, [42] * 13,
+	211, 16, 255, 0, 0, 0x08, 0xd0, [42] * 204,
+	1, 211, 0,
+)
+# It's taken whole, both for a length in class 1 that fits exactly...
+class_exact = Test(
+	in_HL = 'TestDynMem',
+	in_B = 13,
+	in_D = 40,
+	in_TestDynMem = _classes,
+	out_HL = 0xd00d,
+	out_TestDynMem = Memory(
+		0, 0, 0, 0, 0, 0, 0, 0, 0x2a, 0xd0,
+		16, 1, 40,
+	),
+)
+# ...and for the longest length in class 0, since that class is empty and we'd only waste a byte
+class_below = Test(
+	in_HL = 'TestDynMem',
+	in_B = 12,
 	in_D = 40,
-	in_GeneralDynMem = Memory(0, 0, [42]*254),
-	out_HL = 'GeneralDynMem + 256 + 2',
-	out_GeneralDynMem = Memory(0, 0, [42]*254, 3, 40),
+	in_TestDynMem = _classes,
+	out_HL = 0xd00d,
+	out_TestDynMem = Memory(
+		0, 0, 0, 0, 0, 0, 0, 0, 0x2a, 0xd0,
+		16, 1, 40,
+	),
+)
+# One more byte doesn't fit, so we split the chunk from the largest class
+class_above = Test(
+	in_HL = 'TestDynMem',
+	in_B = 14,
+	in_D = 40,
+	in_TestDynMem = _classes,
+	out_HL = 0xd02d,
+	out_TestDynMem = Memory(
+		0, 0, 0x0a, 0xd0, 0, 0, 0, 0, 0x3b, 0xd0,
+		16, 1, 255, 0, 0, 0x02, 0xd0, [42] * 9,
+		16, 16, 1, [42] * 13,
+		17, 16, 40, [None] * 14,
+		194, 17, 255, 0, 0, 0x08, 0xd0, [42] * 187,
+		1, 194, 0,
+	),
+)
+
+# Freeing the allocation between them merges all three chunks, giving back the page we started with
+coalesce = Test('DynMemFree',
+	in_HL = 0xd01d,
+	in_DE = 'TestDynMem',
+	in_TestDynMem = _classes,
+	out_TestDynMem = Memory(
+		[0] * 8, 0x0a, 0xd0,
+		243, 1, 255, 0, 0, 0x08, 0xd0, [None] * 236, # what was in the merged chunks doesn't matter
+		1, 243, 0,
+	),
 )
 
-# first one is too small, second is taken, then we hit sentinel
-_full_mem = Memory(128, 255, [42]*126, 240, 32, [42]*238, 1)
-alloc_failure = Test(
-	in_HL = 'GeneralDynMem',
-	in_B = 200,
+# Nothing free is big enough, and the smaller chunk is looked at and passed over
+_full_page = Memory(
+	0, 0, 0x0a, 0xd0, 0, 0, 0, 0, 0, 0,
+	16, 1, 255, 0, 0, 0x02, 0xd0, [42] * 9,
+	227, 16, 1, [42] * 224,
+	1, 227, 0,
+)
+full_page = Test(
+	in_HL = 'TestDynMem',
+	in_B = 16,
 	in_D = 40,
-	in_GeneralDynMem = _full_mem,
+	in_TestDynMem = _full_page,
 	out_HL = 0,
-	out_GeneralDynMem = _full_mem,
+	out_TestDynMem = _full_page,
 )
+
+
+# These are worked out using the model, for more coverage than we'd want to write out by hand
+
+basic = alloc_test(64)
+minimum = alloc_test(0)
+maximum = alloc_test(dynmem.MAX_DATA)
+# The chunk is only 2 bytes bigger than we need, which isn't enough to split off
+no_split = alloc_test(240, pages=1)
+# Frees of small allocations leave small chunks, which small allocations should take
+reuse_small = alloc_test(8, [8, 8, 8, 8], [1])
+reuse_from_bigger_class = alloc_test(8, [40, 8, 40, 8], [2, 0])
+# No class is guaranteed to have a chunk big enough, so we have to look through the list
+# for the class of the size we want. The first chunk is too small.
+search = alloc_test(200, [150, 120])
+exhausted = alloc_test(0, [240], pages=1)
+too_fragmented = alloc_test(200, [100, 100, 100, 100, 100, 100, 100, 100, 100], [1, 3, 5, 7])
+
+free_alone = free_test(1, [16, 16, 16])
+free_merge_next = free_test(1, [16, 16, 16], [2])
+free_merge_prev = free_test(1, [16, 16, 16], [0])
+free_merge_both = free_test(1, [16, 16, 16], [0, 2])
+free_first = free_test(0, [16, 16])
+# The neighbours are free, but together we'd be too big for one chunk
+free_too_big = free_test(1, [120, 120, 120], [0, 2])
+free_all = free_test(0, [16, 100, 8], [2, 1])
@@ -0,0 +1,459 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+SECTION "malloc test range", WRAMX[$d000]
+TestDynMem:
+	ds 1024
+
+
+
+; --- original target file ---
+include "longcalc.asm"
+include "hram.asm"
+include "constants.asm"
+
+; DynMem is organized into chunks. Each chunk consists of a header and a data range.
+; A chunk can be between DYN_MEM_MIN_CHUNK and 256 bytes.
+; Length is of the whole structure, not just the usable data.
+RSRESET
+; Chunk length including header. Special cases: 0 means 256 (253 bytes of data),
+; 1 is a sentinel value meaning end-of-DynMem-range.
+chunk_len rb 1
+; Length of the previous chunk, so we can find it when merging free chunks.
+; 1 means this is the first chunk in the range.
+chunk_prev_len rb 1
+; Owner task_id, or 255 to indicate no owner (a free chunk).
+chunk_owner rb 1
+; Data itself, variable length
+chunk_data rb 0
+; Free chunks are kept in doubly-linked free lists, with the links in the data range.
+chunk_free_next rw 1 ; next chunk in the same free list, or $0000
+chunk_free_prev rw 1 ; address of the link that points to this chunk, ie. the list head
+                     ; or the previous chunk's chunk_free_next.
+; A chunk must be big enough to hold the links once it's freed.
+DYN_MEM_MIN_CHUNK rb 0
+
+; Free chunks are sorted into size classes by length, each with its own free list:
+;   0: 7-15, 1: 16-31, 2: 32-63, 3: 64-127, 4: 128-256
+; Any chunk in a class whose smallest length is at least what we need will fit,
+; so most allocations can just take the first free chunk from one of the lists.
+; We try the first chunk in the class of the length we need first, to make use of any small holes.
+DYN_MEM_CLASSES EQU 5
+
+; A DynMem range starts with the head of each class's free list (little-endian, $0000 if empty),
+; followed by the chunks, then a sentinel chunk header with length 1 to mark the end.
+DYN_MEM_HEADER_SIZE EQU DYN_MEM_CLASSES * 2
+DYN_MEM_SENTINEL_SIZE EQU chunk_data
+
+
+section "General Dynamic Memory Range", WRAM0
+
+; This dynamic memory section is for general task use,
+; even in tasks that also have their own dedicated RAM bank
+GeneralDynMem::
+	ds GENERAL_DYN_MEM_SIZE * 256
+
+
+section "Dynamic Memory Management Routines", ROM0
+
+; All functions here operate on a given DynMem range.
+
+
+; Initialize DynMem range starting at HL with length B * 256 (min 1).
+; Clobbers A, B, C, H, L.
+DynMemInit::
+	push DE
+	ld D, H
+	ld E, L ; DE = range
+	; All free lists start empty
+	xor A
+	REPT DYN_MEM_HEADER_SIZE
+	ld [HL+], A
+	ENDR
+	; Fill the range with free 256-byte chunks, except the last which is shorter
+	; to make room for the free list heads and the sentinel.
+	ld C, 1 ; C = previous chunk length, 1 for none
+.loop
+	ld A, B
+	dec A ; set z if this is the last chunk
+	ld A, 0 ; chunk_len = 0 -> length 256. Can't xor A as this would reset z.
+	jr nz, .notlast
+	ld A, 256 - DYN_MEM_HEADER_SIZE - DYN_MEM_SENTINEL_SIZE
+.notlast
+	ld [HL+], A
+	ld [HL], C ; chunk_prev_len = previous chunk length
+	inc HL
+	ld [HL], $ff ; owner = $ff (unowned)
+	dec HL
+	dec HL ; HL = chunk
+	ld C, A ; C = length of this chunk, for the next one
+	push BC
+	push HL
+	call DynMemPushFree
+	pop HL
+	pop BC
+	ld A, C
+	dec A
+	LongAddToA HL, HL
+	inc HL ; HL += length. Adding length - 1 then 1 means length 0 adds 256.
+	dec B
+	jr nz, .loop
+	; HL = the last 3 bytes of the range
+	ld [HL], 1 ; chunk_len = 1 -> sentinel value
+	inc HL
+	ld [HL], C ; chunk_prev_len = last chunk length
+	inc HL
+	ld [HL], 0 ; owner = anything but $ff, so it's never merged
+	pop DE
+	ret
+
+
+; Set HL to the head of the free list for the size class of chunk length A (where 0 means 256),
+; in DynMem range DE.
+; Clobbers A.
+DynMemClassHead:
+	dec A ; A = length - 1, so 256 becomes 255
+	ld HL, 2 * 4
+	cp 128 + (-1) ; set carry if length < 128
+	jr nc, .found
+	ld L, 2 * 3
+	cp 64 + (-1)
+	jr nc, .found
+	ld L, 2 * 2
+	cp 32 + (-1)
+	jr nc, .found
+	ld L, 2 * 1
+	cp 16 + (-1)
+	jr nc, .found
+	ld L, 0
+.found
+	add HL, DE
+	ret
+
+
+; Add free chunk HL to the front of the free list for its size class, in DynMem range DE.
+; Clobbers A, B, C, H, L.
+DynMemPushFree:
+	ld B, H
+	ld C, L ; BC = chunk
+	ld A, [HL] ; A = chunk_len
+	call DynMemClassHead ; HL = list head
+	push DE
+	ld A, [HL+]
+	ld E, A
+	ld D, [HL] ; DE = old first chunk in list
+	ld [HL], B
+	dec HL
+	ld [HL], C ; head = our chunk
+	push HL
+	ld H, B
+	ld L, C
+	RepointStruct HL, chunk_len, chunk_free_next
+	ld [HL], E
+	inc HL
+	ld [HL], D ; chunk_free_next = old first chunk
+	inc HL
+	pop BC ; BC = list head
+	ld [HL], C
+	inc HL
+	ld [HL], B ; chunk_free_prev = list head
+	; If there was an old first chunk, its link is now our chunk_free_next
+	ld A, D
+	and A ; set z if D = 0. Chunks are in RAM, so a non-null chunk can't have a high byte of 0.
+	jr z, .done
+	RepointStruct HL, chunk_free_prev + 1, chunk_free_next
+	ld B, H
+	ld C, L ; BC = &(our chunk_free_next)
+	ld H, D
+	ld L, E
+	RepointStruct HL, chunk_len, chunk_free_prev
+	ld [HL], C
+	inc HL
+	ld [HL], B ; old first chunk's chunk_free_prev = &(our chunk_free_next)
+.done
+	pop DE
+	ret
+
+
+; Remove free chunk HL from its free list.
+; Clobbers A, B, C, H, L.
+DynMemUnlink:
+	RepointStruct HL, chunk_len, chunk_free_next
+	ld A, [HL+]
+	ld C, A
+	ld A, [HL+]
+	ld B, A ; BC = next chunk
+	ld A, [HL+]
+	ld H, [HL]
+	ld L, A ; HL = link to our chunk
+	ld [HL], C
+	inc HL
+	ld [HL], B ; link = next chunk
+	ld A, B
+	and A ; set z if there is no next chunk
+	ret z
+	dec HL
+	RepointStruct BC, chunk_len, chunk_free_prev
+	ld A, L
+	ld [BC], A
+	inc BC
+	ld A, H
+	ld [BC], A ; next chunk's chunk_free_prev = link
+	ret
+
+
+; Given chunk lengths in A and C (where 0 means 256), return their combined length in A.
+; If they won't fit in one chunk, set carry instead.
+; Clobbers B.
+DynMemMergedLength:
+	dec A
+	ld B, A
+	ld A, C
+	dec A
+	add B ; A = total length - 2, set carry if total length - 2 >= 256
+	ret c
+	cp $ff ; set carry if total length - 2 < 255, ie. total length <= 256
+	ccf
+	ret c
+	inc A
+	inc A ; A = total length, wrapping 256 to 0. inc doesn't affect carry, which is unset.
+	ret
+
+
+; Find and allocate a memory chunk of B length (that's B usable data, max 253)
+; from DynMem range starting at HL. Returns newly allocated memory in HL, or $0000 on failure.
+; Allocation is registered to task with task id D.
+; Clobbers all but DE.
+DynMemAlloc::
+	push DE ; we need D at the end, but we need DE for the range until then
+	ld D, H
+	ld E, L ; DE = range
+	; B = chunk length needed, at least DYN_MEM_MIN_CHUNK. 0 means 256.
+	ld A, B
+	cp DYN_MEM_MIN_CHUNK - chunk_data
+	jr nc, .big_enough
+	ld A, DYN_MEM_MIN_CHUNK - chunk_data
+.big_enough
+	add chunk_data
+	ld B, A
+
+	; The first chunk in the class containing B is the closest fit we can find without searching,
+	; so take it if it's big enough.
+	call DynMemClassHead ; HL = head for class of B
+	push HL ; save it in case we need to search this class later
+	ld A, [HL+]
+	ld C, A
+	ld A, [HL+] ; AC = first chunk
+	and A ; set z if there's no first chunk
+	jr z, .classes
+	push HL
+	ld H, A
+	ld L, C ; HL = chunk
+	ld A, B
+	dec A
+	ld C, A ; C = needed length - 1
+	ld A, [HL]
+	dec A ; A = chunk length - 1, so 256 becomes 255
+	cp C ; set carry if chunk length < needed length
+	jr nc, .found_first
+	pop HL ; HL = next class head
+
+.classes
+	; Every chunk in the following classes is at least B long.
+	; Take the first chunk from the first non-empty one.
+	ld A, L
+	sub E ; A = offset of head into range
+	cp DYN_MEM_HEADER_SIZE
+	jr nc, .search ; if we're past the last head, no class is guaranteed to fit
+	ld A, [HL+]
+	ld C, A
+	ld A, [HL+] ; AC = first chunk
+	and A ; set z if there's no first chunk
+	jr z, .classes
+	ld H, A
+	ld L, C ; HL = chunk
+	jr .found_guaranteed
+.found_first
+	add SP, 2 ; discard next class head
+.found_guaranteed
+	add SP, 2 ; discard our class head
+	jr .found
+
+.search
+	; No class is guaranteed to have a chunk that fits, but the class containing B might.
+	; Look through it for the first chunk that's big enough.
+	pop HL ; HL = head for class of B
+.search_loop
+	; HL = link to next chunk
+	ld A, [HL+]
+	ld C, A
+	ld A, [HL]
+	and A ; set z if there's no next chunk
+	jr z, .fail
+	ld H, A
+	ld L, C ; HL = chunk
+	ld A, B
+	dec A
+	ld C, A ; C = needed length - 1
+	ld A, [HL]
+	dec A ; A = chunk length - 1, so 256 becomes 255
+	cp C ; set carry if chunk length < needed length
+	jr nc, .found
+	RepointStruct HL, chunk_len, chunk_free_next
+	jr .search_loop
+
+.found
+	; HL = chunk to allocate, B = needed length
+	push HL
+	push BC
+	call DynMemUnlink
+	pop BC
+	pop HL
+	ld A, [HL]
+	sub B ; A = excess length. This also works if either is 256, since it's always positive.
+	cp DYN_MEM_MIN_CHUNK ; set carry if A < min chunk length
+	jr c, .nosplit ; if the excess can't make a chunk, it stays in this one
+	; Slice off the excess as a new free chunk
+	ld C, A ; C = excess
+	ld [HL], B ; set this chunk's length to the needed length
+	push HL
+	ld A, B
+	LongAddToA HL, HL ; HL = excess chunk. B can't be 256 here since the excess would be 0.
+	ld [HL], C ; chunk_len = excess
+	inc HL
+	ld [HL], B ; chunk_prev_len = needed length
+	inc HL
+	ld [HL], $ff ; owner = $ff (unowned)
+	dec HL
+	ld A, C
+	LongAddToA HL, HL ; HL = excess chunk + 1 + excess = the following chunk's chunk_prev_len
+	ld [HL], C
+	ld A, L
+	sub C
+	ld L, A
+	jr nc, .nocarry
+	dec H
+.nocarry
+	dec HL ; HL = excess chunk
+	call DynMemPushFree
+	pop HL
+.nosplit
+	; HL = allocated chunk header start
+	pop DE ; D = owner
+	RepointStruct HL, chunk_len, chunk_owner
+	ld [HL], D
+	RepointStruct HL, chunk_owner, chunk_data ; point at data
+	ret
+
+.fail
+	pop DE
+	ld HL, $00
+	ret
+
+
+; Free memory at HL, which must have come from DynMemAlloc for DynMem range DE.
+; It's merged with the free chunks either side of it (if any) as long as the result fits in a chunk.
+; Clobbers all but DE.
+DynMemFree::
+	RepointStruct HL, chunk_data, chunk_len ; HL = chunk to free
+	ld C, [HL] ; C = length of our chunk, including anything we merge into it
+
+	; If the next chunk is free, merge it into ours
+	push HL
+	ld A, C
+	dec A
+	LongAddToA HL, HL
+	inc HL ; HL += length. Adding length - 1 then 1 means length 0 adds 256.
+	RepointStruct HL, chunk_len, chunk_owner
+	ld A, [HL-]
+	inc A ; set z if owner is $ff
+	jr nz, .next_done
+	dec HL ; HL = next chunk
+	ld A, [HL]
+	call DynMemMergedLength
+	jr c, .next_done
+	ld C, A
+	push BC
+	call DynMemUnlink
+	pop BC
+.next_done
+	pop HL
+
+	; If the previous chunk is free, merge ours into it
+	RepointStruct HL, chunk_len, chunk_prev_len
+	ld A, [HL-]
+	cp 1 ; set z if there is no previous chunk
+	jr z, .prev_done
+	push HL
+	dec HL
+	dec A
+	ld B, A
+	ld A, L
+	sub B
+	ld L, A
+	jr nc, .prev_nocarry
+	dec H
+.prev_nocarry
+	; HL = our chunk - 1 - (previous length - 1) = previous chunk
+	RepointStruct HL, chunk_len, chunk_owner
+	ld A, [HL-]
+	inc A ; set z if owner is $ff
+	jr nz, .prev_not_free
+	dec HL ; HL = previous chunk
+	ld A, [HL]
+	call DynMemMergedLength
+	jr c, .prev_not_free
+	ld C, A
+	push HL
+	push BC
+	call DynMemUnlink
+	pop BC
+	pop HL
+	add SP, 2 ; discard our chunk, the previous chunk is now the start of the merged chunk
+	jr .prev_done
+.prev_not_free
+	pop HL
+.prev_done
+
+	; HL = chunk to free, C = its length
+	ld [HL], C
+	RepointStruct HL, chunk_len, chunk_owner
+	ld [HL], $ff ; owner = $ff (unowned)
+	push HL
+	ld A, C
+	dec A
+	LongAddToA HL, HL ; HL = chunk_owner + length - 1 = the following chunk's chunk_prev_len
+	ld [HL], C
+	pop HL
+	RepointStruct HL, chunk_owner, chunk_len
+	jp DynMemPushFree ; tail call
+
+
+; Task-callable version of DynMemAlloc.
+; Can only allocate memory to yourself, not other tasks.
+; Clobbers all but E.
+T_DynMemAlloc::
+	call T_DisableSwitch
+	ld A, [CurrentTask]
+	ld D, A
+	call DynMemAlloc
+	jp T_EnableSwitch
+
+
+; Task-callable version of DynMemFree.
+; Clobbers all but DE.
+T_DynMemFree::
+	call T_DisableSwitch
+	call DynMemFree
+	jp T_EnableSwitch
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT TestDynMem
@@ -6,8 +6,8 @@
 # You can say None, but it's a weird case.
 file = None
 
-# What top-level directory .asm files to link with. Default is all top-level *.asm files
-# excepting the target file, since they tend to be very cross-dependent.
+# What top-level directory .asm files to link with. Default is whichever top-level and tasks/ *.asm files
+# define the exported labels the test uses, and whichever files those in turn use, excepting the target file.
 # It also excludes 'header.asm' as this special-case file contains specific things like
 # interrupt handlers and the start address, which conflict with the test harness.
 # However, you can also set it to any explicit list or the empty list as shown here.
@@ -68,8 +68,11 @@ no_match = Test(
 	out_zflag = False,
 )
 
+# Marking a test as expected to fail only affects batch roms (see unit_test_gen --batch),
+# where it counts as a pass if it fails and vice versa.
 this_fails = Test(
-	out_HL = 0xcefa
+	out_HL = 0xcefa,
+	expect_fail = True,
 )
 
 # The 'random' global is an RNG seeded with the test suite name, and should be used
@@ -102,4 +105,16 @@ pre_and_post_asm = Test(
 	out_B = 11,
 )
 
+# max_cycles gives a budget for how long the call may take, counted in cycles from the start of
+# the call instruction until the target returns. The runner logs how long it took, and the test fails
+# if it went over. This is mainly for use in the tests/bench_*.py suites.
+within_budget = Test(
+	max_cycles = 39,
+)
+
+# Budgets are usually based on how long the call was measured to take, with some headroom added by budget()
+within_measured_budget = Test(
+	max_cycles = budget(39),
+)
+
 # Currently no way to specify input/output stack, but it wouldn't be much of a change.
@@ -0,0 +1,43 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+SECTION "Test Mem", WRAM0
+
+TestMem:
+	ds 5
+
+SECTION "Test code", ROM0
+
+; Basic function to test. Should output HL = $face, B = input B + 1,
+; A = TestMem[0] + TestMem[1], TestMem[3] = TestMem[0] - TestMem[1],
+; and set z iff A == TestMem[2]
+TestCode:
+	ld HL, $face
+	inc B
+	ld A, [TestMem+2]
+	ld D, A
+	ld A, [TestMem+1]
+	ld C, A
+	ld A, [TestMem]
+	sub C
+	ld [TestMem+3], A
+	ld A, [TestMem]
+	add C
+	cp D
+	ret
+
+
+
+; --- original target file ---
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT TestCode
+EXPORT TestMem
@@ -0,0 +1,186 @@
+"""Tests for the bulk ring buffer macros RingPushN and RingPopN.
+
+Each call has a cycle budget: the worst case measured (including the call itself), with headroom
+added by budget(). That's 80 + 10 cycles per byte, for when the bytes go around the end of the buffer. For comparison, a loop doing a RingPush
+per byte costs 41 cycles per byte, and a loop doing a RingPop per byte costs 42,
+so the bulk macros are faster for anything more than 2 bytes.
+"""
+
+file = None
+
+asm = """
+
+include "longcalc.asm"
+include "ring.asm"
+
+SECTION "Test rings", WRAMX[$d000], BANK[1]
+
+TestRing:
+	RingDeclare 15
+
+SECTION "Test big ring", WRAMX[$d100], BANK[1]
+
+TestBigRing:
+	RingDeclare 255
+
+SECTION "Test buffer", WRAMX[$d400], BANK[1]
+
+TestBuffer:
+	ds 256
+
+SECTION "Test ring materialized macros", ROM0
+
+TestRingPushN:
+	RingPushN TestRing, 15
+	ret
+
+TestRingPopN:
+	RingPopN TestRing, 15
+	ret
+
+TestBigRingPushN:
+	RingPushN TestBigRing, 255
+	ret
+
+"""
+
+CAPACITY = 15
+DATA = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def ring(head, tail, at=0, data='', capacity=CAPACITY):
+	"""Memory for a ring with the given data starting at index at, wrapping around.
+	Other data bytes are unset."""
+	contents = [None] * (capacity + 1)
+	for i, value in enumerate(data):
+		contents[(at + i) % (capacity + 1)] = value
+	return Memory(head, tail, contents)
+
+def cycles(n):
+	return budget(80 + 10 * n)
+
+
+push = Test('TestRingPushN',
+	in_C = 5,
+	in_DE = 'TestBuffer',
+	in_TestBuffer = Memory(DATA),
+	out_B = 5,
+	out_DE = 'TestBuffer + 5',
+	out_TestRing = ring(5, 0, 0, DATA[:5]),
+	max_cycles = cycles(5),
+)
+
+# Goes past the end of the buffer, so is copied in two parts
+push_wraps = Test('TestRingPushN',
+	in_C = 6,
+	in_DE = 'TestBuffer',
+	in_TestBuffer = Memory(DATA),
+	in_TestRing = ring(13, 13),
+	out_B = 6,
+	out_DE = 'TestBuffer + 6',
+	out_TestRing = ring(3, 13, 13, DATA[:6]),
+	max_cycles = cycles(6),
+)
+
+push_to_end = Test('TestRingPushN',
+	in_C = 4,
+	in_DE = 'TestBuffer',
+	in_TestBuffer = Memory(DATA),
+	in_TestRing = ring(12, 12),
+	out_B = 4,
+	out_TestRing = ring(0, 12, 12, DATA[:4]),
+	max_cycles = cycles(4),
+)
+
+# Only room for 7 of the 10 bytes
+push_partial = Test('TestRingPushN',
+	in_C = 10,
+	in_DE = 'TestBuffer',
+	in_TestBuffer = Memory(DATA),
+	in_TestRing = ring(10, 2),
+	out_B = 7,
+	out_DE = 'TestBuffer + 7',
+	out_TestRing = ring(1, 2, 10, DATA[:7]),
+	max_cycles = cycles(7),
+)
+
+push_full = Test('TestRingPushN',
+	in_C = 3,
+	in_DE = 'TestBuffer',
+	in_TestRing = ring(1, 2),
+	out_B = 0,
+	out_DE = 'TestBuffer',
+	out_TestRing = ring(1, 2),
+	max_cycles = cycles(0),
+)
+
+push_none = Test('TestRingPushN',
+	in_C = 0,
+	in_DE = 'TestBuffer',
+	out_B = 0,
+	out_TestRing = ring(0, 0),
+)
+
+# With a capacity of 255, the whole buffer is one page and there's no end to go past
+push_big = Test('TestBigRingPushN',
+	in_C = 20,
+	in_DE = 'TestBuffer',
+	in_TestBuffer = Memory(DATA),
+	out_B = 20,
+	out_TestBigRing = ring(20, 0, 0, DATA[:20], capacity=255),
+	max_cycles = cycles(20),
+)
+
+push_big_wraps = Test('TestBigRingPushN',
+	in_C = 10,
+	in_DE = 'TestBuffer',
+	in_TestBuffer = Memory(DATA),
+	in_TestBigRing = ring(250, 100, capacity=255),
+	out_B = 10,
+	out_TestBigRing = ring(4, 100, 250, DATA[:10], capacity=255),
+	max_cycles = cycles(10),
+)
+
+pop = Test('TestRingPopN',
+	in_C = 3,
+	in_DE = 'TestBuffer',
+	in_TestRing = ring(5, 0, 0, DATA[:5]),
+	out_B = 3,
+	out_DE = 'TestBuffer + 3',
+	out_TestRing = ring(5, 3),
+	out_TestBuffer = Memory(DATA[:3], 0),
+	max_cycles = cycles(3),
+)
+
+# Only 6 of the 10 bytes are there, and they go past the end of the buffer
+pop_wraps = Test('TestRingPopN',
+	in_C = 10,
+	in_DE = 'TestBuffer',
+	in_TestRing = ring(4, 14, 14, DATA[:6]),
+	out_B = 6,
+	out_DE = 'TestBuffer + 6',
+	out_TestRing = ring(4, 4),
+	out_TestBuffer = Memory(DATA[:6], 0),
+	max_cycles = cycles(6),
+)
+
+pop_to_end = Test('TestRingPopN',
+	in_C = 4,
+	in_DE = 'TestBuffer',
+	in_TestRing = ring(0, 12, 12, DATA[:4]),
+	out_B = 4,
+	out_TestRing = ring(0, 0),
+	out_TestBuffer = Memory(DATA[:4], 0),
+	max_cycles = cycles(4),
+)
+
+pop_empty = Test('TestRingPopN',
+	in_C = 3,
+	in_DE = 'TestBuffer',
+	in_TestRing = ring(7, 7),
+	out_B = 0,
+	out_DE = 'TestBuffer',
+	out_TestRing = ring(7, 7),
+	out_TestBuffer = Memory(0),
+	max_cycles = cycles(0),
+)
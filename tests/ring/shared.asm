@@ -0,0 +1,56 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+
+include "longcalc.asm"
+include "ring.asm"
+
+SECTION "Test rings", WRAMX[$d000], BANK[1]
+
+TestRing:
+	RingDeclare 15
+
+SECTION "Test big ring", WRAMX[$d100], BANK[1]
+
+TestBigRing:
+	RingDeclare 255
+
+SECTION "Test buffer", WRAMX[$d400], BANK[1]
+
+TestBuffer:
+	ds 256
+
+SECTION "Test ring materialized macros", ROM0
+
+TestRingPushN:
+	RingPushN TestRing, 15
+	ret
+
+TestRingPopN:
+	RingPopN TestRing, 15
+	ret
+
+TestBigRingPushN:
+	RingPushN TestBigRing, 255
+	ret
+
+
+
+
+; --- original target file ---
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT TestBigRing
+EXPORT TestBigRingPushN
+EXPORT TestBuffer
+EXPORT TestRing
+EXPORT TestRingPopN
+EXPORT TestRingPushN
@@ -0,0 +1,341 @@
+
+import struct
+
+file = 'scheduler'
+
+SLEEP_WHEEL_SIZE = 64
+
+# TimerPeriodic bits
+TIMER_PERIODIC_JOY = 1
+TIMER_PERIODIC_SERIAL = 2
+
+# Reading TimerControl gives 1s for unused bits
+TIMER_STOPPED = 0xf8
+TIMER_SLOW = 0xfc
+TIMER_FAST = 0xfd
+# Other interrupts (eg. vblank) may happen while we're waiting for the timer, so we only look at its bit
+CHECK_TIMER_FLAG = ['\tld A, [InterruptFlags]', '\tand IntEnableTimer']
+
+# Running the timer from a known point, so it doesn't count before we check it
+RESET_DIV = '\tld [DivTimer], A'
+
+
+def run_slow(counter, tick_start, uptime):
+	"""pre_asm to set IdleTickStart and Uptime, then start the timer at the slow rate from counter.
+	The rest of a test's setup runs after pre_asm, so tests using this shouldn't set any other memory:
+	loading it could take long enough for the timer to count."""
+	lines = [
+		'\tld A, {}'.format(tick_start),
+		'\tld [IdleTickStart], A',
+	]
+	for i, value in enumerate(bytearray(struct.pack('<I', uptime))):
+		lines += [
+			'\tld A, {}'.format(value),
+			'\tld [Uptime + {}], A'.format(i),
+		]
+	return lines + [
+		RESET_DIV,
+		'\tld A, {}'.format(counter),
+		'\tld [TimerCounter], A',
+		'\tld A, TimerEnable | TimerFreq12',
+		'\tld [TimerControl], A',
+	]
+
+
+def wheel(*slots):
+	"""Generates a Memory representing the sleep wheel, with the given slots non-empty"""
+	result = [255] * SLEEP_WHEEL_SIZE
+	for slot in slots:
+		result[slot % SLEEP_WHEEL_SIZE] = 8
+	return Memory(result)
+
+
+def uptime(value):
+	"""Generates a Memory() representing the given time value"""
+	return Memory(struct.pack('<I', value))
+
+
+def cursor(value):
+	return Memory(struct.pack('<H', value))
+
+
+start_timer = Test('SchedStartTimer',
+	out_TimerControl = Memory(TIMER_FAST),
+	out_TimerModulo = Memory(0),
+	out_InterruptsEnabled = Memory(4),
+	post_asm = CHECK_TIMER_FLAG,
+	out_A = 4, # the caller resets this
+)
+
+# Nothing to wake for, so we wait as long as we can: 63 ticks. We're 2 slow counts into this one.
+start = Test('_SchedIdleStart',
+	pre_asm = RESET_DIV,
+	in_Uptime = uptime(0x1232),
+	in_TimerCounter = Memory(0x85),
+	out_TimerControl = Memory(TIMER_SLOW),
+	out_TimerCounter = Memory(0x06),
+	out_TimerModulo = Memory(0xfc),
+	out_IdleTickStart = Memory(0x04),
+)
+
+# While a button is held, TimerHandler scans the joypad every 16 ticks, so we wait 14
+start_joypad = Test('_SchedIdleStart',
+	pre_asm = RESET_DIV,
+	in_Uptime = uptime(0x1232),
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_JOY),
+	in_TimerCounter = Memory(0x85),
+	out_TimerControl = Memory(TIMER_SLOW),
+	out_TimerCounter = Memory(0xca),
+	out_IdleTickStart = Memory(0xc8),
+)
+
+# Likewise while it's polling the link cable
+start_serial = Test('_SchedIdleStart',
+	pre_asm = RESET_DIV,
+	in_Uptime = uptime(0x1232),
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_SERIAL),
+	in_TimerCounter = Memory(0x85),
+	out_IdleTickStart = Memory(0xc8),
+)
+
+start_sleeper = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_SleepCount = Memory(1),
+	in_TimerCounter = Memory(0x10),
+	in_SleepCursor = cursor(0x1233),
+	in_IdleNextSleeper = Memory(0x35),
+	out_TimerControl = Memory(TIMER_SLOW),
+	out_TimerModulo = Memory(0xfc),
+	out_IdleTickStart = Memory(0xf4), # 3 ticks
+)
+
+# The next sleeper isn't at a multiple of 16, and is past the next one
+start_sleeper_later = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_SleepCount = Memory(1),
+	in_TimerCounter = Memory(0x10),
+	in_SleepCursor = cursor(0x1233),
+	in_IdleNextSleeper = Memory(0x46),
+	out_IdleTickStart = Memory(0xb0), # 20 ticks
+)
+
+start_sleeper_next_tick = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_SleepCount = Memory(1),
+	in_TimerCounter = Memory(0x10),
+	in_SleepCursor = cursor(0x1233),
+	in_IdleNextSleeper = Memory(0x33),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_IdleTickStart = Memory(0),
+)
+
+# The wheel hasn't been checked up to now, so a task may already be due
+start_wheel_behind = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_SleepCount = Memory(1),
+	in_TimerCounter = Memory(0x10),
+	in_SleepCursor = cursor(0x1232),
+	in_SleepWheel = wheel(),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_IdleTickStart = Memory(0),
+)
+
+start_next_tick = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x123f),
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_JOY),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_IdleTickStart = Memory(0),
+)
+
+start_tick_due = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_InterruptFlags = Memory(4),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_IdleTickStart = Memory(0),
+)
+
+# The tick ended just before we read the count, so it looks like there's plenty of time to switch
+start_tick_just_ended = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_TimerCounter = Memory(0x01),
+	in_InterruptFlags = Memory(4),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_TimerCounter = Memory(0x01),
+	out_IdleTickStart = Memory(0),
+)
+
+start_near_count = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_TimerCounter = Memory(0x7a),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_TimerCounter = Memory(0x7a),
+	out_IdleTickStart = Memory(0),
+)
+
+# CPU accounting works out its timestamps from the slow count, so it doesn't stop us
+start_accounting = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1232),
+	in_AccountingIndex = Memory(1),
+	in_TimerCounter = Memory(0x10),
+	out_TimerControl = Memory(TIMER_SLOW),
+	out_TimerCounter = Memory(0x04),
+	out_IdleTickStart = Memory(0x04),
+)
+
+# We're already slow, waiting for a single tick. Now we can wait as long as we can.
+# (The timer's stopped here, but we'd be running slow)
+start_longer = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1230),
+	in_IdleTickStart = Memory(0xfc),
+	in_TimerCounter = Memory(0xfd),
+	out_TimerCounter = Memory(0x05),
+	out_TimerModulo = Memory(0xfc),
+	out_IdleTickStart = Memory(0x04),
+)
+
+# We're waiting 16 ticks, but a button was pressed, so now we need to wake at the multiple of 16 in 8
+start_shorter = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1238),
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_JOY),
+	in_IdleTickStart = Memory(0xc0),
+	in_TimerCounter = Memory(0xc1),
+	out_TimerCounter = Memory(0xe1),
+	out_TimerModulo = Memory(0xfc),
+	out_IdleTickStart = Memory(0xe0),
+)
+
+start_same = Test('_SchedIdleStart',
+	in_Uptime = uptime(0x1230),
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_JOY),
+	in_IdleTickStart = Memory(0xc0),
+	in_TimerCounter = Memory(0xc5),
+	out_TimerCounter = Memory(0xc5),
+	out_IdleTickStart = Memory(0xc0),
+)
+
+# Something was made runnable after the caller last looked, so we mustn't halt
+idle_runnable = Test('SchedIdle',
+	in_RunMask = Memory(2),
+	in_DeferredWakes = Memory(0xff, 0xff),
+	in_Uptime = uptime(0x1232),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_IdleTickStart = Memory(0),
+)
+
+idle_deferred_wake = Test('SchedIdle',
+	in_RunMask = Memory(0),
+	in_DeferredWakes = Memory(0x00, 0xc3),
+	in_Uptime = uptime(0x1232),
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_IdleTickStart = Memory(0),
+)
+
+find_sleeper = Test('SchedFindNextSleeper',
+	in_SleepCount = Memory(1),
+	in_SleepCursor = cursor(0x1233),
+	in_SleepWheel = wheel(0x1235),
+	out_IdleNextSleeper = Memory(0x35),
+)
+
+# The first non-empty slot is on the next lap of the wheel
+find_sleeper_wraps = Test('SchedFindNextSleeper',
+	in_SleepCount = Memory(1),
+	in_SleepCursor = cursor(0x123e),
+	in_SleepWheel = wheel(0x1241),
+	out_IdleNextSleeper = Memory(0x41),
+)
+
+find_sleeper_at_cursor = Test('SchedFindNextSleeper',
+	in_SleepCount = Memory(2),
+	in_SleepCursor = cursor(0x1233),
+	in_SleepWheel = wheel(0x1233, 0x1235),
+	out_IdleNextSleeper = Memory(0x33),
+)
+
+# Nothing is sleeping, so the cursor may be stale and we leave it alone
+find_sleeper_none = Test('SchedFindNextSleeper',
+	in_SleepCount = Memory(0),
+	in_SleepCursor = cursor(0x1233),
+	in_IdleNextSleeper = Memory(0x12),
+	out_IdleNextSleeper = Memory(0x12),
+)
+
+catch_up = Test('_SchedIdleCatchUp',
+	in_Uptime = uptime(0x1232),
+	in_IdleTickStart = Memory(0xc8),
+	in_TimerCounter = Memory(0xd1),
+	out_Uptime = uptime(0x1234),
+	out_IdleTickStart = Memory(0xd0),
+)
+
+catch_up_none = Test('_SchedIdleCatchUp',
+	in_Uptime = uptime(0x1232),
+	in_IdleTickStart = Memory(0xc8),
+	in_TimerCounter = Memory(0xcb),
+	out_Uptime = uptime(0x1232),
+	out_IdleTickStart = Memory(0xc8),
+)
+
+# Passing a multiple of 256 ticks carries into the rest of Uptime
+catch_up_carry = Test('_SchedIdleCatchUp',
+	in_Uptime = uptime(0x12fe),
+	in_IdleTickStart = Memory(0xc8),
+	in_TimerCounter = Memory(0xd1),
+	out_Uptime = uptime(0x1300),
+	out_IdleTickStart = Memory(0xd0),
+)
+
+# The period is over, and TimerHandler will count the last tick
+catch_up_overflow = Test('_SchedIdleCatchUp',
+	in_Uptime = uptime(0x1232),
+	in_IdleTickStart = Memory(0xc8),
+	in_TimerCounter = Memory(0xfc),
+	in_InterruptFlags = Memory(4),
+	out_Uptime = uptime(0x123f),
+	out_IdleTickStart = Memory(0xfc),
+)
+
+# TimerHandler has already counted the last tick, and we're into the next one
+catch_up_after_overflow = Test('_SchedIdleCatchUp',
+	in_Uptime = uptime(0x1233),
+	in_IdleTickStart = Memory(0xc8),
+	in_TimerCounter = Memory(0xfd),
+	out_Uptime = uptime(0x1240),
+	out_IdleTickStart = Memory(0xfc),
+)
+
+end_not_idle = Test('SchedIdleEnd',
+	out_TimerControl = Memory(TIMER_STOPPED),
+	out_IdleTickStart = Memory(0),
+)
+
+# Half way through a tick, so we switch back with the fast count half way too
+end = Test('SchedIdleEnd',
+	pre_asm = ['\tld A, 5', '\tld [InterruptsEnabled], A'] + run_slow(0xc9, 0xc8, 0x1232),
+	out_Uptime = uptime(0x1232),
+	out_IdleTickStart = Memory(0),
+	out_TimerControl = Memory(TIMER_FAST),
+	out_TimerModulo = Memory(0),
+	out_InterruptsEnabled = Memory(5),
+	post_asm = CHECK_TIMER_FLAG,
+	out_A = 0,
+)
+
+end_catch_up = Test('SchedIdleEnd',
+	pre_asm = run_slow(0xd1, 0xc8, 0x1232),
+	out_Uptime = uptime(0x1234),
+	out_IdleTickStart = Memory(0),
+	out_TimerControl = Memory(TIMER_FAST),
+	post_asm = CHECK_TIMER_FLAG,
+	out_A = 0,
+)
+
+# The next slow count ends the tick, so TimerHandler should count it
+end_on_tick = Test('SchedIdleEnd',
+	pre_asm = run_slow(0xcb, 0xc8, 0x1232),
+	out_Uptime = uptime(0x1232),
+	out_IdleTickStart = Memory(0),
+	out_TimerControl = Memory(TIMER_FAST),
+	post_asm = CHECK_TIMER_FLAG,
+	out_A = 4,
+)
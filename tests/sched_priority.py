@@ -0,0 +1,201 @@
+"""Tests for choosing which task runs next by priority.
+
+An urgent task that's woken waits at most one timer tick for the current task to be switched out,
+then the scheduler picks it in a bounded number of cycles no matter how many other tasks are runnable.
+The add and pop budgets below are the slowest each was measured to take in these tests
+(including the call itself), with headroom added by budget().
+"""
+
+file = 'scheduler'
+
+asm = """
+include "waiter.asm"
+
+SECTION "Test deferred waiter", WRAM0[$c123]
+TestDeferredWaiter:
+	DeclareIntSafeWaiter
+TestDeferredWaiter2:
+	DeclareIntSafeWaiter
+"""
+
+TestDeferredWaiter = 0xc123
+TestDeferredWaiter2 = 0xc128
+
+TASK_SIZE = 8
+MAX_TASKS = 31
+RUN_LIST_SIZE = 31
+PRIORITY_REALTIME, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW = PRIORITIES = range(4)
+
+ADD_CYCLES = 86
+POP_CYCLES = 69
+
+def task_id(priority, n=0):
+	"""Task ids are assigned so that the nth task of each priority is task_id(priority, n)"""
+	return (n * len(PRIORITIES) + priority) * TASK_SIZE
+
+TaskList = Memory(*[
+	[0xd0, 0x00, 0, 0, 0xff, 0xff, 0xff, i % len(PRIORITIES)]
+	for i in range(MAX_TASKS)
+])
+
+def tasks_of(priority):
+	"""All task ids with the given priority"""
+	return [task_id(priority, n) for n in range(MAX_TASKS) if task_id(priority, n) < MAX_TASKS * TASK_SIZE]
+
+def run_list(ids=(), tail=0):
+	"""A run list containing the given task ids, with the first one at index tail"""
+	data = [None] * (RUN_LIST_SIZE + 1)
+	for i, id in enumerate(ids):
+		data[(tail + i) % len(data)] = id
+	return [(tail + len(ids)) % len(data), tail] + data
+
+def run_lists(*lists):
+	"""Memory for all run lists, most urgent first. Missing lists at the end are empty."""
+	return Memory(*(lists + (run_list(),) * (len(PRIORITIES) - len(lists))))
+
+def run_mask(*priorities):
+	return Memory(sum(1 << priority for priority in priorities))
+
+
+init = Test('SchedInit',
+	in_RunList = run_lists(run_list([1], tail=3), run_list([2])),
+	in_RunMask = run_mask(*PRIORITIES),
+	out_RunList = run_lists(),
+	out_RunMask = run_mask(),
+)
+
+
+def add_test(priority, current_priority, run_list_in=(), preempts=False):
+	"""Add a task of the given priority while a task of current_priority is running,
+	with run_list_in already in the task's run list."""
+	task = task_id(priority)
+	current = task_id(current_priority, 1)
+	lists_in = [run_list()] * len(PRIORITIES)
+	lists_in[priority] = run_list(run_list_in)
+	lists_out = list(lists_in)
+	lists_out[priority] = run_list(list(run_list_in) + [task])
+	return Test('SchedAddTask',
+		in_B = task,
+		in_CurrentTask = Memory(current),
+		in_SwitchTimer = Memory(5),
+		in_RunList = run_lists(*lists_in),
+		in_RunMask = run_mask(*([priority] if run_list_in else [])),
+		out_RunList = run_lists(*lists_out),
+		out_RunMask = run_mask(priority),
+		# If we preempt, the current task should be switched out at the next timer tick
+		out_SwitchTimer = Memory(1 if preempts else 5),
+		max_cycles = budget(ADD_CYCLES),
+	)
+
+add_normal = add_test(PRIORITY_NORMAL, PRIORITY_NORMAL)
+add_behind_same = add_test(PRIORITY_NORMAL, PRIORITY_NORMAL, [task_id(PRIORITY_NORMAL, 2)])
+add_less_urgent = add_test(PRIORITY_LOW, PRIORITY_NORMAL)
+add_preempts = add_test(PRIORITY_HIGH, PRIORITY_NORMAL, preempts=True)
+add_realtime_preempts = add_test(PRIORITY_REALTIME, PRIORITY_LOW, preempts=True)
+
+
+def pop_test(lists_in, lists_out, mask_in, mask_out, task):
+	return Test('SchedPopNext',
+		in_RunList = run_lists(*lists_in),
+		in_RunMask = run_mask(*mask_in),
+		out_B = task,
+		out_zflag = False,
+		out_RunList = run_lists(*lists_out),
+		out_RunMask = run_mask(*mask_out),
+		max_cycles = budget(POP_CYCLES),
+	)
+
+pop_empty = Test('SchedPopNext',
+	in_RunList = run_lists(),
+	in_RunMask = run_mask(),
+	out_zflag = True,
+	max_cycles = budget(POP_CYCLES),
+)
+
+pop_round_robin = pop_test(
+	[run_list(), run_list(), run_list([task_id(PRIORITY_NORMAL), task_id(PRIORITY_NORMAL, 1)])],
+	[run_list(), run_list(), run_list([task_id(PRIORITY_NORMAL, 1)], tail=1)],
+	[PRIORITY_NORMAL], [PRIORITY_NORMAL],
+	task_id(PRIORITY_NORMAL),
+)
+
+pop_least_urgent = pop_test(
+	[run_list(), run_list(), run_list(), run_list([task_id(PRIORITY_LOW)], tail=RUN_LIST_SIZE)],
+	[run_list(), run_list(), run_list(), run_list()],
+	[PRIORITY_LOW], [],
+	task_id(PRIORITY_LOW),
+)
+
+# An urgent task is picked first, and just as fast, whether or not other tasks are waiting.
+pop_urgent_alone = pop_test(
+	[run_list(), run_list([task_id(PRIORITY_HIGH)])],
+	[run_list(), run_list([], tail=1)],
+	[PRIORITY_HIGH], [],
+	task_id(PRIORITY_HIGH),
+)
+
+pop_urgent_busy = pop_test(
+	[run_list(), run_list([task_id(PRIORITY_HIGH)]), run_list(tasks_of(PRIORITY_NORMAL)), run_list(tasks_of(PRIORITY_LOW))],
+	[run_list(), run_list([], tail=1), run_list(tasks_of(PRIORITY_NORMAL)), run_list(tasks_of(PRIORITY_LOW))],
+	[PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW], [PRIORITY_NORMAL, PRIORITY_LOW],
+	task_id(PRIORITY_HIGH),
+)
+
+
+set_priority = Test('T_TaskSetPriority',
+	in_B = task_id(PRIORITY_NORMAL, 1),
+	in_C = PRIORITY_REALTIME,
+	out_TaskList = Memory([None] * (task_id(PRIORITY_NORMAL, 1) + TASK_SIZE - 1) + [PRIORITY_REALTIME]),
+)
+
+
+# Interrupt handlers leave waiters for the scheduler to wake
+def waiting_tasks(*waits):
+	"""TaskList with each given (task, waiter), where the task is the only one in the waiter's wait list"""
+	contents = list(TaskList.contents)
+	for task, waiter in waits:
+		contents[task + 4:task + 7] = [waiter >> 8, waiter & 0xff, 0xff]
+	return Memory(contents)
+
+def deferred(task, next=0xffff):
+	"""An IntSafeWaiter with task waiting on it, on the deferred wake list before next"""
+	return Memory(0, 1, task, next & 0xff, next >> 8)
+
+deferred_wake = Test('CheckDeferredWakes',
+	in_CurrentTask = Memory(task_id(PRIORITY_NORMAL, 1)),
+	in_TaskList = waiting_tasks((task_id(PRIORITY_HIGH), TestDeferredWaiter + 1)),
+	in_TestDeferredWaiter = deferred(task_id(PRIORITY_HIGH)),
+	in_DeferredWakes = Memory(TestDeferredWaiter & 0xff, TestDeferredWaiter >> 8),
+	in_RunList = run_lists(),
+	in_RunMask = run_mask(),
+	out_TestDeferredWaiter = Memory(0, 0, 255, 0, 0), # and it can be deferred again
+	out_DeferredWakes = Memory(0xff, 0xff),
+	out_RunList = run_lists(run_list(), run_list([task_id(PRIORITY_HIGH)])),
+	out_RunMask = run_mask(PRIORITY_HIGH),
+)
+
+# Every waiter on the list is woken, however many there are
+deferred_wakes_all = Test('CheckDeferredWakes',
+	in_CurrentTask = Memory(task_id(PRIORITY_NORMAL, 1)),
+	in_TaskList = waiting_tasks(
+		(task_id(PRIORITY_HIGH), TestDeferredWaiter + 1),
+		(task_id(PRIORITY_LOW), TestDeferredWaiter2 + 1),
+	),
+	in_TestDeferredWaiter = deferred(task_id(PRIORITY_HIGH), TestDeferredWaiter2),
+	in_TestDeferredWaiter2 = deferred(task_id(PRIORITY_LOW)),
+	in_DeferredWakes = Memory(TestDeferredWaiter & 0xff, TestDeferredWaiter >> 8),
+	in_RunList = run_lists(),
+	in_RunMask = run_mask(),
+	out_TestDeferredWaiter = Memory(0, 0, 255, 0, 0),
+	out_TestDeferredWaiter2 = Memory(0, 0, 255, 0, 0),
+	out_DeferredWakes = Memory(0xff, 0xff),
+	out_RunList = run_lists(run_list(), run_list([task_id(PRIORITY_HIGH)]), run_list(), run_list([task_id(PRIORITY_LOW)])),
+	out_RunMask = run_mask(PRIORITY_HIGH, PRIORITY_LOW),
+)
+
+no_deferred_wakes = Test('CheckDeferredWakes',
+	in_DeferredWakes = Memory(0xff, 0xff),
+	in_RunList = run_lists(),
+	out_DeferredWakes = Memory(0xff, 0xff),
+	out_RunList = run_lists(),
+)
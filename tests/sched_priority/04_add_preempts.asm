@@ -0,0 +1,292 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+include "waiter.asm"
+include "ring.asm"
+include "task.asm"
+include "hram.asm"
+include "debug.asm"
+include "accounting.asm"
+include "waiter.asm"
+RUN_LIST_SIZE EQU MAX_TASKS
+RUN_LIST_STRIDE EQU RING_SIZE_NO_DATA + RUN_LIST_SIZE + 1
+SLEEP_WHEEL_SIZE EQU 64 ; must be a power of 2
+RSRESET
+sleep_next rb 1 ; task id of next task in the same slot, or $ff
+sleep_time rw 1 ; bottom 16 bits of Uptime to wake at, little-endian
+SLEEP_SIZE rb 0
+_SchedAddToRunList: MACRO
+	RingPushNoCheck RunList + (\1) * RUN_LIST_STRIDE, RUN_LIST_SIZE, B
+	ld HL, RunMask
+	set \1, [HL] ; this must come after the push, so SchedPopNext never sees an empty list with its bit set
+IF (\1) < PRIORITY_COUNT + (-1) ; nothing can be less urgent than the least urgent priority
+	; If the current task is less urgent, ask for a switch on the next timer tick instead of waiting
+	; for its time slice to finish. This bounds how long an urgent task waits to run once it's woken.
+	ld A, [CurrentTask]
+	LongAddToA TaskList+task_priority, HL ; HL = &(TaskList[CurrentTask].task_priority)
+	ld A, [HL]
+	cp (\1) + 1 ; set c if current task's priority <= \1, ie. it's at least as urgent
+	ret c
+	ld A, 1
+	ld [SwitchTimer], A
+ENDC
+	ret
+ENDM
+_SchedPopRunList: MACRO
+	RingPopNoCheck RunList + (\1) * RUN_LIST_STRIDE, RUN_LIST_SIZE, B
+	; A = new tail. If it equals head, the list is now empty.
+	ld HL, RunList + (\1) * RUN_LIST_STRIDE + ring_head
+	cp [HL]
+	jr nz, .found
+	ld HL, RunMask
+	res \1, [HL]
+IF (\1) < PRIORITY_COUNT + (-1)
+	jr .found
+ENDC
+ENDM
+IDLE_TICK_START EQU 256 - 4
+IDLE_MAX_TICKS EQU 63
+IDLE_GUARD EQU 8
+IDLE_RESUME_COUNTS EQU 1
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+	ld HL, RunMask
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld HL, TaskList
+	ld DE, .inMem1
+	call _TestLoadMem
+	ld HL, RunList
+	ld DE, .inMem2
+	call _TestLoadMem
+	ld HL, SwitchTimer
+	ld DE, .inMem3
+	call _TestLoadMem
+	ld HL, CurrentTask
+	ld DE, .inMem4
+	call _TestLoadMem
+	ld B, 8
+	; run test
+	_TestLog "%ZEROCLKS%"
+	call SchedAddTask
+	_TestLog "=== Cycles: %LASTCLKS% clocks, max 107 cycles ==="
+	; check results
+	ld HL, RunMask
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr RunMask+%DE% expected %B% but got %A%"
+	ld HL, RunList
+	ld DE, .outMem1
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr RunList+%DE% expected %B% but got %A%"
+	ld HL, SwitchTimer
+	ld DE, .outMem2
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr SwitchTimer+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 0, 1
+	db 0
+	db 0, 0
+.inMem1
+	db 0, 248
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2, 208, 0, 0, 0, 255, 255, 255, 3
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2, 208, 0, 0, 0, 255, 255, 255, 3
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2, 208, 0, 0, 0, 255, 255, 255, 3
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2, 208, 0, 0, 0, 255, 255, 255, 3
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2, 208, 0, 0, 0, 255, 255, 255, 3
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2, 208, 0, 0, 0, 255, 255, 255, 3
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2, 208, 0, 0, 0, 255, 255, 255, 3
+	db 208, 0, 0, 0, 255, 255, 255, 0, 208, 0, 0, 0, 255, 255, 255, 1
+	db 208, 0, 0, 0, 255, 255, 255, 2
+	db 0, 0
+.inMem2
+	db 0, 2
+	db 0, 0
+	db 32, 2
+	db 0, 0
+	db 32, 2
+	db 0, 0
+	db 32, 2
+	db 0, 0
+	db 0, 0
+.inMem3
+	db 0, 1
+	db 5
+	db 0, 0
+.inMem4
+	db 0, 1
+	db 48
+	db 0, 0
+.outMem0
+	db 0, 1
+	db 2
+	db 0, 0
+.outMem1
+	db 0, 2
+	db 0, 0
+	db 32, 3
+	db 1, 0, 8
+	db 31, 2
+	db 0, 0
+	db 32, 2
+	db 0, 0
+	db 0, 0
+.outMem2
+	db 0, 1
+	db 1
+	db 0, 0
@@ -0,0 +1,838 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+
+include "waiter.asm"
+
+SECTION "Test deferred waiter", WRAM0[$c123]
+TestDeferredWaiter:
+	DeclareIntSafeWaiter
+TestDeferredWaiter2:
+	DeclareIntSafeWaiter
+
+
+
+; --- original target file ---
+include "ring.asm"
+include "task.asm"
+include "hram.asm"
+include "debug.asm"
+include "accounting.asm"
+include "waiter.asm"
+
+
+SECTION "Scheduler RAM", WRAM0
+
+; We have a simple priority scheduler. Each priority has a run list, which is round-robin.
+
+; RunList is an array of rings, one per priority, most urgent first.
+; We assume they can never fill since tasks shouldn't be able to be in there twice.
+RUN_LIST_SIZE EQU MAX_TASKS
+RUN_LIST_STRIDE EQU RING_SIZE_NO_DATA + RUN_LIST_SIZE + 1
+RunList::
+REPT PRIORITY_COUNT
+	RingDeclare RUN_LIST_SIZE
+ENDR
+
+; RunMask has bit N set if RunList N is non-empty, so we can find the most urgent task
+; without looking at every run list.
+RunMask::
+	db
+
+; Sleeping tasks are kept in a timing wheel, so that putting a task to sleep and waking it
+; take the same time no matter how many tasks are sleeping.
+; The wheel has a slot for each value of the bottom bits of Uptime, and each slot is a linked list
+; of the tasks due to wake on a tick with those bottom bits.
+; Since we allow sleeping for up to 65535 ticks, a task may need to go around the wheel many times,
+; so we only wake it when the bottom 16 bits of Uptime match its wake time.
+SLEEP_WHEEL_SIZE EQU 64 ; must be a power of 2
+
+; SleepWheel contains the first task id in each slot's list, or $ff if the slot is empty.
+SleepWheel:
+	ds SLEEP_WHEEL_SIZE
+
+; SleepEntries contains a sleep struct for each task, at SleepEntries + task id.
+RSRESET
+sleep_next rb 1 ; task id of next task in the same slot, or $ff
+sleep_time rw 1 ; bottom 16 bits of Uptime to wake at, little-endian
+SLEEP_SIZE rb 0
+
+IF SLEEP_SIZE > TASK_SIZE
+FAIL "Sleep structs can't be bigger than task structs, or the structs for adjacent task ids overlap"
+ENDC
+
+SleepEntries:
+	ds MAX_TASKS * TASK_SIZE
+
+; SleepCursor is the bottom 16 bits of the next tick we need to check the wheel for,
+; ie. we have woken all tasks due on ticks before it. Little-endian.
+; It's only valid while SleepCount > 0.
+SleepCursor:
+	ds 2
+; SleepCount is the number of tasks in the wheel.
+SleepCount:
+	db
+
+; While nothing is runnable, we slow the timer down so it doesn't interrupt us every tick.
+; See SchedIdle. This is the value TimerCounter had at the start of the current tick,
+; such that it overflows when the period we're waiting for is over. It's 0 when the timer is running normally.
+; CPU accounting also uses it to work out the time while the timer is slow.
+IdleTickStart::
+	db
+; Bottom byte of the tick for the first non-empty slot in the sleep wheel, as of the last SchedFindNextSleeper.
+IdleNextSleeper:
+	db
+
+; IntSafeWaiters that interrupt handlers have woken, which we wake the next time we choose a task
+; to run. See SchedDeferWake.
+; This is the address of the first one, little-endian, or ffff if there are none. The rest follow
+; in a list threaded through their isw_deferred_next fields, so there's always room for every waiter.
+DeferredWakes::
+	ds 2
+
+
+SECTION "Scheduler", ROM0
+
+; The code below that handles each priority's run list is written for exactly 4 priorities
+IF PRIORITY_COUNT != 4
+FAIL "Scheduler needs updating for PRIORITY_COUNT = {PRIORITY_COUNT}"
+ENDC
+
+; Initialize scheduler structs
+SchedInit::
+	RingInit RunList + 0 * RUN_LIST_STRIDE, RUN_LIST_SIZE
+	RingInit RunList + 1 * RUN_LIST_STRIDE, RUN_LIST_SIZE
+	RingInit RunList + 2 * RUN_LIST_STRIDE, RUN_LIST_SIZE
+	RingInit RunList + 3 * RUN_LIST_STRIDE, RUN_LIST_SIZE
+	ld [RunMask], A ; A = 0 from RingInit
+	ld [SleepCount], A
+	ld [IdleTickStart], A
+	ld A, $ff
+	ld [DeferredWakes], A
+	ld [DeferredWakes + 1], A ; no deferred wakes
+	; set all wheel slots to empty
+	ld HL, SleepWheel
+	ld B, SLEEP_WHEEL_SIZE
+.loop
+	ld [HL+], A
+	dec B
+	jr nz, .loop
+	ret
+
+; Helper for SchedAddTask. Push task B to RunList \1 and return.
+_SchedAddToRunList: MACRO
+	RingPushNoCheck RunList + (\1) * RUN_LIST_STRIDE, RUN_LIST_SIZE, B
+	ld HL, RunMask
+	set \1, [HL] ; this must come after the push, so SchedPopNext never sees an empty list with its bit set
+IF (\1) < PRIORITY_COUNT + (-1) ; nothing can be less urgent than the least urgent priority
+	; If the current task is less urgent, ask for a switch on the next timer tick instead of waiting
+	; for its time slice to finish. This bounds how long an urgent task waits to run once it's woken.
+	ld A, [CurrentTask]
+	LongAddToA TaskList+task_priority, HL ; HL = &(TaskList[CurrentTask].task_priority)
+	ld A, [HL]
+	cp (\1) + 1 ; set c if current task's priority <= \1, ie. it's at least as urgent
+	ret c
+	ld A, 1
+	ld [SwitchTimer], A
+ENDC
+	ret
+ENDM
+
+; Enqueue a task with task id in B to be scheduled, after any other runnable tasks of the same priority.
+; If the task is more urgent than the current task, the current task will be switched out at the next
+; timer tick (or as soon as it re-enables switching), so the new task runs within ~1ms.
+; Clobbers A, H, L.
+SchedAddTask::
+	Debug "Enqueue task %B% to run"
+	ld A, B
+	LongAddToA TaskList+task_priority, HL ; HL = &(TaskList[B].task_priority)
+	ld A, [HL]
+	and A
+	jr nz, .not0
+	_SchedAddToRunList 0
+.not0
+	dec A
+	jr nz, .not1
+	_SchedAddToRunList 1
+.not1
+	dec A
+	jr nz, .not2
+	_SchedAddToRunList 2
+.not2
+	_SchedAddToRunList 3
+
+
+; Helper for SchedPopNext. Pop from RunList \1 into B, clear its RunMask bit if it's now empty,
+; and go to .found
+_SchedPopRunList: MACRO
+	RingPopNoCheck RunList + (\1) * RUN_LIST_STRIDE, RUN_LIST_SIZE, B
+	; A = new tail. If it equals head, the list is now empty.
+	ld HL, RunList + (\1) * RUN_LIST_STRIDE + ring_head
+	cp [HL]
+	jr nz, .found
+	ld HL, RunMask
+	res \1, [HL]
+IF (\1) < PRIORITY_COUNT + (-1)
+	jr .found
+ENDC
+ENDM
+
+; Pop the most urgent runnable task into B, or set z if there are none.
+; Takes the same time no matter how many tasks are runnable.
+; Clobbers A, H, L.
+SchedPopNext:
+	; Interrupts may add tasks, so we need to disable them between checking if a list is empty
+	; and clearing its bit, or else we might clear the bit for a task they just added.
+	di
+	ld A, [RunMask]
+	rra
+	jr c, .priority0
+	rra
+	jr c, .priority1
+	rra
+	jr c, .priority2
+	rra
+	jr c, .priority3
+	ei
+	xor A ; set z
+	ret
+.priority0
+	_SchedPopRunList 0
+.priority1
+	_SchedPopRunList 1
+.priority2
+	_SchedPopRunList 2
+.priority3
+	_SchedPopRunList 3
+.found
+	ei
+	or $ff ; unset z
+	ret
+
+
+; Choose next task to run and run it.
+; Does not return.
+SchedLoadNext::
+
+	call CheckDeferredWakes
+	call CheckNextWake
+	call SchedPopNext
+	jr nz, .found
+
+	; halt loop until any task is ready
+.loop
+	call SchedFindNextSleeper
+	di
+	; Nothing is runnable. We record this for CPU accounting every time we wake up, not just the first,
+	; since log entries must be less than 2^-2 seconds apart (see include/accounting.asm).
+	AccountingMark ACCOUNTING_IDLE
+	Debug "Nothing runnable"
+	call SchedIdle
+	ei ; handle whatever woke us
+	call CheckDeferredWakes
+	call CheckNextWake
+	call SchedPopNext
+	jr z, .loop
+	di
+	call SchedIdleEnd
+	ei
+
+.found
+	Debug "Running task %B%"
+	ld A, B
+	jp TaskLoad ; does not return
+
+
+; Put task in B to sleep for DE time units.
+; More properly, this enqueues it to be made runnable after that time.
+; It does not remove it from the pending run list if already present.
+; Clobbers all.
+SchedEnqueueSleepTask::
+	Debug "Putting task %B% to sleep for %DE%"
+	ld A, D
+	or E
+	jp z, SchedAddTask ; sleeping for 0 means it's runnable now. Tail call.
+
+	; Make sure we've woken everything due up until now, so the cursor is just after now.
+	; This means our wake time is after the cursor, and we'll see it next time we pass its slot.
+	push BC
+	push DE
+	call CheckNextWake
+	pop DE
+	pop BC
+	ld A, [SleepCount]
+	and A
+	jr z, .reset_cursor
+	ld HL, SleepCursor
+	ld A, [HL+]
+	ld H, [HL]
+	ld L, A ; HL = cursor
+	jr .got_cursor
+
+.reset_cursor
+	; Nothing else is sleeping, so the cursor is stale (CheckNextWake stops once the wheel is empty).
+	; Start it at the next tick. We need to disable interrupts so we get a consistent read of Uptime.
+	ld HL, Uptime
+	di
+	ld A, [HL+]
+	ld H, [HL]
+	ei
+	ld L, A
+	inc HL ; HL = bottom 16 bits of Uptime + 1
+	ld A, L
+	ld [SleepCursor], A
+	ld A, H
+	ld [SleepCursor+1], A
+
+.got_cursor
+	; Our wake time is the tick before the cursor (the last tick we've checked, ie. now) + DE.
+	; Since DE > 0, this is never before the cursor, and since DE < 2^16 it's less than one lap of
+	; the 16-bit times away.
+	dec HL
+	add HL, DE
+	ld D, H
+	ld E, L ; DE = wake time
+
+	; Push task to the front of the slot's list
+	ld A, E
+	and SLEEP_WHEEL_SIZE + (-1)
+	LongAddToA SleepWheel, HL ; HL = &SleepWheel[wake time % SLEEP_WHEEL_SIZE]
+	ld C, [HL] ; C = old first task in slot
+	ld [HL], B
+	ld A, B
+	LongAddToA SleepEntries+sleep_next, HL ; HL = &(SleepEntries[B].sleep_next)
+	ld [HL], C
+	RepointStruct HL, sleep_next, sleep_time
+	ld [HL], E
+	inc HL
+	ld [HL], D ; sleep_time = DE
+
+	ld HL, SleepCount
+	inc [HL]
+	ret
+
+
+; Put current task to sleep for DE time units of 2^-10 sec (~1ms).
+; Clobbers all.
+T_SchedSleepTask::
+	DisableSwitch
+	ld A, [CurrentTask]
+	ld B, A
+	call SchedEnqueueSleepTask
+	call TaskSave
+	jp SchedLoadNext ; does not return
+
+
+; Wake any sleeping tasks which are due, catching up on all ticks since we last checked.
+; Takes time proportional to the ticks since we last checked and the number of sleeping tasks
+; in those ticks' slots, but not the total number of sleeping tasks.
+; Clobbers all.
+CheckNextWake:
+	ld A, [SleepCount]
+	and A
+	ret z ; nothing is sleeping, and the cursor doesn't matter
+	; BC = bottom 16 bits of Uptime. We need to disable interrupts to get a consistent read.
+	; We re-read it each time around, so we also catch up on ticks that pass while we're working.
+	ld HL, Uptime
+	di
+	ld A, [HL+]
+	ld C, A
+	ld B, [HL]
+	ei
+	; DE = cursor
+	ld HL, SleepCursor
+	ld A, [HL+]
+	ld E, A
+	ld D, [HL]
+	; We're done if cursor is after Uptime, ie. Uptime - cursor is negative.
+	; The cursor can't fall behind by 2^15 ticks, since we check every time we switch tasks.
+	ld A, C
+	sub E
+	ld A, B
+	sbc D
+	bit 7, A
+	ret nz
+
+	; Walk the list in the cursor's slot. HL points to the link to the current task,
+	; which is either the slot itself or the previous task's sleep_next.
+	ld A, E
+	and SLEEP_WHEEL_SIZE + (-1)
+	LongAddToA SleepWheel, HL ; HL = &SleepWheel[cursor % SLEEP_WHEEL_SIZE]
+.slot_loop
+	ld A, [HL]
+	cp $ff
+	jr z, .slot_done
+	ld B, A ; B = task id
+	push HL
+	LongAddToA SleepEntries+sleep_time, HL ; HL = &(SleepEntries[B].sleep_time)
+	; Check if the wake time matches the cursor. If not, it's due on a later lap.
+	ld A, [HL+]
+	cp E
+	jr nz, .not_due
+	ld A, [HL]
+	cp D
+	jr nz, .not_due
+	; Remove the task from the list, by pointing the link to it at the task after it instead.
+	RepointStruct HL, sleep_time + 1, sleep_next
+	ld A, [HL]
+	pop HL
+	ld [HL], A ; HL still points to the link, which now points to the next task
+	ld A, [SleepCount]
+	dec A
+	ld [SleepCount], A
+	Debug "Waking task %B% from sleep"
+	push DE
+	push HL
+	call SchedAddTask ; clobbers A, HL
+	pop HL
+	pop DE
+	jr .slot_loop
+.not_due
+	RepointStruct HL, sleep_time + 1, sleep_next ; HL = link to next task
+	add SP, 2 ; discard saved link to this task
+	jr .slot_loop
+
+.slot_done
+	; Advance cursor and check the next tick
+	inc DE
+	ld HL, SleepCursor
+	ld [HL], E
+	inc HL
+	ld [HL], D
+	jr CheckNextWake
+
+
+; Task-callable way to get current system uptime.
+; Returned in BCDE. Clobbers A, HL.
+; Non-task system callers should not use this, in most cases they should hand-code something faster.
+T_GetUptime::
+	ld HL, Uptime
+	; We need to disable interrupts to get a consistent read
+	di
+	ld A, [HL+]
+	ld E, A
+	ld A, [HL+]
+	ld D, A
+	ld A, [HL+]
+	ld B, [HL]
+	ei
+	ld C, A
+	ret
+
+
+; Wake the IntSafeWaiter in HL the next time we choose a task to run. This is for interrupt handlers,
+; see IntSafeWaiterWake. Interrupts must be disabled.
+; The waiter's isw_deferred_next must be 0, ie. it isn't already on the list. We add it to the front,
+; since the order we wake waiters in doesn't matter.
+; Clobbers A, HL.
+SchedDeferWake::
+	push DE
+	ld A, [DeferredWakes]
+	ld E, A
+	ld A, [DeferredWakes + 1]
+	ld D, A ; DE = first waiter on the list, or ffff
+	ld A, L
+	ld [DeferredWakes], A
+	ld A, H
+	ld [DeferredWakes + 1], A ; this waiter is now first
+	RepointStruct HL, 0, isw_deferred_next
+	ld [HL], E
+	inc HL
+	ld [HL], D ; followed by the rest
+	pop DE
+	; Switch at the next timer tick, so the wake isn't held up until the current task's time is up.
+	ld A, 1
+	ld [SwitchTimer], A
+	ret
+
+
+; Wake any waiters deferred by SchedDeferWake.
+; Clobbers all.
+CheckDeferredWakes:
+	ld A, [DeferredWakes + 1]
+	inc A ; set z if there are none
+	ret z
+.loop
+	; Interrupts may add more while we're working, so we take them one at a time with interrupts disabled
+	di
+	ld HL, DeferredWakes
+	ld A, [HL+]
+	ld H, [HL]
+	ld L, A ; HL = first IntSafeWaiter
+	ld A, H
+	inc A ; set z if there are none left
+	jr z, .done
+	ld D, H
+	ld E, L ; DE = waiter
+	; Take it off the list. Once it's off, interrupt handlers may ask for it to be woken again.
+	RepointStruct HL, 0, isw_deferred_next
+	xor A
+	ld B, [HL]
+	ld [HL+], A
+	ld C, [HL]
+	ld [HL], A ; isw_deferred_next = 0, BC = next waiter
+	ld A, B
+	ld [DeferredWakes], A
+	ld A, C
+	ld [DeferredWakes + 1], A
+	ei
+	ld H, D
+	ld L, E
+	RepointStruct HL, 0, isw_waiter
+	Debug "Waking deferred waiter %HL%"
+	call _WaiterWake ; clobbers all
+	jr .loop
+.done
+	ei
+	ret
+
+
+; Tickless idle
+;
+; Normally the timer counts at 2^18Hz and overflows every tick (see TimerHandler). While nothing is
+; runnable, that's 1024 interrupts a second that do nothing but count. So instead, we switch it to
+; count at 2^12Hz (4 counts per tick), and set it to overflow only when a sleeping task might be due,
+; or after IDLE_MAX_TICKS. If TimerHandler has periodic work to do (scanning the joypad while a button
+; is held, or polling the link cable), we also wake at the next multiple of 16 ticks, when it does it.
+; We add up the ticks that passed ourselves, and let TimerHandler count the last one as normal.
+;
+; Both rates count off the same internal clock, so if each tick starts exactly on a 2^12Hz count,
+; we can switch between them without losing time. The fast count at a slow count is always a multiple
+; of 64, so we know where we are in the tick when we switch to the slow rate. To switch back,
+; we wait for the next slow count and switch as soon as it happens. SchedStartTimer starts the timer
+; lined up this way in the first place.
+;
+; CPU accounting timestamps normally use the fast count, so while the timer is slow, AccountingMark
+; works them out from IdleTickStart instead.
+
+; TimerModulo while idle, so that after a long period ends, the timer overflows every tick.
+IDLE_TICK_START EQU 256 - 4
+; The longest period we wait for, in ticks. A period of 64 would need an IdleTickStart of 0,
+; which means the timer is running normally.
+IDLE_MAX_TICKS EQU 63
+; How close to the next slow count (in fast counts) we can be and still switch to the slow rate in time.
+IDLE_GUARD EQU 8
+; Fast counts missed between a slow count and switching to the fast rate, when the slow count
+; wakes us from halt (see SchedStartTimer). On hardware, TimerCounter is reloaded and the interrupt
+; flag set 1 cycle after it overflows, leaving halt takes 1 more, then the nop takes 1, and the ldh
+; to TimerControl writes on its 3rd and last cycle. So the write lands 5 cycles after the slow count,
+; after the fast count at 4 and before the one at 8. We lose exactly one, with room for the write
+; to be a cycle earlier or 3 later. tools/gb_emulator.py models the same timings.
+IDLE_RESUME_COUNTS EQU 1
+
+
+; Start the timer, such that ticks start exactly on a slow count (see above).
+; Uptime starts counting from when this returns.
+; Interrupts must be disabled. Clobbers A.
+SchedStartTimer::
+	ld A, TimerEnable | TimerFreq12
+	ld [TimerControl], A
+	ld A, IDLE_RESUME_COUNTS
+	ld [TimerModulo], A
+	ld A, $ff
+	ld [TimerCounter], A ; overflow at the next slow count
+	ld A, IntEnableTimer
+	ld [InterruptsEnabled], A
+	xor A
+	ld [InterruptFlags], A
+	ld A, TimerEnable | TimerFreq18
+	halt
+	nop ; in case the count happened just before the halt, and the halt is skipped
+	ld [TimerControl], A
+	xor A
+	ld [TimerModulo], A
+	ret
+
+
+; Halt until an interrupt. Before we do, slow the timer down if we can (see above).
+; Interrupts must be disabled, and stay disabled, so the interrupt that woke us isn't handled
+; until the caller enables them. Clobbers all.
+SchedIdle:
+	ld A, [IdleTickStart]
+	and A
+	call nz, _SchedIdleCatchUp
+	; An interrupt may have made something runnable since the caller last looked.
+	; We mustn't halt until the next one, which may be a long way off with the timer slowed down.
+	ld A, [DeferredWakes + 1]
+	cpl ; A = 0 if there are no deferred wakes
+	ld HL, RunMask
+	or [HL]
+	ret nz
+	call _SchedIdleStart
+	halt
+	nop ; in case something is already pending and the halt is skipped
+	ld A, [IdleTickStart]
+	and A
+	ret z
+	jp _SchedIdleCatchUp ; tail call
+
+
+; Find the first non-empty slot in the sleep wheel from the cursor on, and save the bottom byte of its tick
+; in IdleNextSleeper, for _SchedIdleStart. The task in it may not be due until a later lap, but it's
+; cheaper to wake up and check than to work that out.
+; This may take a while, but only the scheduler changes the wheel, so we can do it with interrupts enabled.
+; Clobbers A, B, C, H, L.
+SchedFindNextSleeper:
+	ld A, [SleepCount]
+	and A
+	ret z ; the cursor is stale, and _SchedIdleStart doesn't need it
+	ld A, [SleepCursor]
+	ld C, A ; C = bottom byte of the tick for the slot we're looking at
+	ld B, SLEEP_WHEEL_SIZE
+.loop
+	ld A, C
+	and SLEEP_WHEEL_SIZE + (-1)
+	LongAddToA SleepWheel, HL ; HL = &SleepWheel[C % SLEEP_WHEEL_SIZE]
+	ld A, [HL]
+	inc A ; set z if slot is empty ($ff)
+	jr nz, .found
+	inc C
+	dec B
+	jr nz, .loop
+	; Every slot is empty, which can't happen while something is sleeping. C is now a whole lap away.
+.found
+	ld A, C
+	ld [IdleNextSleeper], A
+	ret
+
+
+; Slow the timer down until the next time we need to be woken, if that's worth doing.
+; Interrupts must be disabled, and if the timer is already slow, we must have caught up (see
+; _SchedIdleCatchUp). If anything is sleeping, SchedFindNextSleeper must have been called since the wheel
+; was last checked. Clobbers all.
+_SchedIdleStart:
+	; C = ticks TimerHandler can do without running. If it has periodic work to do,
+	; that's until the next multiple of 16.
+	ld C, IDLE_MAX_TICKS
+	ld A, [TimerPeriodic]
+	and A
+	jr z, .got_limit
+	ld A, [Uptime]
+	cpl
+	and $0f
+	inc A
+	ld C, A
+.got_limit
+
+	; If a sleeping task might be due before then, wake for it
+	ld A, [SleepCount]
+	and A
+	jr z, .got_ticks
+	ld A, [Uptime]
+	ld B, A
+	inc A ; A = bottom byte of the next tick
+	ld HL, SleepCursor
+	cp [HL]
+	ret nz ; we haven't checked the wheel up to now, so we can't skip any ticks
+	ld A, [IdleNextSleeper]
+	sub B ; A = ticks until the next non-empty slot, from 1 to SLEEP_WHEEL_SIZE
+	cp C
+	jr nc, .got_ticks
+	ld C, A
+
+.got_ticks
+	ld A, C
+	cp 2
+	ret c ; waking up every tick anyway
+	; C = TimerCounter at the start of this tick, such that it overflows C ticks after it
+	add A
+	add A
+	cpl
+	inc A
+	ld C, A
+
+	ld HL, TimerCounter
+	ld A, [IdleTickStart]
+	and A
+	jr nz, .already_slow
+
+	; Switch from the fast rate, but not if a tick is due, since Uptime is about to change.
+	; As in _SchedIdleCatchUp, we read TimerCounter before checking, so that if the tick ended
+	; just before we read it, we don't take the small count to mean we have time to switch.
+	ld A, [HL]
+	ld B, A
+	ld A, [InterruptFlags]
+	and IntEnableTimer ; same bit as in InterruptsEnabled
+	ret nz
+	ld A, B
+	and 63
+	cp 64 - IDLE_GUARD
+	ret nc ; too close to the next slow count. We'll try again next time we wake.
+	ld A, B
+	rlca
+	rlca
+	and 3 ; A = slow counts since the tick started
+	add C
+	ld B, A
+	ld A, TimerEnable | TimerFreq12
+	ld [TimerControl], A
+	ld [HL], B
+	jr .started
+
+.already_slow
+	; Move the end of the period we're in, if we now want it to end sooner or later.
+	; We can't have caught up past the new end, since it's at least 2 ticks away.
+	cp C
+	ret z
+	ld B, A
+	call _SchedIdleWaitForSafeCount
+	ret nz ; the period we were in just ended
+	ld A, [HL]
+	sub B ; A = slow counts since the tick started
+	add C
+	ld [HL], A
+
+.started
+	ld A, IDLE_TICK_START
+	ld [TimerModulo], A
+	ld A, C
+	ld [IdleTickStart], A
+	ret
+
+
+; While the timer is slow, wait until the next slow count isn't about to happen, so we have time
+; to change TimerCounter before it does. Sets nz if the timer overflowed while we waited.
+; Interrupts must be disabled. Clobbers A.
+_SchedIdleWaitForSafeCount:
+	; Slow counts happen when DivTimer goes from 3 to 0 in the bottom 2 bits
+	ld A, [DivTimer]
+	and 3
+	cp 3
+	jr z, _SchedIdleWaitForSafeCount
+	ld A, [InterruptFlags]
+	and IntEnableTimer
+	ret
+
+
+; While the timer is slow, add any whole ticks that have passed to Uptime, and update IdleTickStart
+; to match. If the timer has overflowed, we don't count the last tick, since TimerHandler does that.
+; This also works if TimerHandler has run already, since the timer is reset to IDLE_TICK_START,
+; which is where IdleTickStart ends up anyway.
+; Interrupts must be disabled. Clobbers A, B, H, L.
+_SchedIdleCatchUp:
+	ld HL, IdleTickStart
+	; We read TimerCounter before checking for an overflow, so that if it overflows in between,
+	; we ignore the value we read.
+	ld A, [TimerCounter]
+	ld B, A
+	ld A, [InterruptFlags]
+	and IntEnableTimer
+	jr z, .no_overflow
+	; The period is over. It was (256 - IdleTickStart) / 4 ticks long.
+	ld A, [HL]
+	cpl
+	inc A
+	rrca
+	rrca
+	dec A
+	ld [HL], IDLE_TICK_START
+	jr _SchedAddUptime ; tail call
+.no_overflow
+	ld A, B
+	sub [HL]
+	and $fc ; A = 4 * whole ticks since IdleTickStart
+	ret z
+	ld B, A
+	add [HL]
+	ld [HL], A
+	ld A, B
+	rrca
+	rrca
+	; fall through
+
+
+; Add A ticks to Uptime. Interrupts must be disabled. Clobbers A, H, L.
+_SchedAddUptime:
+	ld HL, Uptime
+	add [HL]
+	ld [HL+], A
+	ret nc
+	; Carry into the upper bytes, as TimerHandler does. Uptime is in HRAM, so we can inc L freely.
+	inc [HL]
+	ret nz
+	inc L
+	inc [HL]
+	ret nz
+	inc L
+	inc [HL]
+	ret
+
+
+; We're about to run a task. If the timer's been slowed down, switch it back to the fast rate.
+; Interrupts must be disabled. Clobbers A, D, E, H, L.
+SchedIdleEnd:
+	ld A, [IdleTickStart]
+	and A
+	ret z
+	push BC
+	; We wait for the next slow count, and we need to be sure that's what woke us.
+	ld A, [InterruptsEnabled]
+	ld E, A
+	ld A, IntEnableTimer
+	ld [InterruptsEnabled], A
+.retry
+	call _SchedIdleCatchUp
+	call _SchedIdleWaitForSafeCount
+	jr z, .safe
+	; Let TimerHandler count the tick that just ended, then try again
+	ei
+	nop
+	di
+	jr .retry
+.safe
+	ld HL, IdleTickStart
+	ld A, [TimerCounter]
+	sub [HL]
+	inc A
+	ld D, A ; D = slow counts since the tick started, as of the next one
+	; Make it overflow at the next slow count, and be set to the fast count it should be by then
+	and 3
+	rrca
+	rrca
+	add IDLE_RESUME_COUNTS
+	ld [TimerModulo], A
+	ld A, $ff
+	ld [TimerCounter], A
+	ld A, TimerEnable | TimerFreq18
+	halt
+	nop ; in case the count happened just before the halt, and the halt is skipped
+	ld [TimerControl], A
+	xor A
+	ld [TimerModulo], A
+	ld [HL], A ; IdleTickStart = 0, since we're back to normal
+
+	; Count any whole ticks up to now
+	ld A, D
+	rrca
+	rrca
+	and $3f
+	ld C, A
+	ld A, D
+	and 3
+	jr z, .on_tick
+	; We aren't at the end of a tick, so we don't want TimerHandler to run
+	ld HL, InterruptFlags
+	res 2, [HL]
+	jr .count
+.on_tick
+	dec C ; TimerHandler will count the last one
+.count
+	ld A, C
+	call _SchedAddUptime
+	ld A, E
+	ld [InterruptsEnabled], A
+	pop BC
+	ret
+
+
+
+; --- symbols used by tests (may be empty) ---
+EXPORT CheckDeferredWakes
+EXPORT SchedPopNext
+EXPORT TestDeferredWaiter
+EXPORT TestDeferredWaiter2
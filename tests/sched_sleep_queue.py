@@ -5,16 +5,26 @@ file = 'scheduler'
 
 target = 'SchedEnqueueSleepTask'
 
+TASK_SIZE = 8
+MAX_TASKS = 31
+SLEEP_WHEEL_SIZE = 64
 
-def sleep_queue(next_wake_time, items):
-	"""Generates a Memory representing a particular sleep queue.
-	Each item should be a tuple (task, time)"""
-	result = ''
-	last_time = next_wake_time
-	for task, time in items:
-		result += struct.pack('<BH', task, time - last_time)
-		last_time = time
-	result += '\xff' # terminator
+
+def wheel(*slots):
+	"""Generates a Memory representing the sleep wheel.
+	Each slot should be a tuple (slot, first task). Other slots are empty."""
+	result = [255] * SLEEP_WHEEL_SIZE
+	for slot, task in slots:
+		result[slot] = task
+	return Memory(result)
+
+
+def entries(*items):
+	"""Generates a Memory representing the sleep structs of the given tasks.
+	Each item should be a tuple (task, next task, wake time)."""
+	result = [None] * (MAX_TASKS * TASK_SIZE)
+	for task, next_task, time in items:
+		result[task:task+3] = [next_task] + list(bytearray(struct.pack('<H', time)))
 	return Memory(result)
 
 
@@ -23,46 +33,171 @@ def uptime(value):
 	return Memory(struct.pack('<I', value))
 
 
+def cursor(value):
+	return Memory(struct.pack('<H', value))
+
+
 init = Test('SchedInit',
-	out_NextWake = Memory(255),
-	out_SleepingTasks = sleep_queue(0, []),
+	in_SleepCount = Memory(3),
+	in_SleepWheel = wheel((0, 8), (63, 16)),
+	out_SleepCount = Memory(0),
+	out_SleepWheel = wheel(),
 )
 
 # in most cases, we're interested in whether the runlist has been added to,
 # so we default to an empty runlist
 RunList = Memory(0, 0)
+# Woken tasks get added to the run list for their priority. We give every task priority 0
+# so they all go in the first run list, which is the one at RunList.
+TaskList = Memory([0] * TASK_SIZE * MAX_TASKS)
 
 read_empty = Test('CheckNextWake',
-	in_NextWake = Memory(255),
-	out_NextWake = Memory(255),
+	in_SleepCount = Memory(0),
+	in_SleepWheel = wheel((0, 8)), # stale, and should be ignored
+	in_SleepEntries = entries((8, 255, 0x100)),
+	in_SleepCursor = cursor(0x100),
+	in_Uptime = uptime(0x100),
+	out_SleepCount = Memory(0),
 	out_RunList = Memory(0, 0),
 )
 
 read_not_ready = Test('CheckNextWake',
-	in_NextWake = Memory(10),
-	in_NextWakeTime = uptime(0x100),
+	in_SleepCount = Memory(1),
+	in_SleepWheel = wheel((5, 8)),
+	in_SleepEntries = entries((8, 255, 0x105)),
+	in_SleepCursor = cursor(0xf9),
 	in_Uptime = uptime(0xf8),
-	out_NextWake = Memory(10),
-	out_NextWakeTime = uptime(0x100),
+	out_SleepCount = Memory(1),
+	out_SleepWheel = wheel((5, 8)),
+	out_SleepCursor = cursor(0xf9),
 	out_RunList = Memory(0, 0),
 )
 
 read_one = Test('CheckNextWake',
-	in_NextWake = Memory(10),
-	in_NextWakeTime = uptime(0xff),
+	in_SleepCount = Memory(1),
+	in_SleepWheel = wheel((0, 8)),
+	in_SleepEntries = entries((8, 255, 0x100)),
+	in_SleepCursor = cursor(0x100),
+	in_Uptime = uptime(0x100),
+	out_SleepCount = Memory(0),
+	out_SleepWheel = wheel(),
+	out_SleepCursor = cursor(0x101),
+	out_RunList = Memory(1, 0, 8),
+)
+
+# A task in the right slot, but due on a later lap of the wheel
+read_later_lap = Test('CheckNextWake',
+	in_SleepCount = Memory(1),
+	in_SleepWheel = wheel((0, 8)),
+	in_SleepEntries = entries((8, 255, 0x140)),
+	in_SleepCursor = cursor(0x100),
+	in_Uptime = uptime(0x100),
+	out_SleepCount = Memory(1),
+	out_SleepWheel = wheel((0, 8)),
+	out_SleepCursor = cursor(0x101),
+	out_RunList = Memory(0, 0),
+)
+
+# The due task is in the middle of its slot's list
+read_same_slot = Test('CheckNextWake',
+	in_SleepCount = Memory(3),
+	in_SleepWheel = wheel((0, 8)),
+	in_SleepEntries = entries((8, 16, 0x140), (16, 24, 0x100), (24, 255, 0x1c0)),
+	in_SleepCursor = cursor(0x100),
 	in_Uptime = uptime(0x100),
-	in_SleepingTasks = sleep_queue(0xff, []),
-	out_NextWake = Memory(255),
-	out_RunList = Memory(1, 0, 10),
+	out_SleepCount = Memory(2),
+	out_SleepWheel = wheel((0, 8)),
+	out_SleepEntries = entries((8, 24, 0x140), (24, 255, 0x1c0)),
+	out_SleepCursor = cursor(0x101),
+	out_RunList = Memory(1, 0, 16),
+)
+
+# Several ticks have passed since we last checked
+read_catch_up = Test('CheckNextWake',
+	in_SleepCount = Memory(3),
+	in_SleepWheel = wheel((1, 8), (3, 16), (6, 24)),
+	in_SleepEntries = entries((8, 255, 0x101), (16, 255, 0x103), (24, 255, 0x106)),
+	in_SleepCursor = cursor(0x100),
+	in_Uptime = uptime(0x104),
+	out_SleepCount = Memory(1),
+	out_SleepWheel = wheel((6, 24)),
+	out_SleepCursor = cursor(0x105),
+	out_RunList = Memory(2, 0, 8, 16),
+)
+
+read_wraps = Test('CheckNextWake',
+	in_SleepCount = Memory(2),
+	in_SleepWheel = wheel((63, 8), (0, 16)),
+	in_SleepEntries = entries((8, 255, 0xffff), (16, 255, 0x0000)),
+	in_SleepCursor = cursor(0xfffe),
+	in_Uptime = uptime(0x10000),
+	out_SleepCount = Memory(0),
+	out_SleepWheel = wheel(),
+	out_SleepCursor = cursor(0x0001),
+	out_RunList = Memory(2, 0, 8, 16),
+)
+
+enqueue_first = Test(
+	in_B = 8,
+	in_DE = 0x10,
+	in_SleepCount = Memory(0),
+	in_SleepWheel = wheel(),
+	in_SleepCursor = cursor(0x50), # stale
+	in_Uptime = uptime(0x1234),
+	out_SleepCount = Memory(1),
+	out_SleepWheel = wheel((0x04, 8)),
+	out_SleepEntries = entries((8, 255, 0x1244)),
+	out_SleepCursor = cursor(0x1235),
+	out_RunList = Memory(0, 0),
+)
+
+enqueue_same_slot = Test(
+	in_B = 8,
+	in_DE = 0x40,
+	in_SleepCount = Memory(1),
+	in_SleepWheel = wheel((0x04, 16)),
+	in_SleepEntries = entries((16, 255, 0x1244)),
+	in_SleepCursor = cursor(0x1205),
+	in_Uptime = uptime(0x1204),
+	out_SleepCount = Memory(2),
+	out_SleepWheel = wheel((0x04, 8)),
+	out_SleepEntries = entries((8, 16, 0x1244), (16, 255, 0x1244)),
+	out_SleepCursor = cursor(0x1205),
+	out_RunList = Memory(0, 0),
+)
+
+# Catching up wakes a task, then we go to sleep
+enqueue_catches_up = Test(
+	in_B = 8,
+	in_DE = 1,
+	in_SleepCount = Memory(1),
+	in_SleepWheel = wheel((0x02, 16)),
+	in_SleepEntries = entries((16, 255, 0x1202)),
+	in_SleepCursor = cursor(0x1201),
+	in_Uptime = uptime(0x1203),
+	out_SleepCount = Memory(1),
+	out_SleepWheel = wheel((0x04, 8)),
+	out_SleepEntries = entries((8, 255, 0x1204)),
+	out_SleepCursor = cursor(0x1204),
+	out_RunList = Memory(1, 0, 16),
+)
+
+enqueue_max = Test(
+	in_B = 8,
+	in_DE = 0xffff,
+	in_SleepCount = Memory(0),
+	in_SleepWheel = wheel(),
+	in_Uptime = uptime(0x1fff0),
+	out_SleepCount = Memory(1),
+	out_SleepWheel = wheel((0x2f, 8)),
+	out_SleepEntries = entries((8, 255, 0xffef)),
+	out_SleepCursor = cursor(0xfff1),
 )
 
-read_many = Test('CheckNextWake',
-	in_NextWake = Memory(10),
-	in_NextWakeTime = uptime(0xf0),
-	in_Uptime = uptime(0x101),
-	in_SleepingTasks = sleep_queue(0xf0, [(20, 0xf8), (4, 0xffff)]),
-	out_NextWake = Memory(20),
-	out_RunList = Memory(1, 0, 10),
-	out_NextWakeTime = uptime(0xf8),
-	out_SleepingTasks = sleep_queue(0xf8, [(4, 0xffff)]),
+enqueue_zero = Test(
+	in_B = 8,
+	in_DE = 0,
+	in_SleepCount = Memory(0),
+	out_SleepCount = Memory(0),
+	out_RunList = Memory(1, 0, 8),
 )
@@ -0,0 +1,250 @@
+
+file = 'serial'
+
+SERIAL_QUEUE_SIZE = 63
+NONE = 0xff
+IDLE = 0xfe
+ESCAPE = 0xfd
+
+# Reading SerialControl gives 1s for unused bits
+CONTROL_READY = 0xfe
+CONTROL_STARTED = 0xff
+CONTROL_DONE = 0x7e
+
+
+def state(active=0, busy=0, stalled=0, outgoing=IDLE, retries=0):
+	"""Memory for SerialActive and the vars that follow it"""
+	return Memory(active, busy, stalled, outgoing, retries)
+
+def ring(head, tail, *data):
+	return Memory(head, tail, Memory(*data).contents)
+
+
+# TimerPeriodic bits
+TIMER_PERIODIC_JOY = 1
+TIMER_PERIODIC_SERIAL = 2
+
+
+init = Test('SerialInit',
+	in_InterruptsEnabled = Memory(1),
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_JOY | TIMER_PERIODIC_SERIAL),
+	out_SerialTxQueue = ring(0, 0),
+	out_SerialRxQueue = ring(0, 0),
+	out_SerialTxWaiter = Memory(0, 0, 255, 0, 0),
+	out_SerialRxWaiter = Memory(0, 0, 255, 0, 0),
+	out_SerialActive = state(),
+	out_SerialData = Memory(IDLE),
+	out_SerialControl = Memory(CONTROL_READY),
+	out_InterruptsEnabled = Memory(9), # serial int enabled
+	out_TimerPeriodic = Memory(TIMER_PERIODIC_JOY), # the passive side doesn't poll
+)
+
+passive_receive = Test('SerialInt',
+	in_SerialData = Memory(0x42),
+	in_SerialControl = Memory(0),
+	in_SerialTxQueue = ring(1, 0, 0x55),
+	out_SerialRxQueue = ring(1, 0, 0x42),
+	out_SerialTxQueue = ring(1, 1),
+	out_SerialData = Memory(0x55),
+	out_SerialControl = Memory(CONTROL_READY),
+)
+
+passive_idle = Test('SerialInt',
+	in_SerialData = Memory(IDLE),
+	in_SerialControl = Memory(0),
+	out_SerialRxQueue = ring(0, 0),
+	out_SerialTxQueue = ring(0, 0),
+	out_SerialData = Memory(IDLE),
+	out_SerialControl = Memory(CONTROL_READY),
+)
+
+# The byte we receive fills the rx queue, so we don't get ready for another
+passive_stall = Test('SerialInt',
+	in_SerialActive = state(),
+	in_SerialData = Memory(0x42),
+	in_SerialControl = Memory(0),
+	in_SerialRxQueue = ring(61, 63),
+	in_SerialTxQueue = ring(1, 0, 0x55),
+	out_SerialRxQueue = ring(62, 63, [None] * 61, 0x42),
+	out_SerialTxQueue = ring(1, 0), # we haven't taken the next byte
+	out_SerialData = Memory(IDLE),
+	out_SerialControl = Memory(CONTROL_DONE),
+	out_SerialActive = state(stalled=1),
+)
+
+active_moved = Test('SerialInt',
+	in_SerialActive = state(active=1, busy=1, outgoing=0x33),
+	in_SerialData = Memory(0x42),
+	in_SerialTxQueue = ring(1, 0, 0x55),
+	out_SerialRxQueue = ring(1, 0, 0x42),
+	out_SerialTxQueue = ring(1, 1),
+	out_SerialActive = state(active=1, busy=1, outgoing=0x55),
+	out_SerialData = Memory(0x55),
+	out_SerialControl = Memory(CONTROL_STARTED),
+)
+
+# We only received, but keep going in case there's more
+active_received = Test('SerialInt',
+	in_SerialActive = state(active=1, busy=1),
+	in_SerialData = Memory(0x42),
+	out_SerialRxQueue = ring(1, 0, 0x42),
+	out_SerialActive = state(active=1, busy=1),
+	out_SerialData = Memory(IDLE),
+	out_SerialControl = Memory(CONTROL_STARTED),
+)
+
+# Nothing moved either way, so we wait for the next poll
+active_idle = Test('SerialInt',
+	in_SerialActive = state(active=1, busy=1, retries=3),
+	in_SerialData = Memory(IDLE),
+	out_SerialRxQueue = ring(0, 0),
+	out_SerialActive = state(active=1),
+)
+
+active_not_ready = Test('SerialInt',
+	in_SerialActive = state(active=1, busy=1, outgoing=0x33, retries=2),
+	in_SerialData = Memory(NONE),
+	in_SerialTxQueue = ring(1, 0, 0x55),
+	out_SerialRxQueue = ring(0, 0),
+	out_SerialTxQueue = ring(1, 0), # still sending 0x33
+	out_SerialActive = state(active=1, busy=1, outgoing=0x33, retries=3),
+	out_SerialData = Memory(0x33),
+	out_SerialControl = Memory(CONTROL_STARTED),
+)
+
+active_give_up = Test('SerialInt',
+	in_SerialActive = state(active=1, busy=1, outgoing=0x33, retries=7),
+	in_SerialData = Memory(NONE),
+	out_SerialActive = state(active=1, outgoing=0x33),
+)
+
+poll_starts = Test('SerialPoll',
+	in_SerialActive = state(active=1),
+	in_SerialTxQueue = ring(1, 0, 0x55),
+	out_SerialActive = state(active=1, busy=1, outgoing=0x55),
+	out_SerialData = Memory(0x55),
+	out_SerialControl = Memory(CONTROL_STARTED),
+)
+
+poll_busy = Test('SerialPoll',
+	in_SerialActive = state(active=1, busy=1, outgoing=0x33),
+	in_SerialControl = Memory(0x81),
+	in_SerialTxQueue = ring(1, 0, 0x55),
+	out_SerialActive = state(active=1, busy=1, outgoing=0x33),
+	out_SerialTxQueue = ring(1, 0),
+)
+
+# The transfer's done, but its interrupt was lost, so we raise it again
+poll_lost_int = Test('SerialPoll',
+	in_SerialActive = state(active=1, busy=1, outgoing=0x33),
+	in_SerialData = Memory(0x42),
+	in_SerialControl = Memory(0x01),
+	in_InterruptFlags = Memory(4),
+	out_SerialActive = state(active=1, busy=1, outgoing=0x33),
+	out_SerialData = Memory(0x42),
+	out_InterruptFlags = Memory(0xec),
+)
+
+# The transfer's done and its interrupt is already pending
+poll_int_pending = Test('SerialPoll',
+	in_SerialActive = state(active=1, busy=1, outgoing=0x33),
+	in_SerialData = Memory(0x42),
+	in_SerialControl = Memory(0x01),
+	in_InterruptFlags = Memory(8),
+	out_SerialActive = state(active=1, busy=1, outgoing=0x33),
+	out_InterruptFlags = Memory(0xe8),
+)
+
+set_active = Test('SerialSetActive',
+	in_SerialData = Memory(0x55), # already loaded as the passive side
+	in_SerialControl = Memory(0x80),
+	in_SerialTxQueue = ring(1, 0, 0x66),
+	in_TimerPeriodic = Memory(TIMER_PERIODIC_JOY),
+	out_SerialActive = state(active=1, busy=1, outgoing=0x55),
+	out_TimerPeriodic = Memory(TIMER_PERIODIC_JOY | TIMER_PERIODIC_SERIAL), # so TimerHandler polls
+	out_SerialTxQueue = ring(1, 0),
+	out_SerialData = Memory(0x55),
+	out_SerialControl = Memory(CONTROL_STARTED),
+)
+
+send = Test('_SerialTrySend',
+	in_B = 0x42,
+	in_SerialTxQueue = ring(3, 1),
+	out_cflag = 1,
+	out_SerialTxQueue = ring(4, 1, None, None, None, 0x42),
+)
+
+send_escaped = Test('_SerialTrySend',
+	in_B = 0xfe,
+	in_SerialTxQueue = ring(0, 0),
+	out_cflag = 1,
+	out_SerialTxQueue = ring(2, 0, ESCAPE, 0x01),
+)
+
+send_full = Test('_SerialTrySend',
+	in_B = 0x42,
+	in_SerialTxQueue = ring(5, 6),
+	out_cflag = 0,
+	out_SerialTxQueue = ring(5, 6),
+)
+
+# There's room for one byte, but not an escaped one
+send_escaped_full = Test('_SerialTrySend',
+	in_B = 0xff,
+	in_SerialTxQueue = ring(4, 6),
+	out_cflag = 0,
+	out_SerialTxQueue = ring(4, 6),
+)
+
+# As the active side with nothing going on, sending starts a transfer
+send_starts_transfer = Test('_SerialTrySend',
+	in_B = 0x42,
+	in_SerialActive = state(active=1),
+	out_cflag = 1,
+	out_SerialTxQueue = ring(1, 1, 0x42),
+	out_SerialActive = state(active=1, busy=1, outgoing=0x42),
+	out_SerialData = Memory(0x42),
+	out_SerialControl = Memory(CONTROL_STARTED),
+)
+
+recv = Test('_SerialTryRecv',
+	in_SerialRxQueue = ring(1, 0, 0x42),
+	out_cflag = 1,
+	out_B = 0x42,
+	out_SerialRxQueue = ring(1, 1),
+)
+
+recv_empty = Test('_SerialTryRecv',
+	in_SerialRxQueue = ring(7, 7),
+	out_cflag = 0,
+	out_SerialRxQueue = ring(7, 7),
+)
+
+recv_escaped = Test('_SerialTryRecv',
+	in_SerialRxQueue = ring(0, 62, [0x00] * 62, ESCAPE, 0x02), # wraps around
+	out_cflag = 1,
+	out_B = 0xfd,
+	out_SerialRxQueue = ring(0, 0),
+)
+
+# We can't tell what the value is until the byte after the escape arrives
+recv_escape_only = Test('_SerialTryRecv',
+	in_SerialRxQueue = ring(1, 0, ESCAPE),
+	out_cflag = 0,
+	out_SerialRxQueue = ring(1, 0),
+)
+
+# We stalled as the passive side because the rx queue was full. Now there's room, get ready again.
+recv_resumes = Test('_SerialTryRecv',
+	in_SerialActive = state(stalled=1),
+	in_SerialRxQueue = ring(1, 0, 0x42),
+	in_SerialTxQueue = ring(1, 0, 0x55),
+	in_SerialControl = Memory(0),
+	out_cflag = 1,
+	out_B = 0x42,
+	out_SerialRxQueue = ring(1, 1),
+	out_SerialTxQueue = ring(1, 1),
+	out_SerialActive = state(),
+	out_SerialData = Memory(0x55),
+	out_SerialControl = Memory(CONTROL_READY),
+)
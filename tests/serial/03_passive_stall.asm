@@ -0,0 +1,246 @@
+
+; --- GENERATED BY tools/unit_test_gen.py ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+
+include "hram.asm"
+include "ioregs.asm"
+include "ring.asm"
+include "longcalc.asm"
+include "waiter.asm"
+SERIAL_QUEUE_SIZE EQU 63
+SERIAL_NONE EQU $ff ; what the active side reads if the passive side wasn't ready, or there's no cable
+SERIAL_IDLE EQU $fe ; sent when we have nothing to send
+SERIAL_ESCAPE EQU $fd ; the next byte is a data byte >= SERIAL_ESCAPE with its bits flipped
+SERIAL_MAX_RETRIES EQU 8
+SERIAL_START EQU $81 ; start a transfer with our clock
+SERIAL_READY EQU $80 ; wait for a transfer with the other side's clock
+
+
+; --- test harness ---
+SECTION "tools/unit_test_gen.py test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "tools/unit_test_gen.py header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "tools/unit_test_gen.py test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp _TestFailure
+.nofail\@
+ENDM
+
+_TestStart::
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	ld SP, _TestStack
+	; set up test
+	ld HL, SerialTxQueue
+	ld DE, .inMem0
+	call _TestLoadMem
+	ld HL, SerialActive
+	ld DE, .inMem1
+	call _TestLoadMem
+	ld HL, SerialRxQueue
+	ld DE, .inMem2
+	call _TestLoadMem
+	ld HL, SerialControl
+	ld DE, .inMem3
+	call _TestLoadMem
+	ld HL, SerialData
+	ld DE, .inMem4
+	call _TestLoadMem
+	; run test
+	call SerialInt
+	; check results
+	ld HL, SerialTxQueue
+	ld DE, .outMem0
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr SerialTxQueue+%DE% expected %B% but got %A%"
+	ld HL, SerialActive
+	ld DE, .outMem1
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr SerialActive+%DE% expected %B% but got %A%"
+	ld HL, SerialRxQueue
+	ld DE, .outMem2
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr SerialRxQueue+%DE% expected %B% but got %A%"
+	ld HL, SerialData
+	ld DE, .outMem3
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr SerialData+%DE% expected %B% but got %A%"
+	ld HL, SerialControl
+	ld DE, .outMem4
+	call _TestCheckMem
+	_TestFailIfNot nc, "Addr SerialControl+%DE% expected %B% but got %A%"
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.inMem0
+	db 0, 3
+	db 1, 0, 85
+	db 0, 0
+.inMem1
+	db 0, 5
+	db 0, 0, 0, 254, 0
+	db 0, 0
+.inMem2
+	db 0, 2
+	db 61, 63
+	db 0, 0
+.inMem3
+	db 0, 1
+	db 0
+	db 0, 0
+.inMem4
+	db 0, 1
+	db 66
+	db 0, 0
+.outMem0
+	db 0, 2
+	db 1, 0
+	db 0, 0
+.outMem1
+	db 0, 5
+	db 0, 0, 1, 254, 0
+	db 0, 0
+.outMem2
+	db 0, 2
+	db 62, 63
+	db 61, 1
+	db 66
+	db 0, 0
+.outMem3
+	db 0, 1
+	db 254
+	db 0, 0
+.outMem4
+	db 0, 1
+	db 126
+	db 0, 0
@@ -70,23 +70,27 @@ TestWaiter = 0xc123
 TestISW = 0xc223
 TestWRAMXWaiter = 0xd000
 TestWRAMXBank = 1
-TASK_SIZE = 6
+OtherWaiter = 0xc300
+TASK_SIZE = 8
 MAX_TASKS = 31
 TASK_IDS = range(0, (MAX_TASKS + 1) * TASK_SIZE, TASK_SIZE)
 
 def testpair(target, **kwargs):
 	return Test(target, **kwargs), Test(target + "HL", **kwargs)
 
-def task(stack, rambank, waiter):
-	return [stack >> 8, stack & 0xff, 0, rambank, waiter >> 8, waiter & 0xff]
+def task(stack, rambank, waiter, next_task=None):
+	# priority 0 uses the first run list
+	return [stack >> 8, stack & 0xff, 0, rambank, waiter >> 8, waiter & 0xff, next_task, 0]
 
-def tasks(*waiters):
+def tasks(waiters, chain=()):
 	"""creates tasklist of tasks with given waiter value,
 	either (bank, addr), None for no waiter, or (None, bank, addr) for no task in that slot,
 	but set it as though bank and addr had been in that slot before it was wiped.
+	chain is a list of indexes of tasks that form a wait list, in order. Their wait_next fields
+	are set to point along the list, and the last to ff. Other tasks' wait_next fields aren't set.
 	"""
 	result = []
-	for w in waiters:
+	for i, w in enumerate(waiters):
 		if w is None:
 			w = (None, 0xffff)
 		if len(w) == 3:
@@ -95,7 +99,11 @@ def tasks(*waiters):
 		else:
 			stack = 0xd000
 			bank, addr = w
-		result += task(stack, bank, addr)
+		next_task = None
+		if i in chain:
+			position = chain.index(i)
+			next_task = TASK_IDS[chain[position + 1]] if position + 1 < len(chain) else 255
+		result += task(stack, bank, addr, next_task)
 	return Memory(result)
 
 def runlist(*task_ids):
@@ -106,27 +114,27 @@ init, initHL = testpair('TestWaiterInit',
 )
 
 initISW = Test('TestIntSafeWaiterInit',
-	out_TestISW = Memory(0, 0, 255),
+	out_TestISW = Memory(0, 0, 255, 0, 0),
 )
 
 wait_to_one = Test('WaiterWait',
 	in_HL = 'TestWaiter',
 	in_TestWaiter = Memory(0, 0xff),
 	in_CurrentTask = Memory(TASK_IDS[1]),
-	in_TaskList = tasks(None, (6, 0xffff)), # note different WRAMX bank is loaded,
-	                                        # to check we don't look at it
+	in_TaskList = tasks([None, (6, 0xffff)]), # note different WRAMX bank is loaded,
+	                                          # to check we don't look at it
 	in_CurrentRAMBank = Memory(7), # to check that we don't look at it
 	out_TestWaiter = Memory(1, TASK_IDS[1]),
-	out_TaskList = tasks(None, (6, TestWaiter)),
+	out_TaskList = tasks([None, (6, TestWaiter)], chain=[1]),
 )
 
 wait_to_two = Test('WaiterWait',
 	in_HL = 'TestWaiter',
-	in_TestWaiter = Memory(1, 0),
-	in_CurrentTask = Memory(6),
-	in_TaskList = tasks((0, TestWaiter), None),
-	out_TestWaiter = Memory(2, 0),
-	out_TaskList = tasks((0, TestWaiter), (0, TestWaiter)),
+	in_TestWaiter = Memory(1, TASK_IDS[0]),
+	in_CurrentTask = Memory(TASK_IDS[1]),
+	in_TaskList = tasks([(0, TestWaiter), None], chain=[0]),
+	out_TestWaiter = Memory(2, TASK_IDS[1]),
+	out_TaskList = tasks([(0, TestWaiter), (0, TestWaiter)], chain=[1, 0]),
 )
 
 # basic tests to cover HL and immediate versions
@@ -140,48 +148,137 @@ wake_none, wake_none_HL = testpair('TestWaiterWake',
 wake_one, wake_one_HL = testpair('TestWaiterWake',
 	in_TestWaiter = Memory(1, TASK_IDS[0]),
 	in_RunList = runlist(),
-	in_TaskList = tasks((0, TestWaiter)),
+	in_TaskList = tasks([(0, TestWaiter)], chain=[0]),
 	out_TestWaiter = Memory(0, 255),
 	out_RunList = runlist(TASK_IDS[0]),
-	out_TaskList = tasks(None),
+	out_TaskList = tasks([None]),
 )
 
-def wake_test(count, min_id, tasks_in, tasks_out, runlist_out):
-	return Test('TestWaiterWake',
-		in_TestWaiter = Memory(count, min_id),
+def wake_test(count, chain, tasks_in, tasks_out, runlist_out, waiter='TestWaiter', **kwargs):
+	"""Wake a waiter with the given count, whose wait list is the task indexes in chain"""
+	kwargs['in_' + waiter] = Memory(count, TASK_IDS[chain[0]])
+	kwargs['out_' + waiter] = Memory(0, 255)
+	return Test(waiter + 'Wake',
 		in_RunList = runlist(),
-		in_TaskList = tasks(*tasks_in),
-		out_TestWaiter = Memory(0, 255),
+		in_TaskList = tasks(tasks_in, chain),
 		out_RunList = runlist(*runlist_out),
-		out_TaskList = tasks(*tasks_out),
+		out_TaskList = tasks(tasks_out),
+		**kwargs
 	)
 
 wake_not_first = wake_test(
-	1, TASK_IDS[2],
+	1, [2],
 	[None, None, (0, TestWaiter)],
 	[None, None, None],
 	[TASK_IDS[2]],
 )
 
 wake_many = wake_test(
-	3, TASK_IDS[0],
+	3, [0, 1, 3],
 	[(0, TestWaiter), (0, TestWaiter), None, (0, TestWaiter)],
 	[None] * 4,
 	[TASK_IDS[0], TASK_IDS[1], TASK_IDS[3]],
 )
 
+# Tasks are woken in list order, which is the reverse of the order they waited in
+wake_list_order = wake_test(
+	3, [3, 0, 1],
+	[(0, TestWaiter), (0, TestWaiter), None, (0, TestWaiter)],
+	[None] * 4,
+	[TASK_IDS[3], TASK_IDS[0], TASK_IDS[1]],
+)
+
+# A task died while waiting. We can't trust its place in the list, so we find the rest by scanning.
 wake_with_dead_entries = wake_test(
-	2, TASK_IDS[1],
+	2, [1, 2],
 	[None, (None, 0, TestWaiter), (0, TestWaiter)] + [None]*(MAX_TASKS-3),
 	[None, (None, 0, TestWaiter)] + [None]*(MAX_TASKS-2),
 	[TASK_IDS[2]],
 )
 
+# A task died while waiting and its slot was reused by a task waiting on another waiter,
+# whose wait list continues on to another task waiting on that waiter. We mustn't wake either of them.
+wake_with_reused_entry = Test('TestWaiterWake',
+	in_TestWaiter = Memory(3, TASK_IDS[0]),
+	in_RunList = runlist(),
+	in_TaskList = Memory(
+		task(0xd000, 0, TestWaiter, TASK_IDS[1]),
+		task(0xd000, 0, OtherWaiter, TASK_IDS[2]),
+		task(0xd000, 0, OtherWaiter, 255),
+		task(0xd000, 0, TestWaiter, 255), # also waiting on us, but we can only find it by scanning
+		tasks([None] * (MAX_TASKS - 4)).contents,
+	),
+	out_TestWaiter = Memory(0, 255),
+	out_RunList = runlist(TASK_IDS[0], TASK_IDS[3]),
+	out_TaskList = tasks([None, (0, OtherWaiter), (0, OtherWaiter), None]),
+)
+
 wake_wramx = wake_test(
-	2, TASK_IDS[0],
-	[(TestWRAMXBank, TestWRAMXWaiter), (TestWRAMXBank+1, TestWRAMXWaiter)],
-	[None, (TestWRAMXBank+1, TestWRAMXWaiter)],
+	2, [0, 1],
+	[(TestWRAMXBank, TestWRAMXWaiter), (TestWRAMXBank+1, TestWRAMXWaiter)] + [None]*(MAX_TASKS-2),
+	[None, (TestWRAMXBank+1, TestWRAMXWaiter)] + [None]*(MAX_TASKS-2),
 	[TASK_IDS[0]],
+	waiter = 'TestWRAMXWaiter',
+	in_CurrentRAMBank = Memory(TestWRAMXBank),
+)
+
+isw_wake_none = Test('TestIntSafeWaiterWake',
+	in_TestISW = Memory(0, 0, 255, 0, 0),
+	in_RunList = runlist(),
+	in_DeferredWakes = Memory(0xff, 0xff),
+	out_TestISW = Memory(0, 0, 255, 0, 0),
+	out_RunList = runlist(),
+	out_DeferredWakes = Memory(0xff, 0xff),
 )
 
-# TODO test ISW wait and wake cases
+# A task is part way through waiting, so we leave it to that task to wake the waiter
+isw_wake_during_wait = Test('TestIntSafeWaiterWake',
+	in_TestISW = Memory(1, 0, 255),
+	out_TestISW = Memory(2, 0, 255),
+)
+
+# Even with switching enabled, the scheduler does the wake later, so the interrupt handler stays short
+isw_wake_one = Test('TestIntSafeWaiterWake',
+	in_Switchable = Memory(0),
+	in_TestISW = Memory(0, 1, TASK_IDS[0], 0, 0),
+	in_RunList = runlist(),
+	in_DeferredWakes = Memory(0xff, 0xff),
+	in_SwitchTimer = Memory(10),
+	out_TestISW = Memory(0, 1, TASK_IDS[0], 0xff, 0xff), # it's the only one on the list
+	out_RunList = runlist(),
+	out_DeferredWakes = Memory(TestISW & 0xff, TestISW >> 8),
+	out_SwitchTimer = Memory(1), # switch at the next tick, so the scheduler gets to it soon
+)
+
+isw_wake_deferred = Test('TestIntSafeWaiterWake',
+	in_Switchable = Memory(1),
+	in_TestISW = Memory(0, 1, TASK_IDS[0], 0, 0),
+	in_RunList = runlist(),
+	in_DeferredWakes = Memory(0x00, 0xc3), # some other waiter
+	in_SwitchTimer = Memory(10),
+	out_TestISW = Memory(0, 1, TASK_IDS[0], 0x00, 0xc3), # goes ahead of the other waiter
+	out_RunList = runlist(),
+	out_DeferredWakes = Memory(TestISW & 0xff, TestISW >> 8),
+	out_SwitchTimer = Memory(1),
+)
+
+# The scheduler has already been asked to wake it, so we don't add it again
+isw_wake_deferred_again = Test('TestIntSafeWaiterWake',
+	in_Switchable = Memory(2),
+	in_TestISW = Memory(0, 1, TASK_IDS[0], 0xff, 0xff),
+	in_DeferredWakes = Memory(0x00, 0xc3),
+	out_TestISW = Memory(0, 1, TASK_IDS[0], 0xff, 0xff),
+	out_DeferredWakes = Memory(0x00, 0xc3),
+)
+
+# The check passes (A < B), so we don't wait, and A and carry from the check are kept
+isw_check_no_wait = Test('TestIntSafeWaiterCheckOrWait',
+	in_Switchable = Memory(0),
+	in_TestISW = Memory(0, 0, 255),
+	in_A = 1,
+	in_B = 2,
+	out_A = 1,
+	out_cflag = 1,
+	out_TestISW = Memory(0, 0, 255),
+	out_Switchable = Memory(0),
+)
@@ -0,0 +1,100 @@
+"""Benchmarks assets_to_asm's tile extraction against the original pixel-by-pixel implementation,
+and checks they give the same output.
+
+Takes the same json files as assets_to_asm. eg. python tools/assets_benchmark.py assets/font.json
+"""
+
+import json
+import os
+import time
+
+import argh
+from PIL import Image
+
+import assets_to_asm
+
+
+def reference_image_to_tiles(image, pallette, length=None):
+	"""The original implementation of image_to_tiles, which looks up each pixel individually"""
+	width, height = image.size
+
+	if len(pallette) != 4:
+		raise ValueError("pallette must be exactly 4 items")
+	pallette = {value: index for index, value in enumerate(pallette)}
+
+	tiles = []
+	for row in range(height / 8):
+		for col in range(width / 8):
+			tiles.append(reference_extract_tile(image, row, col, pallette))
+			if length is not None and len(tiles) == length:
+				return tiles
+
+	return tiles
+
+
+def reference_extract_tile(image, row, col, pallette):
+	tile = []
+	for y in range(row * 8, (row + 1) * 8):
+		line = []
+		for x in range(col * 8, (col + 1) * 8):
+			pixel = image.getpixel((x, y))
+			if pixel not in pallette:
+				raise Exception("Pixel ({}, {}) = {} is not a value in the pallette".format(x, y, pixel))
+			value = pallette[pixel]
+			line.append(value)
+		tile.append(line)
+	return tile
+
+
+def reference_tile_to_2bpp(tile):
+	"""Pack a tile the way rgbasm does for the original "dw `01230123" output"""
+	data = ''
+	for line in tile:
+		low = high = 0
+		for value in line:
+			low = (low << 1) | (value & 1)
+			high = (high << 1) | (value >> 1)
+		data += chr(low) + chr(high)
+	return data
+
+
+def timed(repeat, fn, *args):
+	"""Returns (result, best time in seconds) of running fn(*args) repeat times"""
+	best = None
+	for _ in range(repeat):
+		start = time.time()
+		result = fn(*args)
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return result, best
+
+
+@argh.arg('filepaths', nargs='+', help="Asset json files to benchmark")
+def main(filepaths, repeat=10):
+	for filepath in filepaths:
+		with open(filepath) as f:
+			meta = json.load(f)
+		imagepath = meta['image']
+		if not os.path.isabs(imagepath):
+			imagepath = os.path.join(os.path.dirname(filepath), imagepath)
+		image = Image.open(imagepath)
+		image.load() # so we don't count loading time against the first run
+
+		# the reference can't handle multi-band pallette values given as (unhashable) lists
+		reference_pallette = [tuple(value) if isinstance(value, list) else value for value in meta['pallette']]
+		old_tiles, old_time = timed(repeat, reference_image_to_tiles, image, reference_pallette, meta.get('length'))
+		new_tiles, new_time = timed(repeat, assets_to_asm.image_to_tiles, image, meta['pallette'], meta.get('length'))
+
+		old_data = ''.join(reference_tile_to_2bpp(tile) for tile in old_tiles)
+		new_data = assets_to_asm.tiles_to_2bpp(new_tiles)
+		if old_data != new_data:
+			raise Exception("Output for {} does not match the reference implementation".format(filepath))
+
+		print "{}: {}x{} {}, {} tiles: per-pixel {:.2f}ms, whole-image {:.2f}ms ({:.1f}x faster)".format(
+			filepath, image.size[0], image.size[1], image.mode, len(new_tiles),
+			old_time * 1000, new_time * 1000, old_time / new_time if new_time else float('inf'),
+		)
+
+
+if __name__ == '__main__':
+	argh.dispatch_command(main)
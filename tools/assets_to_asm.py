@@ -7,19 +7,38 @@ It scans for *.json files that contain the keys:
 	            eg. a 3-item list [R, G, B] for color images, a simple integer for greyscale.
 	"length": Optional. Number of tiles in the image. If not given, is worked out from image size.
 	"name": Optional. The name of the include file to produce. Defaults to the json file's name (not including .json suffix).
+	"dedupe": Optional. If true, identical tiles are only stored once. See below.
+	"compress": Optional. If "rle", tile data is compressed for decompression with Decompress (see tools/rle.py).
 
 Images are scanned for tiles left-to-right, then top-to-bottom. eg. in a 32x16 image, the tiles would be numbered:
 	1234
 	5678
 
-For each json file / image file, it produces an asm file in the output directory that defines the data.
+For each json file / image file, it produces in the output directory a NAME.2bpp file containing the tile data
+in the native 2 bits-per-pixel format, and a NAME.asm file that INCBINs it and defines:
+	NAME_TILE_COUNT: The number of tiles
+	NAME_TILE_DATA_SIZE: The size of the tile data in bytes
+where NAME is the name in upper case.
+If the data is compressed, the .2bpp file is replaced by a compressed NAME.rle file and the stub also defines:
+	NAME_COMPRESSED: The compression type, eg. "rle"
+	NAME_COMPRESSED_SIZE: The size of the compressed data in bytes
+If tiles are deduplicated, NAME_TILE_COUNT is the number of unique tiles and the stub also defines
+a label NameTileMap after the tile data, which is followed by one byte per tile in the original image
+giving that tile's index in the tile data, and:
+	NAME_TILE_MAP_SIZE: The number of tiles in the original image
+A summary of ROM space saved by these options is printed for each asset.
+
+Outputs are only regenerated when they're older than the json file, the image or this tool, unless --force is given.
 """
 
 import json
 import os
+import re
 import sys
 import traceback
 
+import rle
+
 try:
 	from PIL import Image
 except ImportError:
@@ -28,20 +47,20 @@ except ImportError:
 	raise
 
 
-def main(targetdir, outdir):
+def main(targetdir, outdir, force=False):
 	for path, dirs, files in os.walk(targetdir):
 		for filename in files:
 			if not filename.endswith('.json'):
 				continue
 			filepath = os.path.join(path, filename)
 			try:
-				process_file(targetdir, filepath, outdir)
+				process_file(targetdir, filepath, outdir, force)
 			except Exception:
 				sys.stderr.write("An error occurred while processing file {!r}:".format(filepath))
 				traceback.print_exc()
 
 
-def process_file(targetdir, filepath, outdir):
+def process_file(targetdir, filepath, outdir, force=False):
 	filepath_dir = os.path.dirname(filepath)
 
 	with open(filepath) as f:
@@ -52,61 +71,223 @@ def process_file(targetdir, filepath, outdir):
 		imagepath = os.path.join(filepath_dir, imagepath)
 
 	name = meta.get('name', os.path.basename(filepath)[:-len('.json')])
-	image = Image.open(imagepath)
-
-	tiles = image_to_tiles(image, meta['pallette'], meta.get('length'))
-	text = tiles_to_text(filepath, tiles)
 
-	outpath_dir = os.path.join(outdir, os.path.relpath(filepath_dir, targetdir))
+	outpath_dir = os.path.normpath(os.path.join(outdir, os.path.relpath(filepath_dir, targetdir)))
 	outpath = os.path.join(outpath_dir, '{}.asm'.format(name))
+	compress = meta.get('compress')
+	if compress not in (None, 'rle'):
+		raise ValueError("Unknown compression type: {!r}".format(compress))
+	binpath = os.path.join(outpath_dir, '{}.{}'.format(name, compress or '2bpp'))
+	mappath = os.path.join(outpath_dir, '{}.map'.format(name)) if meta.get('dedupe') else None
+
+	outputs = [outpath, binpath] + ([mappath] if mappath else [])
+	if not force and is_up_to_date(outputs, [filepath, imagepath, __file__, rle.__file__]):
+		return
+
+	image = Image.open(imagepath)
+	tiles = image_to_tiles(image, meta['pallette'], meta.get('length'))
+	tile_map = None
+	if mappath:
+		tiles, tile_map = dedupe_tiles(tiles)
+	data = tiles_to_2bpp(tiles)
+	rom_data = rle.compress(data) if compress else data
+	text = gen_stub(filepath, name, binpath, len(tiles), len(data), compress, len(rom_data), mappath, tile_map)
 
 	if not os.path.isdir(outpath_dir):
 		os.makedirs(outpath_dir)
+	with open(binpath, 'wb') as f:
+		f.write(rom_data)
+	if mappath:
+		with open(mappath, 'wb') as f:
+			f.write(''.join(map(chr, tile_map)))
 	with open(outpath, 'w') as f:
 		f.write(text)
 
+	report(name, len(tile_map) if mappath else len(tiles), len(tiles), len(data), data, rom_data, tile_map)
+
+
+def report(name, total_tiles, unique_tiles, data_size, data, rom_data, tile_map):
+	"""Print how much ROM space we saved by deduplication and compression (if any),
+	and how long the data takes to load compared to a plain copy."""
+	rom_size = len(rom_data) + (len(tile_map) if tile_map else 0)
+	raw_size = total_tiles * 16
+	parts = ["{}: {} tiles".format(name, total_tiles)]
+	if tile_map:
+		parts.append("{} unique".format(unique_tiles))
+	parts.append("{} bytes in rom, saved {} of {} bytes".format(rom_size, raw_size - rom_size, raw_size))
+	if rom_data != data:
+		parts.append("copy ~{} cycles, decompress ~{} cycles".format(
+			rle.copy_cycles(data_size), rle.decompress_cycles(rom_data),
+		))
+	print ", ".join(parts)
+
+
+def is_up_to_date(outputs, inputs):
+	"""Returns whether all outputs exist and are newer than all inputs"""
+	if not all(os.path.exists(output) for output in outputs):
+		return False
+	# __file__ may be the .pyc, so we also check the .py
+	inputs = inputs + [os.path.splitext(path)[0] + '.py' for path in inputs if path.endswith('.pyc')]
+	newest_input = max(os.path.getmtime(path) for path in inputs if os.path.exists(path))
+	return min(os.path.getmtime(output) for output in outputs) > newest_input
+
+
+# Marks a pixel that isn't in the pallette, in a string of pallette indexes
+INVALID = '\xff'
+
+# Maps a bitmask of which pallette entries a pixel matches to the pallette index (the highest one, if many),
+# or INVALID if it matches none.
+MASK_TO_INDEX = ''.join(
+	chr(max(index for index in range(4) if mask & (1 << index))) if mask & 0xf else INVALID
+	for mask in range(256)
+)
 
 def image_to_tiles(image, pallette, length=None):
+	"""Returns a list of tiles, each a list of 8 lines, each a string of 8 pallette indexes."""
 	width, height = image.size
 
 	if len(pallette) != 4:
 		raise ValueError("pallette must be exactly 4 items")
-	pallette = {value: index for index, value in enumerate(pallette)}
+	# pixel values for multi-band images come from json as lists, but PIL gives us tuples
+	pallette = [tuple(value) if isinstance(value, list) else value for value in pallette]
+
+	if image.mode == '1':
+		# 1-bit images are packed 8 pixels to a byte, but their pixel values are 0 or 255 so we can treat them as greyscale
+		image = image.convert('L')
+	indexes = image_to_indexes(image, pallette)
+	if indexes is None:
+		indexes = image_to_indexes_slow(image, pallette)
 
 	tiles = []
 	for row in range(height / 8):
 		for col in range(width / 8):
-			tiles.append(extract_tile(image, row, col, pallette))
+			tiles.append(extract_tile(image, indexes, row, col))
 			if length is not None and len(tiles) == length:
 				return tiles
 
 	return tiles
 
 
-def extract_tile(image, row, col, pallette):
+def image_to_indexes(image, pallette):
+	"""Map every pixel of the image to its pallette index, or INVALID.
+	Returns a string of indexes, row by row, or None if the image's mode isn't one byte per band.
+	This works on the whole image at once using string translation, rather than pixel by pixel.
+	"""
+	width, height = image.size
+	bands = len(image.getbands())
+	data = image.tobytes()
+	if len(data) != width * height * bands:
+		return None
+	if not data:
+		return ''
+
+	if bands == 1:
+		table = bytearray(INVALID * 256)
+		for index, value in enumerate(pallette):
+			if isinstance(value, int) and 0 <= value < 256:
+				table[value] = index
+		return data.translate(str(table))
+
+	# For multi-band images, we map each band's value to a bitmask of the pallette entries
+	# that have that value for that band, then AND the masks for all bands together.
+	# We do the AND on the whole image as one big integer.
+	mask = None
+	for band in range(bands):
+		table = bytearray(256)
+		for index, value in enumerate(pallette):
+			if isinstance(value, tuple) and len(value) == bands and 0 <= value[band] < 256:
+				table[value[band]] |= 1 << index
+		band_mask = int(data[band::bands].translate(str(table)).encode('hex'), 16)
+		mask = band_mask if mask is None else mask & band_mask
+	mask = '{:0{}x}'.format(mask, 2 * width * height).decode('hex')
+	return mask.translate(MASK_TO_INDEX)
+
+
+def image_to_indexes_slow(image, pallette):
+	"""As image_to_indexes, but pixel by pixel. Works for any image mode."""
+	width, height = image.size
+	pallette = {value: chr(index) for index, value in enumerate(pallette)}
+	return ''.join(
+		pallette.get(image.getpixel((x, y)), INVALID)
+		for y in range(height)
+		for x in range(width)
+	)
+
+
+def extract_tile(image, indexes, row, col):
+	width, height = image.size
 	tile = []
 	for y in range(row * 8, (row + 1) * 8):
-		line = []
-		for x in range(col * 8, (col + 1) * 8):
+		start = y * width + col * 8
+		line = indexes[start:start + 8]
+		if INVALID in line:
+			x = col * 8 + line.index(INVALID)
 			pixel = image.getpixel((x, y))
-			if pixel not in pallette:
-				raise Exception("Pixel ({}, {}) = {} is not a value in the pallette".format(x, y, pixel))
-			value = pallette[pixel]
-			line.append(value)
+			raise Exception("Pixel ({}, {}) = {} is not a value in the pallette".format(x, y, pixel))
 		tile.append(line)
 	return tile
 
 
-def tiles_to_text(filepath, tiles):
-	tiles = '\n\n'.join(tile_to_text(tile) for tile in tiles)
-	return "; Generated from {}\n\n{}\n".format(filepath, tiles)
+_line_cache = {}
+def line_to_2bpp(line):
+	"""Convert a line of 8 pallette indexes to 2 bytes: the low bits of each pixel, then the high bits,
+	with the leftmost pixel in the most signifigant bit."""
+	if line not in _line_cache:
+		low = high = 0
+		for index in bytearray(line):
+			low = (low << 1) | (index & 1)
+			high = (high << 1) | (index >> 1)
+		_line_cache[line] = chr(low) + chr(high)
+	return _line_cache[line]
 
 
-def tile_to_text(tile):
-	return '\n'.join(
-		"dw `{}".format(''.join(map(str, line)))
-		for line in tile
-	)
+def tiles_to_2bpp(tiles):
+	return ''.join(line_to_2bpp(line) for tile in tiles for line in tile)
+
+
+def dedupe_tiles(tiles):
+	"""Returns (unique tiles, tile map) where tile map is a list of the index of each tile in the unique tiles."""
+	unique = []
+	indexes = {}
+	tile_map = []
+	for tile in tiles:
+		key = tuple(tile)
+		if key not in indexes:
+			indexes[key] = len(unique)
+			unique.append(tile)
+		tile_map.append(indexes[key])
+	if len(unique) > 256:
+		raise ValueError("Too many unique tiles for a tile map ({} > 256)".format(len(unique)))
+	return unique, tile_map
+
+
+def gen_stub(filepath, name, binpath, count, size, compress, rom_size, mappath, tile_map):
+	symbol = re.sub('[^A-Z0-9_]', '_', name.upper())
+	lines = [
+		"; Generated from {}".format(filepath),
+		"",
+		"{}_TILE_COUNT EQU {}".format(symbol, count),
+		"{}_TILE_DATA_SIZE EQU {}".format(symbol, size),
+	]
+	if compress:
+		lines += [
+			"{}_COMPRESSED EQUS \"{}\"".format(symbol, compress),
+			"{}_COMPRESSED_SIZE EQU {}".format(symbol, rom_size),
+		]
+	if mappath:
+		lines += ["{}_TILE_MAP_SIZE EQU {}".format(symbol, len(tile_map))]
+	lines += [
+		"",
+		"INCBIN \"{}\"".format(binpath),
+	]
+	if mappath:
+		label = ''.join(part.capitalize() for part in re.split('[^A-Za-z0-9]+', name)) + 'TileMap'
+		lines += [
+			"",
+			"{}:".format(label),
+			"INCBIN \"{}\"".format(mappath),
+		]
+	return '\n'.join(lines) + '\n'
 
 
 if __name__ == '__main__':
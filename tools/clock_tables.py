@@ -0,0 +1,71 @@
+"""This tool generates the lookup tables used by the clock task (tasks/clock.asm) as an RGBDS asm include file.
+
+Working out the time to display involves dividing by 60 and converting to BCD, which are slow to do
+at runtime. Instead, the clock task looks up the answers in tables built here. Each table is one or
+more whole 256-byte pages, so a lookup is just loading the index into L and the table's page into H.
+
+The tables must be in the same bank as the clock task, which reads them with no bank switching.
+So the generated file has no SECTION of its own: tasks/clock.asm includes it at the start of its
+code section, which is aligned to a page.
+
+The tables are, in order:
+	ClockBCD: For each byte n, n % 100 as 2-digit BCD.
+	ClockDiv60: For each byte n, n / 60.
+	ClockMod60: For each byte n, n % 60.
+	ClockDiv60Carry: For each remainder r < 60, (r * 256) / 60. These are for long division by 60,
+		one byte at a time, where r is the remainder from the more significant bytes.
+	ClockMod60Carry: As ClockDiv60Carry but (r * 256) % 60. This shares a page with ClockDiv60Carry,
+		starting half way through it.
+	ClockCentis: For each 10-bit fraction of a second (in ticks of 2^-10 s), the number of whole
+		hundredths of a second, as 2-digit BCD. This is 4 pages long.
+"""
+
+
+TICKS_PER_SECOND = 2**10
+PAGE_SIZE = 256
+
+
+def bcd(n):
+	return ((n / 10) << 4) | (n % 10)
+
+
+def gen_tables():
+	"""Returns a list of (label, contents) for each table, where contents is a list of bytes,
+	padded to a whole number of pages, or half a page for the two that share one."""
+	half_page = [0] * (PAGE_SIZE / 2 - 60)
+	return [
+		('ClockBCD', [bcd(n % 100) for n in range(PAGE_SIZE)]),
+		('ClockDiv60', [n / 60 for n in range(PAGE_SIZE)]),
+		('ClockMod60', [n % 60 for n in range(PAGE_SIZE)]),
+		('ClockDiv60Carry', [(r * PAGE_SIZE) / 60 for r in range(60)] + half_page),
+		('ClockMod60Carry', [(r * PAGE_SIZE) % 60 for r in range(60)] + half_page),
+		('ClockCentis', [bcd(ticks * 100 / TICKS_PER_SECOND) for ticks in range(TICKS_PER_SECOND)]),
+	]
+
+
+def gen_asm(tables):
+	lines = [
+		"; Generated by tools/clock_tables.py",
+		"; Include this at the start of a page-aligned section, see tasks/clock.asm.",
+	]
+	offset = 0
+	for label, contents in tables:
+		# Every table starts on a page, except the second half of a shared one
+		assert offset % PAGE_SIZE in (0, PAGE_SIZE / 2)
+		lines += ["", "{}:".format(label)]
+		for start in range(0, len(contents), 16):
+			lines.append("\tdb " + ", ".join("${:02x}".format(value) for value in contents[start:start + 16]))
+		offset += len(contents)
+	assert offset % PAGE_SIZE == 0
+	return '\n'.join(lines) + '\n'
+
+
+def main(outpath):
+	"""Write the tables to outpath"""
+	with open(outpath, 'w') as f:
+		f.write(gen_asm(gen_tables()))
+
+
+if __name__ == '__main__':
+	import argh
+	argh.dispatch_command(main)
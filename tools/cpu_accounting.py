@@ -0,0 +1,163 @@
+"""Decodes the CPU accounting log (see include/accounting.asm) from a memory dump,
+and prints the share of CPU time used by each task and OS activity.
+
+Accounting must be stopped with AccountingStop before the dump is taken.
+The dump should be a raw image of memory starting at address --base, eg. the whole 64KB address space
+(the default) or just WRAM with --base 0xc000. The symbol file is used to find the log in the dump.
+"""
+
+import argh
+
+from gb_emulator import load_symbols
+
+
+ENTRY_SIZE = 4
+LOG_SIZE = 256
+
+# Event types, as per include/accounting.asm
+SWITCH, IDLE, VBLANK, TIMER, JOYPAD, END = range(6)
+EMPTY = 0xff
+ACTIVITIES = {VBLANK: 'vblank', TIMER: 'timer', JOYPAD: 'joypad'}
+
+# Timestamps are in units of 2^-18 seconds, or 4 cycles.
+UNITS_PER_SECOND = 2**18
+CYCLES_PER_UNIT = 4
+# The timer interrupt fires every 2^-10 seconds.
+TICK_UNITS = 2**8
+# Cycles taken by the timer interrupt on its fast path, which isn't logged.
+# This is the interrupt dispatch (5), the jr at IntTimer (3) and TimerHandler without joypad scan, carry or switch.
+TIMER_FAST_PATH_CYCLES = 41
+
+
+def read_log(dump, base, symbols):
+	"""Returns the log entries in the dump as a list of (timestamp, type, task), oldest first."""
+	def read(label, length):
+		bank, addr = symbols[label]
+		offset = addr - base
+		if offset < 0 or offset + length > len(dump):
+			raise ValueError("{} at ${:04x} is not in the dump".format(label, addr))
+		return bytearray(dump[offset:offset + length])
+
+	index, = read('AccountingStoppedIndex', 1)
+	if not index:
+		raise ValueError("Accounting hasn't been stopped, so we don't know where the log starts")
+	log = read('AccountingLog', LOG_SIZE)
+
+	entries = []
+	for i in range(0, LOG_SIZE, ENTRY_SIZE):
+		offset = (index - 1 + i) % LOG_SIZE
+		time_hi, time_lo, kind, task = log[offset:offset + ENTRY_SIZE]
+		if kind == EMPTY:
+			continue
+		if kind > END:
+			raise ValueError("Bad entry type {} at log offset {}".format(kind, offset))
+		entries.append(((time_hi << 8) | time_lo, kind, task))
+	return entries
+
+
+def to_intervals(entries):
+	"""Work out who was using the CPU between each pair of entries.
+	Returns a list of (start, end, name) with times in units since the first entry."""
+	intervals = []
+	stack = [] # OS activities in progress, innermost last
+	base = None # the task or idle state under any OS activities
+	prev_stamp = None
+	now = 0
+	for stamp, kind, task in entries:
+		if prev_stamp is not None:
+			elapsed = (stamp - prev_stamp) % 0x10000
+			# The high byte of the timestamp comes from Uptime. If an entry is written while the timer interrupt
+			# is pending, Uptime hasn't been incremented yet and the entry is a tick early. We can only tell when
+			# that puts it before the previous entry, otherwise we live with the error.
+			if elapsed > 0x10000 - TICK_UNITS:
+				elapsed = (elapsed + TICK_UNITS) % 0x10000
+				stamp = (stamp + TICK_UNITS) % 0x10000
+			name = stack[-1] if stack else base
+			if name is not None:
+				intervals.append((now, now + elapsed, name))
+			now += elapsed
+		prev_stamp = stamp
+
+		if base is None:
+			# We don't know what was running before the log started, but the entry records the current task.
+			base = 'task {}'.format(task)
+		if kind == SWITCH:
+			base = 'task {}'.format(task)
+			stack = []
+		elif kind == IDLE:
+			base = 'idle'
+			stack = []
+		elif kind == END:
+			if stack:
+				stack.pop()
+		else:
+			stack.append(ACTIVITIES[kind])
+	return intervals
+
+
+def account(intervals, window):
+	"""Total the time used by each name over the last window units of intervals.
+	Returns ({name: units}, units covered)."""
+	totals = {}
+	if not intervals:
+		return totals, 0
+	end = intervals[-1][1]
+	start = max(0, end - window)
+	for interval_start, interval_end, name in intervals:
+		interval_start = max(interval_start, start)
+		if interval_end <= interval_start:
+			continue
+		totals[name] = totals.get(name, 0) + interval_end - interval_start
+	return totals, end - start
+
+
+def add_timer_estimate(totals, covered):
+	"""The timer interrupt's fast path steals a fixed amount of time every tick, but isn't logged.
+	Estimate it and move it out of the task time it was stolen from.
+	While idle, the scheduler slows the timer down so it barely runs, so we don't count idle time.
+	Returns the estimate in units."""
+	busy = covered - totals.get('idle', 0)
+	estimate = float(busy) / TICK_UNITS * TIMER_FAST_PATH_CYCLES / CYCLES_PER_UNIT
+	victims = [name for name in totals if name not in ACTIVITIES.values() and name != 'idle']
+	victim_total = sum(totals[name] for name in victims)
+	if not victim_total:
+		return 0
+	for name in victims:
+		totals[name] -= estimate * totals[name] / victim_total
+	totals['timer'] = totals.get('timer', 0) + estimate
+	return estimate
+
+
+def sort_key(name):
+	# tasks in id order, then idle, then OS activities
+	if name.startswith('task '):
+		return 0, int(name.split()[1])
+	return 1, name != 'idle', name
+
+
+@argh.arg('--base', type=lambda value: int(value, 0), help="Address of the first byte of the dump")
+def main(dump, symfile='build/debug/rom.sym', base=0, window=1.0):
+	"""Print the CPU usage recorded in the accounting log over the last window seconds,
+	or as much of it as the log covers."""
+	with open(dump, 'rb') as f:
+		data = f.read()
+	entries = read_log(data, base, load_symbols(symfile))
+	if len(entries) < 2:
+		print "Not enough log entries to account for any time"
+		return
+
+	totals, covered = account(to_intervals(entries), int(window * UNITS_PER_SECOND))
+	estimate = add_timer_estimate(totals, covered)
+
+	print "{} log entries, accounting for the last {:.3f}s".format(len(entries), float(covered) / UNITS_PER_SECOND)
+	for name in sorted(totals, key=sort_key):
+		line = "{:>10}: {:5.1f}% {:>9} cycles".format(
+			name, 100. * totals[name] / covered, int(totals[name] * CYCLES_PER_UNIT),
+		)
+		if name == 'timer':
+			line += " (of which {:.1f}% is estimated)".format(100. * estimate / covered)
+		print line
+
+
+if __name__ == '__main__':
+	argh.dispatch_command(main)
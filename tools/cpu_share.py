@@ -0,0 +1,67 @@
+"""Runs a debug rom in the emulator for a while and prints the share of CPU time used by each task
+and OS activity, as per tools/cpu_accounting.py.
+
+This is mainly for seeing how much CPU time tasks use when they're meant to be idle.
+For example, with no input the paint task should spend all its time waiting on the joypad,
+leaving the CPU to other tasks: compare the paint task's share (task 0 in the default rom)
+with the idle time, which is what any CPU-bound task could have had.
+
+Debug roms always collect CPU accounting, so no changes to the rom are needed.
+"""
+
+import argh
+
+import cpu_accounting
+import gb_emulator
+
+
+CYCLES_PER_SECOND = 2**20
+
+
+def stop_accounting(gb, symbols):
+	"""Call AccountingStop as though it were an interrupt handler, since it returns with reti.
+	We wait for interrupts to be enabled first, so the rom can't tell the difference."""
+	while not gb.ime:
+		gb.run(gb.cycles + 1) # one instruction at a time
+	bank, addr = symbols['AccountingStop']
+	resume = gb.pc
+	gb.ime = False
+	gb.halted = False # as with a real interrupt, this wakes the cpu if it was halted
+	gb.push(resume)
+	gb.pc = addr
+	while gb.pc != resume:
+		gb.run(gb.cycles + 1)
+
+
+def main(rom='build/debug/rom.gb', symfile='build/debug/rom.sym', seconds=2.0, window=1.0):
+	"""Run the rom for the given number of seconds with no input, then print the CPU usage
+	recorded over the last window seconds, or as much of it as the log covers."""
+	with open(rom, 'rb') as f:
+		gb = gb_emulator.GameBoy(f.read())
+	symbols = gb_emulator.load_symbols(symfile)
+	if gb.run(int(seconds * CYCLES_PER_SECOND)):
+		print "Rom stopped early, at cycle {}".format(gb.cycles)
+		return
+	stop_accounting(gb, symbols)
+
+	# The log is in WRAM0
+	dump = gb.mem[0xc000:0xd000]
+	entries = cpu_accounting.read_log(dump, 0xc000, symbols)
+	if len(entries) < 2:
+		print "Not enough log entries to account for any time"
+		return
+	totals, covered = cpu_accounting.account(
+		cpu_accounting.to_intervals(entries), int(window * cpu_accounting.UNITS_PER_SECOND),
+	)
+	estimate = cpu_accounting.add_timer_estimate(totals, covered)
+
+	print "After {:.1f}s, {} log entries, accounting for the last {:.3f}s".format(
+		float(gb.cycles) / CYCLES_PER_SECOND, len(entries), float(covered) / cpu_accounting.UNITS_PER_SECOND,
+	)
+	for name in sorted(totals, key=cpu_accounting.sort_key):
+		print "{:>10}: {:5.1f}%".format(name, 100. * totals[name] / covered)
+	print "Timer fast path estimated at {:.1f}%".format(100. * estimate / covered)
+
+
+if __name__ == '__main__':
+	argh.dispatch_command(main)
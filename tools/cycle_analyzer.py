@@ -0,0 +1,1011 @@
+"""Statically works out the best and worst case number of cycles a function can take,
+so we can check at build time that time-critical code like the interrupt handlers stays within budget.
+
+We read the asm sources the same way rgbasm would (includes, macros, REPT, IF and the symbols they use),
+then follow every path through the function from its label to a ret, taking instruction costs from
+gb_instruction_reference.txt. Calls are followed into the called function, and a jump to another
+function is a tail call. Cycles are M-cycles (4 clocks), as in the reference. The 5 cycles an interrupt
+takes to dispatch aren't counted.
+
+Some things can't be worked out from the code alone, so we use annotations in comments:
+	; @loop N or ; @loop MIN..MAX
+		On a loop's backwards jump (or on the loop's label), the number of times the loop body runs.
+		Every loop must have one, unless it spends from a pool (see below).
+	; @pool NAME AMOUNT
+		On a function's label, declares a pool of AMOUNT units which the function spends as it goes.
+		Eg. GraphicsVBlank has a number of time credits, and only does work while it can afford to.
+	; @spend NAME AMOUNT
+		Each time this line runs, it spends AMOUNT from the pool. Paths that would overspend
+		are never taken, which bounds any loop that spends each time around.
+	; @as INSTRUCTION
+		Treat this line as INSTRUCTION, eg. for a hand-encoded instruction or a call to code
+		that's copied to somewhere else at runtime.
+	; @exit
+		Stop counting once this line has run, eg. a jump to code that runs after interrupts are enabled again.
+	; @budget N
+		On a function's label, the worst case may not be more than N cycles. On a label inside a function,
+		the worst case from the start of the function to there. Checked by --check.
+All amounts may be expressions using any constants defined at that point.
+
+As well as per-function totals, --blocks prints the cost of each basic block and loop in the functions reported.
+"""
+
+import itertools
+import os
+import re
+import sys
+
+import argh
+
+
+REFERENCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gb_instruction_reference.txt')
+
+ALU_OPS = ['ADD', 'ADC', 'SUB', 'SBC', 'AND', 'OR', 'XOR', 'CP']
+REGS8 = ['A', 'B', 'C', 'D', 'E', 'H', 'L']
+# Source spellings of operands, and the spelling the reference uses for them
+OPERAND_ALIASES = {
+	'[HLI]': '[HL+]',
+	'[HLD]': '[HL-]',
+	'[C]': '[$FF00+C]',
+}
+# Mnemonic spellings which are shorthand for an LD
+MNEMONIC_ALIASES = {
+	'LDI': ('LD', '[HL+]'),
+	'LDD': ('LD', '[HL-]'),
+	'LDIO': ('LDH', None),
+}
+
+DIRECTIVES = {
+	'INCLUDE', 'INCBIN', 'SECTION', 'PUSHS', 'POPS', 'IF', 'ELIF', 'ELSE', 'ENDC', 'REPT', 'ENDR',
+	'MACRO', 'ENDM', 'SHIFT', 'RSRESET', 'RSSET', 'EXPORT', 'GLOBAL', 'PURGE', 'PRINTT', 'PRINTV',
+	'PRINTI', 'PRINTF', 'WARN', 'FAIL', 'OPT', 'PUSHO', 'POPO', 'CHARMAP', 'NEWCHARMAP', 'SETCHARMAP',
+	'PUSHC', 'POPC', 'UNION', 'NEXTU', 'ENDU',
+}
+DEFINITIONS = {'EQU', 'EQUS', 'SET', '=', 'RB', 'RW', 'RL'}
+RS_SIZES = {'RB': 1, 'RW': 2, 'RL': 4}
+NOTES = {'loop', 'pool', 'spend', 'as', 'exit', 'budget'}
+
+EXIT = 'exit'
+
+
+class AnalysisError(Exception):
+	def __init__(self, where, message):
+		super(AnalysisError, self).__init__("{}: {}".format(where, message))
+
+
+class Unresolved(Exception):
+	"""An expression uses something that isn't a constant, eg. a label's address."""
+
+
+# Stands in for the value of a symbol that is defined, but which we can't work out
+UNRESOLVED = object()
+
+
+def load_reference(path=REFERENCE):
+	"""Parse the instruction reference into a list of (mnemonic, operand patterns, (not taken, taken) cycles)"""
+	with open(path) as f:
+		lines = f.read().split('\n')
+	start = next(i for i, line in enumerate(lines) if line.startswith('TIME\t'))
+	reference = []
+	for line in lines[start + 1:]:
+		if not line.strip():
+			continue
+		time, size, flags, instruction = line.split('\t')
+		instruction = instruction.split(';')[0].strip()
+		time = time.strip('"')
+		not_taken, taken = time.split('/') if '/' in time else (time, time)
+		mnemonics, _, operands = instruction.partition(' ')
+		mnemonics = ALU_OPS if mnemonics == 'alu-op' else mnemonics.strip('()').split(',')
+		for mnemonic in mnemonics:
+			for variant in expand_alternatives(operands.upper().replace(' ', '')):
+				patterns = tuple(normalize_pattern(op) for op in variant.split(',')) if variant else ()
+				reference.append((mnemonic.upper(), patterns, (int(not_taken), int(taken))))
+	return reference
+
+
+def expand_alternatives(text):
+	"""Expand each "(a,b)" in text into every combination of alternatives"""
+	match = re.search(r'\(([^()]*)\)', text)
+	if not match:
+		return [text]
+	results = []
+	for alternative in match.group(1).split(','):
+		results += expand_alternatives(text[:match.start()] + alternative + text[match.end():])
+	return results
+
+
+def normalize_pattern(op):
+	if op in ('N', 'NN', 'B') or op.startswith('$'):
+		return 'imm'
+	if op == 'R':
+		return 'reg8'
+	return {'[NN]': 'mem', '[$FF00+N]': 'mem', 'SP+N': 'spn'}.get(op, op)
+
+
+def split_top(text, sep=','):
+	"""Split text on sep, except inside brackets or strings"""
+	parts = []
+	depth = 0
+	quoted = False
+	current = ''
+	for i, char in enumerate(text):
+		if quoted:
+			if char == '"' and text[i - 1] != '\\':
+				quoted = False
+		elif char == '"':
+			quoted = True
+		elif char in '([':
+			depth += 1
+		elif char in ')]':
+			depth -= 1
+		elif char == sep and depth == 0:
+			parts.append(current.strip())
+			current = ''
+			continue
+		current += char
+	parts.append(current.strip())
+	return parts
+
+
+def split_comment(text):
+	"""Returns (code, comment), where a comment starts at the first ; not in a string"""
+	quoted = False
+	for i, char in enumerate(text):
+		if char == '"' and (i == 0 or text[i - 1] != '\\'):
+			quoted = not quoted
+		elif char == ';' and not quoted:
+			return text[:i], text[i + 1:]
+	return text, ''
+
+
+EXPR_TOKEN = re.compile(r'''\s*(?:
+	(?P<num>\$[0-9a-fA-F_]+|[0-9][0-9_]*)
+	|(?P<bin>%[01_]+)
+	|(?P<str>"(?:[^"\\]|\\.)*")
+	|(?P<name>[A-Za-z_.][\w.#@]*|@)
+	|(?P<op><<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^~!<>(),])
+)''', re.X)
+
+PYTHON_OPS = {'/': '//', '!': ' not ', '&&': ' and ', '||': ' or '}
+
+
+def HIGH(value):
+	return (value >> 8) & 0xff
+
+
+def LOW(value):
+	return value & 0xff
+
+
+def evaluate(expr, symbols):
+	"""Evaluate an rgbasm expression using the given dict of constants."""
+	out = []
+	pos = 0
+	expr = expr.strip()
+	prev_is_value = False
+	while pos < len(expr):
+		match = EXPR_TOKEN.match(expr, pos)
+		if not match or match.end() == pos:
+			raise ValueError("Can't parse expression: {!r}".format(expr))
+		pos = match.end()
+		kind = match.lastgroup
+		token = match.group(kind)
+		if kind == 'bin' and prev_is_value:
+			# it's a modulo followed by a number
+			out.append('%')
+			pos = match.start(kind) + 1
+			prev_is_value = False
+			continue
+		if kind == 'num':
+			out.append(str(int(token[1:].replace('_', ''), 16) if token.startswith('$') else int(token.replace('_', ''))))
+		elif kind == 'bin':
+			out.append(str(int(token[1:].replace('_', ''), 2)))
+		elif kind == 'str':
+			if len(token) != 3:
+				raise Unresolved("string {} in expression".format(token))
+			out.append(str(ord(token[1])))
+		elif kind == 'name' and token.upper() == 'DEF':
+			match = re.match(r'\s*\(\s*([\w.#@]+)\s*\)', expr[pos:])
+			if not match:
+				raise ValueError("Bad DEF() in expression: {!r}".format(expr))
+			pos += match.end()
+			out.append('1' if match.group(1) in symbols else '0')
+		elif kind == 'name' and token.upper() in ('HIGH', 'LOW'):
+			out.append(token.upper())
+			prev_is_value = False
+			continue
+		elif kind == 'name':
+			value = symbols.get(token, UNRESOLVED)
+			if not isinstance(value, (int, long)):
+				raise Unresolved(token)
+			out.append('({})'.format(value))
+		else:
+			out.append(PYTHON_OPS.get(token, token))
+		prev_is_value = kind != 'op' or token == ')'
+	try:
+		value = eval(' '.join(out), {'__builtins__': {}, 'HIGH': HIGH, 'LOW': LOW})
+	except SyntaxError:
+		raise ValueError("Can't parse expression: {!r}".format(expr))
+	return int(value)
+
+
+class Item(object):
+	"""One line of output from the preprocessor: a label, an instruction or data, or a marker
+	that something here couldn't be worked out."""
+	def __init__(self, where, scope, label=None, code=None, notes=None, unknown=None):
+		self.where = where
+		self.scope = scope
+		self.label = label
+		self.code = code
+		self.notes = notes or {}
+		self.unknown = unknown
+
+	def __repr__(self):
+		return '<{} {}>'.format(self.where, self.label or self.code or self.unknown)
+
+
+class Preprocessor(object):
+	"""Reads a source file and everything it includes, as rgbasm would when assembling it.
+	The results are in sections, a list of lists of Items."""
+
+	unique = itertools.count(1)
+
+	def __init__(self, include_dirs, defines):
+		self.include_dirs = include_dirs
+		self.symbols = dict(defines)
+		self.equs = {}
+		self.macros = {}
+		self.rs = 0
+		self.sections = [[]]
+		self.section = self.sections[0]
+		self.section_stack = []
+		self.scope = None
+
+	def process_file(self, path, where=None):
+		for candidate in [path] + [os.path.join(d, path) for d in self.include_dirs]:
+			if os.path.exists(candidate):
+				break
+		else:
+			raise AnalysisError(where or path, "Can't find {}".format(path))
+		with open(candidate) as f:
+			text = f.read()
+		lines = [('{}:{}'.format(candidate, n + 1), line) for n, line in enumerate(text.split('\n'))]
+		self.run(lines)
+
+	def run(self, lines, args=None, unique=None):
+		"""Process a list of (where, text) lines. args and unique are set while expanding a macro."""
+		conditions = [] # for each IF we're in, whether we've taken a branch of it yet
+		i = 0
+		while i < len(lines):
+			where, text = lines[i]
+			i += 1
+			if args is not None:
+				self.symbols['_NARG'] = len(args)
+				text = self.substitute_args(text, args, unique)
+			code, comment = split_comment(text)
+			code = self.interpolate(code.rstrip())
+			if not code.strip():
+				continue
+			self.symbols['__LINE__'] = int(re.match(r'[^:]*:(\d+)', where).group(1))
+			label, word, rest = self.parse_line(code)
+			keyword = word.upper()
+
+			if keyword == 'MACRO':
+				end = self.find_end(lines, i, ('MACRO',), ('ENDM',), where)
+				self.macros[label] = lines[i:end]
+				i = end + 1
+				continue
+			if keyword in DEFINITIONS and label is not None:
+				self.define(label, keyword, rest, where)
+				continue
+			if label is not None:
+				self.add_label(label, where, comment)
+
+			if keyword == 'IF':
+				taken = self.condition(rest, where)
+				conditions.append(taken)
+				if not taken:
+					i = self.skip_branch(lines, i, conditions, where)
+			elif keyword in ('ELIF', 'ELSE'):
+				if not conditions:
+					raise AnalysisError(where, "{} without IF".format(keyword))
+				# we only get here at the end of a branch we took
+				i = self.skip_branch(lines, i, conditions, where, skip_all=True)
+			elif keyword == 'ENDC':
+				if not conditions:
+					raise AnalysisError(where, "ENDC without IF")
+				conditions.pop()
+			elif keyword == 'REPT':
+				end = self.find_end(lines, i, ('REPT',), ('ENDR',), where)
+				count = self.value(rest, where, "REPT count")
+				for _ in range(count or 0):
+					self.run(lines[i:end], args, unique)
+				i = end + 1
+			elif keyword == 'SHIFT':
+				if args:
+					del args[0]
+			elif keyword == 'INCLUDE':
+				self.process_file(rest.strip().strip('"'), where)
+			elif keyword == 'SECTION':
+				self.section = []
+				self.sections.append(self.section)
+				self.scope = None
+			elif keyword == 'PUSHS':
+				self.section_stack.append((self.section, self.scope))
+			elif keyword == 'POPS':
+				self.section, self.scope = self.section_stack.pop()
+			elif keyword == 'RSRESET':
+				self.rs = 0
+			elif keyword == 'RSSET':
+				self.rs = self.value(rest, where, "RSSET")
+			elif keyword in DIRECTIVES:
+				pass
+			elif word in self.macros:
+				self.expand(word, rest, where)
+			elif word:
+				self.section.append(Item(where, self.scope, code=' '.join([word, rest]).strip(), notes=self.notes(comment, where)))
+		if conditions:
+			raise AnalysisError(lines[-1][0], "IF without ENDC")
+
+	def parse_line(self, code):
+		"""Returns (label or None, first word, rest of line)"""
+		label = None
+		if not code[0].isspace():
+			match = re.match(r'([\w.#@]+)(::?)?\s*(.*)$', code)
+			if match:
+				name, colon, rest = match.groups()
+				next_word = rest.split(None, 1)[0].upper() if rest else ''
+				if colon or next_word in DEFINITIONS or next_word == 'MACRO':
+					label, code = name, rest
+				elif name.upper() not in DIRECTIVES and name.upper() not in ('DB', 'DW', 'DL', 'DS') \
+						and name not in self.macros and name not in self.equs:
+					label, code = name, rest
+		word, rest = self.split_word(code)
+		if word in self.equs:
+			# An EQUS used as an instruction or macro, eg. Debug
+			word, rest = self.split_word(self.interpolate(self.equs[word] + ' ' + rest))
+		return label, word, rest
+
+	def split_word(self, code):
+		parts = code.strip().split(None, 1) + ['', '']
+		return parts[0], parts[1].strip()
+
+	def substitute_args(self, text, args, unique):
+		def replace(match):
+			arg = match.group(1)
+			if arg == '@':
+				return '_{}'.format(unique)
+			index = int(arg) - 1
+			return args[index] if index < len(args) else ''
+		return re.sub(r'\\([1-9@])', replace, text)
+
+	def interpolate(self, text):
+		"""Substitute {SYMBOL} with the symbol's value"""
+		def replace(match):
+			value = self.symbols.get(match.group(1))
+			if value is None:
+				value = self.equs.get(match.group(1))
+			if isinstance(value, (int, long)):
+				return '${:X}'.format(value)
+			return match.group(0) if value is None or value is UNRESOLVED else value
+		return re.sub(r'(?<!\\)\{([\w.#@]+)\}', replace, text)
+
+	def find_end(self, lines, start, openers, closers, where):
+		"""Find the index of the line that closes a block started just before start"""
+		depth = 0
+		for i in range(start, len(lines)):
+			code = split_comment(lines[i][1])[0]
+			words = [word.upper().rstrip(':') for word in code.split()[:2]]
+			if any(word in closers for word in words):
+				if depth == 0:
+					return i
+				depth -= 1
+			elif any(word in openers for word in words):
+				depth += 1
+		raise AnalysisError(where, "Unterminated {}".format(openers[0]))
+
+	def skip_branch(self, lines, start, conditions, where, skip_all=False):
+		"""Skip lines until the next branch of the current IF that we should take, or its ENDC.
+		Returns the index of the next line to process."""
+		depth = 0
+		for i in range(start, len(lines)):
+			code = split_comment(lines[i][1])[0].strip()
+			keyword = code.split(None, 1)[0].upper() if code else ''
+			if keyword == 'IF':
+				depth += 1
+			elif keyword == 'ENDC':
+				if depth == 0:
+					conditions.pop()
+					return i + 1
+				depth -= 1
+			elif depth == 0 and not skip_all and keyword == 'ELSE':
+				conditions[-1] = True
+				return i + 1
+			elif depth == 0 and not skip_all and keyword == 'ELIF':
+				rest = code.split(None, 1)[1] if ' ' in code or '\t' in code else ''
+				if self.condition(rest, lines[i][0]):
+					conditions[-1] = True
+					return i + 1
+		raise AnalysisError(where, "IF without ENDC")
+
+	def condition(self, expr, where):
+		value = self.value(expr, where, "IF condition")
+		return bool(value)
+
+	def value(self, expr, where, what):
+		"""Evaluate expr, or if it isn't constant, leave a marker in case we try to analyse code here"""
+		try:
+			return evaluate(expr, self.symbols)
+		except Unresolved as e:
+			self.section.append(Item(where, self.scope, unknown="{} {!r} is not constant ({})".format(what, expr, e)))
+			return None
+		except ValueError as e:
+			raise AnalysisError(where, str(e))
+
+	def define(self, name, keyword, rest, where):
+		if keyword == 'EQUS':
+			self.equs[name] = rest.strip()[1:-1].replace('\\{', '{').replace('\\}', '}')
+			self.symbols[name] = UNRESOLVED
+			return
+		if keyword in RS_SIZES:
+			self.symbols[name] = UNRESOLVED if self.rs is None else self.rs
+			size = self.value(rest, where, name) if rest.strip() else 1
+			self.rs = None if self.rs is None or size is None else self.rs + size * RS_SIZES[keyword]
+			return
+		try:
+			self.symbols[name] = evaluate(rest, self.symbols)
+		except (Unresolved, ValueError):
+			# eg. a string, or something based on a label's address
+			self.symbols[name] = UNRESOLVED
+
+	def add_label(self, label, where, comment):
+		if label.startswith('.'):
+			if self.scope is None:
+				raise AnalysisError(where, "Local label {} outside of any function".format(label))
+			label = self.scope + label
+		else:
+			self.scope = label
+		self.section.append(Item(where, self.scope, label=label, notes=self.notes(comment, where)))
+
+	def expand(self, name, rest, where):
+		body = self.macros[name]
+		args = split_top(rest) if rest.strip() else []
+		saved_narg = self.symbols.get('_NARG')
+		expansion = ' (in {} from {})'.format(name, where)
+		self.run([(line_where + expansion, text) for line_where, text in body], args, next(self.unique))
+		self.symbols['_NARG'] = saved_narg
+
+	def notes(self, comment, where):
+		"""Parse the annotations in a comment"""
+		notes = {}
+		for name, text in re.findall(r'(?:^|\s)@(\w+)\s*((?:(?!\s@\w).)*)', comment):
+			if name not in NOTES:
+				continue
+			text = text.strip()
+			try:
+				if name == 'loop':
+					low, _, high = text.partition('..')
+					notes[name] = (evaluate(low, self.symbols), evaluate(high or low, self.symbols))
+				elif name in ('pool', 'spend'):
+					pool, amount = text.split(None, 1)
+					notes[name] = (pool, evaluate(amount, self.symbols))
+				elif name == 'budget':
+					notes[name] = evaluate(text, self.symbols)
+				else:
+					notes[name] = text
+			except (Unresolved, ValueError) as e:
+				raise AnalysisError(where, "Bad @{} annotation {!r}: {}".format(name, text, e))
+		return notes
+
+
+class Instruction(object):
+	"""A decoded instruction. kind is one of:
+		plain: runs on to the next line
+		jump, branch: unconditional and conditional jumps to target
+		call, ccall: unconditional and conditional calls to target
+		ret, cret: unconditional and conditional returns
+	"""
+	def __init__(self, kind, cycles, target=None):
+		self.kind = kind
+		self.cycles = cycles
+		self.target = target
+
+
+class Program(object):
+	"""All the code from a set of source files, and the costs of its instructions."""
+
+	def __init__(self, filepaths, include_dirs, defines, reference):
+		self.reference = reference
+		self.sections = []
+		for path in filepaths:
+			preprocessor = Preprocessor(include_dirs, defines)
+			preprocessor.process_file(path)
+			self.sections += [(preprocessor.symbols, section) for section in preprocessor.sections]
+		self.labels = {}
+		for symbols, section in self.sections:
+			for index, item in enumerate(section):
+				if item.label is not None:
+					self.labels.setdefault(item.label, []).append((symbols, section, index))
+		self.decoded = {}
+
+	def find(self, label, where):
+		if label not in self.labels:
+			raise AnalysisError(where, "Can't find {}".format(label))
+		if len(self.labels[label]) > 1:
+			raise AnalysisError(where, "{} is defined more than once".format(label))
+		return self.labels[label][0]
+
+	def decode(self, symbols, item):
+		"""Decode an item's instruction, using the symbols defined in its file"""
+		if id(item) not in self.decoded:
+			self.decoded[id(item)] = self._decode(symbols, item)
+		return self.decoded[id(item)]
+
+	def _decode(self, symbols, item):
+		code = item.notes.get('as', item.code)
+		mnemonic, _, rest = code.partition(' ')
+		mnemonic = mnemonic.upper()
+		operands = split_top(rest) if rest.strip() else []
+		if mnemonic in ('DB', 'DW', 'DL', 'DS'):
+			raise AnalysisError(item.where, "Reached data, not code: {}".format(code))
+		if mnemonic in MNEMONIC_ALIASES:
+			mnemonic, memory = MNEMONIC_ALIASES[mnemonic]
+			if memory:
+				operands = [memory if op.upper().replace(' ', '') == '[HL]' else op for op in operands]
+		if mnemonic in ALU_OPS and len(operands) == 1:
+			operands = ['A'] + operands
+		if mnemonic == 'JP' and operands and operands[-1].upper() in ('HL', '[HL]'):
+			raise AnalysisError(item.where, "Can't follow a jump to HL")
+		if mnemonic == 'RST':
+			raise AnalysisError(item.where, "Can't follow rst, use @as to say what it calls")
+
+		classified = [self.classify(op, symbols) for op in operands]
+		if mnemonic == 'LD' and any(
+			(kind == 'mem' and value is not None and value >= 0xff00) or text == '[$FF00+C]'
+			for kind, text, value in classified
+		):
+			# rgbasm assembles these as the faster LDH
+			mnemonic = 'LDH'
+		for ref_mnemonic, patterns, cycles in self.reference:
+			if ref_mnemonic == mnemonic and len(patterns) == len(classified) and all(
+				pattern == kind or pattern == text for pattern, (kind, text, value) in zip(patterns, classified)
+			):
+				break
+		else:
+			raise AnalysisError(item.where, "Unknown instruction: {}".format(code))
+
+		target = operands[-1].strip() if operands else None
+		while target and target.startswith('(') and target.endswith(')'):
+			target = target[1:-1].strip()
+		if target and target.startswith('.'):
+			target = item.scope + target
+		conditional = bool(patterns) and patterns[0] in ('Z', 'NZ', 'C', 'NC')
+		if mnemonic in ('JP', 'JR'):
+			return Instruction('branch' if conditional else 'jump', cycles, target)
+		if mnemonic == 'CALL':
+			return Instruction('ccall' if conditional else 'call', cycles, target)
+		if mnemonic in ('RET', 'RETI'):
+			return Instruction('cret' if conditional else 'ret', cycles)
+		return Instruction('plain', cycles)
+
+	def classify(self, op, symbols):
+		"""Returns (kind, normalized text, constant value or None) for an operand"""
+		text = op.upper().replace(' ', '').replace('\t', '')
+		text = OPERAND_ALIASES.get(text, text)
+		# rgbasm allows HIGH() and LOW() of a register pair to mean one of its registers
+		match = re.match(r'(HIGH|LOW)\((BC|DE|HL)\)$', text)
+		if match:
+			text = match.group(2)[0 if match.group(1) == 'HIGH' else 1]
+		if text in REGS8:
+			return 'reg8', text, None
+		if text in ('AF', 'BC', 'DE', 'HL', 'SP', 'Z', 'NZ', 'NC', '[HL]', '[HL+]', '[HL-]', '[BC]', '[DE]', '[$FF00+C]'):
+			return 'literal', text, None
+		if text.startswith('SP+') or text.startswith('SP-'):
+			return 'spn', text, None
+		if text.startswith('[') and text.endswith(']'):
+			try:
+				value = evaluate(op.strip()[1:-1], symbols)
+			except (Unresolved, ValueError):
+				value = None
+			return 'mem', text, value
+		return 'imm', text, None
+
+
+class Function(object):
+	"""The result of analysing a function: its best and worst case cycles, the same for reaching any labels
+	in it with a budget, and its blocks and loops for reporting"""
+	def __init__(self, name, best, worst, budget, points, blocks, loops):
+		self.name = name
+		self.best = best
+		self.worst = worst
+		self.budget = budget
+		self.points = points
+		self.blocks = blocks
+		self.loops = loops
+
+	def over_budget(self):
+		return (self.budget is not None and self.worst > self.budget) or any(
+			worst > budget for label, best, worst, budget in self.points
+		)
+
+
+class Analyzer(object):
+	def __init__(self, program):
+		self.program = program
+		self.functions = {}
+		self.active = []
+
+	def function(self, name, where=None):
+		"""Analyse the function at label name"""
+		if name in self.functions:
+			return self.functions[name]
+		if name in self.active:
+			raise AnalysisError(where or name, "Recursion: {}".format(' -> '.join(self.active + [name])))
+		self.active.append(name)
+		try:
+			result = self._function(name, where)
+		finally:
+			self.active.pop()
+		self.functions[name] = result
+		return result
+
+	def _function(self, name, where):
+		symbols, section, start = self.program.find(name, where)
+		entry = section[start]
+		pools = [entry.notes['pool']] if 'pool' in entry.notes else []
+
+		successors = self.trace(name, symbols, section, start)
+		# labels within the function which have their own budget, from the start of the function
+		points = [index for index in successors if index != start and 'budget' in section[index].notes]
+		blocks = self.blocks(start, successors, points)
+		graph = dict((leader, edges) for leader, (end, edges) in blocks.items())
+		entry_node, loops, counted = self.collapse_loops(section, start, graph, blocks)
+		costs = self.path_costs(section, graph, entry_node, pools, counted)
+		if costs is None:
+			raise AnalysisError(entry.where, "{} never returns".format(name))
+		point_costs = []
+		for index in sorted(points):
+			item = section[index]
+			if index not in graph:
+				raise AnalysisError(item.where, "Can't have a budget inside a loop")
+			point = self.path_costs(section, graph, entry_node, pools, counted, index)
+			if point is None:
+				raise AnalysisError(item.where, "No way to get here that we can afford")
+			point_costs.append((self.describe(item), point[0], point[1], item.notes['budget']))
+		block_costs = [
+			(section[leader].where, self.describe(section[leader]), min(edge[1] for edge in edges), max(edge[2] for edge in edges))
+			for leader, (end, edges) in sorted(blocks.items())
+		]
+		return Function(name, costs[0], costs[1], entry.notes.get('budget'), point_costs, block_costs, loops)
+
+	def describe(self, item):
+		return item.label or item.code
+
+	def trace(self, name, symbols, section, start):
+		"""Find every line reachable from start. Returns {index: [(next index or EXIT, best, worst, spend)]}"""
+		successors = {}
+		pending = [start]
+		while pending:
+			index = pending.pop()
+			if index in successors:
+				continue
+			successors[index] = self.step(name, symbols, section, index)
+			pending += [next_index for next_index, _, _, _ in successors[index] if next_index is not EXIT]
+		return successors
+
+	def step(self, name, symbols, section, index):
+		item = section[index]
+		if item.unknown:
+			raise AnalysisError(item.where, item.unknown)
+		spend = item.notes.get('spend')
+		result = self._step(name, symbols, section, index, item, spend)
+		if any(next_index == len(section) for next_index, _, _, _ in result):
+			raise AnalysisError(item.where, "Runs off the end of the section")
+		return result
+
+	def _step(self, name, symbols, section, index, item, spend):
+		following = index + 1
+		if item.code is None and 'as' not in item.notes:
+			return [(following, 0, 0, spend)]
+
+		instruction = self.program.decode(symbols, item)
+		not_taken, taken = instruction.cycles
+		if 'exit' in item.notes:
+			return [(EXIT, taken, taken, spend)]
+		if instruction.kind == 'plain':
+			return [(following, taken, taken, spend)]
+		if instruction.kind in ('ret', 'cret'):
+			result = [(EXIT, taken, taken, spend)]
+		elif instruction.kind in ('jump', 'branch') and ('.' in instruction.target or instruction.target == name):
+			# local labels are always within the function
+			result = [(self.local_target(section, instruction.target, item), taken, taken, spend)]
+		else:
+			# a call, or a jump to another function which is a tail call
+			callee = self.function(instruction.target, item.where)
+			after = following if instruction.kind in ('call', 'ccall') else EXIT
+			result = [(after, taken + callee.best, taken + callee.worst, spend)]
+		if instruction.kind in ('branch', 'ccall', 'cret'):
+			result.append((following, not_taken, not_taken, spend))
+		return result
+
+	def local_target(self, section, label, item):
+		for symbols, target_section, index in self.program.labels.get(label, ()):
+			if target_section is section:
+				return index
+		raise AnalysisError(item.where, "Can't find {} in this section".format(label))
+
+	def blocks(self, start, successors, points):
+		"""Group lines into basic blocks, making sure each of points starts one.
+		Returns {leader: (last index, [(next leader or EXIT, best, worst, {pool: amount})])}"""
+		leaders = set([start] + points)
+		for index, edges in successors.items():
+			if len(edges) > 1 or edges[0][0] != index + 1:
+				leaders.update(next_index for next_index, _, _, _ in edges)
+		leaders.discard(EXIT)
+		blocks = {}
+		for leader in leaders:
+			index = leader
+			best = worst = 0
+			spend = {}
+			while True:
+				edges = successors[index]
+				if edges[0][3]:
+					pool, amount = edges[0][3]
+					spend[pool] = spend.get(pool, 0) + amount
+				if len(edges) > 1 or edges[0][0] is EXIT or edges[0][0] in leaders:
+					break
+				best += edges[0][1]
+				worst += edges[0][2]
+				index = edges[0][0]
+			blocks[leader] = (index, [
+				(next_index, best + edge_best, worst + edge_worst, spend)
+				for next_index, edge_best, edge_worst, _ in edges
+			])
+		return blocks
+
+	def collapse_loops(self, section, start, graph, blocks):
+		"""Find the loops in graph, and replace each one that has an @loop annotation with a single node
+		whose edges are the cost of the whole loop. graph is {node: [(next node, best, worst, spend)]}
+		and is modified. Loops which spend from a pool or contain a loop we can't replace are left for
+		path_costs to count its way around instead.
+		Returns (new entry node, [(where, description, (min, max) times, best, worst per time or None)],
+		[(header, body, (min, max) times)] for loops to count)."""
+		back_edges = []
+		state = {start: 'active'}
+		stack = [(start, iter(graph[start]))]
+		while stack:
+			node, edges = stack[-1]
+			for next_node, _, _, _ in edges:
+				if next_node is EXIT:
+					continue
+				if state.get(next_node) == 'active':
+					back_edges.append((node, next_node))
+				elif next_node not in state:
+					state[next_node] = 'active'
+					stack.append((next_node, iter(graph[next_node])))
+					break
+			else:
+				state[node] = 'done'
+				stack.pop()
+
+		predecessors = {}
+		for node, edges in graph.items():
+			for edge in edges:
+				predecessors.setdefault(edge[0], set()).add(node)
+		loops = {}
+		for source, header in back_edges:
+			body, sources = loops.setdefault(header, (set([header]), []))
+			sources.append(source)
+			pending = [source]
+			while pending:
+				node = pending.pop()
+				if node not in body:
+					body.add(node)
+					pending += predecessors.get(node, ())
+
+		found = []
+		counted = []
+		replaced = {}
+		def current(node):
+			while node in replaced:
+				node = replaced[node]
+			return node
+		# innermost first, so we know the cost of any loops inside a loop
+		for header, (body, sources) in sorted(loops.items(), key=lambda loop: len(loop[1][0])):
+			bounds = self.loop_bounds(section, header, [blocks[source][0] for source in sources])
+			if bounds is None:
+				# this had better spend from a pool, which path_costs will check
+				continue
+			low, high = bounds
+			where = section[header].where
+			body = set(current(node) for node in body)
+			header_node = current(header)
+			for node, edges in graph.items():
+				if node not in body and any(edge[0] in body and edge[0] != header_node for edge in edges):
+					raise AnalysisError(where, "Loop can be entered other than at its start")
+
+			order = self.topological_order(graph, header_node, body)
+			if order is None or any(edge[3] for node in body for edge in graph[node]):
+				counted.append((header_node, body, bounds))
+				found.append((where, self.describe(section[header]), bounds, None, None))
+				continue
+
+			# cheapest and dearest path from the header to each node in the loop, without going around again
+			costs = {header_node: (0, 0)}
+			for node in order:
+				node_best, node_worst = costs[node]
+				for next_node, best, worst, spend in graph[node]:
+					if next_node not in body or next_node == header_node:
+						continue
+					if next_node in costs:
+						old_best, old_worst = costs[next_node]
+						costs[next_node] = (min(old_best, node_best + best), max(old_worst, node_worst + worst))
+					else:
+						costs[next_node] = (node_best + best, node_worst + worst)
+			iterations = [
+				(costs[node][0] + best, costs[node][1] + worst)
+				for node in body for next_node, best, worst, _ in graph[node] if next_node == header_node
+			]
+			iteration_best = min(best for best, worst in iterations)
+			iteration_worst = max(worst for best, worst in iterations)
+			# each time but the last goes all the way around, and the last leaves the loop part way
+			exits = [
+				(
+					next_node,
+					(low - 1) * iteration_best + costs[node][0] + best,
+					(high - 1) * iteration_worst + costs[node][1] + worst,
+					{},
+				)
+				for node in body for next_node, best, worst, _ in graph[node] if next_node not in body
+			]
+			loop_node = ('loop', header)
+			for node in body:
+				del graph[node]
+				replaced[node] = loop_node
+			for node, edges in graph.items():
+				graph[node] = [(loop_node if edge[0] in body else edge[0],) + edge[1:] for edge in edges]
+			graph[loop_node] = exits
+			found.append((where, self.describe(section[header]), bounds, iteration_best, iteration_worst))
+		return current(start), found, counted
+
+	def loop_bounds(self, section, header, jumps):
+		"""Find a loop's @loop annotation, on the labels at its start or one of the jumps back to it"""
+		candidates = [section[index] for index in jumps]
+		index = header
+		while section[index].label is not None:
+			candidates.append(section[index])
+			index += 1
+		for item in candidates:
+			if 'loop' in item.notes:
+				return item.notes['loop']
+		return None
+
+	def topological_order(self, graph, start, nodes):
+		"""Order nodes so every edge between them (except those back to start) goes forwards,
+		or None if they contain another loop."""
+		order = []
+		state = {}
+		def visit(node):
+			state[node] = 'active'
+			for next_node, _, _, _ in graph[node]:
+				if next_node in nodes and next_node != start:
+					if state.get(next_node) == 'active' or (next_node not in state and not visit(next_node)):
+						return False
+			state[node] = 'done'
+			order.append(node)
+			return True
+		return order[::-1] if visit(start) else None
+
+	def path_costs(self, section, graph, entry, pools, counted, target=EXIT):
+		"""Find the (best, worst) cost from entry to target (EXIT by default), only taking paths we can
+		afford from the pools, and going around each counted loop as many times as its annotation allows.
+		Returns None if there's no way to target."""
+		names = [name for name, amount in pools]
+		results = {}
+		active = set()
+		def where(node):
+			return section[node[1] if isinstance(node, tuple) else node].where
+		def count(node, next_node, counts):
+			"""The number of times we've been into each counted loop after going from node to next_node,
+			or None if that's more or less times than it allows."""
+			counts = list(counts)
+			for i, (header, body, (low, high)) in enumerate(counted):
+				if next_node == header:
+					counts[i] = counts[i] + 1 if node in body else 1
+					if counts[i] > high:
+						return None
+				elif node in body and next_node not in body:
+					if counts[i] < low:
+						return None
+					counts[i] = 0
+			return tuple(counts)
+		def visit(node, remaining, counts):
+			key = (node, remaining, counts)
+			if key in results:
+				return results[key]
+			if key in active:
+				raise AnalysisError(where(node), "Loop has no @loop annotation, and doesn't spend from a pool")
+			active.add(key)
+			result = None
+			for next_node, best, worst, spend in graph[node]:
+				for pool in spend:
+					if pool not in names:
+						raise AnalysisError(where(node), "Spends from pool {}, which isn't declared".format(pool))
+				after = tuple(left - spend.get(pool, 0) for pool, left in zip(names, remaining))
+				next_counts = count(node, next_node, counts)
+				if any(left < 0 for left in after) or next_counts is None:
+					continue
+				if next_node == target:
+					rest = (0, 0)
+				elif next_node is EXIT:
+					rest = None
+				else:
+					rest = visit(next_node, after, next_counts)
+				if rest is None:
+					continue
+				cost = (best + rest[0], worst + rest[1])
+				result = cost if result is None else (min(result[0], cost[0]), max(result[1], cost[1]))
+			active.remove(key)
+			results[key] = result
+			return result
+		return visit(
+			entry,
+			tuple(amount for name, amount in pools),
+			tuple(1 if header == entry else 0 for header, body, bounds in counted),
+		)
+
+
+def report(function, blocks=False):
+	line = "{}: {}-{} cycles".format(function.name, function.best, function.worst)
+	if function.budget is not None:
+		line += " (budget {}{})".format(function.budget, ", OVER BUDGET" if function.worst > function.budget else "")
+	print line
+	for label, best, worst, budget in function.points:
+		print "\tto {}: {}-{} cycles (budget {}{})".format(label, best, worst, budget, ", OVER BUDGET" if worst > budget else "")
+	if blocks:
+		for where, description, best, worst in function.blocks:
+			print "\t{}: {}: {}-{}".format(where, description, best, worst)
+		for where, description, (low, high), best, worst in function.loops:
+			line = "\t{}: loop {}: {}-{} times".format(where, description, low, high)
+			if best is not None:
+				line += ", {}-{} cycles each".format(best, worst)
+			print line
+
+
+@argh.arg('filepaths', nargs='+', help="Source files to analyse, as they would be assembled")
+@argh.arg('--functions', help="Comma-seperated labels to report, as well as those with an @budget")
+@argh.arg('--define', help="Comma-seperated NAME=VALUE constants to define, like rgbasm -D")
+def main(filepaths, include='include/', define='DEBUG=0', functions='', blocks=False, check=False):
+	"""Report best and worst case cycles for each function with an @budget, and any others asked for.
+	With --check, exit non-zero if any are over budget or can't be analysed."""
+	sys.setrecursionlimit(10000)
+	defines = {}
+	for definition in filter(None, define.split(',')):
+		name, _, value = definition.partition('=')
+		defines[name] = int(value or '1', 0)
+	program = Program(filepaths, [include], defines, load_reference())
+	analyzer = Analyzer(program)
+	names = []
+	for symbols, section in program.sections:
+		for item in section:
+			if item.label and 'budget' in item.notes and item.scope not in names:
+				names.append(item.scope)
+	names += [name for name in functions.split(',') if name and name not in names]
+
+	failed = False
+	for name in names:
+		try:
+			function = analyzer.function(name)
+		except AnalysisError as e:
+			print "{}: Can't analyse: {}".format(name, e)
+			failed = True
+			continue
+		report(function, blocks)
+		if function.over_budget():
+			failed = True
+	if check and failed:
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	argh.dispatch_command(main)
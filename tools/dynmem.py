@@ -0,0 +1,256 @@
+"""A reference model of the dynamic memory allocator in malloc.asm.
+
+It keeps its state in a copy of the DynMem range laid out byte-for-byte the same as the real thing,
+so the unit tests can use it to work out what memory should look like after a series of operations.
+
+Run it directly to benchmark fragmentation over long randomized traces of allocations and frees.
+"""
+
+import random
+
+import argh
+
+
+# Chunk header, as per malloc.asm
+CHUNK_LEN, CHUNK_PREV_LEN, CHUNK_OWNER = range(3)
+CHUNK_DATA = 3
+# Links kept in the data of free chunks
+CHUNK_FREE_NEXT = CHUNK_DATA
+CHUNK_FREE_PREV = CHUNK_DATA + 2
+MIN_CHUNK = CHUNK_DATA + 4
+MAX_DATA = 256 - CHUNK_DATA
+
+SENTINEL = 1
+NO_PREV = 1
+FREE = 0xff
+
+# Smallest chunk length in each size class
+CLASSES = [7, 16, 32, 64, 128]
+HEADER_SIZE = 2 * len(CLASSES)
+
+
+class DynMem(object):
+	"""A DynMem range of the given number of pages, starting at address base.
+	mem holds the contents of the range, with None for bytes the allocator never writes."""
+
+	def __init__(self, base, pages):
+		self.base = base
+		self.pages = pages
+		self.mem = [None] * (256 * pages)
+		# total number of chunks looked at by alloc when no size class was guaranteed to fit
+		self.scanned = 0
+		self.init()
+
+	def __getitem__(self, addr):
+		return self.mem[addr - self.base]
+
+	def __setitem__(self, addr, value):
+		self.mem[addr - self.base] = value
+
+	def word(self, addr):
+		return self[addr] | (self[addr + 1] << 8)
+
+	def set_word(self, addr, value):
+		self[addr] = value & 0xff
+		self[addr + 1] = value >> 8
+
+	def length(self, chunk):
+		"""Chunk length, with 0 meaning 256"""
+		return self[chunk + CHUNK_LEN] or 256
+
+	def prev_length(self, chunk):
+		return self[chunk + CHUNK_PREV_LEN] or 256
+
+	def set_header(self, chunk, length, prev_length=None, owner=None):
+		self[chunk + CHUNK_LEN] = length % 256
+		if prev_length is not None:
+			self[chunk + CHUNK_PREV_LEN] = prev_length % 256
+		if owner is not None:
+			self[chunk + CHUNK_OWNER] = owner
+
+	def class_head(self, length):
+		"""Address of the free list head for the size class containing length"""
+		cls = max(i for i, smallest in enumerate(CLASSES) if length >= smallest)
+		return self.base + 2 * cls
+
+	def init(self):
+		for i in range(HEADER_SIZE):
+			self.mem[i] = 0
+		chunk = self.base + HEADER_SIZE
+		prev_length = NO_PREV
+		for page in range(self.pages):
+			length = 256
+			if page == self.pages - 1:
+				length = 256 - HEADER_SIZE - CHUNK_DATA
+			self.set_header(chunk, length, prev_length, FREE)
+			self.push_free(chunk)
+			prev_length = length
+			chunk += length
+		self.set_header(chunk, SENTINEL, prev_length, 0)
+
+	def push_free(self, chunk):
+		head = self.class_head(self.length(chunk))
+		first = self.word(head)
+		self.set_word(head, chunk)
+		self.set_word(chunk + CHUNK_FREE_NEXT, first)
+		self.set_word(chunk + CHUNK_FREE_PREV, head)
+		if first:
+			self.set_word(first + CHUNK_FREE_PREV, chunk + CHUNK_FREE_NEXT)
+
+	def unlink(self, chunk):
+		next_chunk = self.word(chunk + CHUNK_FREE_NEXT)
+		link = self.word(chunk + CHUNK_FREE_PREV)
+		self.set_word(link, next_chunk)
+		if next_chunk:
+			self.set_word(next_chunk + CHUNK_FREE_PREV, link)
+
+	def free_list(self, head):
+		"""The chunks in the free list with the given head, in order"""
+		chunks = []
+		chunk = self.word(head)
+		while chunk:
+			chunks.append(chunk)
+			chunk = self.word(chunk + CHUNK_FREE_NEXT)
+		return chunks
+
+	def alloc(self, size, owner):
+		"""Allocate size bytes to owner. Returns the address of the data, or 0 on failure."""
+		if not 0 <= size <= MAX_DATA:
+			raise ValueError("Can't allocate {} bytes".format(size))
+		length = max(size + CHUNK_DATA, MIN_CHUNK)
+
+		chunk = None
+		head = self.class_head(length)
+		# Our own class's first chunk is the closest fit, if it's long enough
+		if self.word(head) and self.length(self.word(head)) >= length:
+			chunk = self.word(head)
+		else:
+			# Otherwise, any chunk in a later class is long enough
+			for later in range(head + 2, self.base + HEADER_SIZE, 2):
+				if self.word(later):
+					chunk = self.word(later)
+					break
+			else:
+				for candidate in self.free_list(head):
+					self.scanned += 1
+					if self.length(candidate) >= length:
+						chunk = candidate
+						break
+		if chunk is None:
+			return 0
+
+		self.unlink(chunk)
+		excess = self.length(chunk) - length
+		if excess >= MIN_CHUNK:
+			self.set_header(chunk, length)
+			rest = chunk + length
+			self.set_header(rest, excess, length, FREE)
+			self[rest + excess + CHUNK_PREV_LEN] = excess
+			self.push_free(rest)
+		self[chunk + CHUNK_OWNER] = owner
+		return chunk + CHUNK_DATA
+
+	def free(self, addr):
+		"""Free the allocation at addr, merging it with free neighbours where they fit"""
+		chunk = addr - CHUNK_DATA
+		length = self.length(chunk)
+
+		next_chunk = chunk + length
+		if self[next_chunk + CHUNK_OWNER] == FREE and length + self.length(next_chunk) <= 256:
+			length += self.length(next_chunk)
+			self.unlink(next_chunk)
+
+		if self[chunk + CHUNK_PREV_LEN] != NO_PREV:
+			prev = chunk - self.prev_length(chunk)
+			if self[prev + CHUNK_OWNER] == FREE and length + self.length(prev) <= 256:
+				length += self.length(prev)
+				self.unlink(prev)
+				chunk = prev
+
+		self.set_header(chunk, length, owner=FREE)
+		self[chunk + length + CHUNK_PREV_LEN] = length % 256
+		self.push_free(chunk)
+
+	def chunks(self):
+		"""All chunks in the range as a list of (address, length, owner), not including the sentinel"""
+		result = []
+		chunk = self.base + HEADER_SIZE
+		while self[chunk + CHUNK_LEN] != SENTINEL:
+			result.append((chunk, self.length(chunk), self[chunk + CHUNK_OWNER]))
+			chunk += self.length(chunk)
+		return result
+
+	def largest_free(self):
+		"""Largest allocation that could currently succeed, in bytes of data"""
+		return max([length - CHUNK_DATA for chunk, length, owner in self.chunks() if owner == FREE] or [0])
+
+	def total_free(self):
+		"""Total free data bytes, if all free chunks could be used for data"""
+		return sum(length - CHUNK_DATA for chunk, length, owner in self.chunks() if owner == FREE)
+
+
+def random_trace(rand, length, max_size=64, live=16):
+	"""Generate a trace of operations, each either ('alloc', size, slot) or ('free', slot).
+	Allocation sizes are weighted towards small ones. At most live allocations are held at once,
+	each in its own slot, and frees are of a random held slot."""
+	trace = []
+	held = []
+	for i in range(length):
+		free_slots = [slot for slot in range(live) if slot not in held]
+		if held and (not free_slots or rand.random() < 0.5):
+			slot = rand.choice(held)
+			held.remove(slot)
+			trace.append(('free', slot))
+		else:
+			slot = rand.choice(free_slots)
+			size = min(max_size, int(rand.expovariate(1. / (max_size / 4))) + 1)
+			held.append(slot)
+			trace.append(('alloc', size, slot))
+	return trace
+
+
+def run_trace(dynmem, trace, owner=1):
+	"""Run a trace against the allocator. Allocations that fail leave their slot empty
+	and the matching free is skipped. Returns the number of failed allocations."""
+	slots = {}
+	failures = 0
+	for op in trace:
+		if op[0] == 'alloc':
+			_, size, slot = op
+			slots[slot] = dynmem.alloc(size, owner)
+			if not slots[slot]:
+				failures += 1
+		else:
+			_, slot = op
+			addr = slots.pop(slot)
+			if addr:
+				dynmem.free(addr)
+	return failures
+
+
+def main(traces=100, length=1000, pages=4, max_size=64, live=16, seed=0):
+	"""Run randomized traces against the allocator and report how fragmented memory gets.
+	Fragmentation is how much smaller the largest possible allocation is than it would be if all free memory
+	were in one place (allocations are never bigger than MAX_DATA, so that's the most free memory can be worth)."""
+	rand = random.Random(seed)
+	total_ops = total_allocs = total_failures = total_scanned = 0
+	fragmentation = []
+	for i in range(traces):
+		dynmem = DynMem(0xc000, pages)
+		trace = random_trace(rand, length, max_size, live)
+		total_failures += run_trace(dynmem, trace)
+		total_ops += len(trace)
+		total_allocs += sum(1 for op in trace if op[0] == 'alloc')
+		total_scanned += dynmem.scanned
+		best = min(dynmem.total_free(), MAX_DATA)
+		fragmentation.append(1 - float(dynmem.largest_free()) / best if best else 0)
+	print "{} traces of {} ops, {} pages, sizes up to {}, up to {} live".format(traces, length, pages, max_size, live)
+	print "Failed allocations: {} ({:.2f}%)".format(total_failures, 100. * total_failures / total_allocs)
+	print "Chunks scanned per op: {:.3f}".format(float(total_scanned) / total_ops)
+	print "Fragmentation at end of trace: mean {:.1f}%, worst {:.1f}%".format(
+		100 * sum(fragmentation) / len(fragmentation), 100 * max(fragmentation),
+	)
+
+
+if __name__ == '__main__':
+	argh.dispatch_command(main)
@@ -0,0 +1,797 @@
+"""A minimal headless Game Boy emulator, intended for running test roms quickly.
+
+It emulates the SM83 CPU, memory map (with simple ROM, cart RAM, VRAM and WRAM banking),
+interrupts, the timer, LCD timing (LY and VBlank only, nothing is drawn), OAM DMA,
+CGB general-purpose VRAM DMA and the joypad and serial registers.
+Something can be connected to the other end of the link cable with connect().
+It also understands bgb-style debug messages ("ld d, d" followed by a message header),
+which are collected rather than printed.
+
+Accuracy is "good enough for our code", not cycle-perfect. The exception is the timer, since the scheduler
+switches its rate on the fly (see SchedIdle in scheduler.asm) and relies on exactly when that happens:
+loads and stores access memory on the same cycle of the instruction as on hardware, TIMA reloads and
+raises its interrupt a cycle after it overflows, and leaving halt takes a cycle. All times are in M-cycles
+(1 M-cycle = 4 clocks, 1048576 M-cycles per second), matching the cycle counts in
+our code comments, except for the bgb clock counters in debug messages which are in clocks.
+
+It has no dependencies, and runs under either python 2 or 3.
+"""
+
+import re
+
+
+# Cycle counts
+CYCLES_PER_LINE = 114
+LINES_PER_FRAME = 154
+VBLANK_LINE = 144
+CYCLES_PER_FRAME = CYCLES_PER_LINE * LINES_PER_FRAME
+DIV_PERIOD = 64 # cycles per DIV increment
+TIMER_PERIODS = [256, 4, 16, 64] # cycles per TIMA increment, indexed by TimerControl & 3
+TIMA_RELOAD_CYCLES = 1 # after TIMA overflows, it reads 0 for this long before being reloaded from TMA
+HALT_EXIT_CYCLES = 1 # extra time to resume once an interrupt is pending
+SERIAL_TRANSFER_CYCLES = 1024 # 8 bits at 8192Hz
+SERIAL_NONE = 0xff # what's shifted in when nothing is on the other end
+
+NEVER = float('inf')
+
+# bgb debug message substitutions for registers
+_REGISTER_SUBSTITUTIONS = {
+	'A': lambda cpu: cpu.a,
+	'B': lambda cpu: cpu.b,
+	'C': lambda cpu: cpu.c,
+	'D': lambda cpu: cpu.d,
+	'E': lambda cpu: cpu.e,
+	'H': lambda cpu: cpu.h,
+	'L': lambda cpu: cpu.l,
+	'F': lambda cpu: cpu.f,
+}
+_PAIR_SUBSTITUTIONS = {
+	'AF': lambda cpu: (cpu.a << 8) | cpu.f,
+	'BC': lambda cpu: (cpu.b << 8) | cpu.c,
+	'DE': lambda cpu: (cpu.d << 8) | cpu.e,
+	'HL': lambda cpu: (cpu.h << 8) | cpu.l,
+	'SP': lambda cpu: cpu.sp,
+	'PC': lambda cpu: cpu.pc,
+}
+_SUBSTITUTION_RE = re.compile(r'%([A-Z0-9]+)%')
+
+
+class GameBoy(object):
+	"""A single emulated system running the given rom (a bytes-like object).
+
+	Call run() to execute until the rom stops making progress (see run() for details).
+	Debug messages are appended to the messages list as they are emitted.
+	"""
+
+	ROM_BANK_SIZE = 0x4000
+	CART_RAM_BANKS = 16
+	CART_RAM_BANK_SIZE = 0x2000
+	VRAM_BANKS = 2
+	VRAM_BANK_SIZE = 0x2000
+	WRAM_BANKS = 8
+	WRAM_BANK_SIZE = 0x1000
+
+	def __init__(self, rom):
+		rom = bytearray(rom)
+		# pad rom out to a whole number of banks, with at least 2 banks
+		banks = max(2, -(-len(rom) // self.ROM_BANK_SIZE))
+		self.rom = rom + bytearray([0xff] * (banks * self.ROM_BANK_SIZE - len(rom)))
+		self.rom_banks = banks
+
+		# mem is the currently visible memory map. Banked regions are copied in and out of
+		# their backing stores on a bank switch, so that most reads and writes can go directly to mem.
+		self.mem = bytearray(0x10000)
+		self.mem[:0x8000] = self.rom[:0x8000]
+		self.rom_bank = 1
+		self.cart_ram = [bytearray(self.CART_RAM_BANK_SIZE) for _ in range(self.CART_RAM_BANKS)]
+		self.cart_ram_bank = 0
+		self.vram = [bytearray(self.VRAM_BANK_SIZE) for _ in range(self.VRAM_BANKS)]
+		self.vram_bank = 0
+		self.wram = [bytearray(self.WRAM_BANK_SIZE) for _ in range(self.WRAM_BANKS)]
+		self.wram_bank = 1
+
+		# registers, as per state after the boot rom on a DMG
+		self.a, self.f = 0x01, 0xb0
+		self.b, self.c = 0x00, 0x13
+		self.d, self.e = 0x00, 0xd8
+		self.h, self.l = 0x01, 0x4d
+		self.sp = 0xfffe
+		self.pc = 0x0100
+		self.ime = False
+		self.ei_pending = 0
+		self.halted = False
+		self.looping = False # set when a jump to itself is executed
+
+		self.cycles = 0
+		self.messages = []
+		self.zero_clocks = 0 # clock count at the last %ZEROCLKS%
+
+		# hardware state
+		self.interrupt_flags = 0
+		self.interrupt_enable = 0
+		self.buttons = 0 # bitmask of pressed buttons, same layout as JoyState: dpad in upper nibble
+		self.joy_select = 0x30
+		self.div_base = 0 # cycle at which DIV was last reset
+		self.timer_control = 0
+		self.timer_modulo = 0
+		self.tima_value = 0 # value of TIMA at tima_base
+		self.tima_base = 0
+		self.tima_overflow = NEVER
+		self.lcd_on = False
+		self.lcd_base = 0 # cycle at which the LCD was turned on
+		self.next_vblank = NEVER
+		self.stat = 0
+		self.serial_data = 0
+		self.serial_control = 0
+		self.serial_done = NEVER
+		self.link = None # the other end of the link cable, see connect()
+		self.next_event = NEVER
+
+		self.ops = _OPS
+		self.cb_ops = _CB_OPS
+
+		self.write_lcd_control(0x91) # the boot rom leaves the LCD on
+
+	# --- memory ---
+
+	def read(self, addr):
+		if addr < 0xe000:
+			return self.mem[addr]
+		if addr >= 0xff00:
+			return self.read_io(addr)
+		if addr < 0xfe00:
+			return self.mem[addr - 0x2000] # echo ram
+		return self.mem[addr]
+
+	def write(self, addr, value):
+		if addr < 0x8000:
+			self.write_mbc(addr, value)
+		elif addr < 0xe000:
+			self.mem[addr] = value
+		elif addr < 0xfe00:
+			self.mem[addr - 0x2000] = value # echo ram
+		elif addr < 0xff00:
+			self.mem[addr] = value
+		else:
+			self.write_io(addr, value)
+
+	def write_mbc(self, addr, value):
+		# We act like a simplified MBC5: $2000-$3fff selects rom bank, $4000-$5fff selects ram bank.
+		# Like MBC1, selecting rom bank 0 actually selects bank 1.
+		if 0x2000 <= addr < 0x4000:
+			bank = (value or 1) % self.rom_banks
+			if bank != self.rom_bank:
+				start = bank * self.ROM_BANK_SIZE
+				self.mem[0x4000:0x8000] = self.rom[start:start + self.ROM_BANK_SIZE]
+				self.rom_bank = bank
+		elif 0x4000 <= addr < 0x6000:
+			bank = value % self.CART_RAM_BANKS
+			self.cart_ram[self.cart_ram_bank][:] = self.mem[0xa000:0xc000]
+			self.mem[0xa000:0xc000] = self.cart_ram[bank]
+			self.cart_ram_bank = bank
+
+	def switch_vram_bank(self, bank):
+		bank %= self.VRAM_BANKS
+		self.vram[self.vram_bank][:] = self.mem[0x8000:0xa000]
+		self.mem[0x8000:0xa000] = self.vram[bank]
+		self.vram_bank = bank
+
+	def switch_wram_bank(self, bank):
+		bank = (bank % self.WRAM_BANKS) or 1
+		self.wram[self.wram_bank][:] = self.mem[0xd000:0xe000]
+		self.mem[0xd000:0xe000] = self.wram[bank]
+		self.wram_bank = bank
+
+	def read_io(self, addr):
+		if addr >= 0xff80:
+			if addr == 0xffff:
+				return self.interrupt_enable
+			return self.mem[addr]
+		# We may be part way through an instruction, so anything due by now hasn't been handled yet
+		if self.cycles >= self.next_event:
+			self.process_events()
+		if addr == 0xff00:
+			value = 0xc0 | self.joy_select | 0x0f
+			if not self.joy_select & 0x10:
+				value &= ~(self.buttons >> 4) # dpad
+			if not self.joy_select & 0x20:
+				value &= ~(self.buttons & 0x0f) # buttons
+			return value & 0xff
+		if addr == 0xff01:
+			return self.serial_data
+		if addr == 0xff02:
+			return self.serial_control | 0x7e
+		if addr == 0xff04:
+			return ((self.cycles - self.div_base) // DIV_PERIOD) & 0xff
+		if addr == 0xff05:
+			return self.read_tima()
+		if addr == 0xff06:
+			return self.timer_modulo
+		if addr == 0xff07:
+			return self.timer_control | 0xf8
+		if addr == 0xff0f:
+			return self.interrupt_flags | 0xe0
+		if addr == 0xff41:
+			return 0x80 | self.stat | self.lcd_mode()
+		if addr == 0xff44:
+			return self.read_ly()
+		if addr == 0xff4f:
+			return 0xfe | self.vram_bank
+		if addr == 0xff70:
+			return 0xf8 | self.wram_bank
+		return self.mem[addr]
+
+	def write_io(self, addr, value):
+		if addr >= 0xff80:
+			if addr == 0xffff:
+				self.interrupt_enable = value
+			else:
+				self.mem[addr] = value
+			return
+		if self.cycles >= self.next_event:
+			self.process_events() # as in read_io
+		if addr == 0xff00:
+			self.joy_select = value & 0x30
+		elif addr == 0xff01:
+			self.serial_data = value
+		elif addr == 0xff02:
+			self.write_serial_control(value)
+		elif addr == 0xff04:
+			self.tima_value = self.read_tima()
+			self.div_base = self.tima_base = self.cycles
+			self.update_timer()
+		elif addr == 0xff05:
+			self.tima_value = value
+			self.tima_base = self.cycles
+			self.update_timer()
+		elif addr == 0xff06:
+			self.timer_modulo = value
+		elif addr == 0xff07:
+			self.tima_value = self.read_tima()
+			self.tima_base = self.cycles
+			self.timer_control = value & 7
+			self.update_timer()
+		elif addr == 0xff0f:
+			self.interrupt_flags = value & 0x1f
+		elif addr == 0xff40:
+			self.write_lcd_control(value)
+		elif addr == 0xff41:
+			self.stat = value & 0x78
+		elif addr == 0xff44:
+			pass # read only
+		elif addr == 0xff46:
+			# OAM DMA. We complete it instantly, which is fine as long as
+			# code waits in HRAM for the real duration as it must on hardware.
+			src = value << 8
+			for i in range(0xa0):
+				self.mem[0xfe00 + i] = self.read(src + i)
+		elif addr == 0xff4f:
+			self.switch_vram_bank(value & 1)
+		elif addr == 0xff55:
+			self.vram_dma(value)
+		elif addr == 0xff70:
+			self.switch_wram_bank(value & 7)
+		else:
+			self.mem[addr] = value
+
+	def vram_dma(self, value):
+		# CGB VRAM DMA. We do both general-purpose and hblank modes instantly.
+		src = ((self.mem[0xff51] << 8) | self.mem[0xff52]) & 0xfff0
+		dest = 0x8000 | (((self.mem[0xff53] << 8) | self.mem[0xff54]) & 0x1ff0)
+		length = ((value & 0x7f) + 1) * 16
+		for i in range(length):
+			self.mem[0x8000 | ((dest + i) & 0x1fff)] = self.read((src + i) & 0xffff)
+		self.mem[0xff55] = 0xff
+
+	# --- timer, lcd and serial ---
+
+	def read_tima(self):
+		if not self.timer_control & 4:
+			return self.tima_value
+		period = TIMER_PERIODS[self.timer_control & 3]
+		ticks = (self.cycles - self.div_base) // period - (self.tima_base - self.div_base) // period
+		# This is only 0x100 between overflowing and being reloaded, when it reads 0
+		return (self.tima_value + ticks) & 0xff
+
+	def update_timer(self):
+		"""Recalculate when TIMA will next overflow, after any change to timer state"""
+		if self.timer_control & 4:
+			period = TIMER_PERIODS[self.timer_control & 3]
+			# TIMA increments whenever the relevant bit of the internal counter (which DIV is the top of) falls,
+			# ie. at every multiple of period since div_base.
+			ticks_at_base = (self.tima_base - self.div_base) // period
+			overflow = self.div_base + (ticks_at_base + 0x100 - self.tima_value) * period
+			self.tima_overflow = overflow + TIMA_RELOAD_CYCLES # when it's reloaded and the interrupt is raised
+		else:
+			self.tima_overflow = NEVER
+		self.update_next_event()
+
+	def write_lcd_control(self, value):
+		self.mem[0xff40] = value
+		lcd_on = bool(value & 0x80)
+		if lcd_on and not self.lcd_on:
+			self.lcd_base = self.cycles
+			self.next_vblank = self.cycles + VBLANK_LINE * CYCLES_PER_LINE
+		elif not lcd_on:
+			self.next_vblank = NEVER
+		self.lcd_on = lcd_on
+		self.update_next_event()
+
+	def read_ly(self):
+		if not self.lcd_on:
+			return 0
+		return ((self.cycles - self.lcd_base) // CYCLES_PER_LINE) % LINES_PER_FRAME
+
+	def lcd_mode(self):
+		if not self.lcd_on:
+			return 0
+		ly = self.read_ly()
+		if ly >= VBLANK_LINE:
+			return 1
+		dot = (self.cycles - self.lcd_base) % CYCLES_PER_LINE
+		if dot < 20:
+			return 2
+		if dot < 63:
+			return 3
+		return 0
+
+	def connect(self, link):
+		"""Connect something to the other end of the link cable. It must have:
+			next_transfer: The cycle at which it will next finish a transfer using its own clock, or NEVER.
+			exchange(value, cycle): Called when a transfer finishes, with the byte we sent,
+				or SERIAL_NONE if it used its own clock and we weren't ready. Returns the byte it sent.
+		Transfers using its clock are treated as happening all at once when they finish."""
+		self.link = link
+		self.update_next_event()
+
+	def write_serial_control(self, value):
+		self.serial_control = value & 0x81
+		if value & 0x81 == 0x81:
+			# Transfer using internal clock. With nothing connected, we shift in all 1s.
+			self.serial_done = self.cycles + SERIAL_TRANSFER_CYCLES
+		else:
+			self.serial_done = NEVER
+		self.update_next_event()
+
+	def update_next_event(self):
+		link_transfer = NEVER if self.link is None else self.link.next_transfer
+		self.next_event = min(self.tima_overflow, self.next_vblank, self.serial_done, link_transfer)
+
+	def process_events(self):
+		"""Handle all timed events that are due"""
+		while self.cycles >= self.tima_overflow:
+			self.interrupt_flags |= 0x04
+			self.tima_value = self.timer_modulo
+			self.tima_base = self.tima_overflow - TIMA_RELOAD_CYCLES # counting carries on from the overflow
+			self.update_timer()
+		while self.cycles >= self.next_vblank:
+			self.interrupt_flags |= 0x01
+			self.next_vblank += CYCLES_PER_FRAME
+		if self.cycles >= self.serial_done:
+			self.serial_data = SERIAL_NONE if self.link is None else self.link.exchange(self.serial_data, self.serial_done)
+			self.serial_control &= 0x7f
+			self.serial_done = NEVER
+			self.interrupt_flags |= 0x08
+		while self.link is not None and self.cycles >= self.link.next_transfer:
+			# Transfer using the other end's clock. We only take part if we're waiting for one.
+			if self.serial_control & 0x81 == 0x80:
+				self.serial_data = self.link.exchange(self.serial_data, self.link.next_transfer)
+				self.serial_control &= 0x7f
+				self.interrupt_flags |= 0x08
+			else:
+				self.link.exchange(SERIAL_NONE, self.link.next_transfer)
+		self.update_next_event()
+
+	# --- stack ---
+
+	def push(self, value):
+		sp = (self.sp - 1) & 0xffff
+		self.write(sp, value >> 8)
+		sp = (sp - 1) & 0xffff
+		self.write(sp, value & 0xff)
+		self.sp = sp
+
+	def pop(self):
+		sp = self.sp
+		value = self.read(sp) | (self.read((sp + 1) & 0xffff) << 8)
+		self.sp = (sp + 2) & 0xffff
+		return value
+
+	# --- execution ---
+
+	def run(self, max_cycles=None):
+		"""Run until the rom stops making progress, or the cycle count reaches max_cycles.
+		A rom is considered to have stopped when it executes a jump to itself (a tight infinite loop),
+		or it halts with no possibility of being woken up.
+		Returns True if the rom stopped, False if it ran out of cycles."""
+		ops = self.ops
+		limit = NEVER if max_cycles is None else max_cycles
+		while True:
+			if self.cycles >= self.next_event:
+				self.process_events()
+			pending = self.interrupt_flags & self.interrupt_enable & 0x1f
+			if pending:
+				if self.halted:
+					self.halted = False
+					self.cycles += HALT_EXIT_CYCLES
+				if self.ime:
+					self.service_interrupt(pending)
+			if self.halted:
+				if not self.interrupt_enable or self.next_event == NEVER:
+					return True # halted forever
+				self.cycles = max(self.cycles, min(self.next_event, limit))
+			else:
+				pc = self.pc
+				op = self.mem[pc] if pc < 0xe000 else self.read(pc)
+				self.pc = (pc + 1) & 0xffff
+				cycles = ops[op](self) # this may advance self.cycles itself, up to a memory access
+				self.cycles += cycles
+				if self.ei_pending:
+					self.ei_pending -= 1
+					if not self.ei_pending:
+						self.ime = True
+				if self.looping:
+					return True
+			if self.cycles >= limit:
+				return False
+
+	def service_interrupt(self, pending):
+		for bit in range(5):
+			if pending & (1 << bit):
+				break
+		self.interrupt_flags &= ~(1 << bit)
+		self.ime = False
+		self.push(self.pc)
+		self.pc = 0x40 + 8 * bit
+		self.cycles += 5
+
+	def halt(self):
+		self.halted = True
+
+	# --- debug messages ---
+
+	def debug_message(self):
+		"""Called on executing 'ld d, d'. If it's followed by a bgb debug message, record the message.
+		The format is: ld d, d; jr .end; dw $6464, type; data; .end
+		where type 0 is followed by the text directly, and type 1 by the address and bank of a null-terminated string.
+		"""
+		pc = self.pc
+		read = self.read
+		if read(pc) != 0x18 or read((pc + 2) & 0xffff) != 0x64 or read((pc + 3) & 0xffff) != 0x64:
+			return
+		length = read((pc + 1) & 0xffff) - 4 # the jr skips the header and the data
+		kind = read((pc + 4) & 0xffff) | (read((pc + 5) & 0xffff) << 8)
+		if kind == 0:
+			text = bytearray(read((pc + 6 + i) & 0xffff) for i in range(length))
+		elif kind == 1:
+			addr = read((pc + 6) & 0xffff) | (read((pc + 7) & 0xffff) << 8)
+			bank = read((pc + 8) & 0xffff) | (read((pc + 9) & 0xffff) << 8)
+			text = bytearray()
+			while len(text) < 0x1000:
+				if 0x4000 <= addr < 0x8000:
+					value = self.rom[(bank % self.rom_banks) * self.ROM_BANK_SIZE + addr - 0x4000]
+				else:
+					value = read(addr)
+				if not value:
+					break
+				text.append(value)
+				addr = (addr + 1) & 0xffff
+		else:
+			return
+		self.messages.append(self.substitute(text.decode('latin-1')))
+
+	def substitute(self, text):
+		"""Apply bgb-style substitutions such as %A% or %TOTALCLKS% to a debug message"""
+		def replace(match):
+			name = match.group(1)
+			if name in _REGISTER_SUBSTITUTIONS:
+				return '${:02x}'.format(_REGISTER_SUBSTITUTIONS[name](self))
+			if name in _PAIR_SUBSTITUTIONS:
+				return '${:04x}'.format(_PAIR_SUBSTITUTIONS[name](self))
+			clocks = self.cycles * 4
+			if name == 'TOTALCLKS':
+				return str(clocks)
+			if name == 'ZEROCLKS':
+				self.zero_clocks = clocks
+				return ''
+			if name == 'LASTCLKS':
+				return str(clocks - self.zero_clocks)
+			if name == 'ROMBANK':
+				return str(self.rom_bank)
+			if name in ('LY', 'SCANLINE'):
+				return str(self.read_ly())
+			return match.group(0)
+		return _SUBSTITUTION_RE.sub(replace, text)
+
+
+def _build_ops():
+	"""Generate the opcode tables. Each opcode is a function taking the GameBoy, executing
+	one instruction (with pc already past the opcode byte) and returning the number of cycles taken.
+	We generate source for each one, as this is much faster than decoding operands at runtime."""
+
+	regs = ['b', 'c', 'd', 'e', 'h', 'l', None, 'a'] # None = (HL)
+	pairs = [('b', 'c'), ('d', 'e'), ('h', 'l')]
+	conditions = [
+		'not s.f & 0x80', # nz
+		's.f & 0x80', # z
+		'not s.f & 0x10', # nc
+		's.f & 0x10', # c
+	]
+	HL = '((s.h << 8) | s.l)'
+	IMM8 = ['v = s.read(s.pc)', 's.pc = (s.pc + 1) & 0xffff']
+	IMM16 = ['v = s.read(s.pc) | (s.read((s.pc + 1) & 0xffff) << 8)', 's.pc = (s.pc + 2) & 0xffff']
+	SIGNED = ['if v > 0x7f: v -= 0x100']
+
+	def get(i):
+		return 's.read({})'.format(HL) if regs[i] is None else 's.{}'.format(regs[i])
+
+	# Instructions which access memory do so on their last cycle, or the last two for a read then write.
+	# Their source advances the clock to the access with this, and returns the cycles left after it.
+	def at(cycle):
+		return 's.cycles += {}'.format(cycle)
+
+	def put(i, expr):
+		return 's.write({}, {})'.format(HL, expr) if regs[i] is None else 's.{} = {}'.format(regs[i], expr)
+
+	def get_pair(i):
+		if i == 3:
+			return 's.sp'
+		hi, lo = pairs[i]
+		return '((s.{} << 8) | s.{})'.format(hi, lo)
+
+	def put_pair(i, expr):
+		if i == 3:
+			return ['s.sp = {}'.format(expr)]
+		hi, lo = pairs[i]
+		return ['r = {}'.format(expr), 's.{} = r >> 8'.format(hi), 's.{} = r & 0xff'.format(lo)]
+
+	alu = {
+		'add': [
+			'r = s.a + v',
+			's.f = (0 if r & 0xff else 0x80) | (0x20 if (s.a & 0xf) + (v & 0xf) > 0xf else 0) | (0x10 if r > 0xff else 0)',
+			's.a = r & 0xff',
+		],
+		'adc': [
+			'c = (s.f >> 4) & 1',
+			'r = s.a + v + c',
+			's.f = (0 if r & 0xff else 0x80) | (0x20 if (s.a & 0xf) + (v & 0xf) + c > 0xf else 0) | (0x10 if r > 0xff else 0)',
+			's.a = r & 0xff',
+		],
+		'sub': [
+			'r = s.a - v',
+			's.f = 0x40 | (0 if r & 0xff else 0x80) | (0x20 if (s.a & 0xf) < (v & 0xf) else 0) | (0x10 if r < 0 else 0)',
+			's.a = r & 0xff',
+		],
+		'sbc': [
+			'c = (s.f >> 4) & 1',
+			'r = s.a - v - c',
+			's.f = 0x40 | (0 if r & 0xff else 0x80) | (0x20 if (s.a & 0xf) - (v & 0xf) - c < 0 else 0) | (0x10 if r < 0 else 0)',
+			's.a = r & 0xff',
+		],
+		'and': ['s.a &= v', 's.f = 0x20 if s.a else 0xa0'],
+		'xor': ['s.a ^= v', 's.f = 0 if s.a else 0x80'],
+		'or': ['s.a |= v', 's.f = 0 if s.a else 0x80'],
+		'cp': [
+			'r = s.a - v',
+			's.f = 0x40 | (0 if r & 0xff else 0x80) | (0x20 if (s.a & 0xf) < (v & 0xf) else 0) | (0x10 if r < 0 else 0)',
+		],
+	}
+	alu_order = ['add', 'adc', 'sub', 'sbc', 'and', 'xor', 'or', 'cp']
+
+	shifts = {
+		'rlc': ['c = v >> 7', 'r = ((v << 1) | c) & 0xff'],
+		'rrc': ['c = v & 1', 'r = (v >> 1) | (c << 7)'],
+		'rl': ['c = v >> 7', 'r = ((v << 1) | ((s.f >> 4) & 1)) & 0xff'],
+		'rr': ['c = v & 1', 'r = (v >> 1) | ((s.f & 0x10) << 3)'],
+		'sla': ['c = v >> 7', 'r = (v << 1) & 0xff'],
+		'sra': ['c = v & 1', 'r = (v >> 1) | (v & 0x80)'],
+		'swap': ['c = 0', 'r = ((v << 4) | (v >> 4)) & 0xff'],
+		'srl': ['c = v & 1', 'r = v >> 1'],
+	}
+	shift_order = ['rlc', 'rrc', 'rl', 'rr', 'sla', 'sra', 'swap', 'srl']
+
+	ops = {}
+	cb_ops = {}
+
+	# 8-bit loads
+	for dest in range(8):
+		for src in range(8):
+			if dest == 6 and src == 6:
+				continue # halt
+			if 6 in (dest, src):
+				ops[0x40 + dest * 8 + src] = [at(1), put(dest, get(src))], 1
+			else:
+				ops[0x40 + dest * 8 + src] = [put(dest, get(src))], 1
+	ops[0x52] = ['s.debug_message()'], 1 # ld d, d
+	ops[0x76] = ['s.halt()'], 1
+	for i in range(8):
+		ops[0x06 + i * 8] = (IMM8 + [at(2), put(i, 'v')], 1) if i == 6 else (IMM8 + [put(i, 'v')], 2)
+	for i, addr in enumerate(['((s.b << 8) | s.c)', '((s.d << 8) | s.e)']):
+		ops[0x02 + i * 0x10] = [at(1), 's.write({}, s.a)'.format(addr)], 1
+		ops[0x0a + i * 0x10] = [at(1), 's.a = s.read({})'.format(addr)], 1
+	ops[0x22] = ['r = ' + HL, at(1), 's.write(r, s.a)', 'r = (r + 1) & 0xffff', 's.h = r >> 8', 's.l = r & 0xff'], 1
+	ops[0x32] = ['r = ' + HL, at(1), 's.write(r, s.a)', 'r = (r - 1) & 0xffff', 's.h = r >> 8', 's.l = r & 0xff'], 1
+	ops[0x2a] = ['r = ' + HL, at(1), 's.a = s.read(r)', 'r = (r + 1) & 0xffff', 's.h = r >> 8', 's.l = r & 0xff'], 1
+	ops[0x3a] = ['r = ' + HL, at(1), 's.a = s.read(r)', 'r = (r - 1) & 0xffff', 's.h = r >> 8', 's.l = r & 0xff'], 1
+	ops[0xe0] = IMM8 + [at(2), 's.write_io(0xff00 | v, s.a)'], 1
+	ops[0xf0] = IMM8 + [at(2), 's.a = s.read_io(0xff00 | v)'], 1
+	ops[0xe2] = [at(1), 's.write_io(0xff00 | s.c, s.a)'], 1
+	ops[0xf2] = [at(1), 's.a = s.read_io(0xff00 | s.c)'], 1
+	ops[0xea] = IMM16 + [at(3), 's.write(v, s.a)'], 1
+	ops[0xfa] = IMM16 + [at(3), 's.a = s.read(v)'], 1
+
+	# 16-bit loads and arithmetic
+	for i in range(4):
+		ops[0x01 + i * 0x10] = IMM16 + put_pair(i, 'v'), 3
+		ops[0x03 + i * 0x10] = put_pair(i, '({} + 1) & 0xffff'.format(get_pair(i))), 2
+		ops[0x0b + i * 0x10] = put_pair(i, '({} - 1) & 0xffff'.format(get_pair(i))), 2
+		ops[0x09 + i * 0x10] = [
+			'v = {}'.format(get_pair(i)),
+			'hl = ' + HL,
+			'r = hl + v',
+			's.f = (s.f & 0x80) | (0x20 if (hl & 0xfff) + (v & 0xfff) > 0xfff else 0) | (0x10 if r > 0xffff else 0)',
+			'r &= 0xffff',
+			's.h = r >> 8',
+			's.l = r & 0xff',
+		], 2
+	ops[0x08] = IMM16 + ['s.write(v, s.sp & 0xff)', 's.write((v + 1) & 0xffff, s.sp >> 8)'], 5
+	ops[0xf9] = ['s.sp = ' + HL], 2
+	sp_plus_imm = IMM8 + [
+		'sp = s.sp',
+		's.f = (0x20 if (sp & 0xf) + (v & 0xf) > 0xf else 0) | (0x10 if (sp & 0xff) + v > 0xff else 0)',
+	] + SIGNED + ['r = (sp + v) & 0xffff']
+	ops[0xe8] = sp_plus_imm + ['s.sp = r'], 4
+	ops[0xf8] = sp_plus_imm + ['s.h = r >> 8', 's.l = r & 0xff'], 3
+	for i, (hi, lo) in enumerate(pairs):
+		ops[0xc1 + i * 0x10] = ['r = s.pop()', 's.{} = r >> 8'.format(hi), 's.{} = r & 0xff'.format(lo)], 3
+		ops[0xc5 + i * 0x10] = ['s.push((s.{} << 8) | s.{})'.format(hi, lo)], 4
+	ops[0xf1] = ['r = s.pop()', 's.a = r >> 8', 's.f = r & 0xf0'], 3
+	ops[0xf5] = ['s.push((s.a << 8) | s.f)'], 4
+
+	# 8-bit arithmetic
+	for i in range(8):
+		# inc [HL] and dec [HL] read on the 2nd cycle and write on the 3rd
+		ops[0x04 + i * 8] = [
+			'v = {}'.format(get(i)),
+			'r = (v + 1) & 0xff',
+			's.f = (s.f & 0x10) | (0 if r else 0x80) | (0x20 if v & 0xf == 0xf else 0)',
+			put(i, 'r'),
+		], 1
+		ops[0x05 + i * 8] = [
+			'v = {}'.format(get(i)),
+			'r = (v - 1) & 0xff',
+			's.f = (s.f & 0x10) | 0x40 | (0 if r else 0x80) | (0x20 if v & 0xf == 0 else 0)',
+			put(i, 'r'),
+		], 1
+		if i == 6:
+			for op in (0x04 + i * 8, 0x05 + i * 8):
+				lines, cycles = ops[op]
+				ops[op] = [at(1)] + lines[:-1] + [at(1), lines[-1]], 1
+	for j, name in enumerate(alu_order):
+		for i in range(8):
+			ops[0x80 + j * 8 + i] = ([at(1)] if i == 6 else []) + ['v = {}'.format(get(i))] + alu[name], 1
+		ops[0xc6 + j * 8] = IMM8 + alu[name], 2
+
+	# accumulator rotates and misc
+	ops[0x07] = ['c = s.a >> 7', 's.a = ((s.a << 1) | c) & 0xff', 's.f = c << 4'], 1
+	ops[0x0f] = ['c = s.a & 1', 's.a = (s.a >> 1) | (c << 7)', 's.f = c << 4'], 1
+	ops[0x17] = ['c = s.a >> 7', 's.a = ((s.a << 1) | ((s.f >> 4) & 1)) & 0xff', 's.f = c << 4'], 1
+	ops[0x1f] = ['c = s.a & 1', 's.a = (s.a >> 1) | ((s.f & 0x10) << 3)', 's.f = c << 4'], 1
+	ops[0x27] = [
+		'a = s.a',
+		'f = s.f',
+		'if not f & 0x40:',
+		'	if f & 0x10 or a > 0x99:',
+		'		a += 0x60',
+		'		f |= 0x10',
+		'	if f & 0x20 or (a & 0xf) > 9:',
+		'		a += 6',
+		'else:',
+		'	if f & 0x10:',
+		'		a -= 0x60',
+		'	if f & 0x20:',
+		'		a -= 6',
+		'a &= 0xff',
+		's.a = a',
+		's.f = (f & 0x50) | (0 if a else 0x80)',
+	], 1
+	ops[0x2f] = ['s.a ^= 0xff', 's.f |= 0x60'], 1
+	ops[0x37] = ['s.f = (s.f & 0x80) | 0x10'], 1
+	ops[0x3f] = ['s.f = (s.f & 0x80) | (s.f & 0x10 ^ 0x10)'], 1
+	ops[0x00] = [], 1
+	ops[0x10] = ['s.pc = (s.pc + 1) & 0xffff'], 1 # stop. We treat it as a nop.
+	ops[0xf3] = ['s.ime = False', 's.ei_pending = 0'], 1
+	ops[0xfb] = ['if not s.ime: s.ei_pending = 2'], 1
+
+	# jumps, calls and returns
+	# Jumps check for jumping to themselves, which means the rom has stopped.
+	JR = SIGNED + ['r = (s.pc + v) & 0xffff', 'if v == -2: s.looping = True', 's.pc = r']
+	JP = ['if v == (s.pc - 3) & 0xffff: s.looping = True', 's.pc = v']
+	ops[0x18] = IMM8 + JR, 3
+	ops[0xc3] = IMM16 + JP, 4
+	ops[0xe9] = ['s.pc = ' + HL], 1
+	ops[0xcd] = IMM16 + ['s.push(s.pc)', 's.pc = v'], 6
+	ops[0xc9] = ['s.pc = s.pop()'], 4
+	ops[0xd9] = ['s.pc = s.pop()', 's.ime = True'], 4
+	for i, cond in enumerate(conditions):
+		ops[0x20 + i * 8] = IMM8 + ['if not ({}): return 2'.format(cond)] + JR, 3
+		ops[0xc2 + i * 8] = IMM16 + ['if not ({}): return 3'.format(cond)] + JP, 4
+		ops[0xc4 + i * 8] = IMM16 + ['if not ({}): return 3'.format(cond), 's.push(s.pc)', 's.pc = v'], 6
+		ops[0xc0 + i * 8] = ['if not ({}): return 2'.format(cond), 's.pc = s.pop()'], 5
+	for i in range(8):
+		ops[0xc7 + i * 8] = ['s.push(s.pc)', 's.pc = {}'.format(i * 8)], 4
+
+	ops[0xcb] = ['v = s.read(s.pc)', 's.pc = (s.pc + 1) & 0xffff', 'return s.cb_ops[v](s)'], 0
+
+	# CB-prefixed ops. Cycle counts include the prefix byte.
+	# Those on [HL] read on the 3rd cycle, and those that write back do so on the 4th.
+	for j, name in enumerate(shift_order):
+		for i in range(8):
+			if i == 6:
+				cb_ops[j * 8 + i] = [at(2), 'v = {}'.format(get(i))] + shifts[name] + [
+					's.f = (0 if r else 0x80) | (c << 4)',
+					at(1),
+					put(i, 'r'),
+				], 1
+			else:
+				cb_ops[j * 8 + i] = ['v = {}'.format(get(i))] + shifts[name] + [
+					's.f = (0 if r else 0x80) | (c << 4)',
+					put(i, 'r'),
+				], 2
+	for bit in range(8):
+		for i in range(8):
+			cb_ops[0x40 + bit * 8 + i] = ([at(2)] if i == 6 else []) + [
+				's.f = (s.f & 0x10) | 0x20 | (0 if {} & {} else 0x80)'.format(get(i), 1 << bit),
+			], 1 if i == 6 else 2
+			if i == 6:
+				cb_ops[0x80 + bit * 8 + i] = [at(2), 'v = {}'.format(get(i)), at(1), put(i, 'v & {}'.format(0xff ^ (1 << bit)))], 1
+				cb_ops[0xc0 + bit * 8 + i] = [at(2), 'v = {}'.format(get(i)), at(1), put(i, 'v | {}'.format(1 << bit))], 1
+			else:
+				cb_ops[0x80 + bit * 8 + i] = [put(i, '{} & {}'.format(get(i), 0xff ^ (1 << bit)))], 2
+				cb_ops[0xc0 + bit * 8 + i] = [put(i, '{} | {}'.format(get(i), 1 << bit))], 2
+
+	def compile_table(table, prefix):
+		namespace = {}
+		source = []
+		for op, (lines, cycles) in sorted(table.items()):
+			source.append('def {}_{:02x}(s):'.format(prefix, op))
+			source += ['\t' + line for line in lines]
+			if cycles:
+				source.append('\treturn {}'.format(cycles))
+		exec('\n'.join(source), namespace)
+		def illegal(s):
+			raise ValueError("Illegal opcode at ${:04x}".format((s.pc - 1) & 0xffff))
+		return [namespace.get('{}_{:02x}'.format(prefix, op), illegal) for op in range(256)]
+
+	return compile_table(ops, 'op'), compile_table(cb_ops, 'cb')
+
+
+_OPS, _CB_OPS = _build_ops()
+
+
+def load_symbols(path):
+	"""Parse an rgblink .sym file into a dict {name: (bank, address)}"""
+	symbols = {}
+	with open(path) as f:
+		for line in f:
+			line = line.split(';', 1)[0].strip()
+			if not line:
+				continue
+			location, name = line.split(None, 1)
+			bank, addr = location.split(':')
+			symbols[name] = (int(bank, 16), int(addr, 16))
+	return symbols
+
+
+def describe_address(symbols, bank, addr):
+	"""Describe address as the closest symbol before it, eg. 'Foo+$12'"""
+	best = None
+	for name, (sym_bank, sym_addr) in symbols.items():
+		if sym_addr > addr or (addr >= 0x4000 and sym_addr >= 0x4000 and sym_bank != bank):
+			continue
+		if best is None or sym_addr > best[1]:
+			best = name, sym_addr
+	if best is None:
+		return '${:04x}'.format(addr)
+	name, sym_addr = best
+	return '{}+${:x}'.format(name, addr - sym_addr) if addr != sym_addr else name
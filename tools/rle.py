@@ -0,0 +1,87 @@
+"""Run-length encoding, as decoded by Decompress in compression.asm.
+
+Compressed data is a series of runs, each starting with a control byte C:
+	C = 0: End of data
+	0 < C < 128: The next C bytes are copied as-is
+	C >= 128: The next byte is repeated C - 126 times (ie. 2 to 129 times)
+"""
+
+MAX_LITERAL = 127
+MAX_REPEAT = 129
+# Shortest repeat worth encoding as a repeat run. A repeat of 2 costs as much as 2 literal bytes,
+# and would break up a surrounding literal run.
+MIN_REPEAT = 3
+
+
+def compress(data):
+	"""Compress data (a str or list of byte values) and return the compressed data as a str"""
+	data = bytearray(data)
+	out = bytearray()
+	literal = bytearray()
+
+	def flush_literal():
+		out.append(len(literal))
+		out.extend(literal)
+		del literal[:]
+
+	i = 0
+	while i < len(data):
+		run = 1
+		while i + run < len(data) and run < MAX_REPEAT and data[i + run] == data[i]:
+			run += 1
+		if run >= MIN_REPEAT:
+			if literal:
+				flush_literal()
+			out.append(run + 126)
+			out.append(data[i])
+		else:
+			literal.extend(data[i:i + run])
+			if len(literal) >= MAX_LITERAL:
+				overflow = literal[MAX_LITERAL:]
+				del literal[MAX_LITERAL:]
+				flush_literal()
+				literal.extend(overflow)
+		i += run
+	if literal:
+		flush_literal()
+	out.append(0)
+	return str(out)
+
+
+def decompress(data):
+	"""Reference decompressor. Returns the decompressed data as a str."""
+	data = bytearray(data)
+	out = bytearray()
+	i = 0
+	while data[i]:
+		control = data[i]
+		if control < 128:
+			out.extend(data[i + 1:i + 1 + control])
+			i += 1 + control
+		else:
+			out.extend(data[i + 1:i + 2] * (control - 126))
+			i += 2
+	return str(out)
+
+
+def decompress_cycles(data):
+	"""Estimate of how many cycles Decompress takes to decompress the given compressed data,
+	not including the call. See the cycle counts in compression.asm."""
+	data = bytearray(data)
+	cycles = 0
+	i = 0
+	while data[i]:
+		control = data[i]
+		if control < 128:
+			cycles += 10 + 10 * control + 2
+			i += 1 + control
+		else:
+			cycles += 15 + 8 * (control - 126) + 2
+			i += 2
+	return cycles + 8
+
+
+def copy_cycles(length):
+	"""Estimate of how many cycles LongCopy takes to copy length bytes, for comparison.
+	It costs 10 cycles per byte, plus 4 per 256 bytes and a small fixed overhead."""
+	return 10 * length + 4 * (length // 256) + 8
@@ -0,0 +1,181 @@
+"""A stand-in for another Game Boy on the end of the link cable, for testing the serial driver
+in serial.asm without hardware.
+
+LinkPartner speaks the same protocol as serial.asm (see the comments there), and can be connected
+to an emulated Game Boy with GameBoy.connect(). It can be made slow, to check we don't lose bytes
+when the other side can't keep up.
+
+Run it directly to measure throughput and loss: it runs a debug rom (which runs the serial echo task)
+with a LinkPartner on the other end, sends it random bytes and checks they all come back.
+"""
+
+import random
+from collections import deque
+
+import argh
+
+import gb_emulator
+from gb_emulator import NEVER, SERIAL_TRANSFER_CYCLES
+
+
+# Special values on the wire, as per serial.asm
+NONE = 0xff
+IDLE = 0xfe
+ESCAPE = 0xfd
+MAX_RETRIES = 8
+# How often the active side checks for data when nothing is moving: every 16 timer ticks
+POLL_CYCLES = 16 * 1024
+
+CYCLES_PER_SECOND = 2**20
+
+
+def escape(data):
+	"""Encode data bytes as they're sent over the wire"""
+	wire = []
+	for value in data:
+		if value >= ESCAPE:
+			wire += [ESCAPE, value ^ 0xff]
+		else:
+			wire.append(value)
+	return wire
+
+
+class LinkPartner(object):
+	"""The other end of the link. If active, it starts every transfer, otherwise it waits for us to.
+	It sends data in order, and records data bytes it receives in received.
+	busy_cycles is how long it takes to handle each transfer before it's ready for the next one.
+	If echo is True, it sends back everything it receives."""
+
+	def __init__(self, active, data=(), busy_cycles=0, echo=False):
+		self.active = active
+		self.busy_cycles = busy_cycles
+		self.echo = echo
+		self.tx = deque(escape(data))
+		self.received = []
+		self.escaped = False # the last data byte we received was ESCAPE
+		self.outgoing = IDLE
+		self.ready_at = 0 # passive only: cycle at which we've finished handling the last transfer
+		self.retries = 0
+		self.next_transfer = SERIAL_TRANSFER_CYCLES if active else NEVER
+		# stats
+		self.transfers = 0
+		self.missed = 0 # transfers where the other side (or we, if passive) weren't ready
+		self.last_received = None # cycle at which we last received a data byte
+
+	def next_byte(self):
+		return self.tx.popleft() if self.tx else IDLE
+
+	def receive(self, value, cycle):
+		"""Handle a received byte. Returns True if it was data."""
+		if value in (IDLE, NONE):
+			return False
+		if self.escaped:
+			value ^= 0xff
+			self.escaped = False
+		elif value == ESCAPE:
+			self.escaped = True
+			return True
+		self.received.append(value)
+		self.last_received = cycle
+		if self.echo:
+			self.tx.extend(escape([value]))
+		return True
+
+	def exchange(self, value, cycle):
+		self.transfers += 1
+		if self.active:
+			return self.exchange_active(value, cycle)
+		return self.exchange_passive(value, cycle)
+
+	def exchange_passive(self, value, cycle):
+		if cycle < self.ready_at:
+			# The other side started a transfer before we were ready, so it reads all 1s
+			self.missed += 1
+			return NONE
+		sent = self.outgoing
+		self.receive(value, cycle)
+		self.outgoing = self.next_byte()
+		self.ready_at = cycle + self.busy_cycles
+		return sent
+
+	def exchange_active(self, value, cycle):
+		sent = self.outgoing
+		if value == NONE:
+			self.missed += 1
+			self.retries += 1
+			if self.retries >= MAX_RETRIES:
+				self.retries = 0
+				self.next_transfer = cycle + POLL_CYCLES
+			else:
+				self.next_transfer = cycle + self.busy_cycles + SERIAL_TRANSFER_CYCLES
+			return sent
+		self.retries = 0
+		moved = self.receive(value, cycle) or sent != IDLE
+		self.outgoing = self.next_byte()
+		if moved or self.outgoing != IDLE:
+			self.next_transfer = cycle + self.busy_cycles + SERIAL_TRANSFER_CYCLES
+		else:
+			self.next_transfer = cycle + POLL_CYCLES
+		return sent
+
+
+def call(gb, symbols, name):
+	"""Call a routine in the rom that expects interrupts to be disabled, between two instructions
+	while interrupts are enabled."""
+	while not gb.ime:
+		gb.run(gb.cycles + 1) # one instruction at a time
+	bank, addr = symbols[name]
+	resume = gb.pc
+	gb.ime = False
+	gb.halted = False
+	gb.push(resume)
+	gb.pc = addr
+	while gb.pc != resume:
+		gb.run(gb.cycles + 1)
+	gb.ime = True
+
+
+def main(rom='build/debug/rom.gb', symfile='build/debug/rom.sym', length=1000, rom_active=False,
+	busy_cycles=0, seconds=10.0, seed=0):
+	"""Send length random bytes to the rom's serial echo task, and report how fast they come back
+	and whether any were lost or changed. The rom is the passive side unless --rom-active is given.
+	--busy-cycles makes the partner take that long to handle each transfer."""
+	rand = random.Random(seed)
+	data = [rand.randrange(256) for i in range(length)]
+	with open(rom, 'rb') as f:
+		gb = gb_emulator.GameBoy(f.read())
+	symbols = gb_emulator.load_symbols(symfile)
+
+	# Let the rom start up before connecting, as if the cable was plugged in later
+	gb.run(CYCLES_PER_SECOND / 10)
+	start = gb.cycles
+	partner = LinkPartner(not rom_active, busy_cycles=busy_cycles)
+	if partner.active:
+		partner.next_transfer = start + SERIAL_TRANSFER_CYCLES
+	gb.connect(partner)
+	if rom_active:
+		call(gb, symbols, 'SerialSetActive')
+	partner.tx.extend(escape(data))
+	gb.update_next_event()
+
+	limit = start + int(seconds * CYCLES_PER_SECOND)
+	while len(partner.received) < length and gb.cycles < limit:
+		if gb.run(min(limit, gb.cycles + CYCLES_PER_SECOND / 10)):
+			print "Rom stopped at cycle {}".format(gb.cycles)
+			break
+
+	received = partner.received
+	elapsed = float((partner.last_received or start) - start) / CYCLES_PER_SECOND
+	print "{} side: rom, busy cycles per transfer for partner: {}".format(
+		'Active' if rom_active else 'Passive', busy_cycles,
+	)
+	print "Sent {} bytes, got {} back in {:.3f}s".format(length, len(received), elapsed)
+	if elapsed:
+		print "Throughput: {:.0f} bytes/s each way".format(len(received) / elapsed)
+	print "Transfers: {}, of which {} were missed by the passive side".format(partner.transfers, partner.missed)
+	changed = sum(1 for a, b in zip(data, received) if a != b)
+	print "Lost: {}, changed: {}".format(length - len(received), changed)
+
+
+if __name__ == '__main__':
+	argh.dispatch_command(main)
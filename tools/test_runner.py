@@ -0,0 +1,193 @@
+"""Runs test roms headlessly and reports results.
+
+Each rom is run in the embedded emulator (see gb_emulator.py) until it reaches the test harness's
+_TestSuccess or _TestFailure loops, which leave HL = $face or $dead respectively.
+A rom passes if it ends in _TestSuccess having logged "=== Success ===".
+All other debug messages the rom logs are printed, as bgb would have written them to its debug log.
+
+Tests with a cycle budget (see Test's max_cycles) log the number of clocks their call took.
+These are reported in cycles, and a test that goes over its budget fails.
+
+Roms are independent, so are run in parallel across a pool of worker processes.
+"""
+
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+
+import argh
+
+import gb_emulator
+
+
+SUCCESS_TOKEN = "=== Success ==="
+
+# Logged by each case in a batch rom (see unit_test_gen --batch)
+CASE_RESULT_RE = re.compile(r'^=== Case (\S+) (passed|failed)( unexpectedly| as expected)? ===$')
+
+# Logged after the call in tests with a cycle budget (see unit_test_gen's Test.gen_asm_call)
+CYCLES_RE = re.compile(r'^=== Cycles: (\d+) clocks, max (\d+) cycles ===$')
+# The clock count includes the debug message that started it (ld d, d + jr), which we don't count.
+CYCLES_OVERHEAD = 4
+
+# These roms are meant to fail, so are excluded when running all tests
+EXPECTED_FAILURES = [
+	os.path.join('meta_test', '2_this_fails.gb'),
+]
+
+
+def run_rom(rom_path, max_cycles):
+	"""Run the rom at rom_path, returning a dict describing the result with keys:
+		passed: Whether the test passed
+		messages: List of debug messages logged
+		reason: If not passed, a description of why
+		cycles: How many cycles the rom ran for
+		cases: For batch roms, a list of (case name, whether it passed)
+		budgets: List of (cycles taken, max cycles) for each call with a cycle budget
+	"""
+	with open(rom_path, 'rb') as f:
+		gb = gb_emulator.GameBoy(f.read())
+	stopped = gb.run(max_cycles)
+	messages, cases, budgets = parse_messages(gb.messages)
+
+	hl = (gb.h << 8) | gb.l
+	over_budget = [(taken, budget) for taken, budget in budgets if taken > budget]
+	if stopped and gb.looping and hl == 0xface and SUCCESS_TOKEN in gb.messages:
+		if over_budget:
+			reason = "{} of {} calls went over their cycle budget".format(len(over_budget), len(budgets))
+		else:
+			reason = None
+	elif stopped and gb.looping and hl == 0xdead:
+		reason = "Test failed"
+	else:
+		sym_path = '{}.sym'.format(os.path.splitext(rom_path)[0])
+		pc = gb.pc
+		if os.path.exists(sym_path):
+			pc = gb_emulator.describe_address(gb_emulator.load_symbols(sym_path), gb.rom_bank, pc)
+		else:
+			pc = '${:04x}'.format(pc)
+		if not stopped:
+			reason = "Timed out after {} cycles at {}".format(gb.cycles, pc)
+		elif gb.halted:
+			reason = "Halted forever at {}".format(pc)
+		else:
+			reason = "Stopped at {} with HL = ${:04x}".format(pc, hl)
+
+	return dict(
+		passed = reason is None,
+		messages = messages,
+		reason = reason,
+		cycles = gb.cycles,
+		cases = cases,
+		budgets = budgets,
+	)
+
+
+def parse_messages(raw_messages):
+	"""Interpret the debug messages logged by a test rom.
+	Returns (messages, cases, budgets) where messages are the messages to display,
+	and cases and budgets are as per run_rom.
+	A batch case that goes over its cycle budget counts as failed, even if its checks passed."""
+	messages = []
+	cases = []
+	budgets = []
+	over_budget = False
+	for message in raw_messages:
+		if not message:
+			continue # the message that starts a cycle count is blank
+		match = CYCLES_RE.match(message)
+		if match:
+			clocks, budget = map(int, match.groups())
+			taken = clocks / 4 - CYCLES_OVERHEAD
+			budgets.append((taken, budget))
+			over_budget = taken > budget
+			message = "Took {} cycles (max {}){}".format(taken, budget, " - over budget!" if over_budget else "")
+		match = CASE_RESULT_RE.match(message)
+		if match:
+			name, outcome, qualifier = match.groups()
+			# qualifier is only present when the case was expected to fail
+			cases.append((name, (outcome == 'passed') == (qualifier is None) and not over_budget))
+			over_budget = False
+		messages.append(message)
+	return messages, cases, budgets
+
+
+def _run_rom(args):
+	"""Pool worker. Catches errors so they're reported against the right rom."""
+	rom_path, max_cycles = args
+	try:
+		return run_rom(rom_path, max_cycles)
+	except Exception:
+		return dict(
+			passed=False, messages=[], reason="Emulator error:\n{}".format(traceback.format_exc()),
+			cycles=0, cases=[], budgets=[],
+		)
+
+
+def find_roms(tests_dir):
+	roms = []
+	for path, dirs, files in os.walk(tests_dir):
+		for filename in files:
+			if not filename.endswith('.gb'):
+				continue
+			filepath = os.path.join(path, filename)
+			if os.path.relpath(filepath, tests_dir) in EXPECTED_FAILURES:
+				continue
+			roms.append(filepath)
+	return sorted(roms)
+
+
+@argh.arg('roms', nargs='*', help="Test roms to run. Default is all under tests_dir.")
+def main(roms, tests_dir='tests', jobs=multiprocessing.cpu_count(), max_cycles=10000000):
+	"""For each test rom, or all under tests_dir if none given, run the test and output results.
+	Exits success only if all tests pass."""
+	start = time.time()
+	if not roms:
+		roms = find_roms(tests_dir)
+
+	args = [(rom, max_cycles) for rom in roms]
+	if jobs > 1:
+		pool = multiprocessing.Pool(jobs)
+		results = pool.imap(_run_rom, args)
+	else:
+		pool = None
+		results = map(_run_rom, args)
+
+	failed = []
+	cases = 0
+	failed_cases = 0
+	budgets = 0
+	over_budget = 0
+	try:
+		for rom, result in zip(roms, results):
+			sys.stdout.write("Running test rom: {}\n".format(rom))
+			for message in result['messages']:
+				if message != SUCCESS_TOKEN:
+					sys.stdout.write("{}\n".format(message))
+			cases += len(result['cases'])
+			failed_cases += len([name for name, passed in result['cases'] if not passed])
+			budgets += len(result['budgets'])
+			over_budget += len([taken for taken, budget in result['budgets'] if taken > budget])
+			if not result['passed']:
+				sys.stdout.write("{}\n{} failed!\n".format(result['reason'], rom))
+				failed.append(rom)
+			sys.stdout.write("\n")
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	if cases:
+		sys.stdout.write("{} of {} batch test cases passed\n".format(cases - failed_cases, cases))
+	if budgets:
+		sys.stdout.write("{} of {} calls were within their cycle budget\n".format(budgets - over_budget, budgets))
+	sys.stdout.write("{} of {} test roms passed in {:.2f}s\n".format(len(roms) - len(failed), len(roms), time.time() - start))
+	if failed:
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	argh.dispatch_command(main)
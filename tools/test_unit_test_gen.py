@@ -0,0 +1,61 @@
+"""Tests for unit_test_gen's watch mode: which suites it reloads when files change.
+
+Run with: python -m unittest discover tools
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from unit_test_gen import Watcher
+
+
+class WatcherTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		for subdir in ('include', 'tests', 'tasks'):
+			os.mkdir(self.path(subdir))
+		self.write('foo.asm', 'include "bar.asm"\nSECTION "Foo", ROM0\nFoo::\n\tld A, BAR\n\tret\n')
+		self.write('include/bar.asm', 'BAR EQU 1\n')
+		self.write('other.asm', 'SECTION "Other", ROM0\nOther::\n\tret\n')
+		self.watcher = Watcher(
+			self.dir, self.path('include'), self.path('tests'), [self.path('tasks')], 'build/debug',
+			jobs=1, batch=False, max_cycles=10000,
+		)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def path(self, name):
+		return os.path.abspath(os.path.join(self.dir, name))
+
+	def write(self, name, contents):
+		with open(self.path(name), 'w') as f:
+			f.write(contents)
+
+	def test_explicit_files(self):
+		# A suite that links exactly the files it lists, rather than what it uses
+		self.write('tests/explicit.py', "file = None\nfiles = ['foo']\ntarget = 'Foo'\ncall = Test(out_A = 1)\n")
+		self.assertEqual(self.watcher.reload(set()), ['explicit.py'])
+		self.assertEqual(self.watcher.reload({self.path('other.asm')}), [])
+		self.assertEqual(self.watcher.reload({self.path('foo.asm')}), ['explicit.py'])
+		self.assertEqual(self.watcher.reload({self.path('include/bar.asm')}), ['explicit.py'])
+		self.assertEqual(self.watcher.reload({self.path('tests/explicit.py')}), ['explicit.py'])
+
+	def test_used_files(self):
+		self.write('tests/used.py', "file = None\ntarget = 'Foo'\ncall = Test(out_A = 1)\n")
+		self.assertEqual(self.watcher.reload(set()), ['used.py'])
+		self.assertEqual(self.watcher.reload({self.path('other.asm')}), [])
+		self.assertEqual(self.watcher.reload({self.path('include/bar.asm')}), ['used.py'])
+
+	def test_deleted_suite(self):
+		self.write('tests/explicit.py', "file = None\nfiles = ['foo']\ntarget = 'Foo'\ncall = Test()\n")
+		self.watcher.reload(set())
+		os.remove(self.path('tests/explicit.py'))
+		self.assertEqual(self.watcher.reload({self.path('tests/explicit.py')}), [])
+		self.assertEqual(self.watcher.suites, {})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -4,10 +4,14 @@
 Rather than trying to actually document everything, see meta_test.py as an example.
 """
 
+import hashlib
+import multiprocessing
 import os
 import random
+import re
 import sys
 import time
+import traceback
 
 from easycmd import cmd
 import argh
@@ -29,12 +33,14 @@ class Memory(object):
 
 test_order = 0
 class Test(object):
-	def __init__(self, target=None, pre_asm=[], post_asm=[], **kwargs):
+	def __init__(self, target=None, pre_asm=[], post_asm=[], expect_fail=False, max_cycles=None, **kwargs):
 		global test_order
 		self.order = test_order
 		test_order += 1
 
 		self.target = target
+		self.expect_fail = expect_fail
+		self.max_cycles = max_cycles
 		self.pre_asm = [pre_asm] if isinstance(pre_asm, basestring) else pre_asm
 		self.post_asm = [post_asm] if isinstance(post_asm, basestring) else post_asm
 		self.ins = {
@@ -70,70 +76,15 @@ class Test(object):
 			else:
 				raise ValueError("Bad keyword: {!r} (not a reg, flag or Memory)".format(key))
 
-	def gen_asm(self, include_asm, target, extra_asm, mems):
+	def gen_asm(self, target, mems, declarations):
+		"""Generate the harness and test code for a test rom that runs only this test.
+		The target is linked in from the suite's shared object, and declarations are what the test code
+		needs from it at assembly time (see gen_declarations)."""
 		if self.target is not None:
 			target = self.target
 
-		return r"""
-; --- GENERATED BY {argv[0]} on {now} ---
-
-
-_IS_UNIT_TEST EQU "true"
-
-
-; --- extra asm from test spec (may be empty) ---
-{extra_asm}
-
-
-; --- original target file ---
-{include_asm}
-
-
-; --- test harness ---
-SECTION "{argv[0]} test stack", WRAM0
-
-ds 128
-_TestStack::
-
-SECTION "{argv[0]} header", ROM0 [$100]
-; This must be nop, then a jump, then blank up to 150
-_Start::
-	nop
-	jp _TestStart
-_Header::
-	ds 76 ; Linker will fill this in
-
-SECTION "{argv[0]} test harness", ROM0
-
-_TestFailure::
-	ld b, b ; bgb breakpoint
-	di
-	ld HL, $dead
-.loop
-	jp .loop
-
-_TestSuccess::
-	ld b, b ; bgb breakpoint
-	di
-	ld HL, $face
-.loop
-	jp .loop
-
-_TestLog: MACRO
-	ld d, d ; bgb debug message
-	jr .end\@
-	dw $6464, $0000
-	db \1
-.end\@
-ENDM
-
-_TestFailIfNot: MACRO
-	jr \1, .nofail\@
-	_TestLog \2
-	jp _TestFailure
-.nofail\@
-ENDM
-
+		data = []
+		body = r"""
 _TestStart::
 	xor A
 	ld [$ffff], A ; Disable all interrupts
@@ -143,22 +94,63 @@ _TestStart::
 	; set up test
 {prepare}
 	; run test
-	call {target}
+{call}
 	; check results
 {check}
 	_TestLog "=== Success ==="
 	jp _TestSuccess
+{data}
+""".format(
+	prepare=self.gen_asm_prepare(mems, data),
+	call=self.gen_asm_call(target),
+	check=self.gen_asm_check('_TestFailure', data),
+	data='\n'.join(data),
+)
+		return gen_harness(declarations, body, '_TestFailure')
+
+	def gen_asm_case(self, name, label, target, mems):
+		"""Generate the code for this test as one case in a batch rom.
+		The case is entered by a jump to label, and exits by jumping to
+		_TestBatchPass or _TestBatchFail."""
+		if self.target is not None:
+			target = self.target
+
+		# An expected failure counts as a pass and vice versa
+		passed, failed = ('_TestBatchFail', '_TestBatchPass') if self.expect_fail else ('_TestBatchPass', '_TestBatchFail')
+		data = []
+		return r"""
+SECTION "{argv[0]} case {name}", ROM0
+
+{label}::
+	; set up test
+{prepare}
+	; run test
+{call}
+	; check results
+{check}
+	_TestLog "=== Case {name} passed{unexpectedly} ==="
+	jp {passed}
+.failed
+	_TestLog "=== Case {name} failed{expectedly} ==="
+	jp {failed}
+{data}
 """.format(
 	argv=sys.argv,
-	now=time.strftime("%F %T"),
-	include_asm=include_asm,
-	extra_asm=extra_asm,
-	prepare=self.gen_asm_prepare(mems),
-	target=target,
-	check=self.gen_asm_check(),
+	name=name,
+	label=label,
+	prepare=self.gen_asm_prepare(mems, data),
+	call=self.gen_asm_call(target),
+	check=self.gen_asm_check('.failed', data),
+	data='\n'.join(data),
+	unexpectedly=' unexpectedly' if self.expect_fail else '',
+	expectedly=' as expected' if self.expect_fail else '',
+	passed=passed,
+	failed=failed,
 )
 
-	def gen_asm_prepare(self, global_mems):
+	def gen_asm_prepare(self, global_mems, data):
+		"""Generate code to set up inputs. Any tables it uses are appended to data,
+		which must be placed somewhere after the code, under the same global label."""
 		regs = self.ins['regs']
 		flags = self.ins['flags']
 		local_mems = self.ins['mems']
@@ -174,12 +166,14 @@ _TestStart::
 
 		# our approach: mems first, then flags, then regs
 		lines = list(self.pre_asm)
-		for label, values in mems.items():
-			lines += ["\tld HL, {}".format(label)]
-			for value in values:
-				if value is not None:
-					lines.append("\tld [HL], {}".format(value))
-				lines.append("\tinc HL")
+		for i, (label, values) in enumerate(mems.items()):
+			table = '.inMem{}'.format(i)
+			lines += [
+				"\tld HL, {}".format(label),
+				"\tld DE, {}".format(table),
+				"\tcall _TestLoadMem",
+			]
+			data += gen_mem_table(table, values)
 		for flag, value in flags.items():
 			if flag == 'z':
 				if value:
@@ -195,7 +189,21 @@ _TestStart::
 
 		return '\n'.join(lines)
 
-	def gen_asm_check(self):
+	def gen_asm_call(self, target):
+		"""Generate the call to target. If we have a cycle budget, the call is surrounded by debug messages
+		which reset the clock count and then log it, for the test runner to check against max_cycles.
+		The messages don't touch any registers or flags."""
+		if self.max_cycles is None:
+			return '\tcall {}'.format(target)
+		return '\n'.join([
+			'\t_TestLog "%ZEROCLKS%"',
+			'\tcall {}'.format(target),
+			'\t_TestLog "=== Cycles: %LASTCLKS% clocks, max {} cycles ==="'.format(self.max_cycles),
+		])
+
+	def gen_asm_check(self, fail, data):
+		"""Generate code to check results, jumping to label fail if any check fails.
+		As per gen_asm_prepare, any tables it uses are appended to data."""
 		regs = self.outs['regs']
 		flags = self.outs['flags']
 		mems = self.outs['mems']
@@ -221,39 +229,620 @@ _TestStart::
 				'\tcp {}'.format(value),
 				'\t_TestFailIfNot z, "Reg {} expected {} but got %A%"'.format(reg, value),
 			]
-		for label, values in mems.items():
-			# To save rom space, we make a little common routine for each label
-			# to call into. We record expected value in B and index in DE.
+		for i, (label, values) in enumerate(mems.items()):
+			table = '.outMem{}'.format(i)
 			lines += [
 				"\tld HL, {}".format(label),
-				"\tjr .afterLabelFailRoutine{}".format(label),
-				".labelFailRoutine{}".format(label),
-				'\t_TestLog "Addr {}+%DE% expected %B% but got %A%"'.format(label),
-				"\tjp _TestFailure",
-				".afterLabelFailRoutine{}".format(label),
-				"\tld DE, 0",
+				"\tld DE, {}".format(table),
+				"\tcall _TestCheckMem",
+				'\t_TestFailIfNot nc, "Addr {}+%DE% expected %B% but got %A%"'.format(label),
 			]
-			for value in values:
-				if value is None:
-					lines += [
-						'\tinc HL',
-						'\tinc DE',
-					]
-				else:
-					lines += [
-						'\tld A, [HL+]',
-						'\tld B, {}'.format(value),
-						'\tcp B',
-						'\tjp nz, .labelFailRoutine{}'.format(label),
-						'\tinc DE',
-					]
+			data += gen_mem_table(table, values)
 		return '\n'.join(lines)
 
 
-def process_file(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, filename):
+def budget(cycles):
+	"""A cycle budget (see Test's max_cycles) for a call which was measured to take the given number
+	of cycles, as logged by the test runner. The 25% headroom lets through small changes elsewhere,
+	like a different code layout, but not a real slowdown."""
+	return cycles * 5 / 4
+
+
+def gen_mem_table(label, values):
+	"""Encode values (with None for bytes to leave alone) as a table for _TestLoadMem or _TestCheckMem
+	at the given label. Returns a list of lines.
+	The table is a list of runs, each a count of bytes to skip, a count of values,
+	then the values themselves. It ends with a run that is empty and skips nothing."""
+	# list of (skip, values)
+	runs = []
+	skip = 0
+	values = list(values)
+	while values:
+		if values[0] is None:
+			values.pop(0)
+			skip += 1
+			continue
+		run = []
+		while values and values[0] is not None and len(run) < 255:
+			run.append(values.pop(0))
+		while skip > 255:
+			runs.append((255, []))
+			skip -= 255
+		runs.append((skip, run))
+		skip = 0
+	lines = [label]
+	for skip, run in runs:
+		lines.append("\tdb {}, {}".format(skip, len(run)))
+		for start in range(0, len(run), 16):
+			lines.append("\tdb " + ", ".join(str(value) for value in run[start:start + 16]))
+	lines.append("\tdb 0, 0")
+	return lines
+
+
+DECLARATION_RE = re.compile(
+	r'^\s*(?:purge|rsreset|rsset)\b|^\s*[A-Za-z_][A-Za-z0-9_]*(?:\s*=|\s+(?:EQU|EQUS|SET|RB|RW|RL)\b)',
+	re.IGNORECASE,
+)
+BLOCK_START_RE = re.compile(r'^\s*(?:if|rept)\b', re.IGNORECASE)
+BLOCK_MIDDLE_RE = re.compile(r'^\s*(?:elif|else)\b', re.IGNORECASE)
+BLOCK_END_RE = re.compile(r'^\s*(?:endc|endr)\b', re.IGNORECASE)
+MACRO_RE = re.compile(r'^\s*[A-Za-z_][A-Za-z0-9_]*:\s*MACRO\b', re.IGNORECASE)
+ENDM_RE = re.compile(r'^\s*ENDM\b', re.IGNORECASE)
+SECTION_RE = re.compile(r'^\s*SECTION\b', re.IGNORECASE)
+
+
+def gen_declarations(asm):
+	"""Returns the parts of some asm that code using it needs at assembly time: its macros, constants,
+	and the includes before its first section (later ones may be data, eg. assets), along with any
+	IF or REPT blocks around them. Test roms can't get these from the shared object, as the linker only
+	knows about labels and exported numbers. Constants that depend on labels or on @ are left out,
+	as they only make sense within a section. They're exported from the shared object instead."""
+	labels = set(LABEL_RE.findall(COMMENT_RE.sub('', asm)))
+	lines = []
+	blocks = [] # for each IF or REPT we're in, [index in lines it starts at, whether we kept anything in it]
+	in_macro = False
+	in_section = False
+	for line in asm.splitlines():
+		code = COMMENT_RE.sub('', line)
+		if in_macro:
+			lines.append(line)
+			in_macro = not ENDM_RE.match(code)
+			continue
+		if BLOCK_START_RE.match(code):
+			blocks.append([len(lines), False])
+			lines.append(line)
+			continue
+		if BLOCK_MIDDLE_RE.match(code):
+			lines.append(line)
+			continue
+		if BLOCK_END_RE.match(code):
+			start, kept = blocks.pop()
+			if kept:
+				lines.append(line)
+			else:
+				del lines[start:] # an empty block, which may depend on things we left out
+			continue
+		if SECTION_RE.match(code):
+			in_section = True
+			continue
+		if MACRO_RE.match(code):
+			in_macro = True
+		elif INCLUDE_RE.match(code):
+			if in_section:
+				continue
+		elif not DECLARATION_RE.match(code) or '@' in code or set(SYMBOL_RE.findall(code)) & labels:
+			continue
+		lines.append(line)
+		for block in blocks:
+			block[1] = True
+	return '\n'.join(lines)
+
+
+def gen_shared_asm(include_asm, extra_asm, exports):
+	"""Generate the suite's shared object, which is assembled once and linked into every test rom
+	in the suite: the target file and any extra asm, plus an export of every given symbol
+	so the tests can use labels (and constants the declarations leave out) that are private to the target."""
+	return r"""
+; --- GENERATED BY {argv[0]} ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- extra asm from test spec (may be empty) ---
+{extra_asm}
+
+
+; --- original target file ---
+{include_asm}
+
+
+; --- symbols used by tests (may be empty) ---
+{exports}
+""".format(
+	argv=sys.argv,
+	include_asm=include_asm,
+	extra_asm=extra_asm,
+	exports='\n'.join('EXPORT {}'.format(symbol) for symbol in sorted(exports)),
+)
+
+
+def gen_harness(declarations, body, fail):
+	"""Wrap the given test code in the common parts of a test rom: the harness entry point and macros,
+	after the target's declarations (see gen_declarations). Failed checks in body jump to label fail.
+	The body must define _TestStart."""
+	return r"""
+; --- GENERATED BY {argv[0]} ---
+
+
+_IS_UNIT_TEST EQU "true"
+
+
+; --- declarations from extra asm and target file (may be empty) ---
+{declarations}
+
+
+; --- test harness ---
+SECTION "{argv[0]} test stack", WRAM0
+
+ds 128
+_TestStack::
+
+SECTION "{argv[0]} header", ROM0 [$100]
+; This must be nop, then a jump, then blank up to 150
+_Start::
+	nop
+	jp _TestStart
+_Header::
+	ds 76 ; Linker will fill this in
+
+SECTION "{argv[0]} test harness", ROM0
+
+_TestFailure::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $dead
+.loop
+	jp .loop
+
+_TestSuccess::
+	ld b, b ; bgb breakpoint
+	di
+	ld HL, $face
+.loop
+	jp .loop
+
+_TestLog: MACRO
+	ld d, d ; bgb debug message
+	jr .end\@
+	dw $6464, $0000
+	db \1
+.end\@
+ENDM
+
+; Copy values into memory at HL from a table at DE, as generated by gen_mem_table.
+; Clobbers HL only, so registers set by pre_asm survive.
+_TestLoadMem::
+	push AF
+	push BC
+	push DE
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to copy
+	inc DE
+	ld B, A
+	or C
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 copies nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld [HL+], A
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop DE
+	pop BC
+	pop AF
+	ret
+
+; Compare memory at HL to a table at DE, as generated by gen_mem_table.
+; Sets c on the first mismatch, with DE = its index, B = the expected value and A = the actual value.
+; Otherwise unsets c. Clobbers all regs.
+_TestCheckMem::
+	push HL ; so we can work out the index of a mismatch
+.run
+	ld A, [DE] ; bytes to skip
+	inc DE
+	ld C, A
+	ld A, [DE] ; bytes to compare
+	inc DE
+	ld B, A
+	or C ; also unsets c
+	jr z, .done
+	ld A, C
+	add L
+	ld L, A
+	jr nc, .noCarry
+	inc H
+.noCarry
+	ld C, B
+	inc C ; so a count of 0 compares nothing
+	jr .next
+.loop
+	ld A, [DE]
+	inc DE
+	ld B, A
+	ld A, [HL+]
+	cp B
+	jr nz, .mismatch
+.next
+	dec C
+	jr nz, .loop
+	jr .run
+.done
+	pop HL
+	ret
+.mismatch
+	dec HL ; HL = address of the mismatch
+	ld C, A
+	pop DE
+	ld A, L
+	sub E
+	ld E, A
+	ld A, H
+	sbc D
+	ld D, A ; DE = HL - start
+	ld A, C
+	scf
+	ret
+
+_TestFailIfNot: MACRO
+	jr \1, .nofail\@
+	_TestLog \2
+	jp {fail}
+.nofail\@
+ENDM
+{body}""".format(
+	argv=sys.argv,
+	declarations=declarations,
+	fail=fail,
+	body=body,
+)
+
+
+def gen_batch_asm(tests, target, mems, declarations):
+	"""Generate a single test rom that runs all the given (name, test) cases in order.
+	All of WRAM and HRAM is zeroed and the stack, interrupts and hardware are reset before each case,
+	so cases are independent of each other. Each case's result is logged, and the rom as a whole
+	succeeds only if every case does."""
+	if len(tests) > 255:
+		raise ValueError("Too many test cases for a batch rom ({} > 255)".format(len(tests)))
+	labels = ['_TestCase{}'.format(i) for i in range(len(tests))]
+	cases = '\n'.join(
+		test.gen_asm_case(name, label, target, mems)
+		for label, (name, test) in zip(labels, tests)
+	)
+	body = r"""
+SECTION "{argv[0]} batch state", WRAM0
+
+; Index of the currently running case, and number of failed cases so far.
+; These are preserved across the reset between cases.
+_TestBatchIndex::
+	db
+_TestBatchFails::
+	db
+
+SECTION "{argv[0]} batch harness", ROM0
+
+_TestCases::
+	dw {labels}
+
+_TestStart::
+	ld DE, 0 ; D = case index, E = failures so far
+_TestBatchNext::
+	di
+	xor A
+	ld [$ffff], A ; Disable all interrupts
+	ld [$ff0f], A ; Clear any pending interrupts
+	ld [$ff07], A ; Disable timer
+	ld [$ff26], A ; Disable sound
+	ld [$ff40], A ; Disable video
+	; Zero WRAM and HRAM. We can't call anything as this clears the stack.
+	ld HL, $c000
+.clearWRAM
+	ld [HL+], A
+	bit 5, H ; H = $e0 once we're done
+	jr z, .clearWRAM
+	ld HL, $ff80
+	ld C, $7f ; up to but not including $ffff (interrupt enable)
+.clearHRAM
+	ld [HL+], A
+	dec C
+	jr nz, .clearHRAM
+	ld SP, _TestStack
+	ld A, D
+	ld [_TestBatchIndex], A
+	ld A, E
+	ld [_TestBatchFails], A
+	; find case D and jump to it, or finish if none left
+	ld A, D
+	cp {count}
+	jr nc, .done
+	ld H, 0
+	ld L, D
+	add HL, HL ; HL = 2 * D
+	ld BC, _TestCases
+	add HL, BC
+	ld A, [HL+]
+	ld H, [HL]
+	ld L, A
+	jp HL
+.done
+	ld A, E
+	and A
+	jr nz, .failed
+	_TestLog "=== Success ==="
+	jp _TestSuccess
+.failed
+	_TestLog "=== %E% cases failed ==="
+	jp _TestFailure
+
+_TestBatchPass::
+	ld A, [_TestBatchFails]
+	ld E, A
+	jr _TestBatchAdvance
+
+_TestBatchFail::
+	ld A, [_TestBatchFails]
+	inc A
+	ld E, A
+	; fall through
+
+_TestBatchAdvance:
+	ld A, [_TestBatchIndex]
+	inc A
+	ld D, A
+	jp _TestBatchNext
+
+{cases}
+""".format(
+	argv=sys.argv,
+	labels=', '.join(labels),
+	count=len(tests),
+	cases=cases,
+)
+	return gen_harness(declarations, body, '.failed')
+
+
+_file_hashes = {}
+def hash_file(filepath):
+	"""Hash the contents of filepath. Memoized, as every test in a suite links the same objects."""
+	if filepath not in _file_hashes:
+		with open(filepath, 'rb') as f:
+			_file_hashes[filepath] = hashlib.sha1(f.read()).hexdigest()
+	return _file_hashes[filepath]
+
+
+INCLUDE_RE = re.compile(r'^\s*include\s+"([^"]+)"', re.IGNORECASE | re.MULTILINE)
+EXPORTED_LABEL_RE = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)::', re.MULTILINE)
+EXPORT_RE = re.compile(r'^\s*(?:export|global)\s+(.*)$', re.IGNORECASE | re.MULTILINE)
+LABEL_RE = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)::?(?!\s*MACRO\b)', re.IGNORECASE | re.MULTILINE)
+CONSTANT_RE = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)(?:\s*=|\s+(?:EQU|SET|RB|RW|RL)\b)', re.IGNORECASE | re.MULTILINE)
+SYMBOL_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+COMMENT_RE = re.compile(r';.*$', re.MULTILINE)
+
+
+class SourceScanner(object):
+	"""Works out what asm source refers to, defines and exports, following includes.
+
+	This is a textual scan, so it over-estimates: every identifier counts as a reference,
+	whether it's a label, a macro or an instruction. That's fine for working out what to link,
+	as linking an object that isn't needed is harmless, where missing one isn't.
+	"""
+	def __init__(self, top_level_dir, include_dir):
+		# rgbasm looks for includes relative to where it's run from, then in the include dir
+		self.search_dirs = [top_level_dir, include_dir]
+		self._scanned = {}
+
+	def find_include(self, name):
+		for search_dir in self.search_dirs:
+			path = os.path.abspath(os.path.join(search_dir, name))
+			if os.path.isfile(path):
+				return path
+		# eg. a generated file that hasn't been made yet. The assembler will complain if it matters.
+		return None
+
+	def scan_text(self, text):
+		"""Returns (symbols, exports, definitions, includes) for some asm: every identifier it or anything
+		it includes mentions, the symbols it exports, the labels and numeric constants it or anything it
+		includes defines, and the paths of everything it includes, directly or not."""
+		text = COMMENT_RE.sub('', text)
+		symbols = set(SYMBOL_RE.findall(text))
+		exports = set(EXPORTED_LABEL_RE.findall(text))
+		for names in EXPORT_RE.findall(text):
+			exports.update(name.strip() for name in names.split(','))
+		definitions = set(LABEL_RE.findall(text)) | set(CONSTANT_RE.findall(text))
+		includes = set()
+		for name in INCLUDE_RE.findall(text):
+			path = self.find_include(name)
+			if path is None or path in includes:
+				continue
+			included_symbols, _, included_definitions, included_includes = self.scan_file(path)
+			symbols |= included_symbols
+			definitions |= included_definitions
+			includes |= included_includes
+			includes.add(path)
+		return symbols, exports, definitions, includes
+
+	def forget(self, paths):
+		"""Discard anything memoized about the given changed files, or the files that include them."""
+		for path, (_, _, _, includes) in self._scanned.items():
+			if path in paths or includes & paths:
+				del self._scanned[path]
+
+	def scan_file(self, path):
+		"""As scan_text, for a file. Memoized, as most files are included by many others."""
+		path = os.path.abspath(path)
+		if path not in self._scanned:
+			with open(path) as f:
+				self._scanned[path] = self.scan_text(f.read())
+		return self._scanned[path]
+
+
+class LinkGraph(object):
+	"""The objects that can be linked into a test rom, and what exported symbols each one defines and uses.
+	Objects are given by the name of their source file, relative to top_level_dir and without the .asm,
+	and the sources are scanned with scanner (a SourceScanner)."""
+	def __init__(self, scanner, top_level_dir, link_files):
+		self.link_files = link_files
+		self.definers = {}
+		self.symbols = {}
+		self.sources = {}
+		for link_file in link_files:
+			path = os.path.abspath(os.path.join(top_level_dir, '{}.asm'.format(link_file)))
+			symbols, exports, _, includes = scanner.scan_file(path)
+			self.symbols[link_file] = symbols
+			self.sources[link_file] = includes | {path}
+			for symbol in exports:
+				self.definers[symbol] = link_file
+
+	def closure(self, symbols):
+		"""Returns the link files that define any of symbols, plus everything those need in turn,
+		in the same order as they were given."""
+		needed = set()
+		pending = [symbols]
+		while pending:
+			for symbol in pending.pop():
+				link_file = self.definers.get(symbol)
+				if link_file is not None and link_file not in needed:
+					needed.add(link_file)
+					pending.append(self.symbols[link_file])
+		return [link_file for link_file in self.link_files if link_file in needed]
+
+
+class BuildJob(object):
+	"""A single generated test rom: its asm source, and everything needed to assemble, link and fix it.
+	Jobs are independent of each other, so they may be run in any order or in parallel.
+
+	The rom is cached: a job's key is a hash of everything that goes into the rom, and is saved
+	next to it in a .key file after a successful build. If the saved key matches, the build can be skipped.
+
+	includes is the paths of all files the asm includes, and sources is the paths of every source file
+	that affects the rom, for working out which roms need rebuilding when a file changes.
+	"""
+	def __init__(self, name, asm, path, include_dir, link_paths, includes, sources):
+		self.name = name
+		self.asm = asm
+		self.include_dir = include_dir
+		self.link_paths = link_paths
+		self.includes = includes
+		self.sources = sources
+		self.asm_path = '{}.asm'.format(path)
+		self.obj_path = '{}.o'.format(path)
+		self.sym_path = '{}.sym'.format(path)
+		self.rom_path = '{}.gb'.format(path)
+		self.key_path = '{}.key'.format(path)
+
+	def assemble_command(self):
+		return ['rgbasm', '-DDEBUG', '-i', self.include_dir, '-v', '-o', self.obj_path, self.asm_path]
+
+	def commands(self):
+		# We pad wth 0x40 = ld b, b = BGB breakpoint
+		return [
+			self.assemble_command(),
+			['rgblink', '-n', self.sym_path, '-o', self.rom_path, '-p', '0x40', self.obj_path] + self.link_paths,
+			['rgbfix', '-v', '-p', '0x40', self.rom_path],
+		]
+
+	def key(self):
+		"""Hash of the generated asm, the names and contents of the files it includes,
+		the contents of all linked objects and the commands used to build."""
+		h = hashlib.sha1()
+		h.update(self.asm)
+		for include_path in sorted(self.includes):
+			h.update('{}\0'.format(os.path.relpath(include_path, self.include_dir)))
+			h.update(hash_file(include_path))
+		for link_path in self.link_paths:
+			h.update(hash_file(link_path))
+		h.update(repr(self.commands()))
+		return h.hexdigest()
+
+	def outputs(self):
+		return [self.rom_path, self.sym_path, self.key_path]
+
+	def is_cached(self, key):
+		if not all(os.path.exists(path) for path in self.outputs()):
+			return False
+		with open(self.key_path) as f:
+			return f.read().strip() == key
+
+	def run(self, key=None):
+		"""Write out the asm and build the rom. Returns any output from the tools.
+		If key is given, it is recorded once the rom is successfully built."""
+		if os.path.exists(self.key_path):
+			os.remove(self.key_path) # we're about to overwrite the rom, so it no longer matches
+		with open(self.asm_path, 'w') as f:
+			f.write(self.asm)
+		output = [cmd(command) for command in self.commands()]
+		if key is not None:
+			with open(self.key_path, 'w') as f:
+				f.write('{}\n'.format(key))
+		return ''.join(out for out in output if out)
+
+
+class ObjectJob(BuildJob):
+	"""A suite's shared object: the target file and any extra asm, assembled once and linked into
+	every test rom in the suite. It's cached in the same way as a rom."""
+	def commands(self):
+		return [self.assemble_command()]
+
+	def outputs(self):
+		return [self.obj_path, self.key_path]
+
+	def run(self, key=None):
+		output = super(ObjectJob, self).run(key)
+		_file_hashes.pop(self.obj_path, None) # the roms that link it need to see the new contents
+		return output
+
+
+def find_link_files(top_level_dir, extra_link_dirs):
+	"""Returns the names of all the OS objects a test may link, relative to top_level_dir and without the .asm"""
+	asm_files = os.listdir(top_level_dir)
+	for extra_link_dir in extra_link_dirs:
+		# relative to the top level, so eg. a suite for 'tasks/clock' doesn't link it again
+		asm_files += [
+			os.path.relpath(os.path.join(extra_link_dir, filename), top_level_dir)
+			for filename in os.listdir(extra_link_dir)
+		]
+	return [
+		os.path.splitext(asm_file)[0]
+		for asm_file in asm_files
+		if asm_file.endswith('.asm') and asm_file != 'header.asm'
+	]
+
+
+def load_suite(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, filename, scanner, batch=False):
+	"""Load the test suite in filename and return (object job, rom jobs). The object job builds the target
+	and extra asm into a shared object which every rom links, so it must be run first. There is one
+	rom job per Test, or if batch is set a single rom job for a rom that runs every Test.
+	Unless the suite gives an explicit list of files, each rom only links the objects it needs,
+	as worked out by scanner (a SourceScanner)."""
 	name, _ = os.path.splitext(filename)
 	filepath = os.path.join(tests_dir, filename)
-	config = dict(Memory=Memory, Test=Test, random=random.Random(name))
+	config = dict(Memory=Memory, Test=Test, budget=budget, random=random.Random(name))
 	execfile(filepath, config) # loads config as defined globals
 	if 'file' not in config:
 		raise ValueError("You must specify a target file, or None")
@@ -266,58 +855,332 @@ def process_file(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_di
 	if target is None and any(test.target is None for test in tests.values()):
 		raise ValueError("You must specify a target function, either at top-level or for every test case")
 
+	spec_sources = {os.path.abspath(filepath)}
 	if include_file is None:
 		include_asm = ''
 	else:
 		include_path = os.path.join(top_level_dir, '{}.asm'.format(include_file))
 		with open(include_path) as f:
 			include_asm = f.read()
+		spec_sources.add(os.path.abspath(include_path))
 
-	if link_files is None:
-		asm_files = os.listdir(top_level_dir)
-		for extra_link_dir in extra_link_dirs:
-			asm_files += [os.path.join(extra_link_dir, filename) for filename in os.listdir(extra_link_dir)]
-		link_files = [
-			os.path.splitext(asm_file)[0]
-			for asm_file in asm_files
-			if asm_file.endswith('.asm') and asm_file != 'header.asm'
-		]
+	# We still need the graph for an explicit list of files, to know what sources affect each rom
+	explicit = link_files is not None
+	if not explicit:
+		link_files = find_link_files(top_level_dir, extra_link_dirs)
 		if include_file in link_files:
 			link_files.remove(include_file)
-		link_files = [os.path.join(objs_dir, link_file) for link_file in link_files]
-
-	link_paths = [os.path.join(top_level_dir, '{}.o'.format(link_file)) for link_file in link_files]
+		link_files = sorted(link_files)
+	graph = LinkGraph(scanner, top_level_dir, link_files)
 
 	gendir = os.path.join(tests_dir, name)
 	if not os.path.exists(gendir):
 		os.mkdir(gendir)
 
-	for i, (testname, test) in enumerate(sorted(tests.items(), key=lambda (n,t): t.order)):
-		testname = '{i:0{w}d}_{t}'.format(i=i, t=testname, w=len(str(len(tests)-1)))
-		asm = test.gen_asm(include_asm, target, extra_asm, mems)
-		path = os.path.join(gendir, testname)
-		asm_path = '{}.asm'.format(path)
-		obj_path = '{}.o'.format(path)
-		sym_path = '{}.sym'.format(path)
-		rom_path = '{}.gb'.format(path)
-		with open(asm_path, 'w') as f:
-			f.write(asm)
-		# We pad wth 0x40 = ld b, b = BGB breakpoint
-		cmd(['rgbasm', '-DDEBUG', '-i', include_dir, '-v', '-o', obj_path, asm_path])
-		cmd(['rgblink', '-n', sym_path, '-o', rom_path, '-p', '0x40', obj_path] + link_paths)
-		cmd(['rgbfix', '-v', '-p', '0x40', rom_path])
+	tests = [
+		('{i:0{w}d}_{t}'.format(i=i, t=testname, w=len(str(len(tests)-1))), test)
+		for i, (testname, test) in enumerate(sorted(tests.items(), key=lambda (n,t): t.order))
+	]
 
+	# The tests may use any macro, label or constant from the target or extra asm, not just exported ones.
+	# They get the declarations as source, and the shared object exports any labels they use.
+	shared_asm = '\n'.join([extra_asm, include_asm])
+	declarations = '\n'.join([gen_declarations(extra_asm), gen_declarations(include_asm)])
+	_, _, declared, declared_includes = scanner.scan_text(declarations)
+	if batch:
+		roms = [(name, gen_batch_asm(tests, target, mems, declarations), os.path.join(gendir, 'batch'))]
+	else:
+		roms = [
+			('{}/{}'.format(name, testname), test.gen_asm(target, mems, declarations), os.path.join(gendir, testname))
+			for testname, test in tests
+		]
+	rom_symbols = [scanner.scan_text(asm)[0] for _, asm, _ in roms]
+
+	shared_symbols, shared_exports, shared_definitions, shared_includes = scanner.scan_text(shared_asm)
+	exports = set().union(*rom_symbols) & shared_definitions - shared_exports - declared
+	object_job = ObjectJob(
+		'{}/shared'.format(name), gen_shared_asm(include_asm, extra_asm, exports), os.path.join(gendir, 'shared'),
+		include_dir, [], shared_includes, shared_includes | spec_sources,
+	)
+
+	jobs = []
+	for (rom_name, asm, path), symbols in zip(roms, rom_symbols):
+		needed = link_files if explicit else graph.closure(symbols | shared_symbols)
+		link_paths = [os.path.join(top_level_dir, objs_dir, '{}.o'.format(link_file)) for link_file in needed]
+		sources = set().union(*[graph.sources[link_file] for link_file in needed])
+		jobs.append(BuildJob(
+			rom_name, asm, path, include_dir, [object_job.obj_path] + link_paths, declared_includes,
+			sources | object_job.sources,
+		))
+	return object_job, jobs
+
+
+def filter_cached(jobs, rebuild=False):
+	"""Split jobs into those which need building and those whose cached rom is still valid.
+	Returns a list of (job, key) for jobs to build, and a list of jobs that were cached."""
+	to_build = []
+	cached = []
+	for job in jobs:
+		key = job.key()
+		if not rebuild and job.is_cached(key):
+			cached.append(job)
+		else:
+			to_build.append((job, key))
+	return to_build, cached
+
+
+def process_file(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, filename, scanner, rebuild=False, batch=False):
+	"""Build all test roms in the given suite serially. Returns (number built, number cached)."""
+	object_job, jobs = load_suite(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, filename, scanner, batch)
+	for job, key in filter_cached([object_job], rebuild)[0]:
+		job.run(key)
+	to_build, cached = filter_cached(jobs, rebuild)
+	for job, key in to_build:
+		job.run(key)
+	return len(to_build), len(cached)
+
+
+def _run_job(job_and_key):
+	"""Pool worker. Returns (output, error) so that failures are reported against the right test
+	rather than aborting the whole pool."""
+	job, key = job_and_key
+	try:
+		return job.run(key), None
+	except Exception:
+		return None, traceback.format_exc()
+
+
+def run_jobs(jobs, processes):
+	"""Build all given (job, key) pairs using a pool of the given number of processes.
+	Output is reported in job order regardless of completion order.
+	Returns the list of jobs that failed."""
+	pool = multiprocessing.Pool(processes)
+	failed = []
+	try:
+		for (job, key), (output, error) in zip(jobs, pool.imap(_run_job, jobs)):
+			if output:
+				sys.stdout.write(''.join('{}: {}\n'.format(job.name, line) for line in output.splitlines()))
+			if error is not None:
+				sys.stderr.write('{} failed to build:\n{}'.format(job.name, error))
+				failed.append(job)
+	finally:
+		pool.close()
+		pool.join()
+	return failed
+
+
+def watched_files(top_level_dir, include_dir, tests_dir, extra_link_dirs):
+	"""Returns {path: mtime} for every file watch mode watches: the OS sources, includes and test specs"""
+	paths = []
+	for source_dir in [top_level_dir] + extra_link_dirs:
+		paths += [os.path.join(source_dir, filename) for filename in os.listdir(source_dir) if filename.endswith('.asm')]
+	for path, dirs, files in os.walk(include_dir):
+		paths += [os.path.join(path, filename) for filename in files]
+	paths += [os.path.join(tests_dir, filename) for filename in os.listdir(tests_dir) if filename.endswith('.py')]
+	mtimes = {}
+	for path in paths:
+		try:
+			mtimes[os.path.abspath(path)] = os.stat(path).st_mtime
+		except OSError:
+			pass # deleted since we listed it. We'll notice next time.
+	return mtimes
+
+
+class Watcher(object):
+	"""State kept between rebuilds in watch mode: the scanner, each loaded suite,
+	and whether each rom passed when it was last run."""
+	def __init__(self, top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, jobs, batch, max_cycles):
+		self.top_level_dir = top_level_dir
+		self.include_dir = include_dir
+		self.tests_dir = tests_dir
+		self.extra_link_dirs = extra_link_dirs
+		self.objs_dir = objs_dir
+		self.jobs = max(jobs, 1)
+		self.batch = batch
+		self.max_cycles = max_cycles
+		self.scanner = SourceScanner(top_level_dir, include_dir)
+		self.suites = {} # {filename: (object job, rom jobs)}
+		self.results = {} # {rom path: passed}
 
-def main(top_level_dir, include_dir='include/', tests_dir='tests', extra_link_dirs='tasks', objs_dir='build/debug'):
+	def reload(self, changed):
+		"""Load any new suites, and reload those affected by the given changed paths.
+		Forgets suites that no longer exist. Returns the filenames of the suites that were (re)loaded."""
+		self.scanner.forget(changed)
+		filenames = sorted(filename for filename in os.listdir(self.tests_dir) if filename.endswith('.py'))
+		for filename in set(self.suites) - set(filenames):
+			del self.suites[filename]
+		affected = [
+			filename for filename in filenames
+			if filename not in self.suites or any(
+				job.sources & changed for job in [self.suites[filename][0]] + self.suites[filename][1]
+			)
+		]
+		for filename in affected:
+			self.suites[filename] = load_suite(
+				self.top_level_dir, self.include_dir, self.tests_dir, self.extra_link_dirs, self.objs_dir,
+				filename, self.scanner, self.batch,
+			)
+		return affected
+
+	def update(self, changed):
+		"""Rebuild and rerun whatever is affected by the given changed paths, and print a summary."""
+		# Imported here as only watch mode needs the emulator
+		import test_runner
+
+		timings = []
+		start = time.time()
+		def step(name):
+			now = time.time()
+			timings.append((name, now - step.last))
+			step.last = now
+		step.last = start
+
+		# Any OS object may have changed. make knows which.
+		_file_hashes.clear()
+		link_files = find_link_files(self.top_level_dir, self.extra_link_dirs)
+		cmd(['make', '-C', self.top_level_dir] + [
+			os.path.join(self.objs_dir, '{}.o'.format(link_file)) for link_file in link_files
+		])
+		step('objects')
+
+		affected = self.reload(changed)
+		object_jobs = [self.suites[filename][0] for filename in affected]
+		rom_jobs = sum([self.suites[filename][1] for filename in affected], [])
+		step('generate')
+
+		failed_objects = {job.obj_path for job in run_jobs(filter_cached(object_jobs)[0], self.jobs)}
+		failed = [job for job in rom_jobs if failed_objects & set(job.link_paths)]
+		to_build, _ = filter_cached([job for job in rom_jobs if job not in failed])
+		failed += run_jobs(to_build, self.jobs)
+		built = [job for job, key in to_build if job not in failed]
+		step('build')
+
+		# We only rerun roms that changed, or that we haven't run yet
+		expected_failures = {os.path.join(self.tests_dir, path) for path in test_runner.EXPECTED_FAILURES}
+		to_run = [
+			job.rom_path for job in rom_jobs
+			if job not in failed
+			and (job in built or job.rom_path not in self.results)
+			and job.rom_path not in expected_failures
+		]
+		pool = multiprocessing.Pool(self.jobs)
+		try:
+			results = pool.map(test_runner._run_rom, [(rom, self.max_cycles) for rom in to_run])
+		finally:
+			pool.close()
+			pool.join()
+		for job in failed:
+			self.results[job.rom_path] = False
+		for rom, result in zip(to_run, results):
+			self.results[rom] = result['passed']
+			if not result['passed']:
+				sys.stdout.write("{}\n{}\n{} failed!\n".format('\n'.join(result['messages']), result['reason'], rom))
+		step('run')
+
+		# Forget results for roms that no longer exist
+		current = {job.rom_path for _, rom_jobs in self.suites.values() for job in rom_jobs}
+		for rom in set(self.results) - current:
+			del self.results[rom]
+		passing = len([passed for passed in self.results.values() if passed])
+		print "Ran {} test roms, {} failed ({} failed to build). {} of {} passing overall.".format(
+			len(to_run), len([result for result in results if not result['passed']]) + len(failed), len(failed),
+			passing, len(self.results),
+		)
+		print "Took {:.2f}s: {}".format(
+			time.time() - start, ', '.join('{} {:.2f}s'.format(name, duration) for name, duration in timings),
+		)
+
+
+def watch_tests(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, jobs, batch, max_cycles, interval):
+	"""Poll for changes to sources and test specs every interval seconds, rebuilding and rerunning
+	only the affected tests each time. Runs forever."""
+	watcher = Watcher(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, jobs, batch, max_cycles)
+	previous = {}
+	pending = set()
+	while True:
+		current = watched_files(top_level_dir, include_dir, tests_dir, extra_link_dirs)
+		changed = {path for path in set(current) | set(previous) if current.get(path) != previous.get(path)}
+		previous = current
+		if changed:
+			print "Changed: {}".format(', '.join(sorted(os.path.relpath(path) for path in changed)))
+			pending |= changed
+			try:
+				watcher.update(pending)
+			except Exception:
+				# Keep the changes pending, so once whatever's wrong is fixed we rebuild everything they affect
+				traceback.print_exc()
+			else:
+				pending = set()
+		time.sleep(interval)
+
+
+def main(top_level_dir, include_dir='include/', tests_dir='tests', extra_link_dirs='tasks', objs_dir='build/debug',
+         jobs=1, rebuild=False, batch=False, changed='', watch=False, interval=1.0, max_cycles=10000000):
+	"""Generate and build all test roms. With jobs > 1, roms are built in parallel
+	across all suites and test cases. The results are identical either way.
+	Roms whose inputs are unchanged since they were last built are skipped, unless rebuild is set.
+	If batch is set, each suite is built as one rom tests/SUITE/batch.gb which runs every test in turn
+	and logs the result of each.
+	Changed is a comma-seperated list of source files, relative to top_level_dir. If given, only the roms
+	those files affect are rebuilt, and their paths are listed (with the summary going to stderr instead),
+	eg. for passing to runtests.
+	In watch mode, keep running: every interval seconds, check for changed sources or test specs,
+	then rebuild the OS objects, regenerate and rebuild the affected tests and run them (with the
+	given max_cycles, as per runtests), and print a summary of results and how long each step took."""
 	include_dir = os.path.join(top_level_dir, include_dir)
 	tests_dir = os.path.join(top_level_dir, tests_dir)
 	extra_link_dirs = (
 		[os.path.join(top_level_dir, link_dir) for link_dir in extra_link_dirs.split(',')]
 		if extra_link_dirs else [] # because ''.split(',') == [''] when we want []
 	)
-	for filename in os.listdir(tests_dir):
-		if filename.endswith('.py'):
-			process_file(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, filename)
+	filenames = sorted(filename for filename in os.listdir(tests_dir) if filename.endswith('.py'))
+	if watch:
+		watch_tests(top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, jobs, batch, max_cycles, interval)
+	scanner = SourceScanner(top_level_dir, include_dir)
+	if jobs <= 1 and not changed:
+		built, cached = 0, 0
+		for filename in filenames:
+			suite_built, suite_cached = process_file(
+				top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, filename, scanner, rebuild, batch,
+			)
+			built += suite_built
+			cached += suite_cached
+		print "Test roms: {} built, {} cached".format(built, cached)
+		return
+	# Suites are loaded serially as they're cheap and this keeps generation deterministic.
+	# Only the expensive assemble and link steps are farmed out.
+	object_jobs = []
+	build_jobs = []
+	for filename in filenames:
+		object_job, rom_jobs = load_suite(
+			top_level_dir, include_dir, tests_dir, extra_link_dirs, objs_dir, filename, scanner, batch,
+		)
+		object_jobs.append(object_job)
+		build_jobs += rom_jobs
+	if changed:
+		changed_paths = {os.path.abspath(os.path.join(top_level_dir, path)) for path in changed.split(',')}
+		object_jobs = [job for job in object_jobs if job.sources & changed_paths]
+		build_jobs = [job for job in build_jobs if job.sources & changed_paths]
+		rebuild = True
+	# Every rom links its suite's shared object, so those must be built first
+	failed_objects = {job.obj_path for job in run_jobs(filter_cached(object_jobs, rebuild)[0], max(jobs, 1))}
+	failed = [job for job in build_jobs if failed_objects & set(job.link_paths)]
+	to_build, cached = filter_cached([job for job in build_jobs if job not in failed], rebuild)
+	build_failed = run_jobs(to_build, max(jobs, 1))
+	failed += build_failed
+	summary = "Test roms: {} built, {} cached".format(len(to_build) - len(build_failed), len(cached))
+	if changed:
+		for job in build_jobs:
+			if job not in failed:
+				print job.rom_path
+		sys.stderr.write(summary + '\n')
+	else:
+		print summary
+	if failed:
+		sys.stderr.write("{} of {} test roms failed to build: {}\n".format(
+			len(failed), len(build_jobs), ', '.join(job.name for job in failed)
+		))
+		sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -52,6 +52,7 @@ _IntSafeWaiterWaitFinish:
 	jr z, .noconflict
 	; flag == 2, so a confict occurred. we wake all waiters, including the task we just suspended.
 	push BC
+	RepointStruct HL, isw_flag, isw_waiter
 	call _WaiterWake
 	pop BC
 .noconflict
@@ -71,7 +72,10 @@ _IntSafeWaiterCheckOrWait::
 	call _WaiterWait ; set up task to wait
 	pop HL
 	call _IntSafeWaiterWaitFinish ; the rest of this function proceeds as per IntSafeWaiterWait
-	; We only reach here once the task is woken again and has been switched back to
+	; We only reach here once the task is woken again and has been switched back to.
+	; Unset carry to tell the caller we waited, and the condition needs checking again.
+	scf
+	ccf
 	pop DE
 	ret
 .nowait
@@ -88,13 +92,17 @@ _IntSafeWaiterCheckOrWait::
 	; We now need to call the wake for it.
 	push AF
 	push BC
+	RepointStruct HL, isw_flag, isw_waiter
 	call _WaiterWake
 	pop BC
 	pop AF
 .noconflict
 	pop DE
-	jp T_EnableSwitch ; unlike other cases where we don't return without switching,
-	                  ; here we have to re-enable switch. This is a tail call.
+	; unlike other cases where we don't return without switching, here we have to re-enable switch.
+	push AF ; preserve A and carry from the check over T_EnableSwitch
+	call T_EnableSwitch
+	pop AF
+	ret
 
 
 ; Implements common parts of WaiterWait and IntSafeWaiterWait
@@ -103,23 +111,61 @@ _IntSafeWaiterCheckOrWait::
 _WaiterWait::
 	RepointStruct HL, 0, waiter_count
 	inc [HL]
-	RepointStruct HL, waiter_count, waiter_min_task
-	ld A, [CurrentTask]
-	cp [HL] ; set c if current task < waiter's existing min task
-	jr nc, .notlesser
-	ld [HL], A
-.notlesser
-	RepointStruct HL, waiter_min_task, 0
+	RepointStruct HL, waiter_count, 0
 	ld D, H
 	ld E, L ; DE = HL = waiter address
 	ld A, [CurrentTask]
 	LongAddToA TaskList+task_waiter, HL ; HL = &TaskList[Current Task].task_waiter
 	ld A, D
 	ld [HL+], A
-	ld [HL], E ; task_waiter = DE
+	ld A, E
+	ld [HL+], A ; task_waiter = DE
+	RepointStruct HL, task_waiter + 2, task_wait_next
+	RepointStruct DE, 0, waiter_head
+	ld A, [DE]
+	ld [HL], A ; task_wait_next = old head
+	ld A, [CurrentTask]
+	ld [DE], A ; head = current task
 	ret
 
 
+; Helper for _WaiterWake. Check whether the live task whose task_rambank field is pointed at by HL
+; is waiting on waiter DE, and go to \1 if it isn't. Either way, HL is left pointing at task_waiter + 2.
+; Clobbers A.
+_WaiterCheckTask: MACRO
+	; Check ram bank, if needed.
+	; This seems kinda wasteful to determine every time but we're out of regs.
+	; We determine this from top 4 bits:
+	;  101x - SRAM bank (currently ignored since we assume no sram switching right now)
+	;  1100 - WRAM0 (no bank to check)
+	;  1101 - WRAMX (check ram bank)
+	;  1111 - HRAM (no bank to check)
+	ld A, D
+	rla
+	rla ; this puts 2nd from top bit into carry. 0 -> SRAM, 1 -> WRAM or HRAM
+	; TODO SRAM checking goes here once we track that, for now assume good
+	jr nc, .bank_is_good\@
+	and %11000000 ; select top 2 bits. 00 -> WRAM0, 01 -> WRAMX, 11 -> HRAM
+	cp %01000000 ; set z if WRAMX
+	jr nz, .bank_is_good\@
+	ld A, [CurrentRAMBank]
+	cp [HL] ; compare to task_rambank, set z if match
+	jr z, .bank_is_good\@
+	RepointStruct HL, task_rambank, task_waiter + 2
+	jr \1
+.bank_is_good\@
+	; Advance to task_waiter
+	RepointStruct HL, task_rambank, task_waiter
+	; Check it against address
+	ld A, [HL+]
+	cp D ; set z if upper half of address matches
+	ld A, [HL+]
+	jr nz, \1 ; skip forward if D didn't match
+	cp E ; set z if lower half matches
+	jr nz, \1 ; skip forward if E didn't match
+ENDM
+
+
 ; This function is for internal use by the WaiterWake and WaiterWakeHL macros,
 ; do not use it directly.
 ; Does the actual work of waking waiters.
@@ -127,11 +173,11 @@ _WaiterWait::
 ; so it might have changed.
 ; HL points to waiter.
 ; Clobbers all.
-_WaiterWake::
+_WaiterWake:: ; @pool wakes MAX_TASKS
 	RepointStruct HL, 0, waiter_count
 	ld A, [HL]
 	and A ; set z if A == 0
-	jr z, .finish
+	ret z
 	ld C, A ; C = count of things to wake
 	RepointStruct HL, waiter_count, 0
 	ld D, H
@@ -139,15 +185,45 @@ _WaiterWake::
 	RepointStruct HL, 0, waiter_count
 	xor A
 	ld [HL+], A ; set count to 0
-	RepointStruct HL, waiter_count + 1, waiter_min_task
-	ld B, [HL] ; B = min task
+	RepointStruct HL, waiter_count + 1, waiter_head
+	ld B, [HL] ; B = first task in list
 	dec A ; A = ff
-	ld [HL], A ; set min task id to ff, waiter is now cleared
-	ld A, B
-	LongAddToA TaskList+task_sp, HL ; HL = &TaskList[min task].task_sp
-	; Starting at min task and proceeding until either we wake count tasks, or we hit end of task list.
-	; C contains things left to find, B contains current task id (stop when we hit MAX_TASKS * TASK_SIZE),
+	ld [HL], A ; set head to ff, waiter is now cleared
+
+	; Follow the list, waking each task, until we've woken count tasks.
+	; Normally every task in the list is alive and still waiting on us. But a task doesn't clear its
+	; waiter field on death, and its slot may then be reused by a new task waiting on something else,
+	; so if we find a task that isn't, we can't trust the rest of the list and fall back to a full scan.
+	; C contains things left to find, B contains current task id,
 	; DE is addr to compare to and HL is our pointer.
+.list_loop
+	ld A, B
+	cp MAX_TASKS * TASK_SIZE ; set c if B is a valid task id, and not ff for end of list
+	jr nc, .fallback
+	LongAddToA TaskList+task_sp, HL ; HL = &TaskList[B].task_sp
+	ld A, [HL+]
+	and A ; set z if task is dead
+	jr z, .fallback
+	RepointStruct HL, task_sp + 1, task_rambank
+	_WaiterCheckTask .fallback
+	; HL = task_waiter + 2 = task_wait_next
+	ld A, [HL-] ; A = next task in list
+	ld [HL], $ff
+	dec HL
+	ld [HL], $ff ; task_waiter = ffff (no waiter)
+	push AF
+	call SchedAddTask ; schedule task. clobbers A, HL
+	pop AF
+	ld B, A ; B = next task in list
+	dec C ; decrement count, set z if count == 0. @spend wakes 1
+	jr nz, .list_loop
+	ret
+
+.fallback
+	; Check every task, starting from the first, until either we wake count tasks
+	; or we hit end of task list. Tasks we've already woken no longer match.
+	ld B, 0
+	ld HL, TaskList + task_sp
 .loop
 
 	; A task doesn't clear its waiter field on death, so we need to check its task_sp is non-zero
@@ -161,39 +237,7 @@ _WaiterWake::
 
 	; Advance to task bank fields
 	RepointStruct HL, task_sp + 1, task_rambank
-	; Check ram bank, if needed.
-	; This seems kinda wasteful to determine every time but we're out of regs.
-	; We determine this from top 4 bits:
-	;  101x - SRAM bank (currently ignored since we assume no sram switching right now)
-	;  1100 - WRAM0 (no bank to check)
-	;  1101 - WRAMX (check ram bank)
-	;  1111 - HRAM (no bank to check)
-	ld A, D
-	rla
-	rla ; this puts 2nd from top bit into carry. 0 -> SRAM, 1 -> WRAM or HRAM
-	jr c, .sram
-	and %11000000 ; select top 2 bits. 00 -> WRAM0, 01 -> WRAMX, 11 -> HRAM
-	cp %01000000 ; set z if WRAMX
-	jr nz, .bank_is_good
-.wramx
-	ld A, [CurrentRAMBank]
-	cp [HL] ; compare to task_rambank, set z if match
-	jr z, .bank_is_good
-	RepointStruct HL, task_rambank, TASK_SIZE + task_sp ; Point to next task and continue
-	jr .skip
-.sram
-	; TODO SRAM checking goes here once we track that, for now assume good
-.bank_is_good
-
-	; Advance to task_waiter
-	RepointStruct HL, task_rambank, task_waiter
-	; Check it against address
-	ld A, [HL+]
-	cp D ; set z if upper half of address matches
-	ld A, [HL+]
-	jr nz, .next ; skip forward if D didn't match
-	cp E ; set z if lower half matches
-	jr nz, .next ; skip forward if E didn't match
+	_WaiterCheckTask .next
 	; Address matches: Wake this task and decrement count, check for count == 0 exit
 	push HL ; save pointer to task_waiter+2
 	RepointStruct HL, task_waiter + 2, task_waiter ; HL = task_waiter
@@ -202,8 +246,8 @@ _WaiterWake::
 	ld [HL+], A ; task_waiter = ffff (no waiter), HL = task_waiter + 2
 	call SchedAddTask ; schedule task. clobbers A, HL
 	pop HL ; restore HL = task_waiter + 2
-	dec C ; decrement count, set z if count == 0
-	jr z, .finish ; if count == 0, break
+	dec C ; decrement count, set z if count == 0. @spend wakes 1
+	ret z ; if count == 0, we're done
 .next
 	; Go to next task in B, advance HL to next task's task_sp, check for end of task list
 	RepointStruct HL, task_waiter + 2, TASK_SIZE + task_sp
@@ -212,6 +256,5 @@ _WaiterWake::
 	add TASK_SIZE
 	ld B, A
 	cp MAX_TASKS * TASK_SIZE ; set c if B is still within task list
-	jr c, .loop
-.finish
+	jr c, .loop ; @loop 1..MAX_TASKS
 	ret